@@ -0,0 +1,173 @@
+# ai_admission.py
+"""
+AI 请求准入控制模块
+本地 LM Studio 同一时间只能高效地跑一个（或少数几个）生成任务，多个分析会话同时请求会让模型来回切换，
+全部拖到 300 秒读超时。本模块在代理前为每个上游设置并发上限：
+- 超出上限的请求按到达顺序进入 FIFO 队列，释放的名额直接交给队首（公平，不会被后来者插队）；
+- 队列长度有上限，满了立即拒绝，避免无限堆积；
+- 流式请求在排队期间通过 SSE 推送排队位置（data: {"queue": {...}}），并定期发送注释行保活；
+- 浏览器断开时生成器被取消，调用方在 finally 中 release()：排队中的请求出队，已准入的请求归还名额。
+"""
+import asyncio
+import json
+import time
+from collections import deque
+from typing import Deque, Optional
+
+
+class AdmissionRejected(Exception):
+    """队列已满，拒绝排队"""
+
+
+class AdmissionTimeout(Exception):
+    """排队超时"""
+
+
+class AdmissionTicket:
+    """一次请求的准入凭证"""
+
+    __slots__ = ("future", "enqueued_at", "admitted_at", "released")
+
+    def __init__(self, future: asyncio.Future):
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.admitted_at: Optional[float] = None
+        self.released = False
+
+    @property
+    def admitted(self) -> bool:
+        return self.admitted_at is not None
+
+
+class AdmissionController:
+    """单个上游的并发上限 + FIFO 排队"""
+
+    def __init__(self, name: str, limit: int = 1, max_queue: int = 20):
+        """
+        参数:
+            name: 上游名称（日志用）
+            limit: 同时转发给上游的最大请求数
+            max_queue: 最多排队的请求数
+        """
+        self.name = name
+        self.limit = max(1, limit)
+        self.max_queue = max_queue
+        self._active = 0
+        self._waiters: Deque[AdmissionTicket] = deque()
+        self.admitted_total = 0
+        self.rejected_total = 0
+        self.cancelled_total = 0
+        self.timed_out_total = 0
+        self.max_wait_seconds = 0.0
+
+    def enqueue(self) -> AdmissionTicket:
+        """
+        申请准入：有空闲名额且无人排队时立即准入，否则进入队尾
+
+        异常:
+            AdmissionRejected: 队列已满
+        """
+        ticket = AdmissionTicket(asyncio.get_running_loop().create_future())
+        if self._active < self.limit and not self._waiters:
+            self._admit(ticket)
+            return ticket
+        if len(self._waiters) >= self.max_queue:
+            self.rejected_total += 1
+            raise AdmissionRejected(f"{self.name} 排队请求已达上限 {self.max_queue}")
+        self._waiters.append(ticket)
+        return ticket
+
+    def _admit(self, ticket: AdmissionTicket):
+        self._active += 1
+        ticket.admitted_at = time.monotonic()
+        self.admitted_total += 1
+        self.max_wait_seconds = max(self.max_wait_seconds, ticket.admitted_at - ticket.enqueued_at)
+        if not ticket.future.done():
+            ticket.future.set_result(True)
+
+    def position(self, ticket: AdmissionTicket) -> int:
+        """排队位置（1 表示队首，0 表示已准入）"""
+        if ticket.admitted:
+            return 0
+        try:
+            return self._waiters.index(ticket) + 1
+        except ValueError:
+            return 0
+
+    async def wait(self, ticket: AdmissionTicket, timeout: Optional[float] = None) -> bool:
+        """等待准入，超时返回 False（不自动出队，调用方仍需 release）"""
+        if ticket.admitted:
+            return True
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.future), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def release(self, ticket: AdmissionTicket, timed_out: bool = False):
+        """释放凭证（幂等）：已准入则归还名额并准入队首，排队中则出队"""
+        if ticket.released:
+            return
+        ticket.released = True
+        if ticket.admitted:
+            self._active -= 1
+            while self._waiters and self._active < self.limit:
+                self._admit(self._waiters.popleft())
+            return
+        try:
+            self._waiters.remove(ticket)
+        except ValueError:
+            pass
+        if timed_out:
+            self.timed_out_total += 1
+        else:
+            self.cancelled_total += 1
+        if not ticket.future.done():
+            ticket.future.cancel()
+
+    async def queue_events(self, ticket: AdmissionTicket, timeout: float, update_interval: float = 1.0,
+                           keepalive: float = 15.0):
+        """
+        流式请求排队期间的 SSE 事件：位置变化时推送 data: {"queue": ...}，长时间无变化时发送注释行保活；
+        准入后推送 position=0 并结束
+
+        异常:
+            AdmissionTimeout: 超过 timeout 秒仍未准入
+        """
+        if ticket.admitted:
+            return
+        deadline = time.monotonic() + timeout
+        last_position = None
+        last_sent = time.monotonic()
+        while not ticket.admitted:
+            position = self.position(ticket)
+            if position != last_position:
+                last_position = position
+                last_sent = time.monotonic()
+                yield self._queue_event(position)
+            elif time.monotonic() - last_sent >= keepalive:
+                last_sent = time.monotonic()
+                yield b": queued\n\n"
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise AdmissionTimeout(f"{self.name} 排队超过 {timeout:.0f} 秒")
+            await self.wait(ticket, timeout=min(update_interval, remaining))
+        yield self._queue_event(0)
+
+    def _queue_event(self, position: int) -> bytes:
+        payload = {"queue": {"backend": self.name, "position": position, "waiting": len(self._waiters),
+                             "active": self._active, "limit": self.limit}}
+        return f"data: {json.dumps(payload)}\n\n".encode("utf-8")
+
+    def status(self) -> dict:
+        return {
+            "limit": self.limit,
+            "active": self._active,
+            "waiting": len(self._waiters),
+            "max_queue": self.max_queue,
+            "admitted": self.admitted_total,
+            "rejected": self.rejected_total,
+            "cancelled": self.cancelled_total,
+            "timed_out": self.timed_out_total,
+            "max_wait_seconds": round(self.max_wait_seconds, 3),
+        }
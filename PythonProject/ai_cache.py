@@ -0,0 +1,158 @@
+# ai_cache.py
+"""
+AI 响应缓存模块
+运维人员经常对同一份数据反复提问（"分析 D01 最近 24 小时"），每次都触发一次完整的模型生成。
+本模块按 (模型, 规范化后的消息, 温度, max_tokens, 是否流式, 数据窗指纹) 的哈希缓存完整回答：
+- 规范化：角色小写、内容折叠空白，避免前端缩进/换行差异导致未命中；
+- 数据窗指纹：服务端注入的数据摘要文本的哈希，数据有新读数时摘要变化，缓存自然失效；
+- LRU 淘汰 + TTL 过期，同时限制条目数和总字节数；
+- 流式回答缓存原始 SSE 字节块，命中时按 SSE 回放，前端无需区分是否来自缓存；
+- 只缓存成功且完整的回答（上游报错、超时或中途断开的流不写入）。
+"""
+import hashlib
+import json
+import re
+import time
+from collections import OrderedDict
+from typing import Any, List, Optional
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def fingerprint(text: Optional[str]) -> Optional[str]:
+    """数据窗指纹（摘要文本的短哈希）"""
+    if not text:
+        return None
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def cache_key(body: dict, data_fingerprint: Optional[str] = None) -> str:
+    """根据请求体生成缓存键"""
+    messages = [
+        [str(message.get("role", "")).lower(), _WHITESPACE.sub(" ", str(message.get("content", ""))).strip()]
+        for message in body.get("messages", [])
+    ]
+    temperature = body.get("temperature")
+    normalized = {
+        "model": str(body.get("model", "")).strip().lower(),
+        "messages": messages,
+        "temperature": round(float(temperature), 3) if temperature is not None else None,
+        "max_tokens": body.get("max_tokens"),
+        "stream": bool(body.get("stream", False)),
+        "data": data_fingerprint,
+    }
+    encoded = json.dumps(normalized, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """LRU + TTL 的 AI 回答缓存"""
+
+    def __init__(self, max_entries: int = 200, max_bytes: int = 32 * 1024 * 1024, ttl: float = 1800.0,
+                 max_temperature: float = 0.2):
+        """
+        参数:
+            max_entries: 最多缓存的回答数
+            max_bytes: 缓存总字节数上限（按回答内容估算）
+            ttl: 缓存有效期（秒）
+            max_temperature: 温度不高于该值的请求才参与缓存（温度越高回答越随机，缓存后重复提问会得到一字不差的旧回答）
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_temperature = max_temperature
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (过期时间, 类型, 内容, 字节数)
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def eligible(self, body: dict, requested: Optional[bool] = None) -> bool:
+        """
+        请求是否参与缓存
+
+        参数:
+            requested: 请求体中的 "cache" 字段：True 显式参与，False 显式跳过，None 按温度判断
+                       （未指定温度时上游默认 1.0，不参与）
+        """
+        if requested is not None:
+            return bool(requested)
+        try:
+            return float(body["temperature"]) <= self.max_temperature
+        except (KeyError, TypeError, ValueError):
+            return False
+
+    def get(self, key: str) -> Optional[tuple]:
+        """
+        查找缓存
+
+        返回:
+            (类型, 内容)：类型为 "stream"（SSE 字节块列表）或 "json"（响应字典）；未命中返回 None
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, kind, value, _size = entry
+        if expires_at < time.time():
+            self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return kind, value
+
+    def put_stream(self, key: str, chunks: List[bytes]):
+        """缓存一次完整的流式回答"""
+        self._put(key, "stream", list(chunks), sum(len(chunk) for chunk in chunks))
+
+    def put_json(self, key: str, value: Any):
+        """缓存一次完整的非流式回答"""
+        self._put(key, "json", value, len(json.dumps(value, ensure_ascii=False).encode("utf-8")))
+
+    def _put(self, key: str, kind: str, value: Any, size: int):
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.time() + self.ttl, kind, value, size)
+        self._bytes += size
+        self.stores += 1
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry:
+            self._bytes -= entry[3]
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def status(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "ttl": self.ttl,
+            "max_temperature": self.max_temperature,
+        }
+
+
+async def replay_stream(chunks: List[bytes], coalesce: int = 16 * 1024):
+    """按 SSE 回放缓存的流式回答（把小块合并后发送，减少写次数）"""
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        if len(buffer) >= coalesce:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
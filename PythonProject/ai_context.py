@@ -0,0 +1,238 @@
+# ai_context.py
+"""
+AI 数据上下文模块
+在服务端把一个设备（或全部设备）在某时间窗内的传感器历史压缩成紧凑的统计摘要，供 AI 助手作为系统提示注入：
+- 数据来自数据库聚合层（get_aggregated_data_by_device，按设备和时间分桶的均值/最小值/最大值/条数），不传输原始读数；
+  全部设备时也只查询一次聚合数据和一次警告，再按设备拆分；
+- 每个指标给出均值、最值及其所在时间、加权最小二乘趋势斜率（每小时变化量）、首末值和粗粒度曲线；
+- 警告按类型合并为"发作"统计（次数、累计/最长持续时间、峰值、是否仍未恢复）并列出最近几次。
+浏览器只需提交设备和时间范围，不再下载大量 /api/history 数据自行计算，提示词也从数千条采样缩减到几百字。
+"""
+import time
+from typing import Callable, Dict, List, Optional
+
+# 指标：键 -> (名称, 单位, 聚合均值列, 最小值列, 最大值列)
+DIGEST_METRICS = {
+    "temp": ("温度", "°C", "temperature", "min_temp", "max_temp"),
+    "hum": ("湿度", "%", "humidity", "min_hum", "max_hum"),
+    "lux": ("光照", "lux", "brightness", "min_lux", "max_lux"),
+    "smoke": ("烟雾", "ppm", "smoke_ppm", "min_smoke", "max_smoke"),
+    "pressure": ("大气压", "hPa", "pressure", "min_pressure", "max_pressure"),
+    "temp2": ("温度2", "°C", "temp2", "min_temp2", "max_temp2"),
+    "rs_ro": ("Rs/Ro", "", "rs_ro", "min_rs_ro", "max_rs_ro"),
+}
+# 每台设备最多取的警告条数（全部设备时一次查询，上限按设备数放大）
+WARNINGS_PER_DEVICE = 500
+# 聚合分桶可选的间隔（秒），按时间窗 / 目标桶数向上取最接近的一档
+_BUCKET_INTERVALS = (60, 120, 300, 600, 900, 1800, 3600, 7200, 10800, 21600, 43200, 86400)
+
+
+def choose_interval(span_seconds: float, buckets: int) -> int:
+    """按时间跨度和目标桶数选择聚合间隔"""
+    target = span_seconds / max(1, buckets)
+    for interval in _BUCKET_INTERVALS:
+        if interval >= target:
+            return interval
+    return _BUCKET_INTERVALS[-1]
+
+
+def _num(value) -> Optional[float]:
+    return float(value) if value is not None else None
+
+
+def _fmt_time(ts: Optional[float]) -> str:
+    return time.strftime("%m-%d %H:%M", time.localtime(ts)) if ts is not None else "未知"
+
+
+def _fmt_duration(seconds: float) -> str:
+    if seconds < 3600:
+        return f"{seconds / 60:.0f}分钟"
+    return f"{seconds / 3600:.1f}小时"
+
+
+def summarize_metric(rows: List[dict], avg_col: str, min_col: str, max_col: str, profile_points: int = 12) -> \
+        Optional[dict]:
+    """
+    汇总单个指标的分桶聚合结果
+
+    返回:
+        {"count", "mean", "min", "min_at", "max", "max_at", "slope_per_hour", "first", "last", "profile"}，
+        无有效数据时返回 None
+    """
+    points = []  # (桶时间, 桶均值, 条数)
+    total = 0
+    weighted_sum = 0.0
+    minimum = maximum = None
+    min_at = max_at = None
+    for row in rows:
+        mean = _num(row.get(avg_col))
+        if mean is None:
+            continue
+        ts = float(row["timestamp"])
+        count = int(row.get("data_count") or 1)
+        points.append((ts, mean, count))
+        total += count
+        weighted_sum += mean * count
+        low = _num(row.get(min_col))
+        high = _num(row.get(max_col))
+        low = mean if low is None else low
+        high = mean if high is None else high
+        if minimum is None or low < minimum:
+            minimum, min_at = low, ts
+        if maximum is None or high > maximum:
+            maximum, max_at = high, ts
+    if not points:
+        return None
+
+    # 按条数加权的最小二乘斜率（x 为小时）
+    slope = 0.0
+    if len(points) > 1:
+        t0 = points[0][0]
+        sw = sum(w for _ts, _v, w in points)
+        mx = sum((ts - t0) / 3600.0 * w for ts, _v, w in points) / sw
+        my = sum(v * w for _ts, v, w in points) / sw
+        sxx = sum(w * ((ts - t0) / 3600.0 - mx) ** 2 for ts, _v, w in points)
+        sxy = sum(w * ((ts - t0) / 3600.0 - mx) * (v - my) for ts, v, w in points)
+        slope = sxy / sxx if sxx > 0 else 0.0
+
+    # 粗粒度曲线：把分桶均值再合并为不超过 profile_points 段
+    step = max(1, -(-len(points) // profile_points))
+    profile = []
+    for i in range(0, len(points), step):
+        chunk = points[i:i + step]
+        weight = sum(w for _ts, _v, w in chunk)
+        profile.append(round(sum(v * w for _ts, v, w in chunk) / weight, 2))
+
+    return {
+        "count": total,
+        "mean": round(weighted_sum / total, 2),
+        "min": round(minimum, 2),
+        "min_at": min_at,
+        "max": round(maximum, 2),
+        "max_at": max_at,
+        "slope_per_hour": round(slope, 4),
+        "first": round(points[0][1], 2),
+        "last": round(points[-1][1], 2),
+        "profile": profile,
+    }
+
+
+def summarize_warnings(warnings: List[dict], start: float, end: float, recent: int = 5) -> dict:
+    """把警告记录按类型合并为发作统计（持续时间按与时间窗的重叠部分计算）"""
+    by_type: Dict[str, dict] = {}
+    episodes = []
+    for warning in warnings:
+        warning_type = warning.get("warning_type") or "?"
+        began = _num(warning.get("warning_start_time")) or start
+        resolved_at = _num(warning.get("warning_resolved_time"))
+        duration = max(0.0, min(resolved_at or end, end) - max(began, start))
+        value = _num(warning.get("warning_value"))
+        entry = by_type.setdefault(warning_type, {"episodes": 0, "total_seconds": 0.0, "longest_seconds": 0.0,
+                                                  "peak": None, "active": False})
+        entry["episodes"] += 1
+        entry["total_seconds"] += duration
+        entry["longest_seconds"] = max(entry["longest_seconds"], duration)
+        if value is not None and (entry["peak"] is None or abs(value) > abs(entry["peak"])):
+            entry["peak"] = value
+        if resolved_at is None:
+            entry["active"] = True
+        episodes.append({"type": warning_type, "start": began, "resolved": resolved_at, "value": value,
+                         "message": warning.get("warning_message")})
+    episodes.sort(key=lambda episode: episode["start"], reverse=True)
+    return {"total": len(warnings), "by_type": by_type, "recent": episodes[:recent]}
+
+
+def format_digest(digest: dict, warning_type_names: Optional[Dict[str, str]] = None) -> str:
+    """把摘要格式化为紧凑的中文文本（直接用作提示词）"""
+    names = warning_type_names or {}
+    window = digest["window"]
+    lines = [f"时间窗 {_fmt_time(window['start'])} ~ {_fmt_time(window['end'])}（{_fmt_duration(window['end'] - window['start'])}），"
+             f"按 {_fmt_duration(window['interval'])} 分桶聚合；趋势为每小时变化量，曲线为时间顺序的分段均值。"]
+    for device_id, device in digest["devices"].items():
+        lines.append(f"[{device_id} {device['name']}] 共 {device['count']} 条读数")
+        for key, metric in device["metrics"].items():
+            name, unit = DIGEST_METRICS[key][:2]
+            lines.append(
+                f"- {name}({unit}) 均值 {metric['mean']} 最小 {metric['min']}@{_fmt_time(metric['min_at'])} "
+                f"最大 {metric['max']}@{_fmt_time(metric['max_at'])} 趋势 {metric['slope_per_hour']:+g}/时 "
+                f"首→末 {metric['first']}→{metric['last']} 曲线 {','.join(f'{v:g}' for v in metric['profile'])}"
+            )
+        warnings = device["warnings"]
+        if not warnings["total"]:
+            lines.append("- 警告：无")
+            continue
+        parts = []
+        for warning_type, entry in warnings["by_type"].items():
+            part = (f"{names.get(warning_type, warning_type)} {entry['episodes']} 次，累计 {_fmt_duration(entry['total_seconds'])}，"
+                    f"最长 {_fmt_duration(entry['longest_seconds'])}")
+            if entry["peak"] is not None:
+                part += f"，峰值 {entry['peak']:g}"
+            if entry["active"]:
+                part += "，仍未恢复"
+            parts.append(part)
+        lines.append(f"- 警告 {warnings['total']} 次：" + "；".join(parts))
+        for episode in warnings["recent"]:
+            status = f"{_fmt_time(episode['resolved'])} 恢复" if episode["resolved"] else "未恢复"
+            lines.append(f"  · {_fmt_time(episode['start'])} {names.get(episode['type'], episode['type'])} "
+                         f"{episode['message'] or ''}（{status}）")
+    return "\n".join(lines)
+
+
+class SensorContextBuilder:
+    """按设备和时间窗构建 AI 数据摘要"""
+
+    def __init__(self, get_db_manager: Callable, get_devices: Callable[[], List[str]],
+                 get_device_name: Callable[[str], str], warning_type_names: Optional[Dict[str, str]] = None):
+        """
+        参数:
+            get_db_manager: 获取数据库管理器的函数
+            get_devices: 获取全部设备ID列表的函数（未指定设备时每台设备单独汇总）
+            get_device_name: 设备ID -> 显示名称
+            warning_type_names: 警告类型 -> 中文名称
+        """
+        self.get_db_manager = get_db_manager
+        self.get_devices = get_devices
+        self.get_device_name = get_device_name
+        self.warning_type_names = warning_type_names or {}
+
+    async def build(self, device_id: Optional[str], start: float, end: float, buckets: int = 48) -> dict:
+        """
+        构建摘要
+
+        参数:
+            device_id: 设备ID，None 表示全部设备（每台设备单独汇总）
+            start/end: 时间窗（秒级时间戳）
+            buckets: 目标分桶数，决定聚合粒度
+
+        返回:
+            {"window": {...}, "devices": {设备ID: {"name", "count", "metrics", "warnings"}}, "text": 文本摘要}
+        """
+        db = self.get_db_manager()
+        interval = choose_interval(end - start, buckets)
+        device_ids = [device_id.upper()] if device_id else list(self.get_devices())
+        # 聚合数据和警告各查询一次，再按设备拆分（全部设备时不再逐台设备查询）
+        grouped_rows = await db.get_aggregated_data_by_device(start, end, interval, device_ids=device_ids)
+        grouped_warnings: Dict[str, List[dict]] = {}
+        for warning in await db.get_warnings_in_range(start, end, device_id=device_id,
+                                                      limit=WARNINGS_PER_DEVICE * max(1, len(device_ids))):
+            grouped_warnings.setdefault(str(warning.get("device_id") or "").upper(), []).append(warning)
+        devices = {}
+        for current in device_ids:
+            rows = grouped_rows.get(current, [])
+            if not rows and not device_id:
+                continue
+            metrics = {}
+            for key, (_name, _unit, avg_col, min_col, max_col) in DIGEST_METRICS.items():
+                summary = summarize_metric(rows, avg_col, min_col, max_col)
+                if summary:
+                    metrics[key] = summary
+            warnings = grouped_warnings.get(current, [])
+            devices[current] = {
+                "name": self.get_device_name(current),
+                "count": sum(int(row.get("data_count") or 0) for row in rows),
+                "metrics": metrics,
+                "warnings": summarize_warnings(warnings, start, end),
+            }
+        digest = {"window": {"start": start, "end": end, "interval": interval}, "devices": devices}
+        digest["text"] = format_digest(digest, self.warning_type_names) if devices else "所选时间范围内没有传感器数据。"
+        return digest
@@ -0,0 +1,161 @@
+# ai_stream.py
+"""
+AI 流式响应转发模块
+上游（DeepSeek / LM Studio）返回的是 OpenAI 兼容的 SSE 字节流，浏览器需要的也是同样的字节：
+- 直接转发 aiter_bytes() 的原始字节块，不再 解码成文本 → 再编码回 UTF-8；
+- 旁路地在字节层面按空行切分 SSE 事件（"\\n" 不会出现在 UTF-8 多字节字符内部，切分不会截断汉字），
+  只解析 data 行的 JSON 来统计事件数、生成 token 数和首 token 时间，不影响转发内容；
+- 每个请求结束时打印一行汇总，代替逐块打印；按上游累计最近若干次请求的首 token 时间与生成速率。
+"""
+import json
+import time
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, Optional
+
+
+class StreamMetrics:
+    """单次流式请求的指标"""
+
+    __slots__ = ("backend", "started_at", "first_byte_at", "first_token_at", "finished_at", "bytes", "chunks",
+                 "events", "tokens", "usage", "done", "_buffer")
+
+    def __init__(self, backend: str):
+        self.backend = backend
+        self.started_at = time.monotonic()
+        self.first_byte_at: Optional[float] = None
+        self.first_token_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.bytes = 0
+        self.chunks = 0
+        self.events = 0
+        self.tokens = 0  # 带 content / reasoning_content 增量的事件数（流式接口通常一个事件一个 token）
+        self.usage: Optional[dict] = None  # 上游在最后一个事件里给出的 usage（有则以它为准）
+        self.done = False  # 是否收到 [DONE]
+        self._buffer = b""
+
+    def feed(self, chunk: bytes):
+        """喂入一个原始字节块，解析其中完整的 SSE 事件"""
+        now = time.monotonic()
+        if self.first_byte_at is None:
+            self.first_byte_at = now
+        self.bytes += len(chunk)
+        self.chunks += 1
+        buffer = self._buffer + chunk
+        if b"\r" in buffer:
+            buffer = buffer.replace(b"\r\n", b"\n")
+        *events, self._buffer = buffer.split(b"\n\n")
+        for event in events:
+            self._parse_event(event, now)
+
+    def _parse_event(self, event: bytes, now: float):
+        for line in event.split(b"\n"):
+            if not line.startswith(b"data:"):
+                continue
+            data = line[5:].strip()
+            if not data:
+                continue
+            self.events += 1
+            if data == b"[DONE]":
+                self.done = True
+                continue
+            try:
+                payload = json.loads(data)
+            except ValueError:
+                continue
+            if not isinstance(payload, dict):
+                continue
+            if payload.get("usage"):
+                self.usage = payload["usage"]
+            for choice in payload.get("choices") or ():
+                delta = choice.get("delta") or {}
+                if delta.get("content") or delta.get("reasoning_content"):
+                    self.tokens += 1
+                    if self.first_token_at is None:
+                        self.first_token_at = now
+
+    def finish(self):
+        self.finished_at = time.monotonic()
+
+    @property
+    def completion_tokens(self) -> int:
+        if self.usage and self.usage.get("completion_tokens"):
+            return int(self.usage["completion_tokens"])
+        return self.tokens
+
+    @property
+    def ttft_ms(self) -> Optional[float]:
+        """首 token 时间（毫秒，从发起上游请求算起）"""
+        if self.first_token_at is None:
+            return None
+        return (self.first_token_at - self.started_at) * 1000
+
+    @property
+    def tokens_per_second(self) -> Optional[float]:
+        """首 token 之后的生成速率"""
+        if self.first_token_at is None or self.finished_at is None:
+            return None
+        elapsed = self.finished_at - self.first_token_at
+        return self.completion_tokens / elapsed if elapsed > 0 else None
+
+    def summary(self) -> str:
+        ttft = f"{self.ttft_ms:.0f}ms" if self.ttft_ms is not None else "无"
+        rate = f"{self.tokens_per_second:.1f} tok/s" if self.tokens_per_second is not None else "无"
+        total = (self.finished_at or time.monotonic()) - self.started_at
+        return (f"{self.bytes} 字节 / {self.chunks} 块 / {self.events} 个事件，生成 {self.completion_tokens} tokens，"
+                f"首 token {ttft}，速率 {rate}，总耗时 {total:.1f}s{'' if self.done else '（未收到 [DONE]）'}")
+
+
+class StreamStats:
+    """按上游累计流式请求指标（最近 window 次）"""
+
+    def __init__(self, window: int = 100):
+        self.window = window
+        self._recent: Dict[str, Deque[StreamMetrics]] = {}
+        self._totals: Dict[str, dict] = {}
+
+    def record(self, metrics: StreamMetrics):
+        self._recent.setdefault(metrics.backend, deque(maxlen=self.window)).append(metrics)
+        totals = self._totals.setdefault(metrics.backend, {"requests": 0, "completed": 0, "bytes": 0, "tokens": 0})
+        totals["requests"] += 1
+        totals["completed"] += 1 if metrics.done else 0
+        totals["bytes"] += metrics.bytes
+        totals["tokens"] += metrics.completion_tokens
+
+    @staticmethod
+    def _percentile(values, q: float) -> Optional[float]:
+        if not values:
+            return None
+        values = sorted(values)
+        return round(values[min(len(values) - 1, int(q * len(values)))], 1)
+
+    def status(self) -> Dict[str, dict]:
+        result = {}
+        for backend, totals in self._totals.items():
+            recent = self._recent.get(backend, ())
+            ttfts = [m.ttft_ms for m in recent if m.ttft_ms is not None]
+            rates = [m.tokens_per_second for m in recent if m.tokens_per_second is not None]
+            result[backend] = dict(
+                totals,
+                ttft_ms_p50=self._percentile(ttfts, 0.5),
+                ttft_ms_p95=self._percentile(ttfts, 0.95),
+                tokens_per_second_avg=round(sum(rates) / len(rates), 1) if rates else None,
+            )
+        return result
+
+
+async def relay_sse(response, metrics: StreamMetrics) -> AsyncIterator[bytes]:
+    """
+    原样转发上游 SSE 字节流，同时把每个块交给 metrics 统计
+
+    参数:
+        response: httpx 流式响应（状态码已确认为 200）
+        metrics: 本次请求的指标对象，转发结束（包括中途断开）时调用 finish()
+    """
+    try:
+        async for chunk in response.aiter_bytes():
+            if not chunk:
+                continue
+            metrics.feed(chunk)
+            yield chunk
+    finally:
+        metrics.finish()
@@ -0,0 +1,227 @@
+# ai_upstream.py
+"""
+AI 上游连接池模块
+为每个上游（DeepSeek 在线 API、本地 LM Studio）维护一个常驻的 httpx.AsyncClient：
+- 长连接复用（keep-alive），聊天请求和健康检查不再每次重新握手 TCP/TLS；
+- 安装了 h2（pip install "httpx[http2]"）时对声明 http2 的上游启用 HTTP/2，否则自动退回 HTTP/1.1；
+- 每个上游独立的连接数上限，超时按请求单独指定（流式聊天与健康检查差别很大）；
+- 客户端在首次使用时创建，应用关闭时由 lifespan 调用 close() 统一释放。
+AiHealthProber 在此之上缓存上游健康/模型列表探测结果，多个页面轮询只产生一次上游请求。
+"""
+import asyncio
+import time
+from typing import Dict, Optional
+
+import httpx
+
+try:
+    import h2  # noqa: F401  httpx 的 HTTP/2 支持依赖该包
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# 默认连接池参数（可在每个上游的配置中覆盖）
+DEFAULT_LIMITS = {
+    "max_connections": 20,  # 同时打开的最大连接数
+    "max_keepalive_connections": 10,  # 空闲保活的最大连接数
+    "keepalive_expiry": 60.0,  # 空闲连接保活时间（秒）
+}
+DEFAULT_TIMEOUT = 60.0
+
+
+class UpstreamClientPool:
+    """按上游名称管理常驻的 httpx.AsyncClient"""
+
+    def __init__(self, upstreams: Dict[str, dict]):
+        """
+        参数:
+            upstreams: 上游名称 -> 配置字典，可用字段：
+                base_url: 上游根地址（请求时可传相对路径）
+                http2: 是否尝试 HTTP/2（未安装 h2 时忽略）
+                trust_env: 是否读取环境变量中的代理设置（本地服务应设为 False，直连 localhost）
+                limits: 覆盖 DEFAULT_LIMITS 中的字段
+                timeout: 默认超时（秒），请求时可单独覆盖
+                headers: 默认请求头
+        """
+        self.upstreams = upstreams
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._created_at: Dict[str, float] = {}
+        self._requests: Dict[str, int] = {name: 0 for name in upstreams}
+
+    def get(self, name: str) -> httpx.AsyncClient:
+        """获取（必要时创建）指定上游的客户端"""
+        client = self._clients.get(name)
+        if client is None or client.is_closed:
+            client = self._clients[name] = self._create(name)
+            self._created_at[name] = time.time()
+        self._requests[name] = self._requests.get(name, 0) + 1
+        return client
+
+    def _create(self, name: str) -> httpx.AsyncClient:
+        config = self.upstreams[name]
+        limits = dict(DEFAULT_LIMITS, **config.get("limits", {}))
+        http2 = bool(config.get("http2")) and HTTP2_AVAILABLE
+        print(f"【AI连接池】创建上游客户端 {name}：{config.get('base_url', '')}"
+              f"（{'HTTP/2' if http2 else 'HTTP/1.1'}，最大连接 {limits['max_connections']}，"
+              f"保活 {limits['max_keepalive_connections']}）")
+        return httpx.AsyncClient(
+            base_url=config.get("base_url", ""),
+            http2=http2,
+            trust_env=config.get("trust_env", True),
+            limits=httpx.Limits(**limits),
+            timeout=config.get("timeout", DEFAULT_TIMEOUT),
+            headers=config.get("headers"),
+        )
+
+    async def close(self):
+        """关闭所有客户端（应用关闭时调用）"""
+        for name, client in list(self._clients.items()):
+            try:
+                await client.aclose()
+            except Exception as e:
+                print(f"【AI连接池】关闭上游客户端 {name} 失败：{e}")
+        self._clients.clear()
+        print("【AI连接池】所有上游客户端已关闭")
+
+    def status(self) -> Dict[str, dict]:
+        """各上游客户端状态（是否已创建、协议、借用次数）"""
+        result = {}
+        for name, config in self.upstreams.items():
+            client: Optional[httpx.AsyncClient] = self._clients.get(name)
+            result[name] = {
+                "base_url": config.get("base_url", ""),
+                "open": client is not None and not client.is_closed,
+                "http2": bool(config.get("http2")) and HTTP2_AVAILABLE,
+                "requests": self._requests.get(name, 0),
+                "created_at": self._created_at.get(name),
+            }
+        return result
+
+
+class AiHealthProber:
+    """
+    上游健康/模型列表探测缓存
+    /api/ai/health 与 /api/ai/models 共用同一次 GET /v1/models 的结果：
+    - 缓存新鲜（未超过 ttl）时直接返回，不访问上游；
+    - 缓存过期或强制刷新时发起探测，同一时刻最多一个探测在途，并发请求共享其结果（single-flight）；
+    - 后台任务每 interval 秒刷新一次缓存，但只在最近 idle_after 秒内有人查询过时才刷新，
+      没有页面打开时不打扰上游。
+    """
+
+    def __init__(self, pool: UpstreamClientPool, upstream: str, url: str, interval: float = 10.0,
+                 ttl: float = 15.0, timeout: float = 3.0, idle_after: float = 120.0):
+        """
+        参数:
+            pool: 上游连接池
+            upstream: 连接池中的上游名称
+            url: 探测地址（模型列表接口）
+            interval: 后台刷新间隔（秒）
+            ttl: 缓存有效期（秒），应大于 interval，保证活跃期间查询总能命中缓存
+            timeout: 单次探测超时（秒）
+            idle_after: 超过该时间无人查询则暂停后台刷新（秒）
+        """
+        self.pool = pool
+        self.upstream = upstream
+        self.url = url
+        self.interval = interval
+        self.ttl = ttl
+        self.timeout = timeout
+        self.idle_after = idle_after
+        self._result: Optional[dict] = None
+        self._inflight: Optional[asyncio.Task] = None
+        self._task: Optional[asyncio.Task] = None
+        self._last_demand = 0.0
+        self.probes = 0
+        self.hits = 0
+        self.coalesced = 0
+
+    async def get(self, refresh: bool = False) -> dict:
+        """
+        获取探测结果
+
+        返回:
+            {"online", "status_code", "error"(connect/timeout/status/other/None), "message", "models", "checked_at"}
+        """
+        self._last_demand = time.time()
+        result = self._result
+        if not refresh and result is not None and time.time() - result["checked_at"] <= self.ttl:
+            self.hits += 1
+            return result
+        return await self.refresh()
+
+    async def refresh(self) -> dict:
+        """发起探测；已有探测在途时等待同一个结果"""
+        if self._inflight is None or self._inflight.done():
+            self._inflight = asyncio.create_task(self._probe())
+        else:
+            self.coalesced += 1
+        # shield：单个请求被取消（客户端断开）时不影响其他等待者和缓存更新
+        return await asyncio.shield(self._inflight)
+
+    async def _probe(self) -> dict:
+        self.probes += 1
+        result = {"online": False, "status_code": None, "error": None, "message": "", "models": None,
+                  "checked_at": 0.0}
+        try:
+            response = await self.pool.get(self.upstream).get(self.url, timeout=self.timeout)
+            result["status_code"] = response.status_code
+            if response.status_code == 200:
+                result["online"] = True
+                result["models"] = response.json()
+            else:
+                result["error"] = "status"
+                result["message"] = f"响应异常: {response.status_code}"
+        except httpx.ConnectError as e:
+            result["error"] = "connect"
+            result["message"] = str(e)
+        except httpx.TimeoutException as e:
+            result["error"] = "timeout"
+            result["message"] = str(e)
+        except Exception as e:
+            result["error"] = "other"
+            result["message"] = str(e)
+        result["checked_at"] = time.time()
+        previous = self._result
+        if previous is None or previous["online"] != result["online"]:
+            # 只在状态变化时打印，避免轮询刷屏
+            if result["online"]:
+                count = len((result["models"] or {}).get("data", []))
+                print(f"【AI健康检查】✅ {self.upstream} 在线，加载了 {count} 个模型")
+            else:
+                print(f"【AI健康检查】❌ {self.upstream} 离线（{result['error']}）：{result['message']}")
+        self._result = result
+        return result
+
+    def start(self):
+        """启动后台刷新任务"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if time.time() - self._last_demand > self.idle_after:
+                continue
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"【AI健康检查】后台刷新失败：{e}")
+
+    def status(self) -> dict:
+        result = self._result
+        return {
+            "online": result["online"] if result else None,
+            "checked_at": result["checked_at"] if result else None,
+            "probes": self.probes,
+            "cache_hits": self.hits,
+            "coalesced": self.coalesced,
+        }
@@ -0,0 +1,281 @@
+# ble_manager.py
+"""
+多设备蓝牙连接管理模块
+同时维护 BLE_DEVICES 中每个设备的 bleak 连接，每个连接拥有独立的行分帧缓冲（LineFramer）和设备ID映射。
+使用一个常驻扫描器（检测回调）发现设备，重连时不再反复执行阻塞式 discover。
+BleakClient / BleakScanner 通过工厂参数注入，便于在无蓝牙环境下替换。
+"""
+import asyncio
+import time
+import traceback
+from typing import Callable, Dict, Iterable, Optional
+
+from bleak import BleakClient, BleakScanner
+
+from line_framer import LineFramer
+
+
+def _normalize_address(address: str) -> str:
+    """统一 MAC 地址格式（去掉分隔符并转大写）"""
+    return (address or "").upper().replace(":", "").replace("-", "")
+
+
+class BleConnection:
+    """单个蓝牙设备的连接状态"""
+
+    def __init__(self, name: str, address: str, device_id: str, line_end: bytes = b"\r\n"):
+        self.name = name
+        self.address = address
+        self.device_id = device_id
+        self.client = None
+        self.connected = False
+        self.framer = LineFramer(line_end)
+        self.failures = 0
+        self.connected_since: Optional[float] = None
+        self.last_data_time: Optional[float] = None
+        self.discovered = None  # 扫描器最近一次发现的 BLEDevice
+        self.discovered_event = asyncio.Event()
+        self.disconnected_event = asyncio.Event()
+
+
+class BleManager:
+    """多设备 BLE 连接管理器"""
+
+    def __init__(self,
+                 devices: Dict[str, str],
+                 device_ids: Dict[str, str],
+                 char_uuid: str,
+                 on_line: Callable[[str, bytes], None],
+                 on_state_change: Optional[Callable[[str, bool], None]] = None,
+                 line_end: bytes = b"\r\n",
+                 client_factory: Callable = BleakClient,
+                 scanner_factory: Callable = BleakScanner,
+                 connect_timeout: float = 15.0,
+                 scan_wait: float = 3.0,
+                 fast_retry_attempts: int = 5,
+                 reconnect_interval: float = 10.0):
+        """
+        初始化管理器
+
+        参数:
+            devices: 蓝牙设备名称 -> MAC 地址
+            device_ids: 蓝牙设备名称 -> 设备ID（如 "BT27" -> "D01"），未配置时使用名称
+            char_uuid: 串口透传特征 UUID
+            on_line: 收到完整一行数据时的回调 (device_id, line_bytes)，行内容为未解码的原始字节
+            on_state_change: 连接状态变化回调 (device_id, connected)
+            line_end: 行结束符
+            client_factory: BleakClient 工厂（可替换为模拟实现）
+            scanner_factory: BleakScanner 工厂（可替换为模拟实现）
+            connect_timeout: 单次连接超时（秒）
+            scan_wait: 等待扫描器发现设备的时间，超时后按配置地址直连（秒）
+            fast_retry_attempts: 连续失败多少次之内按1秒快速重试
+            reconnect_interval: 超过快速重试次数后的重连间隔（秒）
+        """
+        self.char_uuid = char_uuid
+        self.on_line = on_line
+        self.on_state_change = on_state_change
+        self.line_end = line_end
+        self.client_factory = client_factory
+        self.scanner_factory = scanner_factory
+        self.connect_timeout = connect_timeout
+        self.scan_wait = scan_wait
+        self.fast_retry_attempts = fast_retry_attempts
+        self.reconnect_interval = reconnect_interval
+
+        self.connections: Dict[str, BleConnection] = {}
+        for name, address in devices.items():
+            device_id = (device_ids.get(name) or name).upper()
+            self.connections[device_id] = BleConnection(name, address, device_id, line_end)
+        self._by_name = {conn.name: conn for conn in self.connections.values()}
+        self._by_address = {_normalize_address(conn.address): conn for conn in self.connections.values()}
+
+        self._scanner = None
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._run_task: Optional[asyncio.Future] = None
+
+    # ============ 查询 ============
+    def has_device(self, device_id: Optional[str]) -> bool:
+        return (device_id or "").upper() in self.connections
+
+    def is_connected(self, device_id: Optional[str]) -> bool:
+        conn = self.connections.get((device_id or "").upper())
+        return bool(conn and conn.connected)
+
+    @property
+    def any_connected(self) -> bool:
+        return any(conn.connected for conn in self.connections.values())
+
+    @property
+    def device_ids(self) -> Iterable[str]:
+        return self.connections.keys()
+
+    def get_client(self, device_id: Optional[str]):
+        conn = self.connections.get((device_id or "").upper())
+        return conn.client if conn and conn.connected else None
+
+    def status(self) -> Dict[str, dict]:
+        """各蓝牙连接的状态快照"""
+        return {
+            device_id: {
+                "name": conn.name,
+                "address": conn.address,
+                "connected": conn.connected,
+                "connected_since": conn.connected_since,
+                "last_data_time": conn.last_data_time,
+                "failures": conn.failures,
+                "lines": conn.framer.lines,
+                "dropped_bytes": conn.framer.dropped_bytes,
+            }
+            for device_id, conn in self.connections.items()
+        }
+
+    # ============ 写入 ============
+    async def write(self, device_id: str, payload: bytes, response: bool = True):
+        """向指定设备写入数据，未连接时抛出 RuntimeError"""
+        client = self.get_client(device_id)
+        if client is None:
+            raise RuntimeError(f"设备 {device_id} 的蓝牙未连接")
+        await client.write_gatt_char(self.char_uuid, payload, response=response)
+
+    # ============ 扫描器 ============
+    def _on_detected(self, device, advertisement_data=None):
+        """常驻扫描器的检测回调：按名称或 MAC 地址匹配已配置设备"""
+        conn = self._by_name.get(getattr(device, "name", None))
+        if conn is None:
+            conn = self._by_address.get(_normalize_address(getattr(device, "address", "")))
+        if conn is None or conn.connected:
+            return
+        if conn.discovered is None:
+            print(f"【BLE】✓ 扫描发现设备：{conn.name} - {device.address}")
+        conn.discovered = device
+        conn.discovered_event.set()
+
+    async def _start_scanner(self):
+        try:
+            self._scanner = self.scanner_factory(detection_callback=self._on_detected)
+            await self._scanner.start()
+            print(f"【BLE】常驻扫描已启动，监听 {len(self.connections)} 个设备：{', '.join(self._by_name)}")
+        except Exception as e:
+            self._scanner = None
+            print(f"【BLE】扫描器启动失败：{e}，将按配置地址直连")
+
+    async def _stop_scanner(self):
+        if self._scanner is None:
+            return
+        try:
+            await self._scanner.stop()
+        except Exception as e:
+            print(f"【BLE】停止扫描器失败：{e}")
+        self._scanner = None
+
+    async def _resolve_target(self, conn: BleConnection):
+        """优先使用扫描器发现的设备对象，未发现时按配置地址直连（Windows直连模式）"""
+        if conn.discovered is None and self._scanner is not None:
+            try:
+                await asyncio.wait_for(conn.discovered_event.wait(), timeout=self.scan_wait)
+            except asyncio.TimeoutError:
+                print(f"【BLE】未扫描到 {conn.name}，尝试直连 {conn.address}")
+        return conn.discovered or conn.address
+
+    # ============ 通知处理 ============
+    def _on_notify(self, conn: BleConnection, data: bytearray):
+        """按连接拆行，每个连接使用独立的分帧缓冲区"""
+        conn.last_data_time = time.time()
+        conn.framer.feed(data, lambda line, c=conn: self._dispatch_line(c, line))
+
+    def _dispatch_line(self, conn: BleConnection, line: memoryview):
+        try:
+            self.on_line(conn.device_id, bytes(line))
+        except Exception as e:
+            print(f"【BLE】处理 {conn.name} 数据失败：{e}")
+            traceback.print_exc()
+
+    def _set_connected(self, conn: BleConnection, connected: bool, client=None):
+        if conn.connected == connected:
+            return
+        conn.connected = connected
+        conn.client = client if connected else None
+        conn.connected_since = time.time() if connected else None
+        if not connected:
+            conn.framer.clear()
+        if self.on_state_change:
+            try:
+                self.on_state_change(conn.device_id, connected)
+            except Exception as e:
+                print(f"【BLE】状态回调失败：{e}")
+
+    # ============ 连接循环 ============
+    async def _connection_loop(self, conn: BleConnection):
+        """单个设备的连接/订阅/重连循环"""
+        while True:
+            target = await self._resolve_target(conn)
+            conn.disconnected_event.clear()
+            print(f"【BLE】连接 {conn.name} ({conn.address}) -> 设备 {conn.device_id}"
+                  f"（连续失败 {conn.failures} 次）")
+            try:
+                client = self.client_factory(
+                    target,
+                    timeout=self.connect_timeout,
+                    disconnected_callback=lambda _client, c=conn: c.disconnected_event.set()
+                )
+                async with client:
+                    if not client.is_connected:
+                        raise RuntimeError("连接未建立")
+                    await client.start_notify(self.char_uuid, lambda _handle, data, c=conn: self._on_notify(c, data))
+                    conn.failures = 0
+                    self._set_connected(conn, True, client)
+                    print(f"【BLE】✓ 已连接并订阅 {conn.name}（设备 {conn.device_id}）")
+
+                    # 等待断开回调，同时低频检查 is_connected 兜底
+                    while client.is_connected and not conn.disconnected_event.is_set():
+                        try:
+                            await asyncio.wait_for(conn.disconnected_event.wait(), timeout=1.0)
+                        except asyncio.TimeoutError:
+                            pass
+                    print(f"【BLE】{conn.name} 连接断开（设备 {conn.device_id}）")
+            except asyncio.CancelledError:
+                self._set_connected(conn, False)
+                raise
+            except Exception as e:
+                conn.failures += 1
+                print(f"【BLE】{conn.name} 连接失败：{e}")
+            finally:
+                # 断开后丢弃旧的设备对象，等待扫描器重新发现
+                conn.discovered = None
+                conn.discovered_event.clear()
+
+            self._set_connected(conn, False)
+            # 正常断开或前几次失败时快速重试，持续失败后放慢节奏
+            await asyncio.sleep(self.reconnect_interval if conn.failures > self.fast_retry_attempts else 1)
+
+    # ============ 生命周期 ============
+    async def run(self):
+        """启动扫描器和所有设备的连接任务，直到 stop() 被调用"""
+        if self._run_task is not None and not self._run_task.done():
+            await asyncio.shield(self._run_task)
+            return
+        self._run_task = asyncio.get_running_loop().create_future()
+        await self._start_scanner()
+        for device_id, conn in self.connections.items():
+            self._tasks[device_id] = asyncio.create_task(self._connection_loop(conn))
+        try:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        finally:
+            await self._stop_scanner()
+            if not self._run_task.done():
+                self._run_task.set_result(None)
+
+    async def stop(self):
+        """取消所有连接任务并停止扫描"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            except Exception:
+                pass
+        self._tasks.clear()
+        await self._stop_scanner()
@@ -0,0 +1,197 @@
+# command_tracker.py
+"""
+命令确认跟踪模块
+记录每条下发命令的在途状态：MQTT 按 mid 关联 QoS1 PUBACK，以可等待的 Future 返回确认结果，
+并按设备和链路统计往返延迟直方图。
+PUBACK 只说明 Broker 已收到命令，不代表设备已收到：固件不会在 data_cmd 上回复，
+该主题上收到的控制命令是本服务（或其他 worker）自己发布的命令经 Broker 回送，不能作为设备回执。
+paho 的回调运行在网络线程中，所有 Future 的结算都通过 call_soon_threadsafe 切回主事件循环。
+"""
+import asyncio
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+
+class LatencyHistogram:
+    """固定桶的延迟直方图（毫秒）"""
+
+    BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.min_ms: Optional[float] = None
+        self.max_ms: Optional[float] = None
+
+    def observe(self, latency_ms: float):
+        index = len(self.BUCKETS_MS)
+        for i, bound in enumerate(self.BUCKETS_MS):
+            if latency_ms <= bound:
+                index = i
+                break
+        self.counts[index] += 1
+        self.count += 1
+        self.total_ms += latency_ms
+        self.min_ms = latency_ms if self.min_ms is None else min(self.min_ms, latency_ms)
+        self.max_ms = latency_ms if self.max_ms is None else max(self.max_ms, latency_ms)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """按桶上界估算分位数"""
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return float(self.BUCKETS_MS[i]) if i < len(self.BUCKETS_MS) else self.max_ms
+        return self.max_ms
+
+    def snapshot(self) -> dict:
+        labels = [f"<={bound}" for bound in self.BUCKETS_MS] + [f">{self.BUCKETS_MS[-1]}"]
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total_ms / self.count, 2) if self.count else None,
+            "min_ms": round(self.min_ms, 2) if self.min_ms is not None else None,
+            "max_ms": round(self.max_ms, 2) if self.max_ms is not None else None,
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+class PendingCommand:
+    """一条在途命令"""
+
+    __slots__ = ("device_id", "command", "transport", "mid", "sent_at", "ack_future")
+
+    def __init__(self, device_id: str, command: str, transport: str, mid: Optional[int],
+                 loop: asyncio.AbstractEventLoop):
+        self.device_id = device_id
+        self.command = command
+        self.transport = transport
+        self.mid = mid
+        self.sent_at = time.monotonic()
+        self.ack_future: asyncio.Future = loop.create_future()
+
+
+class CommandTracker:
+    """在途命令表 + 延迟直方图"""
+
+    def __init__(self, get_main_loop: Callable[[], Optional[asyncio.AbstractEventLoop]],
+                 ack_ttl: float = 30.0):
+        """
+        参数:
+            get_main_loop: 获取主事件循环的函数
+            ack_ttl: 未等待确认的命令在途表中的最长保留时间（秒），超时的条目会被清理并计入超时次数
+        """
+        self.get_main_loop = get_main_loop
+        self.ack_ttl = ack_ttl
+
+        self._by_mid: Dict[int, PendingCommand] = {}
+        # key 为 (设备ID, 链路, 阶段)，阶段目前只有 ack（PUBACK/BLE写响应）
+        self.histograms: Dict[Tuple[str, str, str], LatencyHistogram] = {}
+        self.timeouts: Dict[Tuple[str, str, str], int] = {}
+        self._lock = threading.Lock()
+
+    # ============ 登记 ============
+    def track_mqtt(self, device_id: str, command: str, mid: int) -> Optional[PendingCommand]:
+        """
+        登记一条已发布的 MQTT 命令（须在 publish() 返回后、让出事件循环前调用，
+        PUBACK 回调经 call_soon_threadsafe 排队，因此不会早于登记被处理）
+        """
+        loop = self.get_main_loop()
+        if loop is None:
+            return None
+        pending = PendingCommand(device_id, command, "MQTT", mid, loop)
+        with self._lock:
+            self._prune(time.monotonic())
+            self._by_mid.pop(mid, None)  # mid 回绕复用时移到末尾，保持按登记顺序
+            self._by_mid[mid] = pending
+        return pending
+
+    def record(self, device_id: str, transport: str, stage: str, latency_ms: float):
+        """直接记录一次延迟（用于 BLE 带响应写入等同步确认的链路）"""
+        with self._lock:
+            key = (device_id, transport, stage)
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = LatencyHistogram()
+            histogram.observe(latency_ms)
+
+    # ============ paho 回调（网络线程） ============
+    def on_publish(self, mid: int):
+        """QoS1 PUBACK 到达"""
+        self._dispatch(self._resolve_ack, mid, time.monotonic())
+
+    def _dispatch(self, callback, *args):
+        loop = self.get_main_loop()
+        if loop and loop.is_running():
+            loop.call_soon_threadsafe(callback, *args)
+
+    # ============ 结算（主事件循环） ============
+    def _resolve_ack(self, mid: int, received_at: float):
+        with self._lock:
+            pending = self._by_mid.pop(mid, None)
+        if pending is None:
+            return
+        latency_ms = (received_at - pending.sent_at) * 1000.0
+        self.record(pending.device_id, pending.transport, "ack", latency_ms)
+        if not pending.ack_future.done():
+            pending.ack_future.set_result(latency_ms)
+
+    def _prune(self, now: float):
+        """清理超过保留时间仍未收到 PUBACK 的条目（调用方持有锁；dict 按登记顺序，遇到未过期的即可停止）"""
+        while self._by_mid:
+            mid, pending = next(iter(self._by_mid.items()))
+            if now - pending.sent_at <= self.ack_ttl:
+                break
+            del self._by_mid[mid]
+            self._count_timeout(pending, "ack")
+
+    def _count_timeout(self, pending: PendingCommand, stage: str):
+        key = (pending.device_id, pending.transport, stage)
+        self.timeouts[key] = self.timeouts.get(key, 0) + 1
+
+    # ============ 等待 ============
+    async def wait(self, pending: PendingCommand, timeout: float) -> dict:
+        """
+        等待 QoS1 PUBACK
+
+        参数:
+            pending: track_mqtt 返回的在途命令
+            timeout: 最长等待时间（秒）
+
+        返回:
+            {"acked": bool, "ack_ms": float|None}
+        """
+        outcome = {"acked": False, "ack_ms": None}
+        try:
+            outcome["ack_ms"] = round(await asyncio.wait_for(asyncio.shield(pending.ack_future), timeout), 2)
+            outcome["acked"] = True
+        except asyncio.TimeoutError:
+            with self._lock:
+                if self._by_mid.get(pending.mid) is pending:
+                    del self._by_mid[pending.mid]
+                    self._count_timeout(pending, "ack")
+        return outcome
+
+    # ============ 统计 ============
+    def stats(self) -> dict:
+        """按设备 -> 链路 -> 阶段输出直方图快照、超时次数与在途数量"""
+        devices: Dict[str, dict] = {}
+        with self._lock:
+            for (device_id, transport, stage), histogram in self.histograms.items():
+                entry = devices.setdefault(device_id, {}).setdefault(transport, {})
+                entry[stage] = histogram.snapshot()
+            for (device_id, transport, stage), count in self.timeouts.items():
+                entry = devices.setdefault(device_id, {}).setdefault(transport, {})
+                entry.setdefault("timeouts", {})[stage] = count
+            inflight_ack = len(self._by_mid)
+        return {
+            "devices": devices,
+            "inflight": {"ack": inflight_ack},
+            "buckets_ms": list(LatencyHistogram.BUCKETS_MS),
+        }
@@ -4,7 +4,7 @@
 """
 
 import aiomysql
-from typing import Optional
+from typing import List, Optional
 from contextlib import asynccontextmanager
 import time
 import platform
@@ -61,6 +61,8 @@ class DatabaseManager:
         self.password = password
         self.database = database
         self.pool = None
+        # sensor_states 表字段缓存（建表/迁移完成后填充，避免每次读写都执行 DESCRIBE）
+        self._sensor_state_columns: Optional[set] = None
 
     async def init_pool(self, minsize=1, maxsize=10):
         """初始化连接池"""
@@ -143,6 +145,45 @@ class DatabaseManager:
             print(f"【数据库】插入数据失败：{e}")
             return False
 
+    async def insert_sensor_data_batch(self, rows: list, device_id: Optional[str] = None,
+                                       chunk_size: int = 500) -> bool:
+        """
+        批量插入传感器数据（多行 VALUES，一条 SQL 写入多条读数）
+
+        参数:
+            rows: 元组列表，每项为 (timestamp, temp, hum, lux, smoke, rs_ro, temp2, pressure)，
+                  timestamp 为 None 时使用当前时间
+            device_id: 设备ID（如：D01, D02），可选
+            chunk_size: 每条 SQL 最多写入的行数（避免超过 max_allowed_packet）
+        """
+        if not rows:
+            return True
+        if device_id is None or not str(device_id).strip():
+            device_id = "D01"
+        device_id = str(device_id).upper()
+        now = time.time()
+
+        try:
+            async with self.get_connection() as conn:
+                async with conn.cursor() as cursor:
+                    for start in range(0, len(rows), chunk_size):
+                        chunk = rows[start:start + chunk_size]
+                        # executemany 只能改写纯 %s 的 VALUES，带 FROM_UNIXTIME 时会退化为逐行执行，这里手动拼接
+                        sql = f"""
+                              INSERT INTO sensor_readings (device_id, timestamp, temperature, humidity, brightness, smoke_ppm,
+                                                           rs_ro, temp2, pressure)
+                              VALUES {', '.join(['(%s, FROM_UNIXTIME(%s), %s, %s, %s, %s, %s, %s, %s)'] * len(chunk))}
+                              """
+                        sql_values = []
+                        for timestamp, temp, hum, lux, smoke, rs_ro, temp2, pressure in chunk:
+                            sql_values.extend((device_id, timestamp or now, temp, hum, lux, smoke, rs_ro, temp2,
+                                               pressure))
+                        await cursor.execute(sql, sql_values)
+                    return True
+        except Exception as e:
+            print(f"【数据库】批量插入数据失败（{len(rows)} 条）：{e}")
+            return False
+
     async def get_recent_data(self, limit=100, device_id: Optional[str] = None):
         """
         获取最近的传感器数据
@@ -597,6 +638,131 @@ class DatabaseManager:
             print(f"【数据库】查询警告数据失败：{e}")
             return []
 
+    async def get_aggregated_data_by_device(self, start_time: float, end_time: float, interval_seconds: int = 300,
+                                            device_ids: Optional[List[str]] = None):
+        """
+        一次查询获取多台设备的聚合数据（按设备和时间间隔分组），避免逐台设备查询
+
+        参数:
+            start_time: 起始时间戳（秒）
+            end_time: 结束时间戳（秒）
+            interval_seconds: 聚合间隔（秒），默认300秒（5分钟）
+            device_ids: 设备ID列表（可选），为空时返回所有有数据的设备
+
+        返回:
+            {设备ID: 聚合数据列表}，每台设备的列表按时间升序，字段与 get_aggregated_data 相同
+        """
+        try:
+            async with self.get_connection() as conn:
+                async with conn.cursor(aiomysql.DictCursor) as cursor:
+                    params = [interval_seconds, interval_seconds, start_time, end_time]
+                    device_filter = ""
+                    if device_ids:
+                        device_filter = f"AND device_id IN ({', '.join(['%s'] * len(device_ids))})"
+                        params.extend(str(device_id).strip().upper() for device_id in device_ids)
+                    sql = f"""
+                          SELECT 
+                                 device_id,
+                                 time_bucket as timestamp,
+                                 AVG(temperature) as temperature,
+                                 MIN(temperature) as min_temp,
+                                 MAX(temperature) as max_temp,
+                                 AVG(humidity) as humidity,
+                                 MIN(humidity) as min_hum,
+                                 MAX(humidity) as max_hum,
+                                 AVG(brightness) as brightness,
+                                 MIN(brightness) as min_lux,
+                                 MAX(brightness) as max_lux,
+                                 AVG(smoke_ppm) as smoke_ppm,
+                                 MIN(smoke_ppm) as min_smoke,
+                                 MAX(smoke_ppm) as max_smoke,
+                                 AVG(pressure) as pressure,
+                                 MIN(pressure) as min_pressure,
+                                 MAX(pressure) as max_pressure,
+                                 AVG(temp2) as temp2,
+                                 MIN(temp2) as min_temp2,
+                                 MAX(temp2) as max_temp2,
+                                 AVG(rs_ro) as rs_ro,
+                                 MIN(rs_ro) as min_rs_ro,
+                                 MAX(rs_ro) as max_rs_ro,
+                                 COUNT(*) as data_count
+                          FROM (
+                              SELECT 
+                                     device_id,
+                                     UNIX_TIMESTAMP(
+                                         FROM_UNIXTIME(
+                                             FLOOR(UNIX_TIMESTAMP(timestamp) / %s) * %s
+                                         )
+                                     ) as time_bucket,
+                                     temperature,
+                                     humidity,
+                                     brightness,
+                                     smoke_ppm,
+                                     pressure,
+                                     temp2,
+                                     rs_ro
+                              FROM sensor_readings
+                              WHERE timestamp BETWEEN FROM_UNIXTIME(%s) AND FROM_UNIXTIME(%s)
+                                {device_filter}
+                          ) as grouped_data
+                          GROUP BY device_id, time_bucket
+                          ORDER BY device_id ASC, time_bucket ASC
+                          """
+                    await cursor.execute(sql, params)
+                    grouped = {}
+                    for row in await cursor.fetchall():
+                        grouped.setdefault(row.pop("device_id"), []).append(row)
+                    return grouped
+        except Exception as e:
+            print(f"【数据库】按设备查询聚合数据失败：{e}")
+            return {}
+
+    async def get_warnings_in_range(self, start_time: float, end_time: float, device_id: Optional[str] = None,
+                                    limit: int = 500):
+        """
+        获取与时间范围有重叠的警告（开始于范围内，或开始于范围前但在范围开始时仍未恢复）
+
+        参数:
+            start_time: 起始时间戳（秒）
+            end_time: 结束时间戳（秒）
+            device_id: 设备ID筛选（可选）
+            limit: 最多返回条数（按开始时间倒序取最近的）
+
+        返回:
+            警告列表（时间字段为时间戳）
+        """
+        try:
+            async with self.get_connection() as conn:
+                async with conn.cursor(aiomysql.DictCursor) as cursor:
+                    where_conditions = [
+                        "warning_start_time <= FROM_UNIXTIME(%s)",
+                        "(warning_resolved_time IS NULL OR warning_resolved_time >= FROM_UNIXTIME(%s))",
+                    ]
+                    params = [end_time, start_time]
+                    if device_id and str(device_id).strip():
+                        where_conditions.append("device_id = %s")
+                        params.append(str(device_id).strip().upper())
+                    params.append(limit)
+                    sql = f"""
+                          SELECT warning_type,
+                                 device_id,
+                                 warning_message,
+                                 warning_value,
+                                 is_resolved,
+                                 UNIX_TIMESTAMP(warning_start_time) as warning_start_time,
+                                 UNIX_TIMESTAMP(warning_resolved_time) as warning_resolved_time
+                          FROM warning_data
+                          WHERE {" AND ".join(where_conditions)}
+                          ORDER BY warning_start_time DESC
+                          LIMIT %s
+                          """
+                    await cursor.execute(sql, params)
+                    result = await cursor.fetchall()
+                    return result
+        except Exception as e:
+            print(f"【数据库】查询时间范围警告失败：{e}")
+            return []
+
     async def get_warning_dates(self, device_id: Optional[str] = None):
         """
         获取所有有警告数据的日期列表及每个日期的消息数量
@@ -838,6 +1004,9 @@ class DatabaseManager:
                                 print("【数据库】✓ 已将 sensor_states 主键调整为 (sensor_name, device_id)")
                         except Exception as e:
                             print(f"【数据库】调整 sensor_states 主键失败：{e}")
+
+                    await cursor.execute("DESCRIBE `sensor_states`")
+                    self._sensor_state_columns = {row[0] for row in await cursor.fetchall()}
         except Exception as e:
             print(f"【数据库】创建传感器状态表失败：{e}")
             import traceback
@@ -977,6 +1146,72 @@ class DatabaseManager:
         except Exception as e:
             print(f"【数据库】创建传感器数据表失败：{e}")
 
+    async def ensure_device_registry_table(self):
+        """确保设备注册表存在"""
+        try:
+            async with self.get_connection() as conn:
+                async with conn.cursor() as cursor:
+                    sql = """
+                          CREATE TABLE IF NOT EXISTS device_registry (
+                              device_id VARCHAR(16) NOT NULL COMMENT '设备ID（如：D01, D02）',
+                              name VARCHAR(64) NULL DEFAULT NULL COMMENT '显示名称（为空时使用默认格式）',
+                              auto_registered TINYINT NOT NULL DEFAULT 0 COMMENT '是否由首条消息自动登记：0=配置, 1=自动',
+                              registered_at DATETIME NOT NULL COMMENT '登记时间',
+                              PRIMARY KEY (device_id) USING BTREE
+                          ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+                          COMMENT='设备注册表'
+                          """
+                    await cursor.execute(sql)
+        except Exception as e:
+            print(f"【数据库】创建设备注册表失败：{e}")
+
+    async def get_registered_devices(self):
+        """
+        获取所有已登记的设备
+
+        返回:
+            设备列表，每项包含 device_id, name, auto_registered, registered_at（按登记时间排序）
+        """
+        try:
+            async with self.get_connection() as conn:
+                async with conn.cursor(aiomysql.DictCursor) as cursor:
+                    sql = """
+                          SELECT device_id,
+                                 name,
+                                 auto_registered,
+                                 UNIX_TIMESTAMP(registered_at) as registered_at
+                          FROM device_registry
+                          ORDER BY registered_at, device_id
+                          """
+                    await cursor.execute(sql)
+                    return await cursor.fetchall()
+        except Exception as e:
+            print(f"【数据库】查询设备注册表失败：{e}")
+            return []
+
+    async def register_devices(self, rows: list) -> bool:
+        """
+        登记设备（已存在的设备保持不变，数据库中修改过的名称不会被覆盖）
+
+        参数:
+            rows: [(device_id, name, auto_registered, registered_at 时间戳), ...]
+        """
+        if not rows:
+            return True
+        try:
+            async with self.get_connection() as conn:
+                async with conn.cursor() as cursor:
+                    sql = """
+                          INSERT IGNORE INTO device_registry (device_id, name, auto_registered, registered_at)
+                          VALUES (%s, %s, %s, FROM_UNIXTIME(%s))
+                          """
+                    # 行数很少（启动时的初始设备、之后逐台自动登记），executemany 逐行执行即可
+                    await cursor.executemany(sql, rows)
+                    return True
+        except Exception as e:
+            print(f"【数据库】登记设备失败：{e}")
+            return False
+
     async def set_sensor_state(self, sensor_name: str, sensor_state: str = None, via: str = UNSET,
                                mode: str = UNSET, next_run_time: float = UNSET, last_value: float = UNSET,
                                phase: str = UNSET, phase_message: str = UNSET, phase_until: float = UNSET,
@@ -987,13 +1222,9 @@ class DatabaseManager:
         device_id = (device_id or "D01").upper()
         normalized_state = sensor_state.lower() if sensor_state else None
         try:
-            await self.ensure_sensor_state_table()
+            columns = await self._get_sensor_state_columns()
             async with self.get_connection() as conn:
                 async with conn.cursor() as cursor:
-                    # 检查字段是否存在（普通cursor返回tuple，用row[0]）
-                    await cursor.execute("DESCRIBE `sensor_states`")
-                    columns = {row[0] for row in await cursor.fetchall()}
-
                     # 检查记录是否存在，便于在未提供状态时保持原值
                     await cursor.execute("SELECT sensor_state FROM `sensor_states` WHERE `sensor_name` = %s AND `device_id` = %s LIMIT 1",
                                          (sensor_name, device_id))
@@ -1086,51 +1317,137 @@ class DatabaseManager:
             traceback.print_exc()
             return False
 
+    async def set_sensor_states_bulk(self, rows: list) -> bool:
+        """
+        批量保存传感器状态（多行 upsert，一次请求内相同字段组合的行合并为一条 SQL）
+
+        参数:
+            rows: 字典列表，每项包含 sensor_name、device_id，以及 set_sensor_state 支持的可选字段
+                  （sensor_state/via/mode/next_run_time/last_value/phase/phase_message/phase_until/
+                  samples_collected/samples_target）。sensor_state 为 None 时保持原值（新记录默认 on）。
+        """
+        if not rows:
+            return True
+        time_columns = {'next_run_time', 'phase_until'}
+        optional_columns = ['last_via', 'mode', 'next_run_time', 'last_value', 'phase', 'phase_message',
+                            'phase_until', 'samples_collected', 'samples_target']
+        try:
+            columns = await self._get_sensor_state_columns()
+
+            # 按字段组合分组，保证同组内每行的列完全一致
+            groups = {}
+            for row in rows:
+                row = dict(row)
+                if 'via' in row:
+                    row['last_via'] = row.pop('via')
+                state = row.get('sensor_state')
+                present = tuple(c for c in optional_columns if c in row and c in columns)
+                key = (present, state is None)
+                groups.setdefault(key, []).append(row)
+
+            alias = "new_state"
+            async with self.get_connection() as conn:
+                async with conn.cursor() as cursor:
+                    for (present, keep_state), group_rows in groups.items():
+                        column_names = ['sensor_name', 'device_id', 'sensor_state'] + list(present)
+                        placeholders = ", ".join(
+                            "FROM_UNIXTIME(%s)" if c in time_columns else "%s" for c in column_names
+                        )
+                        updates = [] if keep_state else [f"`sensor_state` = {alias}.`sensor_state`"]
+                        updates += [f"`{c}` = {alias}.`{c}`" for c in present]
+                        updates.append("`updated_at` = CURRENT_TIMESTAMP")
+
+                        sql_values = []
+                        for row in group_rows:
+                            state = row.get('sensor_state')
+                            sql_values.extend([
+                                str(row['sensor_name']).upper(),
+                                (row.get('device_id') or "D01").upper(),
+                                state.lower() if state else 'on',
+                            ])
+                            sql_values.extend(row[c] for c in present)
+
+                        sql = f"""
+                              INSERT INTO `sensor_states` ({', '.join(f'`{c}`' for c in column_names)})
+                              VALUES {', '.join([f'({placeholders})'] * len(group_rows))} AS {alias}
+                              ON DUPLICATE KEY UPDATE
+                                  {', '.join(updates)}
+                              """
+                        await cursor.execute(sql, sql_values)
+            return True
+        except Exception as e:
+            print(f"【数据库】批量保存传感器状态失败：{e}")
+            import traceback
+            traceback.print_exc()
+            return False
+
+    async def _get_sensor_state_columns(self) -> set:
+        """获取 sensor_states 表字段（首次调用时建表/迁移并缓存）"""
+        if self._sensor_state_columns is None:
+            await self.ensure_sensor_state_table()
+        return self._sensor_state_columns or set()
+
+    @staticmethod
+    def _sensor_state_select_fields(columns: set) -> list:
+        """根据已存在的字段构建 sensor_states 的 SELECT 字段列表（确保字段存在且加反引号）"""
+        select_fields = []
+        if 'sensor_state' in columns:
+            select_fields.append("`sensor_state`")
+        if 'last_via' in columns:
+            select_fields.append("`last_via`")
+        if 'mode' in columns:
+            select_fields.append("`mode`")
+        if 'next_run_time' in columns:
+            select_fields.append("UNIX_TIMESTAMP(`next_run_time`) AS `next_run_time`")
+        if 'last_value' in columns:
+            select_fields.append("`last_value`")
+        if 'phase' in columns:
+            select_fields.append("`phase`")
+        if 'phase_message' in columns:
+            select_fields.append("`phase_message`")
+        if 'phase_until' in columns:
+            select_fields.append("UNIX_TIMESTAMP(`phase_until`) AS `phase_until`")
+        if 'samples_collected' in columns:
+            select_fields.append("`samples_collected`")
+        if 'samples_target' in columns:
+            select_fields.append("`samples_target`")
+        if 'updated_at' in columns:
+            select_fields.append("UNIX_TIMESTAMP(`updated_at`) AS `updated_at`")
+
+        # 如果没有任何字段，至少查询基本字段
+        if not select_fields:
+            select_fields = ["`sensor_state`", "`last_via`"]
+
+        if 'device_id' in columns:
+            select_fields.append("`device_id`")
+        return select_fields
+
+    @staticmethod
+    def _fill_sensor_state_defaults(result: Optional[dict], device_id: str) -> Optional[dict]:
+        """如果字段不存在，设置默认值"""
+        if result:
+            result.setdefault('mode', 'balance')
+            result.setdefault('next_run_time', None)
+            result.setdefault('last_value', None)
+            result.setdefault('phase', 'idle')
+            result.setdefault('phase_message', None)
+            result.setdefault('phase_until', None)
+            result.setdefault('samples_collected', None)
+            result.setdefault('samples_target', None)
+
+        if result is not None and 'device_id' not in result:
+            result['device_id'] = device_id
+        return result
+
     async def get_sensor_state(self, sensor_name: str, device_id: str = "D01"):
         """获取传感器状态"""
         sensor_name = sensor_name.upper()
         device_id = (device_id or "D01").upper()
         try:
-            await self.ensure_sensor_state_table()
+            columns = await self._get_sensor_state_columns()
             async with self.get_connection() as conn:
                 async with conn.cursor(aiomysql.DictCursor) as cursor:
-                    # 先检查字段是否存在（DictCursor返回dict，需要用key取值）
-                    await cursor.execute("DESCRIBE `sensor_states`")
-                    rows = await cursor.fetchall()
-                    columns = {row["Field"] for row in rows}
-
-                    # 构建SELECT字段列表（确保字段存在且加反引号）
-                    select_fields = []
-                    if 'sensor_state' in columns:
-                        select_fields.append("`sensor_state`")
-                    if 'last_via' in columns:
-                        select_fields.append("`last_via`")
-                    if 'mode' in columns:
-                        select_fields.append("`mode`")
-                    if 'next_run_time' in columns:
-                        select_fields.append("UNIX_TIMESTAMP(`next_run_time`) AS `next_run_time`")
-                    if 'last_value' in columns:
-                        select_fields.append("`last_value`")
-                    if 'phase' in columns:
-                        select_fields.append("`phase`")
-                    if 'phase_message' in columns:
-                        select_fields.append("`phase_message`")
-                    if 'phase_until' in columns:
-                        select_fields.append("UNIX_TIMESTAMP(`phase_until`) AS `phase_until`")
-                    if 'samples_collected' in columns:
-                        select_fields.append("`samples_collected`")
-                    if 'samples_target' in columns:
-                        select_fields.append("`samples_target`")
-                    if 'updated_at' in columns:
-                        select_fields.append("UNIX_TIMESTAMP(`updated_at`) AS `updated_at`")
-                    
-                    # 如果没有任何字段，至少查询基本字段
-                    if not select_fields:
-                        select_fields = ["`sensor_state`", "`last_via`"]
-
-                    if 'device_id' in columns:
-                        select_fields.append("`device_id`")
-
+                    select_fields = self._sensor_state_select_fields(columns)
                     sql = f"""
                           SELECT {', '.join(select_fields)}
                           FROM `sensor_states`
@@ -1138,32 +1455,49 @@ class DatabaseManager:
                           """
                     await cursor.execute(sql, (sensor_name, device_id))
                     result = await cursor.fetchone()
+                    return self._fill_sensor_state_defaults(result, device_id)
+        except Exception as e:
+            print(f"【数据库】获取传感器状态失败：{e}")
+            import traceback
+            traceback.print_exc()
+            return None
+
+    async def get_sensor_states(self, sensor_names, device_id: str = "D01") -> dict:
+        """
+        一次查询获取同一设备多个传感器的状态
 
-                    # 如果字段不存在，设置默认值
-                    if result:
-                        if 'mode' not in result:
-                            result['mode'] = 'balance'
-                        if 'next_run_time' not in result:
-                            result['next_run_time'] = None
-                        if 'last_value' not in result:
-                            result['last_value'] = None
-                        if 'phase' not in result:
-                            result['phase'] = 'idle'
-                        if 'phase_message' not in result:
-                            result['phase_message'] = None
-                        if 'phase_until' not in result:
-                            result['phase_until'] = None
-                        if 'samples_collected' not in result:
-                            result['samples_collected'] = None
-                        if 'samples_target' not in result:
-                            result['samples_target'] = None
-
-                    if result is not None and 'device_id' not in result:
-                        result['device_id'] = device_id
+        参数:
+            sensor_names: 传感器名称列表（如 ["MQ2", "BMP180", "BH1750"]）
+            device_id: 设备ID
 
-                    return result
+        返回:
+            字典，key 为传感器名称（大写），value 为状态记录；不存在的传感器不出现在结果中。
+            查询失败时返回 None（与“记录不存在”区分，避免调度器误写默认状态）
+        """
+        names = [name.upper() for name in sensor_names]
+        device_id = (device_id or "D01").upper()
+        if not names:
+            return {}
+        try:
+            columns = await self._get_sensor_state_columns()
+            async with self.get_connection() as conn:
+                async with conn.cursor(aiomysql.DictCursor) as cursor:
+                    select_fields = self._sensor_state_select_fields(columns)
+                    placeholders = ", ".join(["%s"] * len(names))
+                    sql = f"""
+                          SELECT `sensor_name`, {', '.join(select_fields)}
+                          FROM `sensor_states`
+                          WHERE `device_id` = %s AND `sensor_name` IN ({placeholders})
+                          """
+                    await cursor.execute(sql, [device_id] + names)
+                    rows = await cursor.fetchall()
+                    states = {}
+                    for row in rows:
+                        name = (row.pop('sensor_name') or '').upper()
+                        states[name] = self._fill_sensor_state_defaults(row, device_id)
+                    return states
         except Exception as e:
-            print(f"【数据库】获取传感器状态失败：{e}")
+            print(f"【数据库】批量获取传感器状态失败：{e}")
             import traceback
             traceback.print_exc()
             return None
@@ -0,0 +1,131 @@
+# device_liveness.py
+"""
+设备在线状态跟踪模块
+把"最后一次收到设备消息的时间"转换为明确的上线/离线事件，由服务端推送，页面不再轮询 /api/devices 或自行按时间推断：
+- 收到消息（touch）：记录最后消息时间；设备原本离线时立即产生上线事件；
+- 离线判定使用截止时间小根堆：每台在线设备在堆中只有一项（最后消息时间 + 超时），
+  定时任务只睡到最早的截止时间，醒来时若该设备期间又有消息则按新的最后消息时间重新入堆，否则产生离线事件；
+  检查代价与在线设备数无关，不需要周期性扫描全部设备。
+touch 可在 paho 网络线程中调用，状态变化回调统一通过 call_soon_threadsafe 切回主事件循环执行。
+"""
+import asyncio
+import heapq
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+
+class LivenessTracker:
+    """设备上线/离线跟踪"""
+
+    def __init__(self, timeout: float, on_change: Callable[[str, bool, float], None],
+                 get_main_loop: Callable[[], Optional[asyncio.AbstractEventLoop]]):
+        """
+        参数:
+            timeout: 超过该秒数未收到消息判定为离线
+            on_change: 状态变化回调 (设备ID, 是否在线, 最后消息时间)，在主事件循环中调用
+            get_main_loop: 返回主事件循环的函数
+        """
+        self.timeout = timeout
+        self.on_change = on_change
+        self.get_main_loop = get_main_loop
+        self._lock = threading.Lock()
+        self._last_seen: Dict[str, float] = {}
+        self._online: Set[str] = set()
+        self._heap: List[Tuple[float, str]] = []  # (截止时间, 设备ID)，每台在线设备一项
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.transitions = 0
+        self.expiry_checks = 0  # 截止时间到期的检查次数
+
+    def touch(self, device_id: str, now: Optional[float] = None):
+        """记录一次设备消息（任意线程）"""
+        now = now or time.time()
+        with self._lock:
+            self._last_seen[device_id] = now
+            if device_id in self._online:
+                return  # 已在线：堆中已有截止时间，到期时再按最新时间顺延
+            self._online.add(device_id)
+            was_idle = not self._heap
+            heapq.heappush(self._heap, (now + self.timeout, device_id))
+            self.transitions += 1
+        self._dispatch(device_id, True, now)
+        if was_idle:
+            # 新的截止时间总是晚于堆中已有的，只有堆原本为空时才需要唤醒定时任务
+            self._notify()
+
+    def is_online(self, device_id: str) -> bool:
+        return device_id in self._online
+
+    def last_seen(self, device_id: str) -> Optional[float]:
+        return self._last_seen.get(device_id)
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def expire(self, now: Optional[float] = None) -> List[str]:
+        """处理到期的截止时间，返回本次判定离线的设备"""
+        now = now or time.time()
+        offline = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                _deadline, device_id = heapq.heappop(self._heap)
+                self.expiry_checks += 1
+                deadline = self._last_seen[device_id] + self.timeout
+                if deadline > now:
+                    heapq.heappush(self._heap, (deadline, device_id))  # 期间有新消息，顺延
+                else:
+                    self._online.discard(device_id)
+                    offline.append(device_id)
+            self.transitions += len(offline)
+        for device_id in offline:
+            self._dispatch(device_id, False, self._last_seen[device_id])
+        return offline
+
+    async def _run(self):
+        while True:
+            with self._lock:
+                deadline = self._heap[0][0] if self._heap else None
+            if deadline is None:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            delay = deadline - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                self.expire()
+            except Exception as e:
+                print(f"【在线状态】离线检查失败：{e}")
+
+    def _notify(self):
+        loop = self.get_main_loop()
+        if loop is not None and self._wakeup is not None:
+            loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _dispatch(self, device_id: str, online: bool, last_seen: float):
+        loop = self.get_main_loop()
+        if loop is None or loop.is_closed():
+            return
+        loop.call_soon_threadsafe(self.on_change, device_id, online, last_seen)
+
+    def status(self) -> dict:
+        return {
+            "timeout": self.timeout,
+            "tracked": len(self._last_seen),
+            "online": sorted(self._online),
+            "pending_deadlines": len(self._heap),
+            "transitions": self.transitions,
+            "expiry_checks": self.expiry_checks,
+        }
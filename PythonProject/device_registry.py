@@ -0,0 +1,250 @@
+# device_registry.py
+"""
+设备注册表模块
+设备不再写死在 MQTT_DEVICES / MQTT_TOPICS 等列表里，而是集中登记在注册表中：
+- 内存中按设备ID保存（字典，O(1) 查找），设备ID列表与命令主题映射在变化时增量维护，调用方不会每次重建；
+- 主题格式 <前缀>/<设备ID>/<后缀> 编译为 topic_router 路由表，每个主题只在第一次出现时匹配、规范化和校验，
+  之后按主题缓存的 (设备ID, 主题类型) 一次字典查找即可得到，不做列表成员检查；
+  MQTT 只需订阅通配主题 stm32/+/data_now、stm32/+/data_cmd，设备数量与订阅数无关；
+- 自动注册：收到未登记设备的数据/命令主题消息时自动登记（设备ID需符合 DEVICE_ID_PATTERN，总数有上限），
+  并通过 on_register 回调写入数据库 device_registry 表、广播给其他 worker 和页面；
+- 启动时由配置中的初始设备和数据库中已登记的设备共同构成注册表，数据库中的名称优先（改名无需改代码）。
+register 可在 paho 网络线程中调用，写操作加锁；读操作只读取不可变快照或字典，无需加锁。
+"""
+import re
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from topic_router import TopicRouter
+
+DEVICE_ID_PATTERN = re.compile(r"^[A-Z0-9_-]{1,16}$")  # 与数据库 device_id VARCHAR(16) 一致
+
+TOPIC_DATA = "data"
+TOPIC_CMD = "cmd"
+
+
+def _device_route(device_id: str, kind: str) -> Optional[Tuple[str, str]]:
+    device_id = device_id.strip().upper()
+    if not DEVICE_ID_PATTERN.match(device_id):
+        return None
+    return device_id, kind
+
+
+def parse_device_topic(topic: str, prefix: str = "stm32", data_suffix: str = "data_now",
+                       cmd_suffix: str = "data_cmd") -> Tuple[Optional[str], Optional[str]]:
+    """
+    拆分设备主题（不带缓存；DeviceRegistry.parse_topic 使用缓存的路由表）
+
+    返回:
+        (设备ID, 主题类型 TOPIC_DATA/TOPIC_CMD)；不是设备主题或设备ID不合法时返回 (None, None)
+    """
+    parts = topic.split("/")
+    if len(parts) != 3 or parts[0] != prefix:
+        return None, None
+    if parts[2] == data_suffix:
+        kind = TOPIC_DATA
+    elif parts[2] == cmd_suffix:
+        kind = TOPIC_CMD
+    else:
+        return None, None
+    return _device_route(parts[1], kind) or (None, None)
+
+
+class DeviceInfo:
+    """一台已登记的设备"""
+
+    __slots__ = ("device_id", "name", "data_topic", "cmd_topic", "auto_registered", "registered_at")
+
+    def __init__(self, device_id: str, name: str, data_topic: str, cmd_topic: str, auto_registered: bool = False,
+                 registered_at: Optional[float] = None):
+        self.device_id = device_id
+        self.name = name
+        self.data_topic = data_topic
+        self.cmd_topic = cmd_topic
+        self.auto_registered = auto_registered
+        self.registered_at = registered_at or time.time()
+
+    def to_dict(self) -> dict:
+        return {
+            "device_id": self.device_id,
+            "name": self.name,
+            "data_topic": self.data_topic,
+            "cmd_topic": self.cmd_topic,
+            "auto_registered": self.auto_registered,
+            "registered_at": self.registered_at,
+        }
+
+
+class DeviceRegistry:
+    """设备注册表"""
+
+    def __init__(self, initial_devices: Iterable[str], names: Optional[Dict[str, str]] = None,
+                 topic_prefix: str = "stm32", data_suffix: str = "data_now", cmd_suffix: str = "data_cmd",
+                 default_name: str = "环境监测设备 {}", auto_register: bool = True, max_devices: int = 5000,
+                 on_register: Optional[Callable[[DeviceInfo], None]] = None):
+        """
+        参数:
+            initial_devices: 配置中的初始设备ID（第一个为默认设备）
+            names: 设备ID -> 显示名称
+            topic_prefix / data_suffix / cmd_suffix: 主题格式 <前缀>/<设备ID>/<后缀>
+            default_name: 未配置名称时的显示名称格式
+            auto_register: 收到未登记设备的消息时是否自动登记
+            max_devices: 注册表容量上限（防止异常主题无限登记）
+            on_register: 自动登记新设备后的回调（持久化、广播），在调用 register 的线程中执行
+        """
+        self.topic_prefix = topic_prefix
+        self.data_suffix = data_suffix
+        self.cmd_suffix = cmd_suffix
+        self.default_name = default_name
+        self.auto_register = auto_register
+        self.max_devices = max_devices
+        self.on_register = on_register
+        self._lock = threading.Lock()
+        self._devices: Dict[str, DeviceInfo] = {}
+        self._id_list = []  # 登记顺序的设备ID
+        self._ids: Tuple[str, ...] = ()  # _id_list 的只读快照（登记新设备时重建，登记远少于读取）
+        self.cmd_topic_map: Dict[str, str] = {}  # 设备ID -> 命令主题（增量维护）
+        self.rejected = 0  # 因设备ID不合法或超出容量而未登记的次数
+        # 主题 -> (设备ID, 主题类型)：数据/命令主题各一条模式，匹配结果按主题缓存（每台设备最多两个主题）
+        self.router = TopicRouter(cache_size=max_devices * 4)
+        self.router.add(self.data_subscription, lambda params: _device_route(params[0], TOPIC_DATA))
+        self.router.add(self.cmd_subscription, lambda params: _device_route(params[0], TOPIC_CMD))
+        names = names or {}
+        for device_id in initial_devices:
+            device_id = (device_id or "").strip().upper()
+            if device_id and device_id not in self._devices:
+                self._add(device_id, names.get(device_id), auto_registered=False)
+
+    # ---------- 主题 ----------
+    @property
+    def data_subscription(self) -> str:
+        """传感器数据通配主题（如 stm32/+/data_now）"""
+        return f"{self.topic_prefix}/+/{self.data_suffix}"
+
+    @property
+    def cmd_subscription(self) -> str:
+        """命令通配主题（如 stm32/+/data_cmd）"""
+        return f"{self.topic_prefix}/+/{self.cmd_suffix}"
+
+    def parse_topic(self, topic: str) -> Tuple[Optional[str], Optional[str]]:
+        """(设备ID, 主题类型)；不是设备主题或设备ID不合法时返回 (None, None)"""
+        return self.router.route(topic) or (None, None)
+
+    def is_data_topic(self, topic: str) -> bool:
+        return self.parse_topic(topic)[1] == TOPIC_DATA
+
+    def device_for_topic(self, topic: str, auto_register: bool = True) -> Optional[str]:
+        """
+        从主题得到设备ID，未登记的设备按需自动登记
+
+        参数:
+            auto_register: 本次调用是否允许自动登记（从属 worker 传 False，由采集主进程负责登记）
+
+        返回:
+            设备ID；不是设备主题、或设备未登记且不能自动登记时返回 None
+        """
+        device_id, _kind = self.parse_topic(topic)
+        if device_id is None:
+            return None
+        if device_id in self._devices:
+            return device_id
+        if auto_register and self.auto_register and self.register(device_id) is not None:
+            return device_id
+        return None
+
+    # ---------- 查询 ----------
+    def __contains__(self, device_id: str) -> bool:
+        return device_id in self._devices
+
+    def __len__(self) -> int:
+        return len(self._devices)
+
+    def get(self, device_id: str) -> Optional[DeviceInfo]:
+        return self._devices.get(device_id)
+
+    def ids(self) -> Tuple[str, ...]:
+        """全部设备ID（登记顺序，第一个为默认设备）"""
+        return self._ids
+
+    def name(self, device_id: str) -> str:
+        info = self._devices.get(device_id)
+        if info is not None and info.name:
+            return info.name
+        return self.default_name.format(device_id)
+
+    def cmd_topic(self, device_id: str) -> Optional[str]:
+        info = self._devices.get(device_id)
+        return info.cmd_topic if info is not None else None
+
+    # ---------- 登记 ----------
+    def register(self, device_id: str, name: Optional[str] = None, notify: bool = True) -> Optional[DeviceInfo]:
+        """
+        登记设备（已登记时返回已有记录）
+
+        参数:
+            notify: 新登记时是否调用 on_register（从数据库加载、或其他 worker 广播的登记传 False）
+
+        返回:
+            设备记录；设备ID不合法或超出容量时返回 None
+        """
+        device_id = str(device_id or "").strip().upper()
+        info = self._devices.get(device_id)
+        if info is not None:
+            return info
+        if not DEVICE_ID_PATTERN.match(device_id):
+            self.rejected += 1
+            return None
+        with self._lock:
+            info = self._devices.get(device_id)
+            if info is not None:
+                return info
+            if len(self._devices) >= self.max_devices:
+                self.rejected += 1
+                print(f"【设备注册】注册表已满（{self.max_devices}），忽略设备 {device_id}")
+                return None
+            info = self._add(device_id, name, auto_registered=True)
+        if notify and self.on_register is not None:
+            print(f"【设备注册】✓ 自动登记新设备：{device_id}")
+            try:
+                self.on_register(info)
+            except Exception as e:
+                print(f"【设备注册】登记回调失败：{e}")
+        return info
+
+    def load(self, rows: Iterable[dict]):
+        """加载数据库中已登记的设备（名称以数据库为准；不触发 on_register）"""
+        for row in rows:
+            device_id = str(row.get("device_id") or "").strip().upper()
+            if not DEVICE_ID_PATTERN.match(device_id):
+                continue
+            info = self.register(device_id, row.get("name"), notify=False)
+            if info is not None:
+                if row.get("name"):
+                    info.name = row["name"]
+                if row.get("auto_registered") is not None:
+                    info.auto_registered = bool(row["auto_registered"])
+
+    def _add(self, device_id: str, name: Optional[str], auto_registered: bool) -> DeviceInfo:
+        info = DeviceInfo(
+            device_id,
+            name or "",
+            f"{self.topic_prefix}/{device_id}/{self.data_suffix}",
+            f"{self.topic_prefix}/{device_id}/{self.cmd_suffix}",
+            auto_registered=auto_registered,
+        )
+        self._devices[device_id] = info
+        self.cmd_topic_map[device_id] = info.cmd_topic
+        self._id_list.append(device_id)
+        self._ids = tuple(self._id_list)
+        return info
+
+    def status(self) -> dict:
+        return {
+            "devices": len(self._devices),
+            "auto_registered": sum(1 for info in self._devices.values() if info.auto_registered),
+            "rejected": self.rejected,
+            "max_devices": self.max_devices,
+            "subscriptions": [self.data_subscription, self.cmd_subscription],
+            "router": self.router.status(),
+        }
@@ -0,0 +1,334 @@
+# event_bus.py
+"""
+跨进程广播总线
+`uvicorn server:app --workers N` 时每个 worker 各有一份 connections，本模块保证任一 worker 发布的广播
+（读数、警告、定位等）都能送达所有 worker 的 WebSocket 客户端。
+
+后端:
+- local: 进程内队列（默认，单 worker）；
+- unix:  本机 Unix 域套接字发布/订阅。多个 worker 通过文件锁（fcntl）选出一个 hub，hub 监听套接字，
+         其余 worker 作为成员连接 hub；任一进程发布的消息先投递给本进程，再经 hub 转发给其他所有进程。
+         hub 退出后锁随进程释放，成员断线后重新选举，新 hub 通过 on_leader 回调得知自己晋升。
+         hub 同时作为"主进程"：server.py 只在主进程中运行 MQTT 采集、蓝牙和调度任务，避免重复入库。
+
+帧格式（unix）: 4 字节大端长度 + 1 字节类型（E=广播消息，P=在线人数心跳）+ 内容。
+慢消费者（发送缓冲超过上限）会被直接断开，由其自行重连，不阻塞其他进程。
+"""
+import asyncio
+import json
+import os
+import struct
+import time
+from typing import Callable, Dict, Optional, Set
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有 fcntl，也不支持 asyncio Unix 套接字
+    fcntl = None
+
+BACKEND_LOCAL = "local"
+BACKEND_UNIX = "unix"
+
+_HEADER = struct.Struct(">IB")
+_KIND_EVENT = ord("E")
+_KIND_PRESENCE = ord("P")
+
+
+class LocalEventBus:
+    """进程内广播（单 worker）"""
+
+    backend = BACKEND_LOCAL
+
+    def __init__(self, get_local_viewers: Callable[[], int] = lambda: 0, max_pending: int = 10000):
+        self.get_local_viewers = get_local_viewers
+        self.on_leader: Optional[Callable[[], None]] = None
+        self._inbox: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self.published = 0
+        self.dropped = 0
+
+    @property
+    def is_leader(self) -> bool:
+        return True
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, message: str):
+        self.published += 1
+        try:
+            self._inbox.put_nowait(message)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def next_message(self) -> str:
+        return await self._inbox.get()
+
+    def viewer_count(self) -> int:
+        return self.get_local_viewers()
+
+    def status(self) -> dict:
+        return {"backend": self.backend, "role": "leader", "published": self.published, "dropped": self.dropped,
+                "viewers": self.viewer_count()}
+
+
+class UnixSocketEventBus:
+    """本机 Unix 域套接字发布/订阅（多 worker）"""
+
+    backend = BACKEND_UNIX
+
+    def __init__(self, path: str, get_local_viewers: Callable[[], int] = lambda: 0, max_pending: int = 10000,
+                 presence_interval: float = 5.0, max_client_buffer: int = 4 * 1024 * 1024,
+                 max_frame: int = 4 * 1024 * 1024):
+        """
+        参数:
+            path: 套接字路径（同一部署的所有 worker 必须一致），锁文件为 path + ".lock"
+            get_local_viewers: 获取本进程 WebSocket 连接数
+            max_pending: 本进程待推送消息上限（超过后丢弃新消息）
+            presence_interval: 在线人数心跳间隔（秒）
+            max_client_buffer: 单个连接的发送缓冲上限（字节），超过视为慢消费者并断开
+            max_frame: 单帧最大长度（字节）
+        """
+        if fcntl is None:
+            raise RuntimeError("当前平台不支持 Unix 套接字事件总线")
+        self.path = str(path)
+        self.lock_path = self.path + ".lock"
+        self.member_id = str(os.getpid())
+        self.get_local_viewers = get_local_viewers
+        self.presence_interval = presence_interval
+        self.max_client_buffer = max_client_buffer
+        self.max_frame = max_frame
+        self.on_leader: Optional[Callable[[], None]] = None
+        self.role: Optional[str] = None  # hub / member（start 超时仍未完成选举时为 None）
+        self._started = False  # start() 是否已返回（此后成为 hub 均视为晋升，需要接管采集）
+        self._inbox: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self._clients: Set[asyncio.StreamWriter] = set()
+        self._hub_writer: Optional[asyncio.StreamWriter] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._lock_fd: Optional[int] = None
+        self._viewers: Dict[str, tuple] = {}  # 成员ID -> (连接数, 更新时间)
+        self._ready = asyncio.Event()
+        self._tasks = []
+        self._stopping = False
+        self.published = 0
+        self.relayed = 0
+        self.dropped = 0
+        self.slow_disconnects = 0
+        self.elections = 0
+
+    @property
+    def is_leader(self) -> bool:
+        return self.role == "hub"
+
+    # ---------- 生命周期 ----------
+    async def start(self, timeout: float = 5.0):
+        """启动并完成首次选举（超时仍未连上时先按成员身份运行，只推送本进程消息）"""
+        self._tasks.append(asyncio.create_task(self._run()))
+        self._tasks.append(asyncio.create_task(self._presence_loop()))
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            print(f"【事件总线】{timeout} 秒内未完成选举，暂时只推送本进程消息")
+        self._started = True
+        print(f"【事件总线】进程 {self.member_id} 角色：{'主进程(hub)' if self.is_leader else '成员'}（{self.path}）")
+
+    async def stop(self):
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        for writer in list(self._clients) + ([self._hub_writer] if self._hub_writer else []):
+            writer.close()
+        self._clients.clear()
+        if self._server:
+            self._server.close()
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)  # 关闭即释放 flock
+            self._lock_fd = None
+
+    # ---------- 选举 ----------
+    async def _run(self):
+        while not self._stopping:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            except (FileNotFoundError, ConnectionRefusedError, OSError):
+                if self._try_lock():
+                    await self._become_hub()
+                    return
+                # 其他进程持有锁但尚未开始监听，稍后重试
+                await asyncio.sleep(0.2)
+                continue
+            await self._member_loop(reader, writer)
+            if not self._stopping:
+                print("【事件总线】与 hub 的连接已断开，重新选举...")
+                await asyncio.sleep(0.1)
+
+    def _try_lock(self) -> bool:
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    async def _become_hub(self):
+        # 持有锁说明原 hub 已退出，残留的套接字文件可以安全删除
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        self._server = await asyncio.start_unix_server(self._handle_member, path=self.path)
+        # 启动时已按成员运行的进程（包括 start 超时、role 仍为 None 的进程）之后成为 hub，都要通知接管采集
+        promoted = self._started
+        self.role = "hub"
+        self.elections += 1
+        self._hub_writer = None
+        self._ready.set()
+        if promoted:
+            print(f"【事件总线】进程 {self.member_id} 晋升为主进程(hub)")
+            if self.on_leader:
+                self.on_leader()
+
+    # ---------- 收发 ----------
+    def _frame(self, kind: int, body: bytes) -> bytes:
+        return _HEADER.pack(len(body), kind) + body
+
+    async def _read_frames(self, reader: asyncio.StreamReader, on_frame: Callable[[int, bytes, bytes], None]):
+        while True:
+            header = await reader.readexactly(_HEADER.size)
+            size, kind = _HEADER.unpack(header)
+            if size > self.max_frame:
+                raise ValueError(f"帧长度超出上限：{size}")
+            body = await reader.readexactly(size)
+            on_frame(kind, body, header + body)
+
+    def _write(self, writer: asyncio.StreamWriter, data: bytes) -> bool:
+        if writer.is_closing():
+            return False
+        if writer.transport.get_write_buffer_size() > self.max_client_buffer:
+            self.slow_disconnects += 1
+            writer.close()
+            return False
+        writer.write(data)
+        return True
+
+    def _deliver(self, message: str):
+        try:
+            self._inbox.put_nowait(message)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def _on_frame(self, kind: int, body: bytes):
+        if kind == _KIND_EVENT:
+            self._deliver(body.decode("utf-8"))
+        elif kind == _KIND_PRESENCE:
+            presence = json.loads(body)
+            self._viewers[presence["id"]] = (presence["viewers"], time.time())
+
+    async def _handle_member(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """hub：接收成员发布的帧，投递给本进程并转发给其他成员"""
+        self._clients.add(writer)
+
+        def on_frame(kind: int, body: bytes, raw: bytes):
+            self._on_frame(kind, body)
+            self._fan_out(raw, exclude=writer)
+
+        try:
+            await self._read_frames(reader, on_frame)
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            self._clients.discard(writer)
+            writer.close()
+
+    def _fan_out(self, data: bytes, exclude: Optional[asyncio.StreamWriter] = None):
+        for writer in list(self._clients):
+            if writer is exclude:
+                continue
+            if self._write(writer, data):
+                self.relayed += 1
+            else:
+                self._clients.discard(writer)
+
+    async def _member_loop(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.role = "member"
+        self._hub_writer = writer
+        self._ready.set()
+        self._send_presence()
+        try:
+            await self._read_frames(reader, lambda kind, body, _raw: self._on_frame(kind, body))
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            self._hub_writer = None
+            writer.close()
+
+    async def publish(self, message: str):
+        """发布一条广播：立即投递给本进程，再送往其他进程"""
+        self.published += 1
+        self._deliver(message)
+        data = self._frame(_KIND_EVENT, message.encode("utf-8"))
+        if self.role == "hub":
+            self._fan_out(data)
+        elif self._hub_writer is not None:
+            if not self._write(self._hub_writer, data):
+                self.dropped += 1
+        else:
+            # 正在重新选举，其他进程暂时收不到
+            self.dropped += 1
+
+    async def next_message(self) -> str:
+        return await self._inbox.get()
+
+    # ---------- 在线人数 ----------
+    def _send_presence(self):
+        data = self._frame(_KIND_PRESENCE, json.dumps(
+            {"id": self.member_id, "viewers": self.get_local_viewers()}).encode())
+        if self.role == "hub":
+            self._fan_out(data)
+        elif self._hub_writer is not None:
+            self._write(self._hub_writer, data)
+
+    async def _presence_loop(self):
+        while True:
+            await asyncio.sleep(self.presence_interval)
+            self._send_presence()
+
+    def viewer_count(self) -> int:
+        """所有 worker 的 WebSocket 连接总数（其他进程的数据来自心跳，超过 3 个心跳周期未更新的忽略）"""
+        deadline = time.time() - self.presence_interval * 3
+        others = sum(count for member_id, (count, updated_at) in self._viewers.items()
+                     if member_id != self.member_id and updated_at >= deadline)
+        return self.get_local_viewers() + others
+
+    def status(self) -> dict:
+        return {
+            "backend": self.backend,
+            "role": "leader" if self.is_leader else "member",
+            "pid": self.member_id,
+            "path": self.path,
+            "members": len(self._clients) if self.is_leader else None,
+            "connected": self.is_leader or self._hub_writer is not None,
+            "published": self.published,
+            "relayed": self.relayed,
+            "dropped": self.dropped,
+            "slow_disconnects": self.slow_disconnects,
+            "viewers": self.viewer_count(),
+        }
+
+
+def create_event_bus(backend: str, path: str, get_local_viewers: Callable[[], int] = lambda: 0):
+    """按配置创建事件总线；平台不支持 Unix 套接字时回退为进程内队列"""
+    if backend == BACKEND_UNIX:
+        if fcntl is None:
+            print("【事件总线】当前平台不支持 Unix 套接字，回退为进程内广播（多 worker 时客户端只能收到本进程消息）")
+        else:
+            return UnixSocketEventBus(path, get_local_viewers=get_local_viewers)
+    return LocalEventBus(get_local_viewers=get_local_viewers)
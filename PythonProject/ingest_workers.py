@@ -0,0 +1,408 @@
+# ingest_workers.py
+"""
+多进程采集模块
+把 MQTT 传感器数据的解码、序列号去重和入库拆分到 N 个工作进程，每个进程负责一部分设备（按主题分片），
+Web 进程只保留 WebSocket 推送、统计、警告处理和自动恢复检查。
+
+两种分片方式:
+- broker: 每个工作进程用 MQTT 共享订阅（$share/<组名>/<主题>）直接从 Broker 接收数据。
+          需要把 Broker 的共享订阅策略设为按主题哈希（EMQX: shared_subscription_strategy = hash_topic），
+          保证同一设备的消息始终落在同一个进程，序列号窗口才有意义。
+- local:  Web 进程照常订阅，收到的原始消息不解码，由 LocalShareBroker 按主题哈希转发给工作进程。
+          无需改动 Broker 配置，也可在没有 Broker 的环境下驱动工作进程（脚本/联调时的本地替身）。
+
+进程间通信（multiprocessing.Queue）:
+- Web -> 工作进程（每个进程一个收件箱）：本地分片转发的原始消息、蓝牙在线设备列表、停止信号；
+- 工作进程 -> Web（所有进程共用一个发件箱，汇总到 Web 进程）：已按序放行的读数、非读数消息（警告/定位等，
+  交回 Web 进程按原逻辑处理）、各进程的统计快照。
+工作进程以 spawn 方式启动（与 Windows 行为一致），入口 run_worker 必须是模块级函数，参数必须可 pickle。
+"""
+import asyncio
+import multiprocessing
+import queue
+import ssl
+import threading
+import time
+import zlib
+from typing import Callable, Dict, List, Optional
+
+from device_registry import TOPIC_DATA, parse_device_topic
+from payload_parser import PayloadParser, KIND_SENSOR, build_reading, resolve_sample_times
+from sequence_tracker import SequenceTracker
+
+SHARDING_BROKER = "broker"
+SHARDING_LOCAL = "local"
+
+# 工作进程 -> Web 进程的事件
+EVENT_READINGS = "readings"  # (EVENT_READINGS, 进程序号, 设备ID, [(t, h, lux, smoke, rs_ro, temp2, pressure, ts)], 是否已入库)
+EVENT_MESSAGE = "message"  # (EVENT_MESSAGE, 进程序号, 主题, 原始消息)
+EVENT_STATS = "stats"  # (EVENT_STATS, 进程序号, 统计快照)
+
+# Web 进程 -> 工作进程的收件箱消息
+INBOX_MESSAGE = "msg"  # (INBOX_MESSAGE, 主题, 原始消息, 是否保留消息)
+INBOX_BLE_DEVICES = "ble"  # (INBOX_BLE_DEVICES, 蓝牙在线的设备ID集合)，这些设备的 MQTT 读数忽略
+INBOX_STOP = "stop"  # (INBOX_STOP,)
+
+
+def shard_for_topic(topic: str, shard_count: int) -> int:
+    """按主题计算分片序号（crc32 在各进程、各次运行间稳定，不受 PYTHONHASHSEED 影响）"""
+    return zlib.crc32(topic.encode()) % shard_count
+
+
+class LocalShareBroker:
+    """
+    共享订阅的本地替身：按主题哈希把消息投递到对应工作进程的收件箱，
+    行为与 Broker 的 $share + hash_topic 策略一致（同一主题始终落在同一进程）。
+    """
+
+    def __init__(self, inboxes: list):
+        self.inboxes = inboxes
+        self.published = 0
+        self.dropped = 0
+
+    def publish(self, topic: str, payload: bytes, retain: bool = False) -> bool:
+        """投递一条消息，收件箱已满时丢弃并返回 False（不阻塞 paho 网络线程）"""
+        try:
+            self.inboxes[shard_for_topic(topic, len(self.inboxes))].put_nowait(
+                (INBOX_MESSAGE, topic, bytes(payload), retain))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self.published += 1
+        return True
+
+
+class _IngestWorker:
+    """工作进程内的采集流水线：解码 -> 序列号去重/重排 -> 多行入库 -> 事件回传"""
+
+    def __init__(self, index: int, settings: dict, inbox, outbox):
+        self.index = index
+        self.settings = settings
+        self.inbox = inbox
+        self.outbox = outbox
+        self.parser = PayloadParser(settings.get("control_commands", ()))
+        self.tracker = SequenceTracker(**settings.get("sequence", {}))
+        self.topic_prefix = settings.get("topic_prefix", "stm32")  # 数据主题 <前缀>/<设备ID>/data_now，设备ID直接从主题拆出
+        self.max_skew = settings.get("max_timestamp_skew", 300)
+        self.batch_max = settings.get("batch_max", 256)
+        self.stats_interval = settings.get("stats_interval", 5.0)
+        self.ble_devices = frozenset()
+        self.db = None
+        self.mqtt_client = None
+        self.counters = {"messages": 0, "readings": 0, "persisted": 0, "forwarded": 0, "retained": 0,
+                         "ignored_ble": 0, "unknown_topic": 0, "batches": 0, "db_errors": 0}
+        self._messages: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stopping = False
+
+    # ---------- 消息来源 ----------
+    def _read_inbox(self):
+        """收件箱读取线程（阻塞读取 multiprocessing.Queue，转交给事件循环）"""
+        while True:
+            try:
+                item = self.inbox.get()
+            except (EOFError, OSError):
+                item = (INBOX_STOP,)
+            kind = item[0]
+            if kind == INBOX_MESSAGE:
+                self._loop.call_soon_threadsafe(self._messages.put_nowait, item[1:])
+            elif kind == INBOX_BLE_DEVICES:
+                self.ble_devices = frozenset(item[1])
+            elif kind == INBOX_STOP:
+                self._loop.call_soon_threadsafe(self._request_stop)
+                return
+
+    def _request_stop(self):
+        self._stopping = True
+        self._messages.put_nowait(None)
+
+    def _start_mqtt(self):
+        """broker 分片：共享订阅直接接收数据主题（paho 自动重连）"""
+        import paho.mqtt.client as mqtt
+
+        config = self.settings["mqtt"]
+        group = config.get("share_group", "sensor_ingest")
+        client = mqtt.Client(client_id=f"{config.get('client_id_prefix', 'ingest_worker')}_{self.index}_{int(time.time())}",
+                             protocol=mqtt.MQTTv311)
+        if config.get("username"):
+            client.username_pw_set(config["username"], config.get("password", ""))
+        if config.get("ca_certs"):
+            client.tls_set(ca_certs=config["ca_certs"], cert_reqs=ssl.CERT_REQUIRED, tls_version=ssl.PROTOCOL_TLS)
+
+        def on_connect(_client, _userdata, _flags, rc):
+            if rc != 0:
+                print(f"【采集进程{self.index}】MQTT连接失败，rc={rc}")
+                return
+            topic = f"{self.topic_prefix}/+/data_now"
+            _client.subscribe(f"$share/{group}/{topic}", qos=1)
+            print(f"【采集进程{self.index}】✓ 已共享订阅数据主题 {topic}（组：{group}）")
+
+        def on_message(_client, _userdata, msg):
+            self._loop.call_soon_threadsafe(self._messages.put_nowait, (msg.topic, msg.payload, msg.retain))
+
+        client.on_connect = on_connect
+        client.on_message = on_message
+        client.reconnect_delay_set(min_delay=1, max_delay=30)
+        client.connect_async(config["host"], config["port"], keepalive=60)
+        client.loop_start()
+        self.mqtt_client = client
+
+    # ---------- 处理 ----------
+    def _emit(self, event: tuple):
+        try:
+            self.outbox.put_nowait(event)
+        except queue.Full:
+            print(f"【采集进程{self.index}】发件箱已满，丢弃事件：{event[0]}")
+
+    async def _handle_batch(self, messages: list):
+        """处理一批消息：同一设备的读数合并为一次多行 INSERT 和一个事件"""
+        received_at = time.time()
+        released: Dict[str, list] = {}
+        for topic, payload, retain in messages:
+            self.counters["messages"] += 1
+            if retain:
+                # 订阅时服务器下发的保留消息（旧数据），与单进程模式一致直接忽略
+                self.counters["retained"] += 1
+                continue
+            device_id, topic_kind = parse_device_topic(topic, self.topic_prefix)
+            if topic_kind != TOPIC_DATA:
+                self.counters["unknown_topic"] += 1
+                continue
+            items = self.parser.classify_many(payload)
+            sensors = [parsed for parsed in items if parsed.kind == KIND_SENSOR]
+            for parsed in items:
+                if parsed.kind != KIND_SENSOR:
+                    # 警告/定位等低频消息交回 Web 进程，复用原有处理逻辑
+                    self.counters["forwarded"] += 1
+                    self._emit((EVENT_MESSAGE, self.index, topic, parsed.raw))
+            if not sensors:
+                continue
+            if device_id in self.ble_devices:
+                self.counters["ignored_ble"] += len(sensors)
+                continue
+
+            out = released.setdefault(device_id, [])
+            timestamps, _skewed = resolve_sample_times(sensors, self.max_skew, received_at)
+            for parsed, ts in zip(sensors, timestamps):
+                t, h, l, rs_ro, ppm, t2, p = parsed.values
+                if t is None or h is None:
+                    continue
+                reading = (t, h, l, ppm, rs_ro, t2, p, ts or received_at)
+                if parsed.seq is None:
+                    out.append(reading)
+                else:
+                    out.extend(self.tracker.accept(device_id, parsed.seq, reading, now=received_at,
+                                                   device_ts=parsed.timestamp))
+
+        for device_id, readings in released.items():
+            await self._persist_and_emit(device_id, readings)
+
+    async def _persist_and_emit(self, device_id: str, readings: list):
+        if not readings:
+            return
+        self.counters["readings"] += len(readings)
+        persisted = False
+        if self.db is not None:
+            rows = [build_reading(*reading[:7], device_id=device_id, ts=reading[7])[1] for reading in readings]
+            persisted = await self.db.insert_sensor_data_batch(rows, device_id=device_id)
+            if persisted:
+                self.counters["persisted"] += len(readings)
+            else:
+                self.counters["db_errors"] += 1
+        self.counters["batches"] += 1
+        self._emit((EVENT_READINGS, self.index, device_id, readings, persisted))
+
+    def _snapshot(self) -> dict:
+        return {
+            "pid": multiprocessing.current_process().pid,
+            "counters": dict(self.counters),
+            "devices": self.tracker.stats(),
+            "db": self.db is not None,
+            "updated_at": time.time(),
+        }
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._messages = asyncio.Queue()
+        print(f"【采集进程{self.index}】启动，分片方式：{self.settings['sharding']}")
+
+        if self.settings.get("persist", True):
+            from db_manager import get_db_manager
+
+            db = get_db_manager()
+            if await db.init_pool(minsize=1, maxsize=self.settings.get("db_pool_size", 2)):
+                self.db = db
+            else:
+                print(f"【采集进程{self.index}】⚠️ 数据库连接失败，读数交由 Web 进程入库")
+
+        threading.Thread(target=self._read_inbox, name=f"ingest-inbox-{self.index}", daemon=True).start()
+        if self.settings["sharding"] == SHARDING_BROKER:
+            self._start_mqtt()
+
+        flush_interval = self.tracker.reorder_delay / 4
+        next_flush = next_stats = time.monotonic()
+        try:
+            while not self._stopping:
+                try:
+                    first = await asyncio.wait_for(self._messages.get(), timeout=flush_interval)
+                except asyncio.TimeoutError:
+                    first = ()
+                batch = [first] if first else []
+                # 一次取走已到达的消息，合并入库
+                while len(batch) < self.batch_max and not self._messages.empty():
+                    item = self._messages.get_nowait()
+                    if item:
+                        batch.append(item)
+                if batch:
+                    try:
+                        await self._handle_batch(batch)
+                    except Exception as e:
+                        print(f"【采集进程{self.index}】处理消息失败：{e}")
+                        import traceback
+                        traceback.print_exc()
+
+                now = time.monotonic()
+                if now >= next_flush:
+                    next_flush = now + flush_interval
+                    for device_id, readings in self.tracker.flush_expired().items():
+                        await self._persist_and_emit(device_id, readings)
+                if now >= next_stats:
+                    next_stats = now + self.stats_interval
+                    self._emit((EVENT_STATS, self.index, self._snapshot()))
+        finally:
+            self._emit((EVENT_STATS, self.index, self._snapshot()))
+            if self.mqtt_client:
+                self.mqtt_client.loop_stop()
+                self.mqtt_client.disconnect()
+            if self.db is not None:
+                await self.db.close_pool()
+            print(f"【采集进程{self.index}】已退出")
+
+
+def run_worker(index: int, settings: dict, inbox, outbox):
+    """工作进程入口"""
+    try:
+        asyncio.run(_IngestWorker(index, settings, inbox, outbox).run())
+    except KeyboardInterrupt:
+        pass
+
+
+class IngestWorkerPool:
+    """Web 进程侧的工作进程管理：启动/停止、本地分片转发、事件汇总"""
+
+    def __init__(self, worker_count: int, settings: dict, on_event: Callable[[tuple], None],
+                 get_main_loop: Callable[[], Optional[asyncio.AbstractEventLoop]], inbox_size: int = 10000):
+        """
+        参数:
+            worker_count: 工作进程数（0 表示不启用，保持单进程采集）
+            settings: 传给工作进程的配置（需可 pickle），包括 sharding、topic_prefix、mqtt、sequence、persist 等
+            on_event: 事件回调（在主事件循环中调用），参数为 EVENT_* 元组
+            get_main_loop: 获取主事件循环
+            inbox_size: 每个收件箱的容量（本地分片时超过即丢弃）
+        """
+        self.worker_count = worker_count
+        self.settings = settings
+        self.on_event = on_event
+        self.get_main_loop = get_main_loop
+        self.inbox_size = inbox_size
+        self.broker: Optional[LocalShareBroker] = None
+        self.worker_stats: Dict[int, dict] = {}
+        self._processes: List[multiprocessing.Process] = []
+        self._inboxes: list = []
+        self._outbox = None
+        self._reader: Optional[threading.Thread] = None
+        self._running = False
+
+    @property
+    def active(self) -> bool:
+        return self._running
+
+    @property
+    def sharding(self) -> str:
+        return self.settings.get("sharding", SHARDING_LOCAL)
+
+    def start(self):
+        if self._running or self.worker_count <= 0:
+            return
+        ctx = multiprocessing.get_context("spawn")
+        self._outbox = ctx.Queue()
+        self._inboxes = [ctx.Queue(maxsize=self.inbox_size) for _ in range(self.worker_count)]
+        for index, inbox in enumerate(self._inboxes):
+            process = ctx.Process(target=run_worker, args=(index, self.settings, inbox, self._outbox),
+                                  name=f"ingest-worker-{index}", daemon=True)
+            process.start()
+            self._processes.append(process)
+        if self.sharding == SHARDING_LOCAL:
+            self.broker = LocalShareBroker(self._inboxes)
+        self._running = True
+        self._reader = threading.Thread(target=self._read_outbox, name="ingest-fan-in", daemon=True)
+        self._reader.start()
+        print(f"【采集进程】已启动 {self.worker_count} 个工作进程（分片方式：{self.sharding}）")
+
+    def _read_outbox(self):
+        """汇总线程：读取所有工作进程的事件，转交主事件循环"""
+        while self._running:
+            try:
+                event = self._outbox.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                break
+            if event[0] == EVENT_STATS:
+                self.worker_stats[event[1]] = event[2]
+                continue
+            loop = self.get_main_loop()
+            if loop and loop.is_running():
+                loop.call_soon_threadsafe(self.on_event, event)
+
+    def dispatch(self, topic: str, payload: bytes, retain: bool = False) -> bool:
+        """本地分片：把原始消息转发给负责该主题的工作进程（可从 paho 线程调用）"""
+        if not self._running or self.broker is None:
+            return False
+        return self.broker.publish(topic, payload, retain)
+
+    def set_ble_devices(self, device_ids):
+        """同步蓝牙在线设备（这些设备的 MQTT 读数由工作进程忽略）"""
+        for inbox in self._inboxes:
+            try:
+                inbox.put_nowait((INBOX_BLE_DEVICES, frozenset(device_ids)))
+            except queue.Full:
+                print("【采集进程】收件箱已满，蓝牙设备列表未同步")
+
+    async def stop(self, timeout: float = 5.0):
+        if not self._running:
+            return
+        for inbox in self._inboxes:
+            try:
+                inbox.put((INBOX_STOP,), timeout=1)
+            except queue.Full:
+                pass
+        deadline = time.monotonic() + timeout
+        loop = asyncio.get_running_loop()
+        for process in self._processes:
+            await loop.run_in_executor(None, process.join, max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.terminate()
+        self._running = False
+        self._processes.clear()
+        self._inboxes.clear()
+        print("【采集进程】已全部停止")
+
+    def device_stats(self) -> Dict[str, dict]:
+        """合并各工作进程的序列号统计（设备按主题分片，不会重复）"""
+        merged: Dict[str, dict] = {}
+        for stats in self.worker_stats.values():
+            merged.update(stats.get("devices", {}))
+        return merged
+
+    def status(self) -> dict:
+        return {
+            "enabled": self._running,
+            "workers": self.worker_count,
+            "sharding": self.sharding,
+            "alive": sum(1 for process in self._processes if process.is_alive()),
+            "dispatched": self.broker.published if self.broker else None,
+            "dropped": self.broker.dropped if self.broker else None,
+            "per_worker": {index: {key: stats[key] for key in ("pid", "counters", "db", "updated_at")}
+                           for index, stats in sorted(self.worker_stats.items())},
+        }
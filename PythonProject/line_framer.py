@@ -0,0 +1,124 @@
+# line_framer.py
+"""
+按行分帧模块（BLE 通知及后续串口等字节流链路共用）
+使用固定容量的缓冲区加读/写偏移，新数据直接写入空闲区，完整行以 memoryview 切片交给回调，
+不再每解析一行就整体搬移剩余缓冲（旧实现 _buffer[:] = _buffer[idx+2:]）。
+仅在写指针到达末尾时把未完成的半行搬回起点；半行超过容量时才扩容。
+"""
+from typing import Callable
+
+# 行首尾需要去除的 ASCII 空白字符（与 str.strip() 对 ASCII 数据的效果一致）
+_WHITESPACE = frozenset(b" \t\r\n\x0b\x0c")
+
+
+class LineFramer:
+    """基于读/写偏移和 memoryview 的行分帧器"""
+
+    def __init__(self, line_end: bytes = b"\r\n", capacity: int = 4096, max_line_length: int = 64 * 1024):
+        """
+        参数:
+            line_end: 行结束符
+            capacity: 初始缓冲容量（字节）
+            max_line_length: 未完成行的最大长度，超过后丢弃（防止无结束符的数据撑爆缓冲）
+        """
+        self.line_end = line_end
+        self._sep_len = len(line_end)
+        self.max_line_length = max_line_length
+        self._buf = bytearray(capacity)
+        self._view = memoryview(self._buf)
+        self._read = 0  # 下一行的起始位置
+        self._write = 0  # 已写入数据的末尾
+        self._scan = 0  # 下一次查找结束符的起点（避免重复扫描半行）
+        self.lines = 0
+        self.dropped_bytes = 0
+
+    def __len__(self) -> int:
+        """当前缓冲中未完成行的字节数"""
+        return self._write - self._read
+
+    @property
+    def capacity(self) -> int:
+        return len(self._buf)
+
+    def clear(self):
+        """丢弃缓冲中的半行（连接断开时调用）"""
+        self._read = self._write = self._scan = 0
+
+    def _reserve(self, size: int):
+        """确保写指针后有 size 字节空闲，必要时把半行搬回起点或扩容"""
+        if self._write + size <= len(self._buf):
+            return
+        pending = self._write - self._read
+        if pending + size <= len(self._buf):
+            # memoryview 同缓冲区赋值按 memmove 处理，重叠区域安全
+            self._view[:pending] = self._view[self._read:self._write]
+        else:
+            new_buf = bytearray(max(len(self._buf) * 2, pending + size))
+            new_buf[:pending] = self._view[self._read:self._write]
+            self._buf = new_buf
+            self._view = memoryview(new_buf)
+        self._scan -= self._read
+        self._read = 0
+        self._write = pending
+
+    def feed(self, data, on_line: Callable[[memoryview], None]) -> int:
+        """
+        写入一段数据，对每个完整行调用 on_line（参数为去除首尾空白的 memoryview，空行跳过）
+
+        注意: 传给回调的 memoryview 指向内部缓冲，只在回调期间有效，需要保留时请自行 bytes() 复制。
+
+        返回:
+            本次解析出的行数
+        """
+        size = len(data)
+        if not size:
+            return 0
+        if self._write + size > len(self._buf):
+            self._reserve(size)
+        read = self._read
+        write = self._write + size
+        self._view[self._write:write] = data
+        self._write = write
+
+        buf = self._buf
+        sep = self.line_end
+        pos = buf.find(sep, self._scan, write)
+        if pos < 0:
+            # 快速路径：本次通知未凑满一行（小 MTU 分片的常见情况）
+            if write - read > self.max_line_length:
+                self.dropped_bytes += write - read
+                self._read = self._write = self._scan = 0
+            else:
+                scan = write - self._sep_len + 1
+                self._scan = scan if scan > read else read
+            return 0
+
+        view = self._view
+        sep_len = self._sep_len
+        count = 0
+        while pos >= 0:
+            start, end = read, pos
+            # 只有首尾确实是空白（<= 0x20）时才逐字节修剪
+            if start < end and (buf[start] <= 32 or buf[end - 1] <= 32):
+                while start < end and buf[start] in _WHITESPACE:
+                    start += 1
+                while end > start and buf[end - 1] in _WHITESPACE:
+                    end -= 1
+            if end > start:
+                count += 1
+                on_line(view[start:end])
+            read = pos + sep_len
+            pos = buf.find(sep, read, write)
+
+        self.lines += count
+        if read == write:
+            # 缓冲已全部消费，直接回到起点，无需搬移
+            self._read = self._write = self._scan = 0
+        elif write - read > self.max_line_length:
+            self.dropped_bytes += write - read
+            self._read = self._write = self._scan = 0
+        else:
+            self._read = read
+            scan = write - sep_len + 1
+            self._scan = scan if scan > read else read
+        return count
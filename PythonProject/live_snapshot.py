@@ -0,0 +1,172 @@
+# live_snapshot.py
+"""
+WebSocket 连接快照模块
+页面打开后原本要先收到 hello，再分别请求 /api/devices、/api/status、历史数据等接口才能把界面填满，
+断线重连时所有页面同时重新请求，每次都要查询 MySQL。
+本模块在内存中维护一份"当前状态"，新连接建立后作为第一帧发送：
+- 设备列表与在线状态（最后一次收到该设备推送的时间）；
+- 每台设备的最新读数；
+- 未恢复的警告（按 设备 + 警告类型 保存，收到 warning_resolved 时移除）；
+- 每台设备最后一次定位；
+- BLE / MQTT 链路状态。
+状态由每个 worker 的广播分发任务逐条观察事件总线上的消息更新（其他 worker 产生的广播同样可见），
+启动时只从数据库补一次最新读数与未恢复警告；快照文本按版本缓存，重连风暴中的大量连接共用同一份序列化结果。
+帧格式：{"type":"snapshot","ts":...,"devices":[...],"readings":[...],"warnings":[...],"locations":[...],"links":{...}}
+"""
+import json
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+# 数据库行 -> 推送读数：字段名与保留的小数位（与 payload_parser.build_reading 一致）
+READING_COLUMNS = (
+    ("temp", "temperature", 2),
+    ("hum", "humidity", 2),
+    ("lux", "brightness", 1),
+    ("smoke", "smoke_ppm", 1),
+    ("pressure", "pressure", 1),
+    ("temp2", "temp2", 2),
+    ("rs_ro", "rs_ro", 2),
+)
+
+
+def _number(value, places: Optional[int] = None):
+    """数据库返回的 Decimal 等数值转为 float（None 保持不变）"""
+    if value is None:
+        return None
+    value = float(value)
+    return round(value, places) if places is not None else value
+
+
+def reading_from_row(row: dict) -> dict:
+    """get_recent_data 返回的一行转为与实时推送相同格式的 reading"""
+    reading = {"type": "reading", "ts": _number(row.get("timestamp"))}
+    for field, column, places in READING_COLUMNS:
+        reading[field] = _number(row.get(column), places)
+    reading["device_id"] = row.get("device_id")
+    return reading
+
+
+def warning_from_row(row: dict, type_names: Dict[str, str], type_units: Dict[str, str]) -> dict:
+    """get_warning_data 返回的一行转为与实时推送相同格式的 warning"""
+    warning_type = row.get("warning_type")
+    return {
+        "type": "warning",
+        "warning_type": warning_type,
+        "warning_name": type_names.get(warning_type, warning_type),
+        "warning_value": _number(row.get("warning_value")),
+        "warning_unit": type_units.get(warning_type, ""),
+        "warning_message": row.get("warning_message") or "",
+        "device_id": row.get("device_id"),
+        "timestamp": _number(row.get("warning_start_time")),
+    }
+
+
+class LiveSnapshot:
+    """当前状态快照（每个 worker 一份）"""
+
+    def __init__(self, get_devices: Callable[[], List[dict]], get_links: Callable[[], dict],
+                 cache_seconds: float = 1.0):
+        """
+        参数:
+            get_devices: 返回设备列表（含在线状态）的函数，格式与 /api/devices 的 devices 相同
+            get_links: 返回链路状态的函数，如 {"ble": True, "mqtt": True}
+            cache_seconds: 状态未变化时快照文本的复用时间（秒）；在线状态随时间变化，因此不会无限期复用
+        """
+        self.get_devices = get_devices
+        self.get_links = get_links
+        self.cache_seconds = cache_seconds
+        self._readings: Dict[str, dict] = {}  # 设备ID -> 最新读数
+        self._warnings: Dict[Tuple[str, str], dict] = {}  # (设备ID, 警告类型) -> 警告事件
+        self._locations: Dict[str, dict] = {}  # 设备ID -> 最后一次定位
+        self._last_seen: Dict[str, float] = {}  # 设备ID -> 最后收到推送的时间
+        self._version = 0
+        self._cached: Optional[str] = None
+        self._cached_version = -1
+        self._cached_at = 0.0
+        self.seeded = False
+        self.builds = 0  # 实际序列化的次数
+        self.served = 0  # 发送给连接的次数
+
+    @staticmethod
+    def _device(message: dict) -> str:
+        return str(message.get("device_id") or "D01").strip().upper()
+
+    def observe(self, message: dict):
+        """观察一条广播事件并更新状态"""
+        kind = message.get("type")
+        if kind == "reading":
+            device_id = self._device(message)
+            self._readings[device_id] = message
+        elif kind == "readings":
+            items = message.get("items")
+            if not items:
+                return
+            device_id = self._device(message)
+            self._readings[device_id] = dict(items[-1], device_id=items[-1].get("device_id") or device_id)
+        elif kind == "warning":
+            device_id = self._device(message)
+            self._warnings[(device_id, message.get("warning_type"))] = message
+        elif kind == "warning_resolved":
+            device_id = self._device(message)
+            self._warnings.pop((device_id, message.get("warning_type")), None)
+        elif kind == "location":
+            device_id = self._device(message)
+            self._locations[device_id] = message
+        else:
+            return
+        self._last_seen[device_id] = time.time()
+        self._version += 1
+
+    def seed(self, readings: List[dict], warnings: List[dict]):
+        """
+        启动时用数据库中的最新读数与未恢复警告补全状态（只补缺失项，已观察到的实时数据优先）
+
+        参数:
+            readings: reading_from_row 的结果
+            warnings: warning_from_row 的结果，按时间倒序（同一设备同一类型只保留最新一条）
+        """
+        for reading in readings:
+            self._readings.setdefault(self._device(reading), reading)
+        for warning in warnings:
+            self._warnings.setdefault((self._device(warning), warning.get("warning_type")), warning)
+        self.seeded = True
+        self._version += 1
+
+    def last_seen(self, device_id: str) -> Optional[float]:
+        """该设备最后一次出现在广播中的时间（未出现过返回 None）"""
+        return self._last_seen.get(device_id)
+
+    def build(self) -> dict:
+        """生成快照"""
+        return {
+            "type": "snapshot",
+            "ts": time.time(),
+            "devices": self.get_devices(),
+            "readings": list(self._readings.values()),
+            "warnings": sorted(self._warnings.values(), key=lambda w: w.get("timestamp") or 0),
+            "locations": list(self._locations.values()),
+            "links": self.get_links(),
+        }
+
+    def message(self) -> str:
+        """快照文本（状态未变化且未过期时复用上次的序列化结果）"""
+        now = time.monotonic()
+        if (self._cached is None or self._cached_version != self._version
+                or now - self._cached_at >= self.cache_seconds):
+            self._cached = json.dumps(self.build(), ensure_ascii=False)
+            self._cached_version = self._version
+            self._cached_at = now
+            self.builds += 1
+        self.served += 1
+        return self._cached
+
+    def status(self) -> dict:
+        return {
+            "seeded": self.seeded,
+            "devices_with_reading": len(self._readings),
+            "open_warnings": len(self._warnings),
+            "locations": len(self._locations),
+            "served": self.served,
+            "builds": self.builds,
+            "bytes": len(self._cached.encode("utf-8")) if self._cached else 0,
+        }
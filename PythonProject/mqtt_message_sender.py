@@ -18,7 +18,8 @@ class MqttMessageSender:
                  get_mqtt_connected: Callable[[], bool],
                  get_connections: Callable[[], Set],
                  get_cmd_topic_map: Callable[[], Dict[str, str]],
-                 get_main_loop: Callable[[], Optional[asyncio.AbstractEventLoop]]):
+                 get_main_loop: Callable[[], Optional[asyncio.AbstractEventLoop]],
+                 get_viewer_count: Optional[Callable[[], int]] = None):
         """
         初始化消息发送管理器
         
@@ -28,12 +29,14 @@ class MqttMessageSender:
             get_connections: 获取WebSocket连接集合的函数
             get_cmd_topic_map: 获取命令主题映射的函数
             get_main_loop: 获取主事件循环的函数
+            get_viewer_count: 获取在线客户端总数的函数（多 worker 时跨进程汇总；未提供时使用本进程连接数）
         """
         self.get_mqtt_client = get_mqtt_client
         self.get_mqtt_connected = get_mqtt_connected
         self.get_connections = get_connections
         self.get_cmd_topic_map = get_cmd_topic_map
         self.get_main_loop = get_main_loop
+        self.get_viewer_count = get_viewer_count
         
         # 跟踪每个设备的消息发送状态
         self.message_send_tasks: Dict[str, Dict] = {}
@@ -98,8 +101,10 @@ class MqttMessageSender:
                 time_str = now_beijing.strftime("%H:%M:%S")
                 
                 # 获取WebSocket连接数
-                connections = self.get_connections()
-                ws_count = len(connections)
+                if self.get_viewer_count:
+                    ws_count = self.get_viewer_count()
+                else:
+                    ws_count = len(self.get_connections())
                 
                 # 构造消息：ms:t_17:31:31,p_2
                 message = f"ms:t_{time_str},p_{ws_count}"
@@ -0,0 +1,380 @@
+# payload_parser.py
+"""
+设备消息解析模块
+一次遍历即可判断消息类别（传感器数据行 / 二进制传感器帧 / 警告(D) / 恢复(S) / 定位JSON / 控制回显 / 其他），
+直接在原始 bytes 上用 translate/split 切分字段，不经过正则回溯，也无需先解码为 str。
+MQTT 和 BLE 共用，调用方再按主题/链路决定如何处理。
+
+二进制传感器帧（小端，共 44 字节，按消息自动识别，与文本协议并存）:
+    偏移  长度  类型     字段
+    0     2     bytes    魔数 "SB"
+    2     1     uint8    版本号（当前为 1）
+    3     1     uint8    标志位（保留，填 0）
+    4     4     uint32   设备序列号（每帧递增，回绕）
+    8     8     float64  采样时间（Unix 秒，0 表示使用服务器接收时间）
+    16    28    float32  T H L R Y W P（与文本协议顺序一致，NaN 表示该字段未采样）
+
+二进制批量帧（版本 2，一条消息携带多条读数，用于高采样率下减少 MQTT 消息数）:
+    偏移  长度  类型     字段
+    0     2     bytes    魔数 "SB"
+    2     1     uint8    版本号 2
+    3     1     uint8    标志位（保留，填 0）
+    4     4     uint32   首条样本的序列号（第 i 条为 base_seq + i）
+    8     8     float64  基准采样时间（Unix 秒，0 表示由服务器按接收时间推算）
+    16    2     uint16   样本数 N
+    18    2     -        填充
+    20    32*N  每条样本：uint32 相对基准时间的偏移（毫秒）+ 7 个 float32（T H L R Y W P）
+
+文本协议也可在一条消息中用换行分隔多行，见 PayloadParser.classify_many。
+"""
+import json
+import math
+import struct
+import time
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+# 消息类别
+KIND_SENSOR = "sensor"  # T=..H=..L=..R=..Y=..W=..P=..[N=..][U=..]（或二进制帧）
+KIND_WARNING = "warning"  # DT32.25（D + 类型 + 数值）
+KIND_RESOLVED = "resolved"  # ST（S + 类型）
+KIND_LOCATION = "location"  # {"lon":..,"lat":..} JSON
+KIND_LEGACY_LOCATION = "legacy_location"  # GPS:... / LOC=... / POSITION:...
+KIND_CONTROL = "control"  # ONMQ2 / OFFMQ2 等控制指令回显
+KIND_QUERY = "query"  # LBS? 定位查询指令
+KIND_MESSAGE_TOGGLE = "message_toggle"  # onmessage / offmessage
+KIND_UNKNOWN = "unknown"
+
+# 传感器数据行的字段顺序：T=温度 H=湿度 L=光照 R=Rs_Ro Y=烟雾PPM W=温度2 P=气压
+SENSOR_KEYS = (b"T=", b"H=", b"L=", b"R=", b"Y=", b"W=", b"P=")
+WARNING_TYPES = frozenset(b"THBSP")
+BINARY_MAGIC = b"SB"
+BINARY_VERSION = 1
+BINARY_FRAME = struct.Struct("<2sBBId7f")
+BINARY_FRAME_SIZE = BINARY_FRAME.size  # 44
+BINARY_BATCH_VERSION = 2
+BINARY_BATCH_HEADER = struct.Struct("<2sBBIdH2x")
+BINARY_BATCH_HEADER_SIZE = BINARY_BATCH_HEADER.size  # 20
+BINARY_BATCH_SAMPLE = struct.Struct("<I7f")
+BINARY_BATCH_SAMPLE_SIZE = BINARY_BATCH_SAMPLE.size  # 32
+_MESSAGE_TOGGLES = frozenset((b"onmessage", b"offmessage"))
+_LEGACY_LOCATION_MARKERS = (b"GPS:", b"LOC=", b"POSITION:")
+
+
+class ParsedPayload:
+    """解析结果"""
+
+    __slots__ = ("kind", "raw", "values", "warning_type", "warning_value", "location", "command",
+                 "binary", "seq", "timestamp", "offset")
+
+    def __init__(self, kind: str, raw: bytes, values: Optional[Tuple[Optional[float], ...]] = None,
+                 warning_type: Optional[str] = None, warning_value: Optional[float] = None,
+                 location: Optional[dict] = None, command: Optional[str] = None,
+                 binary: bool = False, seq: Optional[int] = None, timestamp: Optional[float] = None,
+                 offset: Optional[int] = None):
+        self.kind = kind
+        self.raw = raw
+        self.values = values
+        self.warning_type = warning_type
+        self.warning_value = warning_value
+        self.location = location
+        self.command = command
+        self.binary = binary
+        self.seq = seq
+        self.timestamp = timestamp
+        self.offset = offset  # 批量帧内相对基准时间的偏移（毫秒）
+
+    @property
+    def text(self) -> str:
+        """解码后的消息文本（仅在需要打印/存储时才解码；二进制帧返回摘要）"""
+        if self.binary:
+            return f"<二进制帧 v{self.raw[2]} seq={self.seq} {len(self.raw)}B>"
+        return self.raw.decode("utf-8", "ignore")
+
+
+# 删除数值字符后，合法的数据行只剩下键名骨架；行尾可选 N=序列号、U=采样时间（Unix 秒）
+_NUMBER_CHARS = b"0123456789.+-"
+_SENSOR_SKELETON = b"".join(SENSOR_KEYS)
+# 骨架 -> (字段数, 是否带序列号, 是否带时间戳)
+_SENSOR_SKELETONS = {
+    _SENSOR_SKELETON: (7, False, False),
+    _SENSOR_SKELETON + b"N=": (8, True, False),
+    _SENSOR_SKELETON + b"U=": (8, False, True),
+    _SENSOR_SKELETON + b"N=U=": (9, True, True),
+}
+# 键名替换为等号后，合法数据行中每个键名都与其等号相邻，"==" 的个数恰好等于字段数
+_KEYS_TO_EQUALS = bytes.maketrans(b"THLRYWPNU", b"=========")
+# 键名和等号替换为空格后，split() 即可得到各数值字段
+_KEYS_TO_SPACE = bytes.maketrans(b"THLRYWPNU=", b"          ")
+
+
+def parse_sensor_line(data: bytes) -> Optional[Tuple[Tuple[float, ...], Optional[int], Optional[float]]]:
+    """
+    解析传感器数据行，返回 ((T, H, L, R, Y, W, P), 序列号, 采样时间)，格式不符返回 None。
+    行尾可选 N=<非负整数序列号> 和 U=<Unix 秒>（U=0 视为未携带），未携带时对应项为 None。
+    全部校验和切分都由 bytes 的 C 实现完成：
+    - translate 删除数值字符后必须恰好是允许的键名骨架（如 "T=H=L=R=Y=W=P="，顺序正确、无其他字符）；
+    - 键名替换为等号后 "==" 的个数必须等于字段数（每个键名后紧跟等号）；
+    - 键名与等号替换为空格后 split() 切出的非空字段数必须等于字段数，再交给 float()/int()。
+    与原正则相比唯一的放宽是接受 ".5"、"5." 这类 float() 能识别的小数写法。
+    """
+    if not data.startswith(b"T="):
+        return None
+    layout = _SENSOR_SKELETONS.get(data.translate(None, _NUMBER_CHARS))
+    if layout is None:
+        return None
+    field_count, has_seq, has_timestamp = layout
+    if data.translate(_KEYS_TO_EQUALS).count(b"==") != field_count:
+        return None
+    fields = data.translate(_KEYS_TO_SPACE).split()
+    if len(fields) != field_count:
+        return None
+    try:
+        values = tuple(map(float, fields[:7]))
+        seq = int(fields[7]) if has_seq else None
+        timestamp = float(fields[-1]) if has_timestamp else None
+    except ValueError:
+        return None
+    if seq is not None and not 0 <= seq < 1 << 32:
+        return None
+    return values, seq, (timestamp or None)
+
+
+def parse_binary_frame(data: bytes) -> Optional[Tuple[int, Optional[float], Tuple[Optional[float], ...]]]:
+    """
+    解码二进制传感器帧
+
+    返回:
+        (seq, timestamp, (T, H, L, R, Y, W, P))；timestamp 为 0 时返回 None，NaN 字段返回 None。
+        魔数、版本或长度不符返回 None。
+    """
+    if len(data) != BINARY_FRAME_SIZE:
+        return None
+    magic, version, _flags, seq, timestamp, *values = BINARY_FRAME.unpack(data)
+    if magic != BINARY_MAGIC or version != BINARY_VERSION:
+        return None
+    # float32 精度约 7 位有效数字，保留 4 位小数即可还原设备上的原始读数
+    return seq, (timestamp or None), tuple(None if math.isnan(v) else round(v, 4) for v in values)
+
+
+def encode_binary_frame(values: Sequence[Optional[float]], seq: int, timestamp: float = 0.0) -> bytes:
+    """按二进制帧格式编码一条读数（设备端参考实现 / 模拟器使用），None 编码为 NaN"""
+    return BINARY_FRAME.pack(BINARY_MAGIC, BINARY_VERSION, 0, seq & 0xFFFFFFFF, timestamp,
+                             *(math.nan if v is None else v for v in values))
+
+
+def parse_binary_batch(data: bytes) -> Optional[Tuple[int, Optional[float], List[Tuple[int, Tuple[Optional[float], ...]]]]]:
+    """
+    解码二进制批量帧
+
+    返回:
+        (base_seq, base_timestamp, [(offset_ms, (T, H, L, R, Y, W, P)), ...])；
+        基准时间为 0 时返回 None，NaN 字段返回 None。魔数、版本或长度与样本数不符返回 None。
+    """
+    if len(data) < BINARY_BATCH_HEADER_SIZE:
+        return None
+    magic, version, _flags, base_seq, base_timestamp, count = BINARY_BATCH_HEADER.unpack_from(data)
+    if (magic != BINARY_MAGIC or version != BINARY_BATCH_VERSION
+            or len(data) != BINARY_BATCH_HEADER_SIZE + count * BINARY_BATCH_SAMPLE_SIZE):
+        return None
+    samples = [
+        (offset, tuple(None if math.isnan(v) else round(v, 4) for v in values))
+        for offset, *values in BINARY_BATCH_SAMPLE.iter_unpack(memoryview(data)[BINARY_BATCH_HEADER_SIZE:])
+    ]
+    return base_seq, (base_timestamp or None), samples
+
+
+def encode_binary_batch(samples: Sequence[Tuple[int, Sequence[Optional[float]]]], base_seq: int,
+                        base_timestamp: float = 0.0) -> bytes:
+    """按二进制批量帧格式编码多条读数（设备端参考实现 / 模拟器使用），samples 为 [(offset_ms, values), ...]"""
+    parts = [BINARY_BATCH_HEADER.pack(BINARY_MAGIC, BINARY_BATCH_VERSION, 0, base_seq & 0xFFFFFFFF,
+                                      base_timestamp, len(samples))]
+    for offset, values in samples:
+        parts.append(BINARY_BATCH_SAMPLE.pack(offset, *(math.nan if v is None else v for v in values)))
+    return b"".join(parts)
+
+
+def build_reading(t: float, h: float, lux, smoke=None, rs_ro=None, temp2=None, pressure=None, device_id=None,
+                  ts: Optional[float] = None) -> Tuple[dict, tuple]:
+    """
+    把一条读数整理为前端推送数据和数据库行
+
+    返回:
+        (payload, row)；row 为 (timestamp, temp, hum, lux, smoke, rs_ro, temp2, pressure)
+    """
+    ts = ts or time.time()
+    lux_value_display = None if lux is None else round(lux, 1)
+    smoke_value = None if smoke is None else round(smoke, 1)
+    pressure_value_display = None if pressure is None else round(pressure, 1)
+    temp2_value_display = None if temp2 is None else round(temp2, 2)
+    rs_ro_value_display = None if rs_ro is None else round(rs_ro, 2)
+    # 数据库存储保留更多小数位
+    lux_value_db = None if lux is None else round(lux, 1)
+    pressure_value_db = None if pressure is None else round(pressure, 2)
+    temp2_value_db = None if temp2 is None else round(temp2, 2)
+    rs_ro_value_db = None if rs_ro is None else round(rs_ro, 2)
+    # 发送给前端的数据（包含大气压、温度2和Rs/Ro）
+    payload = {
+        "type": "reading",
+        "ts": ts,
+        "temp": round(t, 2),
+        "hum": round(h, 2),
+        "lux": lux_value_display,
+        "smoke": smoke_value,
+        "pressure": pressure_value_display,
+        "temp2": temp2_value_display,
+        "rs_ro": rs_ro_value_display,
+        "device_id": device_id,  # 添加设备ID
+    }
+    row = (ts, round(t, 2), round(h, 2), lux_value_db, smoke_value, rs_ro_value_db, temp2_value_db, pressure_value_db)
+    return payload, row
+
+
+def resolve_sample_times(items: Sequence[ParsedPayload], max_skew: float,
+                         received_at: Optional[float] = None) -> Tuple[List[Optional[float]], Optional[float]]:
+    """
+    计算一条消息中各条读数的采样时间
+
+    帧内时间与接收时间相差不超过 max_skew 秒时直接使用；未携带或偏差过大时，以接收时间作为偏移最大的样本时间，
+    按各样本偏移向前推算；文本行没有偏移信息，返回 None（使用接收时间）。
+
+    返回:
+        (各条读数的采样时间, 偏差过大而被弃用的帧内时间（正常为 None）)
+    """
+    received_at = received_at or time.time()
+    offsets = [parsed.offset for parsed in items if parsed.offset is not None]
+    last_offset = max(offsets) if offsets else 0
+    first_ts = next((parsed.timestamp for parsed in items if parsed.timestamp is not None), None)
+    trusted = first_ts is not None and abs(first_ts - received_at) <= max_skew
+
+    timestamps = []
+    for parsed in items:
+        if trusted and parsed.timestamp is not None:
+            timestamps.append(parsed.timestamp)
+        elif parsed.offset is not None:
+            timestamps.append(received_at - (last_offset - parsed.offset) / 1000)
+        else:
+            timestamps.append(None)
+    return timestamps, (first_ts if first_ts is not None and not trusted else None)
+
+
+class PayloadParser:
+    """单次遍历的消息分类器"""
+
+    def __init__(self, control_commands: Iterable[str] = ()):
+        """
+        参数:
+            control_commands: 控制指令集合（如 ONMQ2/OFFMQ2），用于识别 data_cmd 上的回显
+        """
+        self.control_commands = frozenset(command.upper().encode() for command in control_commands)
+        self._max_command_length = max((len(command) for command in self.control_commands), default=0)
+
+    def classify_many(self, data) -> List[ParsedPayload]:
+        """
+        对可能携带多条记录的消息分类，返回至少一项
+
+        - 二进制批量帧：每条样本一个 KIND_SENSOR 结果（raw 为整帧，timestamp/offset/seq 按样本计算）；
+        - 换行分隔的多行文本：逐行 classify，空行跳过；
+        - 其他情况与 classify 相同，返回单项列表。
+        """
+        raw = data if type(data) is bytes else bytes(data)
+        if raw.startswith(BINARY_MAGIC) and len(raw) >= BINARY_BATCH_HEADER_SIZE:
+            if raw[2] == BINARY_BATCH_VERSION:
+                batch = parse_binary_batch(raw)
+                if batch is None:
+                    return [ParsedPayload(KIND_UNKNOWN, raw, binary=True)]
+                base_seq, base_timestamp, samples = batch
+                return [
+                    ParsedPayload(KIND_SENSOR, raw, values, binary=True, seq=(base_seq + i) & 0xFFFFFFFF,
+                                  timestamp=None if base_timestamp is None else base_timestamp + offset / 1000,
+                                  offset=offset)
+                    for i, (offset, values) in enumerate(samples)
+                ] or [ParsedPayload(KIND_UNKNOWN, raw, binary=True)]
+            if len(raw) == BINARY_FRAME_SIZE:
+                # 单条二进制帧内可能恰好含有换行字节，不能按行切分
+                return [self.classify(raw)]
+        if b"\n" in raw:
+            items = [self.classify(line) for line in raw.split(b"\n") if line.strip()]
+            if items:
+                return items
+        return [self.classify(raw)]
+
+    def classify(self, data) -> ParsedPayload:
+        """
+        对一条消息分类并提取字段
+
+        参数:
+            data: 原始消息（bytes / bytearray / memoryview）
+        """
+        raw = data if type(data) is bytes else bytes(data)
+
+        # 二进制帧需在去除空白前识别（帧内任意字节都可能是空白字符）
+        if len(raw) == BINARY_FRAME_SIZE and raw.startswith(BINARY_MAGIC):
+            frame = parse_binary_frame(raw)
+            if frame is not None:
+                seq, timestamp, values = frame
+                return ParsedPayload(KIND_SENSOR, raw, values, binary=True, seq=seq, timestamp=timestamp)
+            return ParsedPayload(KIND_UNKNOWN, raw, binary=True)
+
+        raw = raw.strip()
+        if not raw:
+            return ParsedPayload(KIND_UNKNOWN, raw)
+        first = raw[0]
+
+        # 传感器数据行（最常见，放在最前面）
+        if first == 0x54 and raw[1:2] == b"=":  # "T="
+            line = parse_sensor_line(raw)
+            if line is not None:
+                values, seq, timestamp = line
+                parsed = ParsedPayload(KIND_SENSOR, raw, values)
+                # 绝大多数数据行不带 N=/U=，避免关键字传参的额外开销
+                if seq is not None or timestamp is not None:
+                    parsed.seq = seq
+                    parsed.timestamp = timestamp
+                return parsed
+            return ParsedPayload(KIND_UNKNOWN, raw)
+
+        # 定位 JSON
+        if first == 0x7B:  # "{"
+            try:
+                location = json.loads(raw)
+            except ValueError:
+                location = None
+            if isinstance(location, dict) and "lon" in location and "lat" in location:
+                return ParsedPayload(KIND_LOCATION, raw, location=location)
+            return ParsedPayload(KIND_UNKNOWN, raw)
+
+        size = len(raw)
+        # 恢复信号：S + 类型（恰好两个字符）
+        if first == 0x53 and size == 2:  # "S"
+            warning_type = raw[1:2].upper()
+            if warning_type[0] in WARNING_TYPES:
+                return ParsedPayload(KIND_RESOLVED, raw, warning_type=warning_type.decode())
+
+        # 异常数据：D + 类型 + 数值
+        if first == 0x44 and size > 2:  # "D"
+            warning_type = raw[1:2].upper()
+            if warning_type[0] in WARNING_TYPES:
+                try:
+                    warning_value = float(raw[2:])
+                except ValueError:
+                    return ParsedPayload(KIND_UNKNOWN, raw)
+                return ParsedPayload(KIND_WARNING, raw, warning_type=warning_type.decode(),
+                                     warning_value=warning_value)
+
+        # 短指令：控制回显 / 定位查询 / 消息开关
+        if size <= max(self._max_command_length, 10):
+            if raw == b"LBS?":
+                return ParsedPayload(KIND_QUERY, raw, command="LBS?")
+            upper = raw.upper()
+            if upper in self.control_commands:
+                return ParsedPayload(KIND_CONTROL, raw, command=upper.decode())
+            lower = raw.lower()
+            if lower in _MESSAGE_TOGGLES:
+                return ParsedPayload(KIND_MESSAGE_TOGGLE, raw, command=lower.decode())
+
+        # 旧定位格式
+        for marker in _LEGACY_LOCATION_MARKERS:
+            if marker in raw:
+                return ParsedPayload(KIND_LEGACY_LOCATION, raw)
+
+        return ParsedPayload(KIND_UNKNOWN, raw)
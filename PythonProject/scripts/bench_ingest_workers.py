@@ -0,0 +1,93 @@
+# bench_ingest_workers.py
+"""
+多进程采集吞吐测试：通过 LocalShareBroker（共享订阅的本地替身）向 N 个工作进程投递模拟设备消息，
+统计 Web 进程汇总到全部读数所需的时间。不连接 MQTT Broker 和数据库（persist=False），
+测得的是解码 + 序列号去重 + 进程间传递的开销。
+
+用法（在 PythonProject 目录下）:
+    python scripts/bench_ingest_workers.py [消息条数] [设备数] [工作进程数列表，如 1,2,4]
+"""
+import asyncio
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from ingest_workers import IngestWorkerPool, SHARDING_LOCAL, EVENT_READINGS  # noqa: E402
+from payload_parser import encode_binary_batch  # noqa: E402
+
+
+def make_messages(count: int, devices: int, batch: int):
+    """每个设备的消息携带 batch 条读数（batch=1 时为带序列号的文本行）"""
+    rng = random.Random(42)
+    seqs = [0] * devices
+    messages = []
+    for i in range(count):
+        device = i % devices
+        topic = f"stm32/D{device + 1:02d}/data_now"
+        if batch == 1:
+            payload = (f"T={rng.uniform(15, 30):.2f}H={rng.uniform(30, 80):.2f}L={rng.uniform(0, 2000):.1f}"
+                       f"R={rng.uniform(0.5, 3):.2f}Y={rng.uniform(0, 50):.1f}W={rng.uniform(15, 30):.2f}"
+                       f"P={rng.uniform(990, 1030):.2f}N={seqs[device]}").encode()
+        else:
+            samples = [(j * 100, (rng.uniform(15, 30), rng.uniform(30, 80), rng.uniform(0, 2000), 1.0, 2.0,
+                                  rng.uniform(15, 30), rng.uniform(990, 1030))) for j in range(batch)]
+            payload = encode_binary_batch(samples, seqs[device])
+        seqs[device] += batch
+        messages.append((topic, payload))
+    return messages
+
+
+async def run(workers: int, messages, devices: int, expected: int) -> float:
+    loop = asyncio.get_running_loop()
+    received = 0
+    done = asyncio.Event()
+
+    def on_event(event):
+        nonlocal received
+        if event[0] == EVENT_READINGS:
+            received += len(event[3])
+            if received >= expected:
+                done.set()
+
+    pool = IngestWorkerPool(
+        worker_count=workers,
+        settings={
+            "sharding": SHARDING_LOCAL,
+            "topic_prefix": "stm32",
+            "persist": False,
+            "stats_interval": 1.0,
+        },
+        on_event=on_event,
+        get_main_loop=lambda: loop,
+        inbox_size=0,
+    )
+    pool.start()
+    # 等待工作进程就绪（spawn 启动需要重新导入模块）
+    await asyncio.sleep(2.0)
+    started = time.perf_counter()
+    for topic, payload in messages:
+        pool.dispatch(topic, payload)
+    await asyncio.wait_for(done.wait(), timeout=120)
+    elapsed = time.perf_counter() - started
+    await pool.stop()
+    return elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    devices = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    worker_counts = [int(n) for n in sys.argv[3].split(",")] if len(sys.argv) > 3 else [1, 2, 4]
+    for batch in (1, 20):
+        messages = make_messages(count // batch, devices, batch)
+        expected = len(messages) * batch
+        print(f"{len(messages)} 条消息 × {batch} 条读数，{devices} 个设备")
+        for workers in worker_counts:
+            elapsed = asyncio.run(run(workers, messages, devices, expected))
+            print(f"  {workers} 个工作进程  {elapsed * 1000:>8.1f} ms  {expected / elapsed / 1e3:>8.1f} k读数/秒")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# bench_line_framer.py
+"""
+BLE 行分帧微基准：对比旧实现（bytearray 追加 + find + 整体搬移）与 LineFramer。
+模拟三种通知流：默认 MTU 的 20 字节分片、扩展 MTU 的 244 字节分片、以及一次通知携带大量行的突发流。
+
+用法（在 PythonProject 目录下）:
+    python scripts/bench_line_framer.py [行数]
+"""
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from line_framer import LineFramer  # noqa: E402
+
+LINE_END = b"\r\n"
+
+
+def make_stream(line_count: int) -> bytes:
+    rng = random.Random(42)
+    lines = []
+    for _ in range(line_count):
+        lines.append(
+            f"T={rng.uniform(15, 30):.2f}H={rng.uniform(30, 80):.2f}L={rng.uniform(0, 2000):.1f}"
+            f"R={rng.uniform(0.5, 3):.2f}Y={rng.uniform(0, 50):.1f}W={rng.uniform(15, 30):.2f}"
+            f"P={rng.uniform(990, 1030):.2f}".encode() + LINE_END
+        )
+    return b"".join(lines)
+
+
+def chunk_fixed(stream: bytes, size: int):
+    return [stream[i:i + size] for i in range(0, len(stream), size)]
+
+
+def chunk_bursty(stream: bytes):
+    """突发流：大部分通知很小，偶尔一次携带数千字节（缓存积压后集中下发）"""
+    rng = random.Random(7)
+    chunks = []
+    i = 0
+    while i < len(stream):
+        size = rng.choice((20, 20, 20, 64, 244, 4096, 16384))
+        chunks.append(stream[i:i + size])
+        i += size
+    return chunks
+
+
+def run_legacy(chunks) -> int:
+    """旧 ble_notify_handler 的拆行逻辑（全局 bytearray，每行整体搬移剩余缓冲）"""
+    buffer = bytearray()
+    count = 0
+
+    def on_line(line: str):
+        nonlocal count
+        count += 1
+
+    def notify_handler(_handle, data):
+        nonlocal buffer
+        buffer += data
+        while True:
+            idx = buffer.find(LINE_END)
+            if idx < 0:
+                break
+            line = buffer[:idx].decode(errors="ignore").strip()
+            buffer[:] = buffer[idx + len(LINE_END):]
+            if line:
+                on_line(line)
+
+    for data in chunks:
+        notify_handler(0, data)
+    return count
+
+
+def run_framer(chunks) -> int:
+    """LineFramer：回调中解码，与 BleManager 的用法一致"""
+    framer = LineFramer(LINE_END)
+    count = 0
+
+    def on_line(line: str):
+        nonlocal count
+        count += 1
+
+    def dispatch(view):
+        on_line(str(view, "utf-8", "ignore"))
+
+    def notify_handler(_handle, data):
+        framer.feed(data, dispatch)
+
+    for data in chunks:
+        notify_handler(0, data)
+    return count
+
+
+def bench(name: str, func, chunks, total_bytes: int, repeat: int = 3):
+    best = None
+    lines = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        lines = func(chunks)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"  {name:<8} {lines:>8} 行  {best * 1000:>9.1f} ms  "
+          f"{total_bytes / best / 1e6:>7.2f} MB/s  {lines / best / 1e3:>8.1f} k行/秒")
+    return lines
+
+
+def main():
+    line_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    stream = make_stream(line_count)
+    scenarios = {
+        "20字节分片（默认MTU）": chunk_fixed(stream, 20),
+        "244字节分片（扩展MTU）": chunk_fixed(stream, 244),
+        "突发流（20B~16KB）": chunk_bursty(stream),
+        "积压回放（256KB/次）": chunk_fixed(stream, 256 * 1024),
+    }
+    print(f"数据量：{line_count} 行，{len(stream) / 1e6:.2f} MB")
+    for title, chunks in scenarios.items():
+        print(f"{title}：{len(chunks)} 次通知")
+        legacy = bench("旧实现", run_legacy, chunks, len(stream))
+        framer = bench("Framer", run_framer, chunks, len(stream))
+        assert legacy == framer == line_count, (legacy, framer)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# bench_payload_parser.py
+"""
+消息解析微基准：对比原有路径（decode + strip + 7组正则 fullmatch + 7次 float，失败后依次尝试
+警告解析 / json.loads / 子串判断）与 payload_parser 的单次分类。
+负载按实际比例混合：绝大多数为传感器数据行，少量警告、恢复、定位 JSON、控制回显。
+
+用法（在 PythonProject 目录下）:
+    python scripts/bench_payload_parser.py [消息条数]
+"""
+import json
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from payload_parser import PayloadParser  # noqa: E402
+
+PATTERN_DATA = re.compile(
+    r"T=([+-]?\d+(?:\.\d+)?)H=([+-]?\d+(?:\.\d+)?)L=([+-]?\d+(?:\.\d+)?)R=([+-]?\d+(?:\.\d+)?)Y=([+-]?\d+(?:\.\d+)?)W=([+-]?\d+(?:\.\d+)?)P=([+-]?\d+(?:\.\d+)?)"
+)
+CONTROL_COMMANDS = {"ONMQ2", "OFFMQ2", "ONBMP180", "OFFBMP180", "ONBH1750", "OFFBH1750"}
+
+
+def make_payloads(count: int):
+    rng = random.Random(42)
+    payloads = []
+    for _ in range(count):
+        roll = rng.random()
+        if roll < 0.90:
+            payload = (f"T={rng.uniform(15, 30):.2f}H={rng.uniform(30, 80):.2f}L={rng.uniform(0, 2000):.1f}"
+                       f"R={rng.uniform(0.5, 3):.2f}Y={rng.uniform(0, 50):.1f}W={rng.uniform(15, 30):.2f}"
+                       f"P={rng.uniform(990, 1030):.2f}")
+        elif roll < 0.94:
+            payload = f"D{rng.choice('THBSP')}{rng.uniform(0, 100):.2f}"
+        elif roll < 0.96:
+            payload = f"S{rng.choice('THBSP')}"
+        elif roll < 0.98:
+            payload = json.dumps({"utc": "2025-11-04T14:59:53Z", "iccid": "898604011025D0227746", "type": "LBS",
+                                  "imei": "864865082106973", "csq": 31,
+                                  "lon": round(rng.uniform(117, 119), 5), "lat": round(rng.uniform(24, 25), 5)})
+        else:
+            payload = rng.choice(sorted(CONTROL_COMMANDS))
+        payloads.append(payload.encode())
+    return payloads
+
+
+def legacy_classify(raw: bytes):
+    """原 mqtt_on_message 的判定顺序（去掉打印与副作用）"""
+    payload = raw.decode("utf-8").strip()
+    m = PATTERN_DATA.fullmatch(payload)
+    if m:
+        t = float(m.group(1))
+        h = float(m.group(2))
+        l = float(m.group(3))
+        rs_ro = float(m.group(4))
+        ppm = float(m.group(5))
+        t2 = float(m.group(6))
+        p = float(m.group(7))
+        return "sensor", (t, h, l, rs_ro, ppm, t2, p)
+    if payload.strip().upper() in CONTROL_COMMANDS:
+        return "control", None
+    if payload.strip().lower() in ["onmessage", "offmessage"]:
+        return "message_toggle", None
+    warning = payload.strip()
+    if len(warning) >= 2:
+        if warning.startswith('S') and len(warning) == 2 and warning[1].upper() in ['T', 'H', 'B', 'S', 'P']:
+            return "resolved", None
+        if warning.startswith('D') and len(warning) > 2 and warning[1].upper() in ['T', 'H', 'B', 'S', 'P']:
+            try:
+                return "warning", float(warning[2:])
+            except ValueError:
+                pass
+    try:
+        location = json.loads(payload)
+        if "lon" in location and "lat" in location:
+            return "location", location
+    except (json.JSONDecodeError, ValueError, TypeError):
+        pass
+    if "GPS:" in payload or "LOC=" in payload or "POSITION:" in payload:
+        return "legacy_location", None
+    return "unknown", None
+
+
+def bench(name: str, func, payloads, repeat: int = 5):
+    best = None
+    kinds = {}
+    for _ in range(repeat):
+        kinds = {}
+        started = time.perf_counter()
+        for raw in payloads:
+            kind = func(raw)
+            kinds[kind] = kinds.get(kind, 0) + 1
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"  {name:<10} {best * 1000:>8.1f} ms  {len(payloads) / best / 1e3:>8.1f} k条/秒  "
+          f"{best / len(payloads) * 1e6:>6.2f} µs/条")
+    return kinds
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    payloads = make_payloads(count)
+    parser = PayloadParser(CONTROL_COMMANDS)
+
+    sensor_only = [raw for raw in payloads if raw.startswith(b"T=")]
+    other_only = [raw for raw in payloads if not raw.startswith(b"T=")]
+    scenarios = {
+        "混合负载": payloads,
+        "仅传感器数据行": sensor_only,
+        "仅非传感器消息": other_only,
+    }
+    for title, data in scenarios.items():
+        print(f"{title}：{len(data)} 条")
+        legacy = bench("原有路径", lambda raw: legacy_classify(raw)[0], data)
+        fast = bench("单次分类", lambda raw: parser.classify(raw).kind, data)
+        assert legacy == fast, (legacy, fast)
+
+
+if __name__ == "__main__":
+    main()
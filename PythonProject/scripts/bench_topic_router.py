@@ -0,0 +1,53 @@
+# bench_topic_router.py
+"""
+MQTT 主题路由基准：对比每条消息得到 (设备ID, 主题类型) 的几种方式
+- 列表成员检查（注册表之前的做法：topic in MQTT_TOPICS，再拆分主题取设备ID）
+- 逐条拆分 + 规范化 + 正则校验（parse_device_topic，不带缓存）
+- 编译后的主题路由表 + 按主题缓存结果（DeviceRegistry.parse_topic / TopicRouter）
+
+用法（在 PythonProject 目录下）:
+    python scripts/bench_topic_router.py [设备数] [消息数]
+"""
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from device_registry import DeviceRegistry, parse_device_topic  # noqa: E402
+
+
+def main():
+    devices = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 500000
+    ids = [f"D{i:04d}" for i in range(devices)]
+    data_topics = [f"stm32/{device_id}/data_now" for device_id in ids]
+    rng = random.Random(42)
+    topics = [rng.choice(data_topics) for _ in range(count)]
+    registry = DeviceRegistry(ids, max_devices=devices + 10)
+
+    def by_list(topic):
+        if topic in data_topics:
+            return topic.split("/")[1], "data"
+        return None, None
+
+    cases = [
+        ("列表成员检查 + 拆分", by_list),
+        ("拆分 + 校验（无缓存）", parse_device_topic),
+        ("路由表 + 结果缓存", registry.parse_topic),
+    ]
+    print(f"{devices} 台设备，{count} 条消息\n")
+    print(f"{'方式':<24}{'耗时(ms)':>10}{'条/秒':>14}")
+    for name, parse in cases:
+        sample = topics if parse is not by_list or devices <= 1000 else topics[: count // 10]
+        start = time.perf_counter()
+        for topic in sample:
+            parse(topic)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<24}{elapsed * 1000:>10.1f}{len(sample) / elapsed:>14.0f}")
+    print(f"\n路由表：{registry.router.status()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# bench_ws_wire.py
+"""
+WebSocket 线路字节基准：对比同一串推送事件在以下方式下写到线路上的负载字节数与压缩耗时
+- 不压缩（未协商 permessage-deflate）
+- uvicorn 默认 permessage-deflate（窗口 2^15，zlib 默认级别，上下文接管）
+- 调优后的 permessage-deflate（WS_DEFLATE：窗口 2^13，level 6，memLevel 5）
+- 调优压缩 + ?batch= 合并（每帧合并 N 条事件）
+- ?proto=delta 增量编码（可与压缩、合并叠加）
+压缩过程与 websockets 的 PerMessageDeflate.encode 一致（Z_SYNC_FLUSH 后去掉末尾 4 字节）。
+
+用法（在 PythonProject 目录下）:
+    python scripts/bench_ws_wire.py [事件数]
+"""
+import json
+import random
+import sys
+import time
+import zlib
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from ws_delta import DeltaEncoder  # noqa: E402
+
+_EMPTY_BLOCK = b"\x00\x00\xff\xff"
+
+
+def make_events(count: int):
+    """三台设备的读数（缓慢随机游走，接近真实传感器）夹杂少量警告"""
+    rng = random.Random(42)
+    ts = time.time()
+    state = {f"D0{i}": [22.0, 50.0, 300.0, 3.0, 1010.0, 22.0, 1.0] for i in (1, 2, 3)}
+    steps = (0.01, 0.01, 0.1, 0.1, 0.1, 0.01, 0.01)
+    events = []
+    for i in range(count):
+        ts += rng.uniform(0.2, 1.0)
+        device_id = "D0%d" % rng.randint(1, 3)
+        if i % 50 == 49:
+            events.append(json.dumps({"type": "warning", "device_id": device_id,
+                                      "warning_type": "temp_high", "warning_message": "温度过高",
+                                      "value": round(rng.uniform(35, 40), 2), "ts": ts}, ensure_ascii=False))
+            continue
+        values = state[device_id]
+        for k, step in enumerate(steps):
+            values[k] += step * rng.choice((-2, -1, 0, 0, 0, 1, 2))
+        events.append(json.dumps({
+            "type": "reading", "ts": ts, "temp": round(values[0], 2), "hum": round(values[1], 2),
+            "lux": round(values[2], 1), "smoke": round(values[3], 1), "pressure": round(values[4], 1),
+            "temp2": round(values[5], 2), "rs_ro": round(values[6], 2), "device_id": device_id,
+        }))
+    return events
+
+
+def deflate_frames(frames, wbits: int, level: int, mem_level: int, min_size: int = 0):
+    encoder = zlib.compressobj(level, zlib.DEFLATED, -wbits, mem_level)
+    total = 0
+    for frame in frames:
+        data = frame.encode("utf-8")
+        if len(data) < min_size:
+            total += len(data)
+            continue
+        out = encoder.compress(data) + encoder.flush(zlib.Z_SYNC_FLUSH)
+        if out.endswith(_EMPTY_BLOCK):
+            out = out[:-4]
+        total += len(out)
+    return total
+
+
+def delta_encode(events):
+    encoder = DeltaEncoder()
+    return [encoder.encode(json.loads(event), event) for event in events]
+
+
+def batch(events, size: int):
+    return [events[0] if len(chunk) == 1 else '{"type":"batch","events":[' + ",".join(chunk) + "]}"
+            for chunk in (events[i:i + size] for i in range(0, len(events), size))]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    events = make_events(count)
+    raw = sum(len(event.encode("utf-8")) for event in events)
+    print(f"{count} 条事件，原始负载 {raw / 1024:.1f}KB（平均 {raw / count:.0f} 字节/条）\n")
+    cases = [
+        ("默认 deflate (2^15, level -1)", events, dict(wbits=15, level=-1, mem_level=8)),
+        ("调优 deflate (2^13, level 6)", events, dict(wbits=13, level=6, mem_level=5, min_size=64)),
+        ("调优 + batch 4 条/帧", batch(events, 4), dict(wbits=13, level=6, mem_level=5, min_size=64)),
+        ("调优 + batch 16 条/帧", batch(events, 16), dict(wbits=13, level=6, mem_level=5, min_size=64)),
+        ("增量 + 调优", delta_encode(events), dict(wbits=13, level=6, mem_level=5, min_size=64)),
+        ("增量 + 调优 + batch 4 条/帧", batch(delta_encode(events), 4), dict(wbits=13, level=6, mem_level=5, min_size=64)),
+    ]
+    print(f"{'方式':<28}{'帧数':>8}{'线路字节':>12}{'比例':>8}{'耗时(ms)':>10}")
+    print(f"{'不压缩':<28}{len(events):>8}{raw:>12}{1.0:>8.3f}{0.0:>10.1f}")
+    delta_raw = sum(len(frame.encode("utf-8")) for frame in delta_encode(events))
+    print(f"{'增量（不压缩）':<28}{len(events):>8}{delta_raw:>12}{delta_raw / raw:>8.3f}{0.0:>10.1f}")
+    for name, frames, options in cases:
+        start = time.perf_counter()
+        total = deflate_frames(frames, **options)
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"{name:<28}{len(frames):>8}{total:>12}{total / raw:>8.3f}{elapsed:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
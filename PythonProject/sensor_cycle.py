@@ -0,0 +1,332 @@
+# sensor_cycle.py
+"""
+传感器供电调度模块
+以注册表驱动所有需要开/关循环供电的传感器（MQ2、BMP180、BH1750 等），
+每台设备只运行一个调度任务、一个唤醒事件，每轮调度用一次查询读取该设备全部传感器状态。
+新增传感器只需在 server.py 的注册表中追加一个 SensorDefinition。
+"""
+import asyncio
+import time
+import traceback
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+
+
+class SensorDefinition:
+    """单个可调度传感器的定义（命令、模式配置、默认模式）"""
+
+    def __init__(self, name: str, on_command: str, off_command: str,
+                 mode_config: Dict[str, dict], default_mode: str,
+                 slug: Optional[str] = None, label: Optional[str] = None):
+        """
+        参数:
+            name: 传感器名称（sensor_states 表中的 sensor_name，如 "MQ2"）
+            on_command: 开启命令（如 "ONMQ2"）
+            off_command: 关闭命令（如 "OFFMQ2"）
+            mode_config: 模式配置字典（eco/balance/safe/always/dev ...）
+            default_mode: 默认模式
+            slug: API 路径名（默认为小写名称，如 /api/mq2/...）
+            label: 日志标签（默认为名称）
+        """
+        self.name = name.upper()
+        self.on_command = on_command
+        self.off_command = off_command
+        self.mode_config = mode_config
+        self.default_mode = default_mode
+        self.slug = slug or name.lower()
+        self.label = label or self.name
+
+    def command_for(self, phase: str) -> str:
+        """根据目标阶段返回命令"""
+        return self.on_command if phase == "on" else self.off_command
+
+    def get_mode_config(self, mode_key: Optional[str]) -> dict:
+        """获取模式配置，未知模式回退到默认模式"""
+        return self.mode_config.get(mode_key, self.mode_config[self.default_mode])
+
+    @property
+    def commands(self) -> set:
+        return {self.on_command, self.off_command}
+
+
+class SensorCycleEngine:
+    """传感器供电调度引擎"""
+
+    def __init__(self,
+                 definitions: Dict[str, SensorDefinition],
+                 get_db: Callable,
+                 send_command: Callable[..., Awaitable[dict]],
+                 get_devices: Callable[[], Iterable[str]],
+                 wait_for_transport: Callable[[str], Awaitable[Optional[str]]],
+                 get_preferred_transport: Callable[[str], str]):
+        """
+        初始化调度引擎
+
+        参数:
+            definitions: 传感器注册表（名称 -> SensorDefinition）
+            get_db: 获取数据库管理器的函数
+            send_command: 发送命令的协程函数（command, device_id=...）
+            get_devices: 获取需要调度的设备列表的函数
+            wait_for_transport: 等待通信链路就绪的协程函数（preferred）
+            get_preferred_transport: 获取设备首选链路的函数（device_id -> "BLE"/"MQTT"）
+        """
+        self.definitions = definitions
+        self.get_db = get_db
+        self.send_command = send_command
+        self.get_devices = get_devices
+        self.wait_for_transport = wait_for_transport
+        self.get_preferred_transport = get_preferred_transport
+
+        # 每台设备一个调度任务和一个唤醒事件（所有传感器共享）
+        self.cycle_tasks: Dict[str, asyncio.Task] = {}
+        self.cycle_wakeups: Dict[str, asyncio.Event] = {}
+        self.bootstrap_task: Optional[asyncio.Task] = None
+        self.running = False  # 启动初始化完成、各设备调度任务已启动
+
+    def get(self, sensor_name: str) -> Optional[SensorDefinition]:
+        return self.definitions.get((sensor_name or "").upper())
+
+    @property
+    def control_commands(self) -> set:
+        """所有已注册传感器的控制命令（用于识别 data_cmd 上的回显）"""
+        commands = set()
+        for definition in self.definitions.values():
+            commands |= definition.commands
+        return commands
+
+    # ============ 任务管理 ============
+    def start(self):
+        """启动初始化任务（等待链路就绪后交给调度器）"""
+        if self.bootstrap_task is None or self.bootstrap_task.done():
+            self.bootstrap_task = asyncio.create_task(self.initialize_on_startup())
+
+    def ensure_started(self):
+        """确保每台设备的调度任务仅启动一次"""
+        self.running = True
+        for device in self.get_devices():
+            task = self.cycle_tasks.get(device)
+            if task and not task.done():
+                continue
+            if device not in self.cycle_wakeups:
+                self.cycle_wakeups[device] = asyncio.Event()
+            self.cycle_tasks[device] = asyncio.create_task(self.device_cycle_manager(device))
+
+    def on_device_added(self):
+        """
+        运行时新登记设备后调用（主事件循环）：调度器已在运行时为新设备补启动调度任务，
+        否则该设备的模式/开关变化只写入数据库而不会执行；启动初始化完成前由 initialize_on_startup 统一启动
+        """
+        if self.running:
+            self.ensure_started()
+
+    def wake(self, device_id: str):
+        """唤醒指定设备的调度器（模式或开关变化后立即生效）"""
+        device_id = (device_id or "D01").upper()
+        event = self.cycle_wakeups.get(device_id)
+        if event:
+            event.set()
+
+    async def stop(self):
+        """取消所有调度任务"""
+        tasks = list(self.cycle_tasks.values())
+        if self.bootstrap_task:
+            tasks.append(self.bootstrap_task)
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self.cycle_tasks.clear()
+        self.cycle_wakeups.clear()
+        self.bootstrap_task = None
+        self.running = False
+
+    async def wait_for_signal(self, timeout: float, device_id: str):
+        """在循环中等待调度唤醒或超时"""
+        if timeout <= 0:
+            return
+        event = self.cycle_wakeups.setdefault(device_id, asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        else:
+            event.clear()
+
+    # ============ 启动初始化 ============
+    async def initialize_on_startup(self):
+        """
+        等待通信链路就绪后初始化所有注册传感器，将状态交给调度器统一开启。
+        每台设备只等待一次链路，再一次性写入全部传感器的待调度状态。
+        """
+        db = self.get_db()
+        names = "/".join(self.definitions.keys())
+
+        for device in self.get_devices():
+            transport = await self.wait_for_transport(self.get_preferred_transport(device))
+            if transport:
+                print(f"【传感器初始化】通信链路 {transport} 已就绪（设备 {device}），交由调度器开启 {names}。")
+                phase_message = f"等待调度器开启（链路：{transport}）"
+            else:
+                print(f"【传感器初始化】未等到可用通信链路（设备 {device}），调度器将持续重试。")
+                phase_message = "等待调度器开启（链路未就绪）"
+
+            for definition in self.definitions.values():
+                try:
+                    await db.set_sensor_state(
+                        definition.name,
+                        sensor_state="off",
+                        via=transport,
+                        mode=definition.default_mode,
+                        phase="pending",
+                        phase_message=phase_message,
+                        phase_until=None,
+                        device_id=device
+                    )
+                except Exception as e:
+                    print(f"【{definition.label}初始化】记录设备 {device} 状态失败：{e}")
+
+        self.ensure_started()
+
+    # ============ 调度逻辑 ============
+    async def apply_phase(self, db, definition: SensorDefinition, mode_key: str, target_phase: str,
+                          config: dict, duration: Optional[int], device_id: str = "D01") -> bool:
+        """根据目标阶段发送开启/关闭命令，并写入数据库状态。"""
+        command = definition.command_for(target_phase)
+        result = await self.send_command(command, device_id=device_id)
+        if not result.get("success"):
+            message = f"{'开启' if target_phase == 'on' else '关闭'}失败：{result.get('error', '未知错误')}"
+            await db.set_sensor_state(
+                definition.name,
+                phase="error",
+                phase_message=message,
+                phase_until=None,
+                device_id=device_id
+            )
+            print(f"【{definition.label}调度】❌ {message}")
+            return False
+
+        phase_until = time.time() + duration if duration else None
+        status_text = "供电中" if target_phase == "on" else "休眠中"
+        await db.set_sensor_state(
+            definition.name,
+            sensor_state=target_phase,
+            via=result.get("via"),
+            mode=mode_key,
+            phase=target_phase,
+            phase_message=f"{config['name']} · {status_text}",
+            phase_until=phase_until,
+            next_run_time=phase_until,
+            device_id=device_id
+        )
+        label = "开启" if target_phase == "on" else "关闭"
+        print(
+            f"【{definition.label}调度】✓ {config['name']} {label}成功，下一次在 {('%.0f秒后' % duration) if duration else '持续运行'} 切换")
+        return True
+
+    async def step(self, db, definition: SensorDefinition, record: Optional[dict], device_id: str) -> float:
+        """
+        推进单个传感器的调度状态
+
+        返回:
+            距离下一次需要处理该传感器的秒数（0 表示立即再次处理）
+        """
+        if not record:
+            await db.set_sensor_state(
+                definition.name,
+                "on",
+                mode=definition.default_mode,
+                phase="pending",
+                phase_message="等待调度",
+                phase_until=None,
+                device_id=device_id
+            )
+            return 2
+
+        mode = record.get("mode") or definition.default_mode
+        if mode not in definition.mode_config:
+            mode = definition.default_mode
+            await db.set_sensor_state(definition.name, mode=mode, device_id=device_id)
+
+        config = definition.get_mode_config(mode)
+        phase = (record.get("phase") or "pending").lower()
+        phase_until = record.get("phase_until")
+
+        if phase == "manual":
+            # 手动关闭期间保持关闭状态（状态未变化时不重复写库）
+            if record.get("sensor_state") != "off" or record.get("phase_until") is not None:
+                await db.set_sensor_state(
+                    definition.name,
+                    sensor_state="off",
+                    phase="manual",
+                    phase_message=record.get("phase_message") or "手动关闭",
+                    phase_until=None,
+                    next_run_time=None,
+                    device_id=device_id
+                )
+            return 5
+
+        if config.get("always_on"):
+            if phase != "on" or record.get("sensor_state") != "on":
+                if await self.apply_phase(db, definition, mode, "on", config, duration=None, device_id=device_id):
+                    return 0
+                return 5
+            return 10
+
+        if phase not in ("on", "off") or not phase_until:
+            if await self.apply_phase(db, definition, mode, "on", config, config["on_duration"], device_id=device_id):
+                return 0
+            return 5
+
+        now = time.time()
+        if now >= phase_until - 0.2:
+            next_phase = "off" if phase == "on" else "on"
+            duration = config["on_duration"] if next_phase == "on" else config["off_duration"]
+            if await self.apply_phase(db, definition, mode, next_phase, config, duration, device_id=device_id):
+                return 0
+            return 5
+
+        return max(1, min(5, phase_until - now))
+
+    async def device_cycle_manager(self, device_id: str):
+        """
+        设备级供电调度器：一个任务驱动该设备的全部注册传感器，
+        等待时间取各传感器下一次切换时间的最小值。
+        """
+        db = self.get_db()
+        device_id = (device_id or "D01").upper()
+        sensor_names: List[str] = list(self.definitions.keys())
+        print(f"【传感器调度】供电调度器已启动（设备 {device_id}，传感器：{'/'.join(sensor_names)}）")
+
+        while True:
+            try:
+                records = await db.get_sensor_states(sensor_names, device_id=device_id)
+                if records is None:
+                    # 数据库暂不可用，稍后重试
+                    await self.wait_for_signal(5, device_id)
+                    continue
+
+                sleep_for = None
+                for name, definition in self.definitions.items():
+                    try:
+                        wait = await self.step(db, definition, records.get(name), device_id)
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        print(f"【{definition.label}调度】❌ 调度器错误（设备 {device_id}）：{e}")
+                        traceback.print_exc()
+                        wait = 5
+                    sleep_for = wait if sleep_for is None else min(sleep_for, wait)
+
+                if sleep_for is None:
+                    sleep_for = 5
+                await self.wait_for_signal(sleep_for, device_id)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                print(f"【传感器调度】❌ 调度器错误（设备 {device_id}）：{e}")
+                traceback.print_exc()
+                await self.wait_for_signal(5, device_id)
+
+        print(f"【传感器调度】供电调度器已停止（设备 {device_id}）")
@@ -0,0 +1,227 @@
+# sequence_tracker.py
+"""
+设备序列号窗口模块
+按设备维护一个滑动窗口：
+- 去重：窗口内已放行过的序列号再次到达（QoS1 重投、断线重连后重发、BLE 与 MQTT 同时上报）直接丢弃；
+- 乱序重排：比期望序列号超前的读数先暂存，缺口补齐后按序放行；等待超过 reorder_delay 或暂存数超过
+  max_pending 时认定缺口丢失，跳过缺口继续放行；
+- 丢包统计：跳过的缺口计入 lost，缺口之后又迟到的读数仍会放行并计入 recovered；
+- 重新同步：序列号前后跳变超过窗口（计数器回绕异常等）时以新序列号重新开始，不计入丢包；
+- 设备重启：计数器从 0 重新开始时新序列号仍在去重窗口内，不能当作重复丢弃。同一序列号再次到达但设备采样时间
+  与上次不同（重投的读数时间相同，重启后的新读数时间不同，无论设备时钟是否随重启回退），
+  或设备未携带采样时间而序列号回到 0/1（RESTART_SEQ_MAX）时，判定为重启并重新同步；
+  重启后较小的序列号已移出去重窗口时按迟到读数放行，遇到窗口内时间不同的序列号时再重新同步。
+序列号按 uint32 回绕比较。条目内容对本模块不透明，由调用方决定如何入库。
+线程安全：MQTT 回调运行在 paho 网络线程，BLE 和定时刷新运行在主事件循环，内部用锁保护。
+"""
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+SEQ_MODULO = 1 << 32
+_SEQ_HALF = 1 << 31
+RESTART_SEQ_MAX = 1  # 设备未携带采样时间时，回退到不大于该值的序列号视为重启
+
+
+def seq_diff(seq: int, base: int) -> int:
+    """按 uint32 回绕计算 seq - base（结果范围 [-2^31, 2^31)）"""
+    diff = (seq - base) % SEQ_MODULO
+    return diff - SEQ_MODULO if diff >= _SEQ_HALF else diff
+
+
+class DeviceSequenceState:
+    """单个设备的窗口状态与统计"""
+
+    __slots__ = ("next_seq", "seen", "seen_order", "pending", "received", "released", "duplicates", "lost",
+                 "recovered", "reordered", "resyncs", "last_seq", "last_seen")
+
+    def __init__(self, window: int):
+        self.next_seq: Optional[int] = None  # 下一个期望的序列号
+        self.seen: Dict[int, Optional[float]] = {}  # 最近已放行的序列号 -> 设备采样时间（未携带为 None）
+        self.seen_order = deque(maxlen=window)
+        self.pending: Dict[int, tuple] = {}  # 暂存的超前读数：seq -> (到达时间, 条目, 设备采样时间)
+        self.received = 0
+        self.released = 0
+        self.duplicates = 0
+        self.lost = 0
+        self.recovered = 0
+        self.reordered = 0
+        self.resyncs = 0
+        self.last_seq: Optional[int] = None
+        self.last_seen: Optional[float] = None
+
+    def mark_seen(self, seq: int, device_ts: Optional[float] = None):
+        if len(self.seen_order) == self.seen_order.maxlen:
+            self.seen.pop(self.seen_order[0], None)
+        self.seen_order.append(seq)
+        self.seen[seq] = device_ts
+
+    def snapshot(self) -> dict:
+        expected = self.released + self.lost - self.recovered
+        return {
+            "received": self.received,
+            "released": self.released,
+            "duplicates": self.duplicates,
+            "lost": self.lost,
+            "recovered": self.recovered,
+            "reordered": self.reordered,
+            "resyncs": self.resyncs,
+            "pending": len(self.pending),
+            "next_seq": self.next_seq,
+            "last_seq": self.last_seq,
+            "last_seen": self.last_seen,
+            "loss_rate": round((self.lost - self.recovered) / expected, 4) if expected > 0 else 0.0,
+        }
+
+
+class SequenceTracker:
+    """按设备的序列号去重 / 缺口检测 / 有界乱序重排"""
+
+    def __init__(self, window: int = 256, reorder_delay: float = 2.0, max_pending: int = 64):
+        """
+        参数:
+            window: 去重窗口大小（最近放行的序列号个数），也是判定序列号跳变的阈值
+            reorder_delay: 超前读数最长等待缺口补齐的时间（秒）
+            max_pending: 每个设备最多暂存的超前读数，超过后立即跳过最早的缺口
+        """
+        self.window = window
+        self.reorder_delay = reorder_delay
+        self.max_pending = min(max_pending, window)
+        self._devices: Dict[str, DeviceSequenceState] = {}
+        self._lock = threading.Lock()
+
+    def _state(self, device_id: str) -> DeviceSequenceState:
+        state = self._devices.get(device_id)
+        if state is None:
+            state = self._devices[device_id] = DeviceSequenceState(self.window)
+        return state
+
+    def accept(self, device_id: str, seq: int, item: Any, now: Optional[float] = None,
+               device_ts: Optional[float] = None) -> List[Any]:
+        """
+        提交一条带序列号的条目
+
+        参数:
+            device_ts: 设备帧内的原始采样时间（未携带为 None），用于区分重投与设备重启后的新读数；
+                       须是设备上报的值本身，不能是按接收时间推算的时间（重投时会变化）
+
+        返回:
+            本次可以按序放行的条目列表（可能为空：重复或正在等待缺口补齐）
+        """
+        now = now or time.time()
+        seq &= SEQ_MODULO - 1
+        with self._lock:
+            state = self._state(device_id)
+            state.received += 1
+            state.last_seq = seq
+            state.last_seen = now
+            released: List[Any] = []
+
+            if state.next_seq is None:
+                state.next_seq = seq
+            diff = seq_diff(seq, state.next_seq)
+
+            if diff < 0:
+                if self._restarted(state, seq, device_ts):
+                    print(f"【序列号】设备 {device_id} 序列号回退到 {seq}（期望 {state.next_seq}），判定设备重启")
+                    self._resync(state, seq, released)
+                    self._release_in_order(state, seq, item, released, device_ts)
+                elif seq in state.seen:
+                    state.duplicates += 1
+                elif -diff <= self.window:
+                    # 已判定丢失的缺口迟到了，照常放行（入库不要求严格按序）
+                    state.recovered += 1
+                    state.mark_seen(seq, device_ts)
+                    state.released += 1
+                    released.append(item)
+                else:
+                    self._resync(state, seq, released)
+                    self._release_in_order(state, seq, item, released, device_ts)
+                return released
+
+            if diff == 0:
+                if state.pending:
+                    # 补上了缺口：该读数比后续读数晚到
+                    state.reordered += 1
+                self._release_in_order(state, seq, item, released, device_ts)
+                return released
+
+            if diff > self.window:
+                self._resync(state, seq, released)
+                self._release_in_order(state, seq, item, released, device_ts)
+                return released
+
+            if seq in state.pending:
+                state.duplicates += 1
+                return released
+            state.pending[seq] = (now, item, device_ts)
+            while len(state.pending) > self.max_pending:
+                self._skip_gap(state, released)
+            return released
+
+    def flush_expired(self, now: Optional[float] = None) -> Dict[str, List[Any]]:
+        """
+        放行等待超时的暂存条目（定时调用），返回 {设备ID: 条目列表}
+        """
+        now = now or time.time()
+        result: Dict[str, List[Any]] = {}
+        with self._lock:
+            for device_id, state in self._devices.items():
+                released: List[Any] = []
+                while state.pending and min(pending[0] for pending in state.pending.values()) \
+                        + self.reorder_delay <= now:
+                    self._skip_gap(state, released)
+                if released:
+                    result[device_id] = released
+        return result
+
+    @staticmethod
+    def _restarted(state: DeviceSequenceState, seq: int, device_ts: Optional[float]) -> bool:
+        """回退的序列号是否为设备重启后的新读数（而不是重投或迟到的读数）"""
+        if device_ts is None:
+            # 无法与上次比较：只有回到计数起点才认定重启（起点读数的重投会多存一条，好过丢弃重启后的数据）
+            return seq <= RESTART_SEQ_MAX
+        if seq not in state.seen:
+            return False
+        seen_ts = state.seen[seq]
+        return seen_ts is None or abs(device_ts - seen_ts) > 1e-3
+
+    def _release_in_order(self, state: DeviceSequenceState, seq: int, item: Any, released: List[Any],
+                          device_ts: Optional[float] = None):
+        """放行 seq 对应条目，并继续放行暂存中紧随其后的连续条目"""
+        state.mark_seen(seq, device_ts)
+        state.released += 1
+        released.append(item)
+        next_seq = (seq + 1) % SEQ_MODULO
+        while next_seq in state.pending:
+            _arrived, pending_item, pending_ts = state.pending.pop(next_seq)
+            state.mark_seen(next_seq, pending_ts)
+            state.released += 1
+            released.append(pending_item)
+            next_seq = (next_seq + 1) % SEQ_MODULO
+        state.next_seq = next_seq
+
+    def _skip_gap(self, state: DeviceSequenceState, released: List[Any]):
+        """认定最早的缺口丢失，从暂存中最小的序列号继续放行"""
+        first = min(state.pending, key=lambda pending_seq: seq_diff(pending_seq, state.next_seq))
+        state.lost += seq_diff(first, state.next_seq)
+        _arrived, item, device_ts = state.pending.pop(first)
+        self._release_in_order(state, first, item, released, device_ts)
+
+    def _resync(self, state: DeviceSequenceState, seq: int, released: List[Any]):
+        """序列号跳变超过窗口或设备重启：按序放行暂存条目后从新序列号重新开始"""
+        for pending_seq in sorted(state.pending, key=lambda pending_seq: seq_diff(pending_seq, state.next_seq)):
+            item = state.pending[pending_seq][1]
+            state.released += 1
+            released.append(item)
+        state.pending.clear()
+        state.seen.clear()
+        state.seen_order.clear()
+        state.next_seq = seq
+        state.resyncs += 1
+
+    def stats(self) -> Dict[str, dict]:
+        """各设备的去重/丢包/乱序统计"""
+        with self._lock:
+            return {device_id: state.snapshot() for device_id, state in self._devices.items()}
@@ -1,21 +1,20 @@
 # server.py
 import asyncio
 import json
+import os
 import platform
-import re
 import time
 import ssl
+import tempfile
 from datetime import datetime, timezone, timedelta
 from pathlib import Path
-from typing import Set, Optional, Dict
+from typing import Set, Optional, Dict, List
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request
-from fastapi.staticfiles import StaticFiles
 from fastapi.responses import StreamingResponse
-from starlette.responses import FileResponse, Response, PlainTextResponse
+from starlette.responses import Response, PlainTextResponse
 import uvicorn
-from bleak import BleakClient, BleakScanner  # 添加 BleakScanner
 import httpx
 import paho.mqtt.client as mqtt
 from secrets_manager import SECRETS
@@ -26,6 +25,63 @@ from db_manager import get_db_manager
 # 导入MQTT消息发送模块
 from mqtt_message_sender import MqttMessageSender
 
+# 导入传感器供电调度模块
+from sensor_cycle import SensorDefinition, SensorCycleEngine
+
+# 导入命令确认跟踪模块
+from command_tracker import CommandTracker
+
+# 导入多设备蓝牙连接管理模块
+from ble_manager import BleManager
+
+# 导入设备序列号去重/乱序重排模块
+from sequence_tracker import SequenceTracker
+
+# 导入多进程采集模块
+from ingest_workers import IngestWorkerPool, SHARDING_BROKER, SHARDING_LOCAL, EVENT_READINGS, EVENT_MESSAGE
+
+# 导入跨进程广播总线
+from event_bus import create_event_bus, BACKEND_LOCAL
+
+# 导入 AI 上游连接池
+from ai_upstream import UpstreamClientPool, AiHealthProber
+
+# 导入 AI 数据摘要构建器
+from ai_context import SensorContextBuilder
+
+# 导入 AI 响应缓存
+from ai_cache import ResponseCache, cache_key, fingerprint, replay_stream
+
+# 导入 AI 请求准入控制
+from ai_admission import AdmissionController, AdmissionRejected, AdmissionTimeout
+
+# 导入 AI 流式响应字节转发
+from ai_stream import StreamMetrics, StreamStats, relay_sse
+
+# 导入静态资源管线（指纹地址、ETag、预压缩）
+from static_assets import AssetPipeline, AssetStaticFiles
+
+# 导入 WebSocket 线路压缩与批量发送
+from ws_wire import WebSocketBatcher, make_ws_protocol, wire_stats
+
+# 导入 WebSocket 读数增量编码
+from ws_delta import DeltaEncoder, delta_stats, schema_message
+
+# 导入 WebSocket 连接快照
+from live_snapshot import LiveSnapshot, reading_from_row, warning_from_row
+
+# 导入设备在线状态跟踪
+from device_liveness import LivenessTracker
+
+# 导入设备注册表
+from device_registry import DeviceRegistry, DEVICE_ID_PATTERN, TOPIC_DATA, TOPIC_CMD
+
+# 导入设备消息解析模块
+from payload_parser import (
+    PayloadParser, ParsedPayload, build_reading, resolve_sample_times, KIND_SENSOR, KIND_WARNING, KIND_RESOLVED,
+    KIND_LOCATION, KIND_LEGACY_LOCATION, KIND_CONTROL, KIND_QUERY, KIND_MESSAGE_TOGGLE
+)
+
 # ============ 基本配置 ============
 PROJECT_DIR = Path(__file__).parent
 WEB_DIR = PROJECT_DIR / "web"
@@ -37,10 +93,10 @@ CAFILE_DIR = PROJECT_DIR / "cafile"
 # MQTT配置（主要数据源）
 MQTT_BROKER = "b734d07e.ala.cn-hangzhou.emqxsl.cn"
 MQTT_PORT = 8883  # MQTT over TLS/SSL
-# 支持的设备列表
+# 初始设备列表（第一个为默认设备）；其他设备首次发来消息时自动登记到设备注册表（数据库 device_registry 表），无需改代码
 MQTT_DEVICES = ["D01", "D02", "D03", "D04"]  # 支持多个设备（目前除了前面两个，后面的都是占位符）
 
-# 设备名称映射配置（可自定义每个设备的显示名称）
+# 设备名称映射配置（可自定义每个设备的显示名称；数据库 device_registry.name 非空时以数据库为准）
 DEVICE_NAMES = {
     "D01": "实验平台",
     "D02": "算力机房",
@@ -48,25 +104,63 @@ DEVICE_NAMES = {
     "D04": "访客中心"
 }
 
-# 为每个设备生成主题列表
-MQTT_TOPICS = [f"stm32/{device}/data_now" for device in MQTT_DEVICES]  # 传感器数据主题列表
-MQTT_CMD_TOPICS = [f"stm32/{device}/data_cmd" for device in MQTT_DEVICES]  # 定位命令主题列表
-MQTT_TOPIC_MAP = {device.upper(): f"stm32/{device}/data_now" for device in MQTT_DEVICES}
-MQTT_CMD_TOPIC_MAP = {device.upper(): f"stm32/{device}/data_cmd" for device in MQTT_DEVICES}
-# 保留旧的主题变量以兼容现有代码（使用D01作为默认）
-MQTT_TOPIC = MQTT_TOPICS[0]  # 默认使用D01主题（向后兼容）
-MQTT_CMD_TOPIC = MQTT_CMD_TOPICS[0]  # 默认使用D01命令主题（向后兼容）
+# 设备主题：<前缀>/<设备ID>/data_now 为传感器数据，<前缀>/<设备ID>/data_cmd 为定位/控制命令，均以通配主题订阅
+MQTT_TOPIC_PREFIX = "stm32"
+DEVICE_AUTO_REGISTER = True  # 收到未登记设备的消息时自动登记
+DEVICE_REGISTRY_MAX = 5000  # 注册表容量上限（防止异常主题无限登记）
+device_registry = DeviceRegistry(
+    ["D01"] + MQTT_DEVICES,
+    names=DEVICE_NAMES,
+    topic_prefix=MQTT_TOPIC_PREFIX,
+    auto_register=DEVICE_AUTO_REGISTER,
+    max_devices=DEVICE_REGISTRY_MAX,
+    on_register=lambda info: on_device_registered(info)
+)
 MQTT_USERNAME = SECRETS.get("MQTT_USERNAME", "")
 MQTT_PASSWORD = SECRETS.get("MQTT_PASSWORD", "")
 MQTT_CA_CERT_FILE = CAFILE_DIR / "emqxsl-ca.crt"  # CA证书文件路径
-# MQTT 控制指令（需要从定位解析中排除）
-MQTT_CONTROL_COMMANDS = {"ONMQ2", "OFFMQ2"}
 
 # DeepSeek API 配置（在线模型）
 DEEPSEEK_API_KEY = SECRETS.get("DEEPSEEK_API_KEY", "")
 DEEPSEEK_API_URL = "https://api.deepseek.com/v1/chat/completions"
 DEEPSEEK_ONLINE_MODELS = ["deepseek-reasoner", "deepseek-chat"]  # 在线模型列表
 
+# 本地 LM Studio 配置
+LM_STUDIO_BASE_URL = "http://localhost:1234"
+LM_STUDIO_CHAT_URL = f"{LM_STUDIO_BASE_URL}/v1/chat/completions"
+LM_STUDIO_MODELS_URL = f"{LM_STUDIO_BASE_URL}/v1/models"
+
+# AI 上游连接池：每个上游一个常驻客户端（长连接复用，安装 h2 后 DeepSeek 走 HTTP/2），应用关闭时释放
+AI_UPSTREAMS = {
+    "deepseek": {
+        "base_url": "https://api.deepseek.com",
+        "http2": True,
+        "limits": {"max_connections": 20, "max_keepalive_connections": 10, "keepalive_expiry": 60.0},
+    },
+    "lm_studio": {
+        "base_url": LM_STUDIO_BASE_URL,
+        "trust_env": False,  # 禁用代理，直连 localhost（避免代理干扰）
+        "limits": {"max_connections": 10, "max_keepalive_connections": 5, "keepalive_expiry": 30.0},
+    },
+}
+# 流式聊天的超时：连接10秒，读取300秒（包括模型推理时间），写入60秒
+AI_STREAM_TIMEOUT = httpx.Timeout(connect=10.0, read=300.0, write=60.0, pool=10.0)
+ai_clients = UpstreamClientPool(AI_UPSTREAMS)
+# AI 请求准入控制：每个上游的并发上限与 FIFO 排队上限；流式请求排队时向页面推送排队位置
+AI_ADMISSION = {
+    "lm_studio": {"limit": 1, "max_queue": 20},  # 本地单模型：同一时间只生成一个回答，避免多会话互相拖慢
+    "deepseek": {"limit": 8, "max_queue": 50},
+}
+AI_QUEUE_TIMEOUT = 300.0  # 排队超时（秒）
+ai_admission = {name: AdmissionController(name, **config) for name, config in AI_ADMISSION.items()}
+ai_stream_stats = StreamStats()  # 流式回答的首 token 时间、生成速率统计
+# LM Studio 健康/模型列表探测：后台每 AI_PROBE_INTERVAL 秒刷新（近期有人查询时），/api/ai/health 与
+# /api/ai/models 共用缓存，缓存过期时并发请求合并为一次探测
+AI_PROBE_INTERVAL = 10.0
+AI_PROBE_TTL = 15.0
+ai_prober = AiHealthProber(ai_clients, "lm_studio", LM_STUDIO_MODELS_URL, interval=AI_PROBE_INTERVAL,
+                           ttl=AI_PROBE_TTL)
+
 # 提示用户配置敏感信息的密钥文件，避免将密钥写死在代码中
 if not MQTT_USERNAME or not MQTT_PASSWORD:
     print("【警告】未在密钥文件中配置 MQTT_USERNAME/MQTT_PASSWORD，将无法正常连接 MQTT 服务器。")
@@ -76,21 +170,21 @@ if not DEEPSEEK_API_KEY:
 
 # 蓝牙设备配置（优先数据源）
 BLE_DEVICES = {
-    "BT27": "48:87:2D:7D:7C:60",  # 仅使用 BT27 设备
+    "BT27": "48:87:2D:7D:7C:60",
+}
+# 蓝牙设备名称 -> 设备ID（蓝牙连接时忽略该设备的 MQTT 传感器数据）
+BLE_DEVICE_IDS = {
+    "BT27": "D01",
 }
 UART_RXTX_CHAR = "0000FFE1-0000-1000-8000-00805F9B34FB"  # HM-10/BT05
 LINE_END = b"\r\n"
 
 # 数据源状态标志
 ble_or_mqtt_first = 1  # 0表示蓝牙优先 1表示MQTT优先
-ble_connected = False  # 蓝牙连接状态
+ble_connected = False  # 蓝牙连接状态（任一蓝牙设备已连接）
 ble_connection_attempted = False  # 蓝牙是否已尝试连接
 mqtt_connected = False  # MQTT连接状态
 mqtt_connection_attempted = False  # MQTT是否已尝试连接
-# MQTT首次消息标志（用于屏蔽服务器保留的最后一条消息）
-mqtt_first_message_received = {}  # 字典，key为主题，value为是否已收到第一条消息
-# 当前活跃的BLE客户端（用于写入命令）
-ble_client = None
 
 # 设备最后消息时间记录（用于判断设备在线状态）
 device_last_message_time = {}  # 字典，key为设备ID，value为最后一次收到消息的时间戳
@@ -150,56 +244,47 @@ DEFAULT_MQ2_MODE = "eco"
 DEFAULT_BMP180_MODE = "always"  # BMP180默认不省电
 DEFAULT_BH1750_MODE = "always"  # BH1750默认不省电
 
-# MQ2 初始化与调度任务
-mq2_bootstrap_task = None
-mq2_cycle_tasks: Dict[str, asyncio.Task] = {}
-mq2_cycle_wakeups: Dict[str, asyncio.Event] = {}
-
-# BMP180 初始化与调度任务
-bmp180_bootstrap_task = None
-bmp180_cycle_tasks: Dict[str, asyncio.Task] = {}
-bmp180_cycle_wakeups: Dict[str, asyncio.Event] = {}
+# 供电调度传感器注册表：新增传感器只需在此追加一项（命令、模式配置、默认模式）
+SENSOR_CYCLE_REGISTRY = {
+    definition.name: definition
+    for definition in (
+        SensorDefinition("MQ2", on_command="ONMQ2", off_command="OFFMQ2",
+                         mode_config=MQ2_MODE_CONFIG, default_mode=DEFAULT_MQ2_MODE),
+        SensorDefinition("BMP180", on_command="ONBMP180", off_command="OFFBMP180",
+                         mode_config=MQ2_MODE_CONFIG, default_mode=DEFAULT_BMP180_MODE),
+        SensorDefinition("BH1750", on_command="ONBH1750", off_command="OFFBH1750",
+                         mode_config=MQ2_MODE_CONFIG, default_mode=DEFAULT_BH1750_MODE),
+    )
+}
 
-# BH1750 初始化与调度任务
-bh1750_bootstrap_task = None
-bh1750_cycle_tasks: Dict[str, asyncio.Task] = {}
-bh1750_cycle_wakeups: Dict[str, asyncio.Event] = {}
+# MQTT 控制指令（需要从定位解析中排除）
+MQTT_CONTROL_COMMANDS = set().union(*(definition.commands for definition in SENSOR_CYCLE_REGISTRY.values()))
 
 
 def get_managed_mq2_devices():
-    seen = set()
-    devices = []
-    for candidate in ["D01"] + MQTT_DEVICES:
-        if not candidate:
-            continue
-        dev = candidate.upper()
-        if dev not in seen:
-            seen.add(dev)
-            devices.append(dev)
-    if not devices:
-        devices = ["D01"]
-    return devices
+    """全部已登记设备的ID（注册表维护的只读快照，第一个为默认设备 D01）"""
+    return device_registry.ids()
 
 
-def ensure_mq2_cycle_started():
-    """
-    确保MQ2供电调度器仅针对需要的设备各启动一次。
-    """
-    global mq2_cycle_tasks, mq2_cycle_wakeups
-    for device in get_managed_mq2_devices():
-        task = mq2_cycle_tasks.get(device)
-        if task and not task.done():
-            continue
-        if device not in mq2_cycle_wakeups:
-            mq2_cycle_wakeups[device] = asyncio.Event()
-        mq2_cycle_tasks[device] = asyncio.create_task(mq2_cycle_manager(device))
+def get_cmd_topic(device_id: Optional[str]) -> str:
+    """设备的命令主题（未登记的设备退回默认设备的命令主题）"""
+    return device_registry.cmd_topic(device_id) or device_registry.cmd_topic(get_managed_mq2_devices()[0])
 
 
-def wake_mq2_cycle(device_id: str):
-    device_id = (device_id or "D01").upper()
-    event = mq2_cycle_wakeups.get(device_id)
-    if event:
-        event.set()
+def on_device_registered(info):
+    """自动登记新设备后：启动该设备的调度任务，写入数据库并广播 device_registered（其他 worker 和页面据此加入该设备；任意线程）"""
+    async def _persist_and_announce():
+        sensor_cycle_engine.on_device_added()
+        await get_db_manager().register_devices([(info.device_id, info.name or None, 1, info.registered_at)])
+        await broadcast_queue.put(json.dumps({
+            "type": "device_registered",
+            "device_id": info.device_id,
+            "name": device_registry.name(info.device_id),
+            "timestamp": time.time()
+        }))
+
+    if main_loop and main_loop.is_running():
+        asyncio.run_coroutine_threadsafe(_persist_and_announce(), main_loop)
 
 
 def transports_ready() -> bool:
@@ -215,69 +300,151 @@ if platform.system() == "Windows":
 main_loop = None
 
 
-# ============ 平台兼容性函数 ============
-async def get_device_address():
-    """
-    扫描并获取可用的蓝牙设备地址
-    支持BT27设备
-    """
-    try:
-        print(f"【BLE】正在扫描设备 BT27...")
-        # 快速扫描（3秒足够发现附近设备）
-        devices = await BleakScanner.discover(timeout=3.0)
-
-        # 遍历扫描到的设备，查找我们支持的设备
-        for device in devices:
-            if device.name in BLE_DEVICES:
-                print(f"【BLE】✓ 找到设备：{device.name} - {device.address}")
-                return device.address, device.name
-
-        # 如果没有通过名称找到，尝试通过MAC地址匹配（适用于某些平台）
-        for device in devices:
-            device_addr_upper = device.address.upper().replace(":", "").replace("-", "")
-            for name, addr in BLE_DEVICES.items():
-                config_addr_upper = addr.upper().replace(":", "").replace("-", "")
-                if device_addr_upper == config_addr_upper:
-                    print(f"【BLE】✓ 通过MAC地址找到设备：{name} - {device.address}")
-                    return device.address, name
-
-        # 如果扫描失败，使用默认的第一个设备地址（Windows直连模式）
-        default_name = list(BLE_DEVICES.keys())[0]
-        default_addr = BLE_DEVICES[default_name]
-        print(f"【BLE】未扫描到设备，尝试直连 {default_name} ({default_addr})")
-        return default_addr, default_name
-
-    except Exception as e:
-        # 出错时使用默认设备
-        default_name = list(BLE_DEVICES.keys())[0]
-        default_addr = BLE_DEVICES[default_name]
-        print(f"【BLE】扫描失败：{e}，尝试直连 {default_name} ({default_addr})")
-        return default_addr, default_name
-
-
 # ============ WebSocket 广播 ============
 connections: Set[WebSocket] = set()
+# 以 /ws?batch=N 连接的客户端：N 毫秒内的事件合并为一帧发送
+ws_batchers: Dict[WebSocket, WebSocketBatcher] = {}
+WS_BATCH_MIN_MS = 50  # 允许的合并窗口范围（毫秒）
+WS_BATCH_MAX_MS = 5000
+# 以 /ws?proto=delta 连接的客户端：读数只发送相对上一帧的量化增量，定期发送完整关键帧
+ws_delta_encoders: Dict[WebSocket, DeltaEncoder] = {}
+# 正在发送首帧（快照、hello、增量精度表）的连接：期间的广播先暂存，首帧发完后按序补发，保证首帧总在最前
+ws_initial_backlog: Dict[WebSocket, List[str]] = {}
+WS_DELTA_KEYFRAME_INTERVAL = 30  # 每台设备最多连续发送的增量帧数
+WS_DELTA_KEYFRAME_SECONDS = 60.0  # 每台设备关键帧的最长间隔（秒）
+# 连接快照：新连接的第一帧即为当前状态（设备在线状态、最新读数、未恢复警告、最后定位、链路状态），
+# 页面无需再逐个请求接口；状态由广播分发任务维护，启动时只查询一次数据库
+LIVE_SNAPSHOT_CACHE_SECONDS = 1.0  # 状态未变化时快照文本的复用时间（秒）
+LIVE_SNAPSHOT_SEED_WARNINGS = 200  # 启动时最多读取的未恢复警告条数
+live_snapshot = LiveSnapshot(
+    get_devices=lambda: build_device_list(),
+    get_links=lambda: {"ble": ble_connected, "mqtt": mqtt_connected},
+    cache_seconds=LIVE_SNAPSHOT_CACHE_SECONDS
+)
+# permessage-deflate 调优（python server.py 启动时生效；uvicorn 命令行启动时使用其默认压缩参数）
+WS_DEFLATE = {
+    "server_max_window_bits": 13,  # 压缩窗口 8KB：覆盖几十条近期推送的重复字段；每连接压缩器约 48KB（默认 2^15 约 256KB）
+    "client_max_window_bits": 13,
+    "level": 6,
+    "mem_level": 5,
+    "min_size": 64,  # 小于 64 字节的帧不压缩
+}
 broadcast_queue: asyncio.Queue = asyncio.Queue()  # 兼容 Python 3.8
+# 广播后端：local=进程内（单 worker）；unix=本机 Unix 套接字发布/订阅（uvicorn --workers N 时使用，
+# 任一 worker 产生的广播推送给所有 worker 的 WebSocket 客户端，并选出唯一的采集主进程）
+EVENT_BUS_BACKEND = BACKEND_LOCAL
+EVENT_BUS_PATH = str(Path(tempfile.gettempdir()) / "sensor_event_bus.sock")
+event_bus = create_event_bus(EVENT_BUS_BACKEND, EVENT_BUS_PATH, get_local_viewers=lambda: len(connections))
+# 是否为采集主进程：MQTT 数据订阅、蓝牙、统计、调度等只在主进程运行（单 worker 时始终为 True）
+ingest_leader = True
 
 # ============ MQTT消息发送控制 ============
 # 创建MQTT消息发送管理器实例（将在lifespan中初始化）
 mqtt_message_sender: Optional[MqttMessageSender] = None
 
+# ============ 命令确认跟踪 ============
+COMMAND_ACK_TIMEOUT = 5.0  # 等待 QoS1 PUBACK 的超时时间（秒）
+COMMAND_MAX_RETRIES = 3  # 批量控制对失败项的最大重试次数
+# 在途命令表：MQTT 按 mid 关联 PUBACK，并统计延迟直方图
+command_tracker = CommandTracker(get_main_loop=lambda: main_loop)
+
 
 async def broadcaster():
-    print("【服务】广播任务已启动。")
+    """把本进程产生的广播发布到事件总线（由总线投递给所有 worker）"""
+    print(f"【服务】广播任务已启动（后端：{event_bus.backend}）。")
     while True:
         msg = await broadcast_queue.get()
+        await event_bus.publish(msg)
+
+
+async def websocket_fanout():
+    """从事件总线取出广播（含其他 worker 发布的），推送给本进程的 WebSocket 客户端"""
+    while True:
+        msg = await event_bus.next_message()
+        size = len(msg.encode("utf-8"))
+        # 每条广播只解析一次：更新连接快照，增量模式的连接复用解析结果
+        try:
+            parsed = json.loads(msg)
+            live_snapshot.observe(parsed)
+            if parsed.get("type") == "device_registered":
+                # 其他 worker 自动登记的设备（本进程已登记时为空操作）；本进程运行调度器时同样为其启动调度任务
+                device_registry.register(parsed.get("device_id"), notify=False)
+                sensor_cycle_engine.on_device_added()
+        except Exception as e:
+            parsed = None
+            print(f"【WS】广播解析失败：{e}")
         待移除 = []
         for ws in list(connections):
+            text = msg
+            encoder = ws_delta_encoders.get(ws)
+            if encoder is not None and parsed is not None:
+                try:
+                    text = encoder.encode(parsed, msg)
+                except Exception as e:
+                    print(f"【WS】增量编码失败，原样发送：{e}")
+            backlog = ws_initial_backlog.get(ws)
+            if backlog is not None:
+                backlog.append(text)
+                continue
+            batcher = ws_batchers.get(ws)
+            if batcher is not None:
+                batcher.add(text)
+                continue
             try:
-                await ws.send_text(msg)
+                await ws.send_text(text)
+                wire_stats.record_send(size if text is msg else len(text.encode("utf-8")))
             except Exception:
                 待移除.append(ws)
         for ws in 待移除:
             connections.discard(ws)
 
 
+async def seed_live_snapshot(db):
+    """启动时从数据库读取每台设备的最新读数和未恢复警告，补全连接快照（只执行一次）"""
+    readings = []
+    for dev_id in get_managed_mq2_devices():
+        rows = await db.get_recent_data(limit=1, device_id=dev_id)
+        readings.extend(reading_from_row(row) for row in rows)
+    rows = await db.get_warning_data(limit=LIVE_SNAPSHOT_SEED_WARNINGS, is_resolved=0)
+    warnings = [warning_from_row(row, WARNING_TYPE_NAMES, WARNING_TYPE_UNITS) for row in rows]
+    live_snapshot.seed(readings, warnings)
+    print(f"【WS】连接快照已初始化：{len(readings)} 台设备的最新读数，{len(warnings)} 条未恢复警告")
+
+
+def publish_device_status(device_id: str, online: bool, last_seen: float):
+    """设备上线/离线时广播 device_status 事件（由 device_liveness 在主事件循环中回调）"""
+    via_list = []
+    if online:
+        if ble_manager.is_connected(device_id):
+            via_list.append("BLE")
+        if mqtt_connected:
+            via_list.append("MQTT")
+    event = {
+        "type": "device_status",
+        "device_id": device_id,
+        "online": online,
+        "via": via_list,
+        "last_seen": last_seen,
+        "timestamp": time.time()
+    }
+    broadcast_queue.put_nowait(json.dumps(event))
+    print(f"【在线状态】设备 {device_id} {'上线' if online else '离线'}")
+
+
+# 设备在线状态：最后消息时间超过 DEVICE_ONLINE_TIMEOUT 即离线，上线/离线变化以 device_status 事件推送
+# （仅采集主进程跟踪，截止时间小根堆判定离线，无需周期扫描）
+device_liveness = LivenessTracker(DEVICE_ONLINE_TIMEOUT, on_change=publish_device_status,
+                                  get_main_loop=lambda: main_loop)
+
+
+def mark_device_seen(device_id: str):
+    """记录设备最后消息时间（任意线程）；采集主进程同时更新在线状态跟踪"""
+    now = time.time()
+    device_last_message_time[device_id] = now
+    if ingest_leader:
+        device_liveness.touch(device_id, now)
+
+
 # ============ 统计（每 5 秒打印一次） ============
 stat_all = 0  # 最近窗口收到的数据总条数
 stat_with_lux = 0  # 其中含亮度字段的条数
@@ -302,22 +469,66 @@ async def stats_task():
 
         if total == 0:
             print(
-                f"【统计】({time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())} 当前连接数：{len(connections)}) 近 5 秒无数据。")
+                f"【统计】({time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())} 当前连接数：{event_bus.viewer_count()}) 近 5 秒无数据。")
         else:
             rps = total / 窗口
             ratio_lux = (with_lux / total) * 100.0
             ratio_smoke = (with_smoke / total) * 100.0
             print(
-                f"【统计】({time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())} 当前连接数：{len(connections)}) 近 5 秒收到 {total} 条，平均 {rps:.2f} 条/秒；亮度字段占比 {ratio_lux:.1f}%（{with_lux}/{total}）；烟雾字段占比 {ratio_smoke:.1f}%（{with_smoke}/{total}）。")
+                f"【统计】({time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())} 当前连接数：{event_bus.viewer_count()}) 近 5 秒收到 {total} 条，平均 {rps:.2f} 条/秒；亮度字段占比 {ratio_lux:.1f}%（{with_lux}/{total}）；烟雾字段占比 {ratio_smoke:.1f}%（{with_smoke}/{total}）。")
 
 
-# ============ BLE 解析 ============
+# ============ 消息解析 ============
 # 数据格式：T=24.61H=45.78L=0.0R=1.01Y=3.4W=26.10P=1014.23
 # T=温度 H=湿度 L=光照 R=Rs_Ro Y=烟雾PPM W=温度2 P=气压
-PATTERN_DATA = re.compile(
-    r"T=([+-]?\d+(?:\.\d+)?)H=([+-]?\d+(?:\.\d+)?)L=([+-]?\d+(?:\.\d+)?)R=([+-]?\d+(?:\.\d+)?)Y=([+-]?\d+(?:\.\d+)?)W=([+-]?\d+(?:\.\d+)?)P=([+-]?\d+(?:\.\d+)?)"
+# MQTT 与 BLE 共用的单次分类解析器（传感器行/二进制帧/警告/恢复/定位/控制回显）
+payload_parser = PayloadParser(MQTT_CONTROL_COMMANDS)
+# 二进制帧携带的设备采样时间与服务器时间相差超过该值（秒）时改用接收时间
+BINARY_TIMESTAMP_MAX_SKEW = 300
+# 带序列号（二进制帧 seq / 文本行 N=）的读数经按设备的滑动窗口去重、检测缺口，并在有界窗口内重排后再入库
+SEQUENCE_WINDOW = 256  # 去重窗口（最近放行的序列号个数）
+SEQUENCE_REORDER_DELAY = 2.0  # 超前读数最长等待缺口补齐的时间（秒）
+SEQUENCE_MAX_PENDING = 64  # 每个设备最多暂存的超前读数
+sequence_tracker = SequenceTracker(window=SEQUENCE_WINDOW, reorder_delay=SEQUENCE_REORDER_DELAY,
+                                   max_pending=SEQUENCE_MAX_PENDING)
+
+# 多进程采集：MQTT 传感器数据的解码、去重和入库交给 N 个工作进程（按主题分片），本进程只负责推送/警告/自动恢复
+INGEST_WORKERS = 0  # 工作进程数，0 表示单进程（默认，所有处理在本进程完成）
+# local：本进程照常订阅，原始消息按主题哈希转发给工作进程；
+# broker：工作进程通过 $share 共享订阅直接从 Broker 接收（需将 Broker 共享订阅策略设为 hash_topic）
+INGEST_SHARDING = SHARDING_LOCAL
+INGEST_SHARE_GROUP = "sensor_ingest"  # 共享订阅组名
+ingest_pool = IngestWorkerPool(
+    worker_count=INGEST_WORKERS,
+    settings={
+        "sharding": INGEST_SHARDING,
+        "topic_prefix": MQTT_TOPIC_PREFIX,
+        "control_commands": sorted(MQTT_CONTROL_COMMANDS),
+        "sequence": {"window": SEQUENCE_WINDOW, "reorder_delay": SEQUENCE_REORDER_DELAY,
+                     "max_pending": SEQUENCE_MAX_PENDING},
+        "max_timestamp_skew": BINARY_TIMESTAMP_MAX_SKEW,
+        "mqtt": {
+            "host": MQTT_BROKER,
+            "port": MQTT_PORT,
+            "username": MQTT_USERNAME,
+            "password": MQTT_PASSWORD,
+            "ca_certs": str(MQTT_CA_CERT_FILE),
+            "share_group": INGEST_SHARE_GROUP,
+        },
+    },
+    on_event=lambda event: handle_ingest_event(event),
+    get_main_loop=lambda: main_loop
 )
-_buffer = bytearray()
+
+
+def resolve_reading_timestamp(parsed: ParsedPayload, device_id: Optional[str] = None) -> Optional[float]:
+    """取二进制帧的设备采样时间，未携带或时钟偏差过大时返回 None（使用接收时间）"""
+    if parsed.timestamp is None:
+        return None
+    if abs(parsed.timestamp - time.time()) > BINARY_TIMESTAMP_MAX_SKEW:
+        print(f"【解析】设备 {device_id} 时间戳偏差过大（{parsed.timestamp:.0f}），改用接收时间")
+        return None
+    return parsed.timestamp
 
 
 def _check_sensor_value_normal(warning_type: str, value: float) -> bool:
@@ -338,84 +549,40 @@ def _check_sensor_value_normal(warning_type: str, value: float) -> bool:
     return threshold['min'] <= value <= threshold['max']
 
 
-def _enqueue_reading(t: float, h: float, lux, smoke=None, rs_ro=None, temp2=None, pressure=None, source=None,
-                     device_id=None):
-    """入队广播，并更新统计计数。"""
-    ts = time.time()
-    lux_value_display = None if lux is None else round(lux, 1)
-    smoke_value = None if smoke is None else round(smoke, 1)
-    pressure_value_display = None if pressure is None else round(pressure, 1)
-    temp2_value_display = None if temp2 is None else round(temp2, 2)
-    rs_ro_value_display = None if rs_ro is None else round(rs_ro, 2)
-    # 数据库存储保留更多小数位
-    lux_value_db = None if lux is None else round(lux, 1)
-    pressure_value_db = None if pressure is None else round(pressure, 2)
-    temp2_value_db = None if temp2 is None else round(temp2, 2)
-    rs_ro_value_db = None if rs_ro is None else round(rs_ro, 2)
-    # 发送给前端的数据（包含大气压、温度2和Rs/Ro）
-    payload = {
-        "type": "reading",
-        "ts": ts,
-        "temp": round(t, 2),
-        "hum": round(h, 2),
-        "lux": lux_value_display,
-        "smoke": smoke_value,
-        "pressure": pressure_value_display,
-        "temp2": temp2_value_display,
-        "rs_ro": rs_ro_value_display,
-        "device_id": device_id,  # 添加设备ID
-    }
-
-    # 更新统计并保存到数据库
-    async def _inc_and_queue():
-        async with stat_lock:
-            globals()["stat_all"] += 1
-            if lux is not None:
-                globals()["stat_with_lux"] += 1
-            if smoke is not None:
-                globals()["stat_with_smoke"] += 1
-        await broadcast_queue.put(json.dumps(payload))
+async def _update_mq2_last_value(db, smoke_value: float, source=None, device_id=None):
+    """记录 MQ2 最近一次读数（状态保持不变）"""
+    try:
+        via_label = source or ("BLE" if ble_connected else ("MQTT" if mqtt_connected else None))
+        await db.set_sensor_state(
+            "MQ2",
+            sensor_state=None,
+            via=via_label,
+            last_value=smoke_value,
+            device_id=(device_id or "D01")
+        )
+    except Exception as e:
+        print(f"【数据库】更新MQ2最近值失败：{e}")
 
-        # 保存到数据库（包括新增的3个参数和设备ID）
-        db = get_db_manager()
-        try:
-            await db.insert_sensor_data(
-                temp=round(t, 2),
-                hum=round(h, 2),
-                lux=lux_value_db,
-                smoke=smoke_value,
-                timestamp=ts,
-                rs_ro=rs_ro_value_db,
-                temp2=temp2_value_db,
-                pressure=pressure_value_db,
-                device_id=device_id  # 添加设备ID
-            )
-        except Exception as e:
-            print(f"【数据库】保存数据失败：{e}")
-        else:
-            if smoke_value is not None:
-                try:
-                    via_label = source or ("BLE" if ble_connected else ("MQTT" if mqtt_connected else None))
-                    await db.set_sensor_state(
-                        "MQ2",
-                        sensor_state=None,
-                        via=via_label,
-                        last_value=smoke_value,
-                        device_id=(device_id or "D01")
-                    )
-                except Exception as e:
-                    print(f"【数据库】更新MQ2最近值失败：{e}")
 
-        # 自动恢复机制：检查是否有未恢复的警告，连续收到N个正常数据包后自动标记为安全
-        try:
-            async with warning_recovery_lock:
-                # 查询所有未恢复的警告类型
-                current_device_id = device_id or "D01"
-                unresolved_types = await db.get_unresolved_warning_types(device_id=current_device_id)
+async def _check_auto_recovery(db, device_id, samples):
+    """
+    自动恢复机制：检查是否有未恢复的警告，连续收到N个正常数据包后自动标记为安全
 
-                if unresolved_types:
+    参数:
+        samples: 按时间顺序排列的读数列表，每项为 (ts, t, h, lux, smoke, pressure)；
+                 批量消息只查询一次未恢复警告，再按顺序逐条计数
+    """
+    try:
+        async with warning_recovery_lock:
+            # 查询所有未恢复的警告类型
+            current_device_id = device_id or "D01"
+            unresolved_types = await db.get_unresolved_warning_types(device_id=current_device_id)
+
+            if unresolved_types:
+                pending_types = list(unresolved_types)
+                for ts, t, h, lux, smoke, pressure in samples:
                     # 对于每个未恢复的警告类型，检查当前数据值是否正常
-                    for warning_type in unresolved_types:
+                    for warning_type in list(pending_types):
                         # 根据警告类型获取对应的传感器值
                         sensor_value = None
                         if warning_type == 'T':
@@ -437,6 +604,7 @@ def _enqueue_reading(t: float, h: float, lux, smoke=None, rs_ro=None, temp2=None
                         is_normal = _check_sensor_value_normal(warning_type, sensor_value)
 
                         counter_key = (current_device_id, warning_type)
+                        type_name = WARNING_TYPE_NAMES.get(warning_type, warning_type)
 
                         if is_normal:
                             # 值在正常范围内，增加计数器
@@ -447,20 +615,11 @@ def _enqueue_reading(t: float, h: float, lux, smoke=None, rs_ro=None, temp2=None
                             # 检查是否达到阈值
                             if warning_recovery_counters[counter_key] >= AUTO_RECOVERY_NORMAL_PACKETS:
                                 # 自动标记为安全
-                                type_names = {
-                                    'T': '温度',
-                                    'H': '湿度',
-                                    'B': '亮度',
-                                    'S': 'PPM',
-                                    'P': '大气压'
-                                }
-                                type_name = type_names.get(warning_type, warning_type)
-
                                 success = await db.resolve_warning(warning_type, device_id=current_device_id)
+                                # 无论成功与否都重置计数器（失败可能是已经被手动恢复了），本批后续读数不再检查该类型
+                                warning_recovery_counters[counter_key] = 0
+                                pending_types.remove(warning_type)
                                 if success:
-                                    # 重置计数器
-                                    warning_recovery_counters[counter_key] = 0
-
                                     # 通过WebSocket推送恢复通知
                                     resolved_notification = {
                                         "type": "warning_resolved",
@@ -473,123 +632,278 @@ def _enqueue_reading(t: float, h: float, lux, smoke=None, rs_ro=None, temp2=None
                                     await broadcast_queue.put(json.dumps(resolved_notification))
                                     print(
                                         f"【自动恢复】✓ {type_name}传感器已自动恢复（连续收到{AUTO_RECOVERY_NORMAL_PACKETS}个正常数据包，当前值：{sensor_value}）")
-                                else:
-                                    # 如果标记失败，可能是已经被手动恢复了，重置计数器
-                                    warning_recovery_counters[counter_key] = 0
                             else:
                                 # 打印进度（可选，避免日志过多）
                                 if warning_recovery_counters[counter_key] == 1:
-                                    type_names = {
-                                        'T': '温度',
-                                        'H': '湿度',
-                                        'B': '亮度',
-                                        'S': 'PPM',
-                                        'P': '大气压'
-                                    }
-                                    type_name = type_names.get(warning_type, warning_type)
                                     print(
                                         f"【自动恢复】开始监控{type_name}传感器恢复状态（需要连续{AUTO_RECOVERY_NORMAL_PACKETS}个正常数据包，当前值：{sensor_value}）")
                         else:
                             # 值不在正常范围内，重置计数器
                             if counter_key in warning_recovery_counters:
-                                type_names = {
-                                    'T': '温度',
-                                    'H': '湿度',
-                                    'B': '亮度',
-                                    'S': 'PPM',
-                                    'P': '大气压'
-                                }
-                                type_name = type_names.get(warning_type, warning_type)
                                 threshold = SENSOR_THRESHOLDS.get(warning_type, {})
                                 print(
                                     f"【自动恢复】{type_name}传感器值异常（当前值：{sensor_value}，正常范围：{threshold.get('min', '?')}-{threshold.get('max', '?')}），重置恢复计数器")
                                 del warning_recovery_counters[counter_key]
 
-                # 清理已经不存在的未恢复警告类型的计数器
-                if unresolved_types:
-                    # 只保留仍然存在的未恢复警告类型的计数器
-                    keys_to_remove = [
-                        k for k in list(warning_recovery_counters.keys())
-                        if k[0] == current_device_id and k[1] not in unresolved_types
-                    ]
-                    for k in keys_to_remove:
-                        del warning_recovery_counters[k]
-        except Exception as e:
-            print(f"【自动恢复】检查失败：{e}")
+            # 清理已经不存在的未恢复警告类型的计数器
+            if unresolved_types:
+                # 只保留仍然存在的未恢复警告类型的计数器
+                keys_to_remove = [
+                    k for k in list(warning_recovery_counters.keys())
+                    if k[0] == current_device_id and k[1] not in unresolved_types
+                ]
+                for k in keys_to_remove:
+                    del warning_recovery_counters[k]
+    except Exception as e:
+        print(f"【自动恢复】检查失败：{e}")
+
 
+def _schedule_ingest(coro):
+    """把入库/广播协程调度到主事件循环（可从 paho / bleak 回调线程调用）"""
     # 检查是否有事件循环
     global main_loop
     if main_loop and main_loop.is_running():
         # 使用 asyncio.run_coroutine_threadsafe 从其他线程调度协程
-        asyncio.run_coroutine_threadsafe(_inc_and_queue(), main_loop)
+        asyncio.run_coroutine_threadsafe(coro, main_loop)
     else:
         # 如果在同一个事件循环中，直接创建任务
         try:
-            asyncio.create_task(_inc_and_queue())
+            asyncio.create_task(coro)
         except RuntimeError:
             # 没有运行中的事件循环，尝试使用全局循环
             if main_loop:
-                asyncio.run_coroutine_threadsafe(_inc_and_queue(), main_loop)
+                asyncio.run_coroutine_threadsafe(coro, main_loop)
+            else:
+                coro.close()
 
 
-def ble_notify_handler(_handle, data: bytearray):
-    global _buffer, device_last_message_time
-    _buffer += data
-    while True:
-        idx = _buffer.find(LINE_END)
-        if idx < 0:
-            break
-        line = _buffer[:idx].decode(errors="ignore").strip()
-        _buffer[:] = _buffer[idx + len(LINE_END):]
-
-        # 更新设备最后消息时间（蓝牙设备对应D01）
-        device_last_message_time["D01"] = time.time()
-
-        # 解析数据格式：T=24.61H=45.78%L=0.0R=1.01Y=3.4W=26.10P=1014.23
-        m = PATTERN_DATA.fullmatch(line)
-        if m:
-            t = float(m.group(1))  # T = 温度
-            h = float(m.group(2))  # H = 湿度
-            l = float(m.group(3))  # L = 光照
-            rs_ro = float(m.group(4))  # R = Rs_Ro
-            ppm = float(m.group(5))  # Y = PPM (烟雾)
-            t2 = float(m.group(6))  # W = 温度2
-            p = float(m.group(7))  # P = 气压
-
-            print(f"【BLE】解析数据 - T:{t}°C H:{h}% L:{l}lux Y:{ppm}ppm | R:{rs_ro} W:{t2}°C P:{p}hpa")
-            # 蓝牙设备对应D01设备（因为蓝牙连接时会屏蔽D01的MQTT数据）
-            _enqueue_reading(t, h, l, ppm, rs_ro, t2, p, source="BLE", device_id="D01")
+def _enqueue_reading(t: float, h: float, lux, smoke=None, rs_ro=None, temp2=None, pressure=None, source=None,
+                     device_id=None, ts: Optional[float] = None, persist: bool = True):
+    """入队广播，并更新统计计数。ts 为设备采样时间（缺省为接收时间）；persist=False 表示已由采集进程入库。"""
+    payload, row = build_reading(t, h, lux, smoke, rs_ro, temp2, pressure, device_id, ts)
+
+    # 更新统计并保存到数据库
+    async def _inc_and_queue():
+        async with stat_lock:
+            globals()["stat_all"] += 1
+            if lux is not None:
+                globals()["stat_with_lux"] += 1
+            if smoke is not None:
+                globals()["stat_with_smoke"] += 1
+        await broadcast_queue.put(json.dumps(payload))
+
+        # 保存到数据库（包括新增的3个参数和设备ID）
+        db = get_db_manager()
+        timestamp, temp, hum, lux_db, smoke_db, rs_ro_db, temp2_db, pressure_db = row
+        try:
+            if persist:
+                await db.insert_sensor_data(
+                    temp=temp,
+                    hum=hum,
+                    lux=lux_db,
+                    smoke=smoke_db,
+                    timestamp=timestamp,
+                    rs_ro=rs_ro_db,
+                    temp2=temp2_db,
+                    pressure=pressure_db,
+                    device_id=device_id  # 添加设备ID
+                )
+        except Exception as e:
+            print(f"【数据库】保存数据失败：{e}")
         else:
-            # 尝试解析警告数据（蓝牙设备对应D01）
-            if parse_warning_data(line, source="BLE", device_id="D01"):
-                # 警告数据已处理
-                pass
-            else:
-                print(f"【BLE】未能解析的数据格式：{line}")
+            if smoke_db is not None:
+                await _update_mq2_last_value(db, smoke_db, source, device_id)
+
+        await _check_auto_recovery(db, device_id, [(timestamp, t, h, lux, smoke, pressure)])
+
+    _schedule_ingest(_inc_and_queue())
+
+
+def _enqueue_readings(readings: list, source=None, device_id=None, persist: bool = True):
+    """
+    批量入队：一条消息携带的多条读数合并为一次统计、一帧广播、一条多行 INSERT
+
+    参数:
+        readings: 按时间顺序排列的读数列表，每项为 (t, h, lux, smoke, rs_ro, temp2, pressure, ts)
+        persist: 是否写入数据库（采集进程已入库时为 False）
+    """
+    if not readings:
+        return
+    built = [build_reading(t, h, lux, smoke, rs_ro, temp2, pressure, device_id, ts)
+             for t, h, lux, smoke, rs_ro, temp2, pressure, ts in readings]
+    frame = {
+        "type": "readings",
+        "device_id": device_id,
+        "items": [payload for payload, _row in built],
+    }
+    rows = [row for _payload, row in built]
+
+    async def _inc_and_queue_batch():
+        async with stat_lock:
+            globals()["stat_all"] += len(readings)
+            globals()["stat_with_lux"] += sum(1 for reading in readings if reading[2] is not None)
+            globals()["stat_with_smoke"] += sum(1 for reading in readings if reading[3] is not None)
+        await broadcast_queue.put(json.dumps(frame))
+
+        db = get_db_manager()
+        if not persist or await db.insert_sensor_data_batch(rows, device_id=device_id):
+            # 只需记录本批最后一个烟雾读数
+            last_smoke = next((row[4] for row in reversed(rows) if row[4] is not None), None)
+            if last_smoke is not None:
+                await _update_mq2_last_value(db, last_smoke, source, device_id)
+
+        await _check_auto_recovery(db, device_id, [
+            (row[0], t, h, lux, smoke, pressure)
+            for row, (t, h, lux, smoke, _rs_ro, _temp2, pressure, _ts) in zip(rows, readings)
+        ])
+
+    _schedule_ingest(_inc_and_queue_batch())
+
+
+def _ingest_sensor_readings(items: list, source=None, device_id=None):
+    """
+    读数入库前的序列号检查：带序列号的读数经 sequence_tracker 去重/重排后按序放行，不带序列号的直接放行
+
+    参数:
+        items: 按到达顺序排列的 (seq, reading, device_ts) 列表，reading 为 (t, h, lux, smoke, rs_ro, temp2, pressure, ts)，
+               seq 为 None 表示设备未携带序列号；device_ts 为帧内原始采样时间（未携带为 None），用于识别设备重启
+    """
+    device_key = device_id or "D01"
+    received_at = time.time()
+    released = []
+    for seq, reading, device_ts in items:
+        if seq is None:
+            released.append(reading)
+            continue
+        if reading[7] is None:
+            # 暂存的读数可能稍后才放行，采样时间按到达时间固定下来
+            reading = reading[:7] + (received_at,)
+        released.extend(sequence_tracker.accept(device_key, seq, reading, now=received_at, device_ts=device_ts))
+    _enqueue_released_readings(released, source, device_id)
+
+
+def _enqueue_released_readings(readings: list, source=None, device_id=None, persist: bool = True):
+    """单条读数走原有入队流程，多条合并为一批"""
+    if len(readings) == 1:
+        t, h, lux, smoke, rs_ro, temp2, pressure, ts = readings[0]
+        _enqueue_reading(t, h, lux, smoke, rs_ro, temp2, pressure, source=source, device_id=device_id, ts=ts,
+                         persist=persist)
+    elif readings:
+        _enqueue_readings(readings, source=source, device_id=device_id, persist=persist)
+
+
+async def sequence_flush_task():
+    """定时放行等待缺口超时的暂存读数（缺口计为丢包）"""
+    while True:
+        await asyncio.sleep(SEQUENCE_REORDER_DELAY / 4)
+        try:
+            for device_id, readings in sequence_tracker.flush_expired().items():
+                print(f"【序列号】设备 {device_id} 缺口等待超时，放行暂存读数 {len(readings)} 条")
+                _enqueue_released_readings(readings, device_id=device_id)
+        except Exception as e:
+            print(f"【序列号】刷新暂存读数失败：{e}")
+
+
+def handle_ingest_event(event: tuple):
+    """处理采集工作进程回传的事件（在主事件循环中调用）"""
+    kind = event[0]
+    if kind == EVENT_READINGS:
+        _worker, device_id, readings, persisted = event[1:]
+        # broker 分片时数据主题不经过本进程，新设备在此登记
+        device_registry.register(device_id)
+        mark_device_seen(device_id)
+        # 工作进程入库失败（或未连上数据库）时由本进程补写
+        _enqueue_released_readings(readings, source="MQTT", device_id=device_id, persist=not persisted)
+    elif kind == EVENT_MESSAGE:
+        # 警告/定位等非读数消息按原逻辑处理
+        _worker, topic, payload = event[1:]
+        process_mqtt_message(topic, payload)
+
+
+def handle_ble_line(device_id: str, line: bytes):
+    """处理蓝牙连接上收到的一行原始数据（由 BleManager 按连接拆行后回调）"""
+    global device_last_message_time
+
+    # 更新设备最后消息时间
+    mark_device_seen(device_id)
+
+    # 解析数据格式：T=24.61H=45.78L=0.0R=1.01Y=3.4W=26.10P=1014.23
+    parsed = payload_parser.classify(line)
+    if parsed.kind == KIND_SENSOR:
+        t, h, l, rs_ro, ppm, t2, p = parsed.values  # 温度/湿度/光照/Rs_Ro/烟雾PPM/温度2/气压
+        if t is None or h is None:
+            print(f"【BLE】二进制帧缺少温湿度，已丢弃 [设备: {device_id}]")
+            return
+
+        print(f"【BLE】解析数据 [设备: {device_id}] - T:{t}°C H:{h}% L:{l}lux Y:{ppm}ppm | R:{rs_ro} W:{t2}°C P:{p}hpa")
+        # 蓝牙连接时会屏蔽该设备的MQTT数据
+        _ingest_sensor_readings([(parsed.seq, (t, h, l, ppm, rs_ro, t2, p, resolve_reading_timestamp(parsed, device_id)),
+                                  parsed.timestamp)],
+                                source="BLE", device_id=device_id)
+    elif handle_parsed_warning(parsed, source="BLE", device_id=device_id):
+        # 警告数据已处理
+        pass
+    else:
+        print(f"【BLE】未能解析的数据格式 [设备: {device_id}]：{parsed.text}")
+
+
+def on_ble_state_change(device_id: str, connected: bool):
+    """蓝牙连接状态变化：同步全局 ble_connected 标志"""
+    global ble_connected
+    ble_connected = ble_manager.any_connected
+    if ingest_pool.active:
+        sync_ingest_ble_devices()
+    if connected:
+        print(f"【BLE】说明：设备 {device_id} 已由蓝牙接管传感器数据，其MQTT传感器数据被忽略")
+    else:
+        print(f"【BLE】✓ 设备 {device_id} 已切换到 MQTT 数据源（MQTT 持续连接中，立即接管）")
+
+
+def sync_ingest_ble_devices():
+    """把蓝牙在线的设备同步给采集工作进程（其 MQTT 读数由工作进程忽略）"""
+    ingest_pool.set_ble_devices(
+        device_id for device_id in set(BLE_DEVICE_IDS.values()) if ble_manager.is_connected(device_id)
+    )
+
+
+# 多设备蓝牙连接管理器（每个 BLE_DEVICES 条目一个并发连接，共用一个常驻扫描器）
+ble_manager = BleManager(
+    devices=BLE_DEVICES,
+    device_ids=BLE_DEVICE_IDS,
+    char_uuid=UART_RXTX_CHAR,
+    on_line=handle_ble_line,
+    on_state_change=on_ble_state_change,
+    line_end=LINE_END
+)
 
 
 # ============ MQTT 处理 ============
 mqtt_client = None
+# 从属 worker 启动的 MQTT 任务（命令通道）；晋升为采集主进程时沿用，不再重复创建 MQTT 客户端
+mqtt_running_task: Optional[asyncio.Task] = None
+
+
+def subscribe_data_topics(client):
+    """订阅所有设备的传感器数据主题（仅采集主进程；多进程采集且由工作进程共享订阅时，本进程不再订阅）"""
+    if not ingest_leader:
+        print("【MQTT】本 worker 不是采集主进程，只订阅命令主题（用于控制回显）")
+    elif ingest_pool.active and ingest_pool.sharding == SHARDING_BROKER:
+        print("【MQTT】传感器数据主题由采集工作进程共享订阅，本进程跳过")
+    else:
+        client.subscribe(device_registry.data_subscription)
+        print(f"【MQTT】✓ 已订阅传感器数据主题：{device_registry.data_subscription}")
 
 
 def mqtt_on_connect(client, userdata, flags, rc):
     """MQTT连接回调"""
-    global mqtt_connected, mqtt_first_message_received
+    global mqtt_connected
     if rc == 0:
         mqtt_connected = True
         print("【MQTT】✓ 成功连接到MQTT服务器")
-        # 重置首次消息标志（连接成功后，下次收到的第一条消息可能是服务器保留的消息）
-        mqtt_first_message_received = {}
-        print("【MQTT】已重置首次消息标志，将屏蔽订阅后的第一条消息（通常是服务器保留的最后一条消息）")
-        # 订阅所有设备的传感器数据主题
-        for topic in MQTT_TOPICS:
-            client.subscribe(topic)
-            print(f"【MQTT】✓ 已订阅传感器数据主题：{topic}")
-        # 订阅所有设备的定位命令主题
-        for topic in MQTT_CMD_TOPICS:
-            client.subscribe(topic)
-            print(f"【MQTT】✓ 已订阅定位命令主题：{topic}")
-        print(f"【MQTT】已订阅 {len(MQTT_TOPICS)} 个设备的传感器数据主题和 {len(MQTT_CMD_TOPICS)} 个定位命令主题")
+        subscribe_data_topics(client)
+        # 订阅所有设备的定位命令主题（通配主题，新设备无需重新订阅）
+        client.subscribe(device_registry.cmd_subscription)
+        print(f"【MQTT】✓ 已订阅定位命令主题：{device_registry.cmd_subscription}（已登记 {len(device_registry)} 台设备）")
     else:
         mqtt_connected = False
         print(f"【MQTT】❌ 连接失败，错误码：{rc}")
@@ -607,113 +921,118 @@ def mqtt_on_disconnect(client, userdata, rc):
 
 def extract_device_id_from_topic(topic: str) -> Optional[str]:
     """
-    从MQTT主题中提取设备ID
+    从MQTT主题中提取设备ID（未登记的设备由采集主进程自动登记）
     例如：stm32/D01/data_now -> D01
           stm32/D02/data_cmd -> D02
     """
+    return device_registry.device_for_topic(topic, auto_register=ingest_leader)
+
+
+def handle_location(location_data: dict, device_id: Optional[str] = None) -> bool:
+    """
+    处理已解析的定位信息（包含 lon/lat 的字典），通过WebSocket推送到前端
+
+    参数:
+        location_data: 定位数据字典
+        device_id: 设备ID（可选）
+    """
     try:
-        parts = topic.split('/')
-        if len(parts) >= 2 and parts[0] == 'stm32':
-            device_id = parts[1].upper()
-            if device_id in MQTT_DEVICES:
-                return device_id
-    except Exception:
-        pass
-    return None
+        lon = float(location_data["lon"])
+        lat = float(location_data["lat"])
+    except (KeyError, TypeError, ValueError) as e:
+        print(f"【定位】定位数据中经纬度无效：{e}")
+        return False
+
+    # 提取其他信息（如果有）
+    utc = location_data.get("utc", "")
+    iccid = location_data.get("iccid", "")
+    imei = location_data.get("imei", "")
+    csq = location_data.get("csq", None)
+    location_type = location_data.get("type", "")
+
+    print(f"【定位】✓ 解析成功 - 经度: {lon}, 纬度: {lat}, 类型: {location_type}")
+    if utc:
+        print(f"【定位】UTC时间: {utc}")
+    if csq is not None:
+        print(f"【定位】信号强度(CSQ): {csq}")
+
+    # 通过WebSocket推送定位信息
+    async def _broadcast_location():
+        try:
+            location_notification = {
+                "type": "location",
+                "lon": lon,
+                "lat": lat,
+                "utc": utc,
+                "iccid": iccid,
+                "imei": imei,
+                "csq": csq,
+                "location_type": location_type,
+                "device_id": device_id,
+                "timestamp": time.time()
+            }
+            await broadcast_queue.put(json.dumps(location_notification))
+            device_info = f" [设备: {device_id}]" if device_id else ""
+            print(f"【定位】✓ 已推送定位信息到前端{device_info}")
+        except Exception as e:
+            print(f"【定位】推送定位信息失败：{e}")
+
+    # 检查是否有事件循环
+    global main_loop
+    if main_loop and main_loop.is_running():
+        asyncio.run_coroutine_threadsafe(_broadcast_location(), main_loop)
+    else:
+        try:
+            asyncio.create_task(_broadcast_location())
+        except RuntimeError:
+            if main_loop:
+                asyncio.run_coroutine_threadsafe(_broadcast_location(), main_loop)
+
+    return True
 
 
 def parse_location_data(payload, device_id: Optional[str] = None):
     """
-    解析定位信息（JSON格式）
+    解析定位信息
     支持的格式：
     - JSON格式：{"utc":"2025-11-04T14:59:53Z","iccid":"898604011025D0227746","type":"LBS","imei":"864865082106973","csq":31,"lon":118.0412,"lat":24.37883}
-    
+    - 旧格式：GPS:lat=39.9042,lon=116.4074,alt=50 / LOC=39.9042,116.4074
+
     参数:
-        payload: 定位数据内容
+        payload: 定位数据内容（str 或 bytes）
         device_id: 设备ID（可选）
     """
     try:
+        if isinstance(payload, (bytes, bytearray, memoryview)):
+            payload = bytes(payload).decode("utf-8", "ignore")
+        payload = payload.strip()
         device_info = f" [设备: {device_id}]" if device_id else ""
         print(f"【定位】收到定位信息{device_info}: {payload}")
 
-        # 尝试解析JSON格式的定位数据
-        try:
-            location_data = json.loads(payload)
-
-            # 检查是否是定位数据（包含lon和lat字段）
-            if "lon" in location_data and "lat" in location_data:
-                lon = float(location_data["lon"])
-                lat = float(location_data["lat"])
-
-                # 提取其他信息（如果有）
-                utc = location_data.get("utc", "")
-                iccid = location_data.get("iccid", "")
-                imei = location_data.get("imei", "")
-                csq = location_data.get("csq", None)
-                location_type = location_data.get("type", "")
-
-                print(f"【定位】✓ 解析成功 - 经度: {lon}, 纬度: {lat}, 类型: {location_type}")
-                if utc:
-                    print(f"【定位】UTC时间: {utc}")
-                if csq is not None:
-                    print(f"【定位】信号强度(CSQ): {csq}")
-
-                # 通过WebSocket推送定位信息
-                async def _broadcast_location():
-                    try:
-                        location_notification = {
-                            "type": "location",
-                            "lon": lon,
-                            "lat": lat,
-                            "utc": utc,
-                            "iccid": iccid,
-                            "imei": imei,
-                            "csq": csq,
-                            "location_type": location_type,
-                            "device_id": device_id,
-                            "timestamp": time.time()
-                        }
-                        await broadcast_queue.put(json.dumps(location_notification))
-                        device_info = f" [设备: {device_id}]" if device_id else ""
-                        print(f"【定位】✓ 已推送定位信息到前端{device_info}")
-                    except Exception as e:
-                        print(f"【定位】推送定位信息失败：{e}")
-
-                # 检查是否有事件循环
-                global main_loop
-                if main_loop and main_loop.is_running():
-                    asyncio.run_coroutine_threadsafe(_broadcast_location(), main_loop)
-                else:
-                    try:
-                        asyncio.create_task(_broadcast_location())
-                    except RuntimeError:
-                        if main_loop:
-                            asyncio.run_coroutine_threadsafe(_broadcast_location(), main_loop)
-
-                return True
-            else:
-                print(f"【定位】JSON数据中缺少lon或lat字段")
-                return False
-
-        except json.JSONDecodeError:
-            # 不是JSON格式，尝试其他格式
-            print(f"【定位】不是JSON格式，尝试其他格式解析")
-            if "GPS:" in payload:
-                # GPS:lat=39.9042,lon=116.4074,alt=50
-                parts = payload[4:].split(',')
-                lat = float(parts[0].split('=')[1])
-                lon = float(parts[1].split('=')[1])
-                print(f"【定位】解析GPS格式 - 经度: {lon}, 纬度: {lat}")
-                return True
-            elif payload.startswith("LOC="):
-                # LOC=39.9042,116.4074
-                coords = payload[4:].split(',')
-                lat, lon = float(coords[0]), float(coords[1])
-                print(f"【定位】解析LOC格式 - 经度: {lon}, 纬度: {lat}")
-                return True
-            else:
-                print(f"【定位】未知格式: {payload}")
-                return False
+        parsed = payload_parser.classify(payload.encode("utf-8"))
+        if parsed.kind == KIND_LOCATION:
+            return handle_location(parsed.location, device_id=device_id)
+        if payload.startswith("{"):
+            print(f"【定位】JSON数据中缺少lon或lat字段")
+            return False
+
+        # 不是JSON格式，尝试其他格式
+        if "GPS:" in payload:
+            # GPS:lat=39.9042,lon=116.4074,alt=50
+            parts = payload[4:].split(',')
+            lat = float(parts[0].split('=')[1])
+            lon = float(parts[1].split('=')[1])
+            print(f"【定位】解析GPS格式 - 经度: {lon}, 纬度: {lat}")
+            return True
+        elif payload.startswith("LOC="):
+            # LOC=39.9042,116.4074
+            coords = payload[4:].split(',')
+            lat, lon = float(coords[0]), float(coords[1])
+            print(f"【定位】解析LOC格式 - 经度: {lon}, 纬度: {lat}")
+            return True
+        else:
+            print(f"【定位】未知格式: {payload}")
+            return False
 
     except Exception as e:
         print(f"【定位】解析失败：{e}")
@@ -722,172 +1041,266 @@ def parse_location_data(payload, device_id: Optional[str] = None):
         return False
 
 
-def parse_warning_data(payload, source="MQTT", device_id: Optional[str] = None):
+WARNING_TYPE_NAMES = {
+    'T': '温度',
+    'H': '湿度',
+    'B': '亮度',
+    'S': 'PPM',
+    'P': '大气压'
+}
+WARNING_TYPE_UNITS = {
+    'T': '°C',
+    'H': '%',
+    'B': 'lux',
+    'S': 'ppm',
+    'P': 'hPa'
+}
+
+# AI 数据摘要：按设备和时间窗从聚合层生成统计摘要，由 /api/ai/context 返回或在聊天代理中注入系统提示
+AI_CONTEXT_DEFAULT_HOURS = 24  # 未指定时间范围时的默认时间窗（小时）
+AI_CONTEXT_BUCKETS = 48  # 目标分桶数（决定聚合粒度）
+ai_context_builder = SensorContextBuilder(
+    get_db_manager=lambda: get_db_manager(),
+    get_devices=lambda: get_managed_mq2_devices(),
+    get_device_name=lambda device_id: device_registry.name(device_id),
+    warning_type_names=WARNING_TYPE_NAMES
+)
+
+# AI 响应缓存：相同模型、相同问题、相同数据窗的重复请求直接返回上次的完整回答（流式回答按 SSE 回放）
+# 默认只缓存低温度（接近确定性）的请求，未指定温度按上游默认 1.0 处理不缓存；分析页的对话温度为 0.7，不参与缓存
+# 请求体带 "cache": true 可显式参与缓存，"cache": false 可显式跳过
+AI_CACHE_TTL = 1800  # 缓存有效期（秒）
+AI_CACHE_MAX_ENTRIES = 200  # 最多缓存的回答数
+AI_CACHE_MAX_BYTES = 32 * 1024 * 1024  # 缓存总字节数上限
+AI_CACHE_MAX_TEMPERATURE = 0.2  # 温度不高于该值的请求才参与缓存
+ai_response_cache = ResponseCache(max_entries=AI_CACHE_MAX_ENTRIES, max_bytes=AI_CACHE_MAX_BYTES, ttl=AI_CACHE_TTL,
+                                  max_temperature=AI_CACHE_MAX_TEMPERATURE)
+
+
+def handle_warning_resolved(warning_type: str, source="MQTT", device_id: Optional[str] = None,
+                            message: str = ""):
     """
-    解析警告数据
-    支持的格式：
-    - 异常数据：DT32.25 (D=危险, T=温度, 32.25=异常值)
-    - 恢复数据：ST (S=安全, T=温度)
-    - 其他类型：H(湿度), B(亮度), S(ppm), P(大气压)
-    
+    处理恢复信号（如 ST）：标记数据库中的警告已恢复并推送通知
+
     参数:
-        payload: 原始消息内容
+        warning_type: 警告类型字母（T/H/B/S/P）
         source: 数据源（MQTT或BLE）
         device_id: 设备ID（可选）
+        message: 原始消息（用于日志）
     """
-    try:
-        payload = payload.strip()
-
-        # 检查是否是警告数据格式
-        # 异常格式：D + 类型字母 + 数值（如：DT32.25, DH45.78, DB1000, DS50.5, DP1014.23）
-        # 恢复格式：S + 类型字母（如：ST, SH, SB, SS, SP）
-
-        if len(payload) >= 2:
-            # 检查是否是恢复数据（S开头）
-            if payload.startswith('S') and len(payload) == 2:
-                warning_type = payload[1].upper()
-                if warning_type in ['T', 'H', 'B', 'S', 'P']:
-                    device_info = f" [设备: {device_id}]" if device_id else ""
-                    print(f"【警告-{source}】收到恢复信号{device_info}：{payload} (类型: {warning_type})")
-
-                    # 异步保存恢复数据并推送通知
-                    async def _save_resolved():
-                        try:
-                            db = get_db_manager()
-                            success = await db.resolve_warning(warning_type, device_id=(device_id or "D01"))
-
-                            if success:
-                                # 重置自动恢复计数器（因为已经手动恢复了）
-                                async with warning_recovery_lock:
-                                    counter_key = ((device_id or "D01"), warning_type)
-                                    if counter_key in warning_recovery_counters:
-                                        del warning_recovery_counters[counter_key]
-                                        print(f"【自动恢复】已重置{warning_type}类型的恢复计数器（收到手动恢复信号）")
-
-                                # 通过WebSocket推送恢复通知
-                                type_names = {
-                                    'T': '温度',
-                                    'H': '湿度',
-                                    'B': '亮度',
-                                    'S': 'PPM',
-                                    'P': '大气压'
-                                }
-                                type_name = type_names.get(warning_type, warning_type)
-
-                                resolved_notification = {
-                                    "type": "warning_resolved",
-                                    "warning_type": warning_type,
-                                    "warning_name": type_name,
-                                    "device_id": device_id or "D01",
-                                    "timestamp": time.time()
-                                }
-                                await broadcast_queue.put(json.dumps(resolved_notification))
-                                device_info = f" [设备: {device_id}]" if device_id else ""
-                                print(f"【警告-{source}】✓ 已推送恢复通知{device_info}")
-                        except Exception as e:
-                            print(f"【警告-{source}】保存恢复数据失败：{e}")
-
-                    # 检查是否有事件循环
-                    global main_loop
-                    if main_loop and main_loop.is_running():
-                        asyncio.run_coroutine_threadsafe(_save_resolved(), main_loop)
-                    else:
-                        try:
-                            asyncio.create_task(_save_resolved())
-                        except RuntimeError:
-                            if main_loop:
-                                asyncio.run_coroutine_threadsafe(_save_resolved(), main_loop)
-                    return True
-
-            # 检查是否是异常数据（D开头，后面跟类型字母和数值）
-            elif payload.startswith('D') and len(payload) > 2:
-                warning_type = payload[1].upper()
-                if warning_type in ['T', 'H', 'B', 'S', 'P']:
-                    # 提取数值部分（从第3个字符开始）
-                    try:
-                        warning_value = float(payload[2:])
-
-                        # 根据类型生成中文描述
-                        type_names = {
-                            'T': '温度',
-                            'H': '湿度',
-                            'B': '亮度',
-                            'S': 'PPM',
-                            'P': '大气压'
-                        }
-                        type_name = type_names.get(warning_type, warning_type)
-                        unit = '°C' if warning_type == 'T' else ('%' if warning_type == 'H' else (
-                            'lux' if warning_type == 'B' else ('ppm' if warning_type == 'S' else 'hPa')))
-
-                        device_info = f" [设备: {device_id}]" if device_id else ""
-                        print(
-                            f"【警告-{source}】⚠️ 检测到异常{device_info}：{type_name}异常，当前值：{warning_value}{unit} (消息: {payload})")
-
-                        # 异步保存警告数据并推送通知
-                        async def _save_warning():
-                            try:
-                                db = get_db_manager()
-                                await db.insert_warning_data(
-                                    warning_type=warning_type,
-                                    warning_message=payload,
-                                    warning_value=warning_value,
-                                    device_id=device_id or "D01"
-                                )
-
-                                # 重置自动恢复计数器（因为出现了新的异常）
-                                async with warning_recovery_lock:
-                                    counter_key = ((device_id or "D01"), warning_type)
-                                    if counter_key in warning_recovery_counters:
-                                        del warning_recovery_counters[counter_key]
-                                        print(f"【自动恢复】已重置{warning_type}类型的恢复计数器（检测到新的异常）")
-
-                                # 通过WebSocket推送警告通知
-                                warning_notification = {
-                                    "type": "warning",
-                                    "warning_type": warning_type,
-                                    "warning_name": type_name,
-                                    "warning_value": warning_value,
-                                    "warning_unit": unit,
-                                    "warning_message": payload,
-                                    "device_id": device_id or "D01",
-                                    "timestamp": time.time()
-                                }
-                                await broadcast_queue.put(json.dumps(warning_notification))
-                            except Exception as e:
-                                print(f"【警告-{source}】保存警告数据失败：{e}")
-
-                        # 检查是否有事件循环
-                        if main_loop and main_loop.is_running():
-                            asyncio.run_coroutine_threadsafe(_save_warning(), main_loop)
-                        else:
-                            try:
-                                asyncio.create_task(_save_warning())
-                            except RuntimeError:
-                                if main_loop:
-                                    asyncio.run_coroutine_threadsafe(_save_warning(), main_loop)
-                        return True
-                    except ValueError:
-                        # 无法解析数值
-                        print(f"【警告-{source}】警告数据格式错误，无法解析数值：{payload}")
-                        return False
+    device_info = f" [设备: {device_id}]" if device_id else ""
+    print(f"【警告-{source}】收到恢复信号{device_info}：{message} (类型: {warning_type})")
 
-        return False
+    # 异步保存恢复数据并推送通知
+    async def _save_resolved():
+        try:
+            db = get_db_manager()
+            success = await db.resolve_warning(warning_type, device_id=(device_id or "D01"))
+
+            if success:
+                # 重置自动恢复计数器（因为已经手动恢复了）
+                async with warning_recovery_lock:
+                    counter_key = ((device_id or "D01"), warning_type)
+                    if counter_key in warning_recovery_counters:
+                        del warning_recovery_counters[counter_key]
+                        print(f"【自动恢复】已重置{warning_type}类型的恢复计数器（收到手动恢复信号）")
+
+                # 通过WebSocket推送恢复通知
+                resolved_notification = {
+                    "type": "warning_resolved",
+                    "warning_type": warning_type,
+                    "warning_name": WARNING_TYPE_NAMES.get(warning_type, warning_type),
+                    "device_id": device_id or "D01",
+                    "timestamp": time.time()
+                }
+                await broadcast_queue.put(json.dumps(resolved_notification))
+                print(f"【警告-{source}】✓ 已推送恢复通知{device_info}")
+        except Exception as e:
+            print(f"【警告-{source}】保存恢复数据失败：{e}")
 
-    except Exception as e:
-        print(f"【警告-{source}】解析警告数据失败：{e}")
-        return False
+    # 检查是否有事件循环
+    global main_loop
+    if main_loop and main_loop.is_running():
+        asyncio.run_coroutine_threadsafe(_save_resolved(), main_loop)
+    else:
+        try:
+            asyncio.create_task(_save_resolved())
+        except RuntimeError:
+            if main_loop:
+                asyncio.run_coroutine_threadsafe(_save_resolved(), main_loop)
+    return True
 
 
-def mqtt_on_message(client, userdata, msg):
-    """
-    MQTT消息回调
-    处理从MQTT接收到的消息（传感器数据、定位信息等）
+def handle_warning_raised(warning_type: str, warning_value: float, message: str, source="MQTT",
+                          device_id: Optional[str] = None):
     """
-    global ble_connected, mqtt_first_message_received, main_loop, device_last_message_time
-
-    try:
-        topic = msg.topic
-        payload = msg.payload.decode('utf-8').strip()
+    处理异常数据（如 DT32.25）：写入警告表并推送通知
+
+    参数:
+        warning_type: 警告类型字母（T/H/B/S/P）
+        warning_value: 异常值
+        message: 原始消息（写入 warning_message）
+        source: 数据源（MQTT或BLE）
+        device_id: 设备ID（可选）
+    """
+    type_name = WARNING_TYPE_NAMES.get(warning_type, warning_type)
+    unit = WARNING_TYPE_UNITS.get(warning_type, '')
+
+    device_info = f" [设备: {device_id}]" if device_id else ""
+    print(
+        f"【警告-{source}】⚠️ 检测到异常{device_info}：{type_name}异常，当前值：{warning_value}{unit} (消息: {message})")
+
+    # 异步保存警告数据并推送通知
+    async def _save_warning():
+        try:
+            db = get_db_manager()
+            await db.insert_warning_data(
+                warning_type=warning_type,
+                warning_message=message,
+                warning_value=warning_value,
+                device_id=device_id or "D01"
+            )
+
+            # 重置自动恢复计数器（因为出现了新的异常）
+            async with warning_recovery_lock:
+                counter_key = ((device_id or "D01"), warning_type)
+                if counter_key in warning_recovery_counters:
+                    del warning_recovery_counters[counter_key]
+                    print(f"【自动恢复】已重置{warning_type}类型的恢复计数器（检测到新的异常）")
+
+            # 通过WebSocket推送警告通知
+            warning_notification = {
+                "type": "warning",
+                "warning_type": warning_type,
+                "warning_name": type_name,
+                "warning_value": warning_value,
+                "warning_unit": unit,
+                "warning_message": message,
+                "device_id": device_id or "D01",
+                "timestamp": time.time()
+            }
+            await broadcast_queue.put(json.dumps(warning_notification))
+        except Exception as e:
+            print(f"【警告-{source}】保存警告数据失败：{e}")
+
+    # 检查是否有事件循环
+    global main_loop
+    if main_loop and main_loop.is_running():
+        asyncio.run_coroutine_threadsafe(_save_warning(), main_loop)
+    else:
+        try:
+            asyncio.create_task(_save_warning())
+        except RuntimeError:
+            if main_loop:
+                asyncio.run_coroutine_threadsafe(_save_warning(), main_loop)
+    return True
+
+
+def handle_parsed_warning(parsed: ParsedPayload, source="MQTT", device_id: Optional[str] = None) -> bool:
+    """处理分类结果中的警告/恢复消息，其他类别返回 False"""
+    if parsed.kind == KIND_RESOLVED:
+        return handle_warning_resolved(parsed.warning_type, source=source, device_id=device_id, message=parsed.text)
+    if parsed.kind == KIND_WARNING:
+        return handle_warning_raised(parsed.warning_type, parsed.warning_value, parsed.text, source=source,
+                                     device_id=device_id)
+    return False
+
+
+def parse_warning_data(payload, source="MQTT", device_id: Optional[str] = None):
+    """
+    解析警告数据
+    支持的格式：
+    - 异常数据：DT32.25 (D=危险, T=温度, 32.25=异常值)
+    - 恢复数据：ST (S=安全, T=温度)
+    - 其他类型：H(湿度), B(亮度), S(ppm), P(大气压)
+    
+    参数:
+        payload: 原始消息内容（str 或 bytes）
+        source: 数据源（MQTT或BLE）
+        device_id: 设备ID（可选）
+    """
+    try:
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        return handle_parsed_warning(payload_parser.classify(payload), source=source, device_id=device_id)
+    except Exception as e:
+        print(f"【警告-{source}】解析警告数据失败：{e}")
+        return False
+
+
+def resolve_batch_timestamps(items, device_id: Optional[str] = None) -> list:
+    """批量消息中各条读数的采样时间（规则见 payload_parser.resolve_sample_times）"""
+    timestamps, skewed = resolve_sample_times(items, BINARY_TIMESTAMP_MAX_SKEW)
+    if skewed is not None:
+        print(f"【解析】设备 {device_id} 批量帧时间戳偏差过大（{skewed:.0f}），改用接收时间推算")
+    return timestamps
+
+
+def handle_mqtt_batch(items, device_id: Optional[str] = None):
+    """
+    处理一条携带多条记录的 MQTT 数据消息
+    传感器读数合并为一批（一次多行入库、一帧广播），警告/定位等其他记录逐条按单条消息处理
+    """
+    device_info = f" [设备: {device_id}]" if device_id else ""
+    # 该设备蓝牙已连接时忽略MQTT传感器数据（蓝牙优先），其他记录照常处理
+    skip_sensor = ble_manager.is_connected(device_id)
+    readings = []
+    dropped = 0
+    others = 0
+    for parsed, ts in zip(items, resolve_batch_timestamps(items, device_id)):
+        kind = parsed.kind
+        if kind == KIND_SENSOR:
+            if skip_sensor:
+                continue
+            t, h, l, rs_ro, ppm, t2, p = parsed.values  # 温度/湿度/光照/Rs_Ro/烟雾PPM/温度2/气压
+            if t is None or h is None:
+                dropped += 1
+                continue
+            readings.append((parsed.seq, (t, h, l, ppm, rs_ro, t2, p, ts), parsed.timestamp))
+        elif handle_parsed_warning(parsed, source="MQTT", device_id=device_id):
+            others += 1
+        elif kind == KIND_LOCATION:
+            others += 1
+            handle_location(parsed.location, device_id=device_id)
+        else:
+            others += 1
+            print(f"【MQTT】批量消息中的记录未处理{device_info}: {parsed.text}")
+
+    print(f"【MQTT】收到批量数据{device_info}：共 {len(items)} 条，读数 {len(readings)} 条"
+          f"{'（蓝牙在线，读数已忽略）' if skip_sensor else ''}，其他 {others} 条"
+          f"{f'，缺少温湿度丢弃 {dropped} 条' if dropped else ''}")
+    _ingest_sensor_readings(readings, source="MQTT", device_id=device_id)
+
+
+def mqtt_on_publish(client, userdata, mid):
+    """MQTT发布确认回调（QoS1 收到 PUBACK 时触发，运行在 paho 网络线程）"""
+    command_tracker.on_publish(mid)
+
+
+def mqtt_on_message(client, userdata, msg):
+    """MQTT消息回调（运行在 paho 网络线程）"""
+    # 多进程采集（本地分片）：数据主题的原始消息不在本进程解码，直接转发给负责该主题的工作进程
+    if ingest_pool.active and ingest_pool.sharding == SHARDING_LOCAL and device_registry.is_data_topic(msg.topic):
+        ingest_pool.dispatch(msg.topic, msg.payload, msg.retain)
+        return
+    process_mqtt_message(msg.topic, msg.payload, msg.retain)
+
+
+def process_mqtt_message(topic: str, payload: bytes, retain: bool = False):
+    """
+    处理从MQTT接收到的消息（传感器数据、定位信息等），消息先经 payload_parser 一次分类
+    """
+    global ble_connected, main_loop, device_last_message_time
+
+    try:
+        _topic_device, topic_kind = device_registry.parse_topic(topic)
+        if topic_kind == TOPIC_DATA:
+            # 数据主题的一条消息可能携带多条记录（换行分隔的文本行或二进制批量帧）
+            items = payload_parser.classify_many(payload)
+        else:
+            items = [payload_parser.classify(payload)]
+        parsed = items[0]
+        kind = parsed.kind
 
         # 从主题中提取设备ID
         device_id = extract_device_id_from_topic(topic)
@@ -895,106 +1308,105 @@ def mqtt_on_message(client, userdata, msg):
 
         # 更新设备最后消息时间
         if device_id:
-            device_last_message_time[device_id] = time.time()
+            mark_device_seen(device_id)
+        elif topic_kind is not None:
+            # 设备主题但未能登记（注册表已满、关闭了自动登记或本 worker 不负责登记）
+            return
 
-        # 屏蔽传感器数据主题的第一条消息（通常是服务器保留的最后一条消息，会导致重复数据）
-        if topic in MQTT_TOPICS and topic not in mqtt_first_message_received:
-            mqtt_first_message_received[topic] = True
-            print(f"【MQTT】⚠️ 屏蔽第一条消息（服务器保留消息）{device_info} - 主题: {topic}, 内容: {payload[:50]}...")
+        # 屏蔽传感器数据主题的保留消息（订阅时服务器重发的最后一条消息，会导致重复数据）
+        # QoS1 重投等其他重复由序列号窗口去重
+        if topic_kind == TOPIC_DATA and retain:
+            print(f"【MQTT】⚠️ 屏蔽保留消息{device_info} - 主题: {topic}, 内容: {parsed.text[:50]}...")
             return
 
         # 根据主题区分处理
-        if topic in MQTT_CMD_TOPICS:
+        if topic_kind == TOPIC_CMD:
             # 定位命令主题，处理定位数据（JSON格式）
             # 忽略查询命令"LBS?"（这是我们发送的命令，不是定位数据）
-            if payload.strip() == "LBS?":
-                print(f"【MQTT-定位】收到定位查询命令（忽略）{device_info}: {payload}")
+            if kind == KIND_QUERY:
+                print(f"【MQTT-定位】收到定位查询命令（忽略）{device_info}: {parsed.text}")
                 return
-            normalized_payload = payload.strip().upper()
-            if normalized_payload in MQTT_CONTROL_COMMANDS:
-                print(f"【MQTT-控制】收到控制指令回显（忽略定位解析）{device_info}: {payload}")
+            if kind == KIND_CONTROL:
+                # 固件不在 data_cmd 上回复，这是本服务（或其他 worker）发布的命令经 Broker 回送，不代表设备已收到
+                print(f"【MQTT-控制】收到控制指令（本服务发布的命令回送，忽略）{device_info}: {parsed.text}")
                 return
-
-            print(f"【MQTT-定位】收到定位数据{device_info} (主题: {topic}): {payload}")
-            if parse_location_data(payload, device_id=device_id):
-                # 定位数据已处理
+            if not ingest_leader:
+                # 定位数据由采集主进程入库并广播，避免多个 worker 重复处理
                 return
+
+            print(f"【MQTT-定位】收到定位数据{device_info} (主题: {topic}): {parsed.text}")
+            if kind == KIND_LOCATION:
+                handled = handle_location(parsed.location, device_id=device_id)
             else:
-                print(f"【MQTT-定位】未能解析定位数据{device_info}: {payload}")
-                return
+                handled = parse_location_data(parsed.text, device_id=device_id)
+            if not handled:
+                print(f"【MQTT-定位】未能解析定位数据{device_info}: {parsed.text}")
+            return
 
         # 传感器数据主题
-        elif topic in MQTT_TOPICS:
-            # 解析传感器数据格式：T=24.61H=45.78%L=0.0R=1.01Y=3.4W=26.10P=1014.23
-            m = PATTERN_DATA.fullmatch(payload)
-            if m:
-                # 传感器数据：仅在蓝牙未连接时使用（避免重复数据）
-                # 注意：多设备模式下，即使蓝牙连接，MQTT的其他设备数据也应该处理
-                # 这里保持原有逻辑：如果蓝牙连接，只忽略MQTT数据（假设蓝牙是D01设备）
-                # 如果需要支持蓝牙多设备，需要进一步修改
-                if ble_connected and device_id == "D01":
-                    # 蓝牙已连接且是D01设备，忽略MQTT传感器数据（蓝牙优先）
+        elif topic_kind == TOPIC_DATA:
+            if len(items) > 1:
+                handle_mqtt_batch(items, device_id=device_id)
+                return
+
+            # 解析传感器数据格式：T=24.61H=45.78L=0.0R=1.01Y=3.4W=26.10P=1014.23
+            if kind == KIND_SENSOR:
+                # 传感器数据：该设备的蓝牙连接在线时忽略（避免重复数据），其他设备始终处理
+                if ble_manager.is_connected(device_id):
+                    # 该设备蓝牙已连接，忽略MQTT传感器数据（蓝牙优先）
                     return
 
-                print(f"【MQTT】收到传感器数据{device_info}: {payload}")
-                t = float(m.group(1))  # T = 温度
-                h = float(m.group(2))  # H = 湿度
-                l = float(m.group(3))  # L = 光照
-                rs_ro = float(m.group(4))  # R = Rs_Ro
-                ppm = float(m.group(5))  # Y = PPM (烟雾)
-                t2 = float(m.group(6))  # W = 温度2
-                p = float(m.group(7))  # P = 气压
+                print(f"【MQTT】收到传感器数据{device_info}: {parsed.text}")
+                t, h, l, rs_ro, ppm, t2, p = parsed.values  # 温度/湿度/光照/Rs_Ro/烟雾PPM/温度2/气压
+                if t is None or h is None:
+                    print(f"【MQTT】二进制帧缺少温湿度，已丢弃{device_info}: {parsed.text}")
+                    return
 
                 print(
                     f"【MQTT】解析传感器数据{device_info} - T:{t}°C H:{h}% L:{l}lux Y:{ppm}ppm | R:{rs_ro} W:{t2}°C P:{p}hpa")
-                _enqueue_reading(t, h, l, ppm, rs_ro, t2, p, source="MQTT", device_id=device_id)
-            else:
-                # 非传感器数据格式（可能是警告数据、定位数据或其他指令）
-                # 无论蓝牙是否连接都处理
-                print(f"【MQTT】收到其他消息{device_info}: {payload}")
+                _ingest_sensor_readings(
+                    [(parsed.seq, (t, h, l, ppm, rs_ro, t2, p, resolve_reading_timestamp(parsed, device_id)),
+                      parsed.timestamp)],
+                    source="MQTT", device_id=device_id)
+                return
 
-                # 检查是否是onmessage或offmessage命令（使用消息发送模块处理）
+            # 非传感器数据格式（可能是警告数据、定位数据或其他指令），无论蓝牙是否连接都处理
+            payload = parsed.text
+            print(f"【MQTT】收到其他消息{device_info}: {payload}")
+
+            if kind == KIND_MESSAGE_TOGGLE:
+                # onmessage或offmessage命令（使用消息发送模块处理）
                 global mqtt_message_sender
-                payload_normalized = payload.strip().lower()
-                if payload_normalized in ["onmessage", "offmessage"]:
-                    print(
-                        f"【MQTT】检测到消息命令: {payload_normalized}, 设备: {device_id}, mqtt_message_sender: {mqtt_message_sender is not None}")
-                    if mqtt_message_sender:
-                        result = mqtt_message_sender.handle_message(device_id, payload)
-                        print(f"【MQTT】handle_message 返回: {result}")
-                        if result:
-                            # 消息已被处理（onmessage或offmessage）
-                            return
-                    else:
-                        print(f"【MQTT】警告：mqtt_message_sender 未初始化")
+                print(
+                    f"【MQTT】检测到消息命令: {parsed.command}, 设备: {device_id}, mqtt_message_sender: {mqtt_message_sender is not None}")
+                if mqtt_message_sender:
+                    result = mqtt_message_sender.handle_message(device_id, payload)
+                    print(f"【MQTT】handle_message 返回: {result}")
+                    if result:
+                        # 消息已被处理（onmessage或offmessage）
+                        return
+                else:
+                    print(f"【MQTT】警告：mqtt_message_sender 未初始化")
+
+            if handle_parsed_warning(parsed, source="MQTT", device_id=device_id):
+                # 警告数据已处理
+                return
 
-                # 首先尝试解析警告数据
-                if parse_warning_data(payload, source="MQTT", device_id=device_id):
-                    # 警告数据已处理
+            if kind == KIND_LOCATION:
+                # 设备可能将JSON格式定位数据发送到传感器数据主题
+                print(f"【MQTT】检测到JSON格式定位数据{device_info}，尝试解析...")
+                if handle_location(parsed.location, device_id=device_id):
                     return
+            elif kind == KIND_LEGACY_LOCATION:
+                # 旧格式定位信息兼容（GPS:/LOC=/POSITION:）
+                parse_location_data(payload, device_id=device_id)
+                return
 
-                # 尝试解析JSON格式的定位数据（设备可能将定位数据发送到传感器数据主题）
-                try:
-                    location_data = json.loads(payload)
-                    if "lon" in location_data and "lat" in location_data:
-                        # 这是JSON格式的定位数据
-                        print(f"【MQTT】检测到JSON格式定位数据{device_info}，尝试解析...")
-                        if parse_location_data(payload, device_id=device_id):
-                            # 定位数据已处理
-                            return
-                except (json.JSONDecodeError, ValueError):
-                    # 不是JSON格式，继续尝试其他格式
-                    pass
-
-                # 尝试解析定位信息（旧格式兼容）
-                if "GPS:" in payload or "LOC=" in payload or "POSITION:" in payload:
-                    parse_location_data(payload, device_id=device_id)
-                else:
-                    # 其他未知格式的消息
-                    print(f"【MQTT】未知消息格式{device_info}，已记录: {payload}")
+            # 其他未知格式的消息
+            print(f"【MQTT】未知消息格式{device_info}，已记录: {payload}")
         else:
             # 未知主题
-            print(f"【MQTT】收到未知主题的消息 (主题: {topic}): {payload}")
+            print(f"【MQTT】收到未知主题的消息 (主题: {topic}): {parsed.text}")
 
     except Exception as e:
         print(f"【MQTT】消息处理错误：{e}")
@@ -1051,7 +1463,7 @@ async def mqtt_task():
                 continue
 
             # 创建MQTT客户端
-            mqtt_client = mqtt.Client(client_id=f"python_sensor_client_{int(time.time())}", protocol=mqtt.MQTTv311)
+            mqtt_client = mqtt.Client(client_id=f"python_sensor_client_{int(time.time())}_{os.getpid()}", protocol=mqtt.MQTTv311)
             mqtt_client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
             mqtt_client.tls_set(
                 ca_certs=str(MQTT_CA_CERT_FILE),
@@ -1061,6 +1473,7 @@ async def mqtt_task():
             mqtt_client.on_connect = mqtt_on_connect
             mqtt_client.on_disconnect = mqtt_on_disconnect
             mqtt_client.on_message = mqtt_on_message
+            mqtt_client.on_publish = mqtt_on_publish
 
             print(f"【MQTT】正在连接到 {MQTT_BROKER}:{MQTT_PORT}...")
             mqtt_connection_attempted = True
@@ -1082,7 +1495,7 @@ async def mqtt_task():
                 continue
 
             print("【MQTT】✓ MQTT连接成功，持续保持连接（零延迟切换就绪）")
-            print(f"【MQTT】说明：MQTT持续订阅所有消息（支持 {len(MQTT_DEVICES)} 个设备：{', '.join(MQTT_DEVICES)}）")
+            print(f"【MQTT】说明：MQTT持续订阅所有设备消息（已登记 {len(device_registry)} 台设备，新设备自动登记）")
             print("【MQTT】  - 传感器数据：蓝牙连接时忽略D01数据，蓝牙断开时立即接管；其他设备数据始终处理")
             print("【MQTT】  - 其他消息（如定位信息）：始终处理")
 
@@ -1110,14 +1523,21 @@ async def mqtt_task():
             await asyncio.sleep(10)
 
 
-async def mqtt_first_ble_fallback_task():
+async def mqtt_first_ble_fallback_task(running_mqtt: Optional[asyncio.Task] = None):
     """
     MQTT优先任务，MQTT掉线自动切BLE，BLE期间定期重试MQTT。
+
+    参数:
+        running_mqtt: 已在运行的 MQTT 任务（从属 worker 晋升时传入），第一轮等待它结束而不是再启动一个
     """
     global mqtt_connected, ble_connected
     while True:
         # 只要MQTT没连接，就优先连MQTT，否则只保活（数据源由MQTT提供）
-        await mqtt_task()
+        if running_mqtt is not None and not running_mqtt.done():
+            await asyncio.shield(running_mqtt)
+        else:
+            await mqtt_task()
+        running_mqtt = None
         print("【主控】MQTT离线，尝试启用BLE备用...")
         await ble_task()  # MQTT掉线后尝试蓝牙
         print("【主控】BLE已退出，10秒后重新尝试MQTT连接...")
@@ -1125,139 +1545,67 @@ async def mqtt_first_ble_fallback_task():
 
 
 async def ble_task():
-    """连接 BLE 并订阅通知，掉线自动重连。支持BT27设备。优先使用的数据源。"""
-    global ble_connected, ble_connection_attempted, mqtt_connected, ble_client
+    """连接所有蓝牙设备并订阅通知，掉线自动重连（由 BleManager 并发维护每个设备的连接）。"""
+    global ble_connection_attempted
 
-    print("【BLE】蓝牙任务启动，优先尝试连接蓝牙设备...")
+    print(f"【BLE】蓝牙任务启动，连接 {len(BLE_DEVICES)} 个蓝牙设备：{', '.join(BLE_DEVICES.keys())}")
 
     # 标记已尝试连接（让MQTT任务知道可以开始等待了）
     ble_connection_attempted = True
 
-    # 尝试连接蓝牙（最多尝试5次，快速重试）
-    max_initial_attempts = 5
-    initial_connected = False
-
-    for attempt in range(1, max_initial_attempts + 1):
-        try:
-            # 扫描并获取可用的设备地址（返回地址和设备名称）
-            device_addr, device_name = await get_device_address()
-            print(f"【BLE】连接尝试 {attempt}/{max_initial_attempts}：{device_name} ({device_addr})")
-
-            async with BleakClient(device_addr, timeout=15.0) as client:
-                if not client.is_connected:
-                    print(f"【BLE】连接失败（尝试 {attempt}/{max_initial_attempts}），立即重试...")
-                    await asyncio.sleep(1)
-                    continue
-
-                print(f"【BLE】✓ 已连接到 {device_name}")
-
-                # 等待连接稳定（Windows蓝牙需要短暂等待）
-                await asyncio.sleep(0.5)
-
-                # 再次验证连接状态
-                if not client.is_connected:
-                    print(f"【BLE】连接已断开，重试中...")
-                    await asyncio.sleep(2)
-                    continue
-
-                # 连接成功，开始订阅
-                print(f"【BLE】准备订阅 FFE1 特征通知...")
-                try:
-                    await client.start_notify(UART_RXTX_CHAR, ble_notify_handler)
-                    print(f"【BLE】✓ 已订阅通知，开始接收 {device_name} 的数据（优先数据源）")
-                    print(f"【BLE】说明：蓝牙已接管传感器数据，MQTT传感器数据被忽略")
-
-                    # 订阅成功，标记连接成功
-                    ble_connected = True
-                    ble_client = client
-                    initial_connected = True
-                except Exception as subscribe_error:
-                    print(f"【BLE】订阅失败: {subscribe_error}")
-                    print(f"【BLE】立即重试...")
-                    await asyncio.sleep(1)
-                    continue
-
-                # 保持连接，直到断开（快速检测：100ms轮询）
-                while client.is_connected:
-                    await asyncio.sleep(0.1)
-
-                # 连接断开
-                ble_connected = False
-                ble_client = None
-                print(f"【BLE】{device_name} 连接断开")
-                print(f"【BLE】✓ 已切换到 MQTT 数据源（MQTT 持续连接中，立即接管）")
-                break
-
-        except Exception as e:
-            print(f"【BLE】连接尝试失败（{attempt}/{max_initial_attempts}）：{e}")
-            if attempt < max_initial_attempts:
-                await asyncio.sleep(1)
-
-    # 如果初次连接失败，使用 MQTT 并持续重试蓝牙
-    if not initial_connected:
-        print("【BLE】⚠️ 初次蓝牙连接失败，MQTT 将接管数据传输")
-        print("【BLE】说明：系统将持续尝试重连蓝牙，一旦连接成功立即切回")
-
-    # 持续尝试重连蓝牙
-    reconnect_interval = 10  # 重连间隔（秒）
-    while True:
-        # 等待一段时间再重试（避免频繁重连）
-        await asyncio.sleep(reconnect_interval)
-
-        try:
-            # 扫描并获取可用的设备地址
-            device_addr, device_name = await get_device_address()
-            print(f"【BLE】尝试重新连接：{device_name} ({device_addr})")
-
-            async with BleakClient(device_addr, timeout=15.0) as client:
-                if not client.is_connected:
-                    print(f"【BLE】重连失败，{reconnect_interval}秒后重试...")
-                    continue
+    await ble_manager.run()
 
-                print(f"【BLE】✓ 重新连接成功：{device_name}")
 
-                # 等待连接稳定
-                await asyncio.sleep(0.5)
-
-                # 验证连接状态
-                if not client.is_connected:
-                    print(f"【BLE】连接已断开，{reconnect_interval}秒后重试...")
-                    continue
-
-                # 开始订阅
-                try:
-                    await client.start_notify(UART_RXTX_CHAR, ble_notify_handler)
-                    print(f"【BLE】✓ 已重新订阅通知，恢复数据接收")
-                    print(f"【BLE】✓ 已切换回蓝牙数据源（MQTT转入待机状态）")
-
-                    # 订阅成功，标记连接成功
-                    ble_connected = True
-                    ble_client = client
-                except Exception as subscribe_error:
-                    print(f"【BLE】订阅失败: {subscribe_error}")
-                    print(f"【BLE】{reconnect_interval}秒后重试...")
-                    continue
-
-                # 保持连接（快速检测：100ms轮询）
-                while client.is_connected:
-                    await asyncio.sleep(0.1)
-
-                # 连接断开
-                ble_connected = False
-                ble_client = None
-                print(f"【BLE】连接再次断开")
-                print(f"【BLE】✓ 已切换到 MQTT 数据源（立即接管）")
+def start_ingest_tasks(promoted: bool = False):
+    """
+    启动采集相关的后台任务（仅采集主进程）
 
-        except Exception as e:
-            print(f"【BLE】重连错误：{e}")
+    参数:
+        promoted: 从属 worker 晋升为主进程时为 True（MQTT 命令通道已在运行，只需补订数据主题，
+                  再按 ble_or_mqtt_first 启动尚未运行的数据源任务）
+    """
+    global ingest_leader
+    ingest_leader = True
+    if INGEST_WORKERS > 0:
+        ingest_pool.start()
+        sync_ingest_ble_devices()
+    if promoted:
+        print("【主控】本 worker 接管传感器采集")
+        if mqtt_client is not None and mqtt_connected:
+            subscribe_data_topics(mqtt_client)
+        if ble_or_mqtt_first == 0:
+            # 蓝牙优先：MQTT 已在待机，只需启动蓝牙
+            asyncio.create_task(ble_task())
+            print("【主控】已设为蓝牙优先，MQTT待机，蓝牙上线立刻切换。")
+        else:
+            # MQTT优先：沿用正在运行的 MQTT 任务，掉线后再由蓝牙接管
+            asyncio.create_task(mqtt_first_ble_fallback_task(mqtt_running_task))
+            print("【主控】已设为MQTT优先，主连MQTT，断线时自动切BLE备用。")
+    elif ble_or_mqtt_first == 0:
+        # 蓝牙优先
+        asyncio.create_task(ble_task())
+        asyncio.create_task(mqtt_task())
+        print("【主控】已设为蓝牙优先，MQTT待机，蓝牙上线立刻切换。")
+    else:
+        # MQTT优先，断线后BLE接管且重试MQTT
+        asyncio.create_task(mqtt_first_ble_fallback_task())
+        print("【主控】已设为MQTT优先，主连MQTT，断线时自动切BLE备用。")
+    asyncio.create_task(stats_task())
+    asyncio.create_task(sequence_flush_task())
+    sensor_cycle_engine.start()
+    if promoted:
+        # 接管前其他 worker 广播过的设备按连接快照记录的时间继续跟踪，使其离线时同样能推送事件
+        for dev_id in get_managed_mq2_devices():
+            last_seen = live_snapshot.last_seen(dev_id)
+            if last_seen and time.time() - last_seen < DEVICE_ONLINE_TIMEOUT:
+                device_liveness.touch(dev_id, last_seen)
+    device_liveness.start()
 
 
 # ============ FastAPI 应用（lifespan，避免弃用警告） ============
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global main_loop, mq2_bootstrap_task, mq2_cycle_tasks, mq2_cycle_wakeups, mqtt_client
-    global bmp180_bootstrap_task, bmp180_cycle_tasks, bmp180_cycle_wakeups
-    global bh1750_bootstrap_task, bh1750_cycle_tasks, bh1750_cycle_wakeups
+    global main_loop, mqtt_client, mqtt_running_task
     global mqtt_message_sender
     print("【服务】应用启动中...")
 
@@ -1270,7 +1618,8 @@ async def lifespan(app: FastAPI):
         get_mqtt_client=lambda: mqtt_client,
         get_mqtt_connected=lambda: mqtt_connected,
         get_connections=lambda: connections,
-        get_cmd_topic_map=lambda: MQTT_CMD_TOPIC_MAP,
+        get_viewer_count=event_bus.viewer_count,
+        get_cmd_topic_map=lambda: device_registry.cmd_topic_map,
         get_main_loop=lambda: main_loop
     )
     print("【服务】MQTT消息发送管理器已初始化")
@@ -1283,78 +1632,58 @@ async def lifespan(app: FastAPI):
         await db.ensure_sensor_state_table()
         await db.ensure_sensor_readings_table()
         await db.ensure_warning_table()
+        await db.ensure_device_registry_table()
+        device_registry.load(await db.get_registered_devices())
+        await db.register_devices([(dev_id, DEVICE_NAMES.get(dev_id), 0, time.time())
+                                   for dev_id in get_managed_mq2_devices()
+                                   if not device_registry.get(dev_id).auto_registered])
+        print(f"【设备注册】已加载 {len(device_registry)} 台设备")
+        await seed_live_snapshot(db)
     else:
         print("【警告】数据库连接失败，数据将不会被持久化")
 
-    # 启动后台任务
+    # 启动事件总线（多 worker 时完成主进程选举）和广播任务
+    global ingest_leader
+    await event_bus.start()
     asyncio.create_task(broadcaster())
-    if ble_or_mqtt_first == 0:
-        # 蓝牙优先
-        asyncio.create_task(ble_task())
-        asyncio.create_task(mqtt_task())
-        print("【主控】已设为蓝牙优先，MQTT待机，蓝牙上线立刻切换。")
+    asyncio.create_task(websocket_fanout())
+    ingest_leader = event_bus.is_leader
+    if ingest_leader:
+        start_ingest_tasks()
     else:
-        # MQTT优先，断线后BLE接管且重试MQTT
-        asyncio.create_task(mqtt_first_ble_fallback_task())
-        print("【主控】已设为MQTT优先，主连MQTT，断线时自动切BLE备用。")
-    asyncio.create_task(stats_task())
-    mq2_bootstrap_task = asyncio.create_task(initialize_mq2_on_startup())
-    bmp180_bootstrap_task = asyncio.create_task(initialize_bmp180_on_startup())
-    bh1750_bootstrap_task = asyncio.create_task(initialize_bh1750_on_startup())
+        # 从属 worker：只提供页面、API 和 WebSocket；MQTT 仅用于下发命令，主进程退出时由本进程接管采集
+        print("【服务】本 worker 为从属进程，传感器采集由主进程负责")
+        event_bus.on_leader = lambda: start_ingest_tasks(promoted=True)
+        mqtt_running_task = asyncio.create_task(mqtt_task())
+
+    ai_prober.start()
+
+    # 静态资源连同压缩变体读入内存；开发模式下轮询文件变化自动重新加载
+    for pipeline in (static_assets, resource_assets):
+        await asyncio.to_thread(pipeline.preload)
+        if STATIC_DEV_MODE:
+            pipeline.start_watcher(STATIC_WATCH_INTERVAL)
 
     print("【服务】应用已启动。")
     yield
     print("【服务】应用正在关闭...")
 
-    for task in list(mq2_cycle_tasks.values()):
-        task.cancel()
-        try:
-            await task
-        except asyncio.CancelledError:
-            pass
-    mq2_cycle_tasks.clear()
-    mq2_cycle_wakeups.clear()
-    if mq2_bootstrap_task:
-        mq2_bootstrap_task.cancel()
-        try:
-            await mq2_bootstrap_task
-        except asyncio.CancelledError:
-            pass
-
-    for task in list(bmp180_cycle_tasks.values()):
-        task.cancel()
-        try:
-            await task
-        except asyncio.CancelledError:
-            pass
-    bmp180_cycle_tasks.clear()
-    bmp180_cycle_wakeups.clear()
-    if bmp180_bootstrap_task:
-        bmp180_bootstrap_task.cancel()
-        try:
-            await bmp180_bootstrap_task
-        except asyncio.CancelledError:
-            pass
-
-    for task in list(bh1750_cycle_tasks.values()):
-        task.cancel()
-        try:
-            await task
-        except asyncio.CancelledError:
-            pass
-    bh1750_cycle_tasks.clear()
-    bh1750_cycle_wakeups.clear()
-    if bh1750_bootstrap_task:
-        bh1750_bootstrap_task.cancel()
-        try:
-            await bh1750_bootstrap_task
-        except asyncio.CancelledError:
-            pass
+    await event_bus.stop()
+    await device_liveness.stop()
+    await sensor_cycle_engine.stop()
+    await ble_manager.stop()
+    await ingest_pool.stop()
 
     # 清理MQTT消息发送管理器
     if mqtt_message_sender:
         await mqtt_message_sender.cleanup()
 
+    # 停止 AI 健康探测并关闭上游连接池
+    await ai_prober.stop()
+    await static_assets.stop_watcher()
+    await resource_assets.stop_watcher()
+    await ai_clients.close()
+
     # 停止MQTT客户端
     if mqtt_client:
         try:
@@ -1371,77 +1700,69 @@ async def lifespan(app: FastAPI):
 
 app = FastAPI(lifespan=lifespan)
 
+# 静态资源管线：.js/.css 输出为内容指纹地址并长期缓存，HTML 外壳带 ETag，均按 Accept-Encoding 发送预压缩版本；
+# 启动时整个目录读入内存，请求时不再读盘
+STATIC_DEV_MODE = False  # 开发模式：轮询 web/、resource/ 文件变化并自动重新加载（生产环境改文件后重启即可）
+STATIC_WATCH_INTERVAL = 1.0  # 开发模式下检查文件变化的间隔（秒）
+static_assets = AssetPipeline(WEB_DIR, url_prefix="/static")
+resource_assets = AssetPipeline(RESOURCE_DIR, url_prefix="/resource", fingerprint_suffixes=())
+
 # 静态资源放在 /static，避免拦截 /ws 或 /
-app.mount("/static", StaticFiles(directory=str(WEB_DIR)), name="static")
+app.mount("/static", AssetStaticFiles(pipeline=static_assets, directory=str(WEB_DIR)), name="static")
 # 将 resource 文件夹挂载到 /resource 路径
-app.mount("/resource", StaticFiles(directory=str(RESOURCE_DIR)), name="resource")
+app.mount("/resource", AssetStaticFiles(pipeline=resource_assets, directory=str(RESOURCE_DIR)), name="resource")
 
 
 # HTML页面
-# 设备总览首页：强制不缓存，防止浏览器看到旧 HTML
+# 页面外壳均为 Cache-Control: no-cache + ETag：浏览器每次重新验证，内容未变时返回 304，
+# 页面内引用的 /static 资源被改写为指纹地址，文件一改地址就变，不会看到旧脚本
+# 设备总览首页
 @app.get("/", tags=["首页-设备总览"])
-async def device_index():
-    if not DEVICE_INDEX_FILE.exists():
-        return Response("未找到 web/devices.html", status_code=404)
-
+async def device_index(request: Request):
     try:
-        content = DEVICE_INDEX_FILE.read_text(encoding="utf-8")
+        return static_assets.html_response(request.headers, DEVICE_INDEX_FILE)
+    except FileNotFoundError:
+        return Response("未找到 web/devices.html", status_code=404)
     except Exception as e:
         print(f"【首页】读取 devices.html 失败：{e}")
         return Response("读取首页失败", status_code=500)
 
-    return Response(
-        content,
-        media_type="text/html",
-        headers={"Cache-Control": "no-store, no-cache, must-revalidate, max-age=0"}
-    )
+
+def inject_amap_key(content: str) -> str:
+    """实时数据页：在返回前注入高德地图 Key"""
+    amap_key = SECRETS.get("AMAP_WEB_KEY", "")
+    if not amap_key:
+        print("【警告】未在密钥文件中配置 AMAP_WEB_KEY，高德地图功能将不可用或受限。")
+    return content.replace("__AMAP_WEB_KEY__", amap_key)
 
 
-# 实时数据页：保持原有逻辑，在返回前注入高德地图 Key
+# 实时数据页
 @app.get("/realtime.html", tags=["实时数据页"])
-async def realtime_index():
-    if not INDEX_FILE.exists():
-        return Response("未找到 web/index.html", status_code=404)
-
+async def realtime_index(request: Request):
     try:
-        content = INDEX_FILE.read_text(encoding="utf-8")
+        return static_assets.html_response(request.headers, INDEX_FILE, transform=inject_amap_key)
+    except FileNotFoundError:
+        return Response("未找到 web/index.html", status_code=404)
     except Exception as e:
         print(f"【实时页】读取 index.html 失败：{e}")
         return Response("读取首页失败", status_code=500)
 
-    amap_key = SECRETS.get("AMAP_WEB_KEY", "")
-    if not amap_key:
-        print("【警告】未在密钥文件中配置 AMAP_WEB_KEY，高德地图功能将不可用或受限。")
-    content = content.replace("__AMAP_WEB_KEY__", amap_key)
-
-    return Response(
-        content,
-        media_type="text/html",
-        headers={"Cache-Control": "no-store, no-cache, must-revalidate, max-age=0"}
-    )
-
 
 # 数据分析页面
 @app.get("/analysis.html", tags=["数据分析页"])
-async def analysis_page():
-    analysis_file = WEB_DIR / "analysis.html"
-    if not analysis_file.exists():
+async def analysis_page(request: Request):
+    try:
+        return static_assets.html_response(request.headers, WEB_DIR / "analysis.html")
+    except FileNotFoundError:
         return Response("未找到 web/analysis.html", status_code=404)
-    return FileResponse(
-        str(analysis_file),
-        headers={"Cache-Control": "no-store, no-cache, must-revalidate, max-age=0"}
-    )
 
 
 @app.get("/easter.html", tags=["彩蛋页"])
-async def easter_page():
-    easter_file = WEB_DIR / "easter.html"
-    if not easter_file.exists():
+async def easter_page(request: Request):
+    try:
+        return static_assets.html_response(request.headers, WEB_DIR / "easter.html")
+    except FileNotFoundError:
         return Response("未找到 web/easter.html", status_code=404)
-    return FileResponse(
-        str(easter_file),
-        headers={"Cache-Control": "no-store, must-revalidate, max-age=0"}
-    )
 
 # 这是给微信验证用的接口
 @app.get("/248a1604fe87bdaa034745d8ed14e74e.txt", tags=["微信验证"], response_class=PlainTextResponse)
@@ -1450,32 +1771,52 @@ async def wechat_verify():
 
 
 # ============ 设备控制（BLE 优先，MQTT 兜底） ============
-async def send_command_ble_or_mqtt(command: str, device_id: str = "D01"):
+async def send_command_ble_or_mqtt(command: str, device_id: str = "D01", wait_ack: bool = False,
+                                   ack_timeout: float = COMMAND_ACK_TIMEOUT):
     """
     发送命令到设备：优先通过BLE写入，失败或未连接则通过MQTT发布。
-    返回字典包含方式、是否成功及附加信息。
+    MQTT 默认只检查 publish 返回码；wait_ack=True 时等待 QoS1 PUBACK（Broker 已收到，不代表设备已收到）后才视为成功，
+    PUBACK 延迟无论是否等待都会计入统计。
+    返回字典包含方式、是否成功、确认延迟及附加信息。
     """
-    global ble_connected, ble_client, mqtt_client, mqtt_connected
+    global mqtt_client, mqtt_connected
     device_id = (device_id or "D01").upper()
 
-    # 优先尝试BLE（仅D01支持BLE）
-    if device_id == "D01" and ble_connected and ble_client is not None:
+    # 优先尝试BLE（仅已配置蓝牙且连接在线的设备）
+    if ble_manager.is_connected(device_id):
         try:
             payload = (command + "\r\n").encode("utf-8")
-            await ble_client.write_gatt_char(UART_RXTX_CHAR, payload, response=True)
-            print(f"【控制】✓ 通过 BLE 发送命令：{command} (设备: {device_id})")
-            return {"success": True, "via": "BLE", "device_id": device_id}
+            started = time.monotonic()
+            await ble_manager.write(device_id, payload, response=True)
+            ack_ms = (time.monotonic() - started) * 1000.0
+            command_tracker.record(device_id, "BLE", "ack", ack_ms)
+            print(f"【控制】✓ 通过 BLE 发送命令：{command} (设备: {device_id}，写响应 {ack_ms:.0f}ms)")
+            return {"success": True, "via": "BLE", "device_id": device_id, "acked": True, "ack_ms": round(ack_ms, 2)}
         except Exception as e:
             print(f"【控制】通过 BLE 发送命令失败：{e}，设备 {device_id} 将回退到MQTT")
 
     # 回退到MQTT
     if mqtt_connected and mqtt_client is not None:
         try:
-            target_topic = MQTT_CMD_TOPIC_MAP.get(device_id, MQTT_CMD_TOPIC)
+            target_topic = get_cmd_topic(device_id)
             result = mqtt_client.publish(target_topic, command, qos=1)
             if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                print(f"【控制】✓ 通过 MQTT 发送命令：{command} -> {target_topic}")
-                return {"success": True, "via": "MQTT", "topic": target_topic, "device_id": device_id}
+                # publish() 返回后立即登记（期间不让出事件循环，PUBACK 结算不会早于登记）
+                pending = command_tracker.track_mqtt(device_id, command.strip().upper(), result.mid)
+                response = {"success": True, "via": "MQTT", "topic": target_topic, "device_id": device_id,
+                            "mid": result.mid}
+                if not wait_ack or pending is None:
+                    print(f"【控制】✓ 通过 MQTT 发送命令：{command} -> {target_topic}")
+                    return response
+
+                outcome = await command_tracker.wait(pending, ack_timeout)
+                response.update(outcome)
+                if not outcome["acked"]:
+                    response.update(success=False, error=f"等待 PUBACK 超时（{ack_timeout:g}秒）")
+                    print(f"【控制】❌ MQTT 命令未确认：{command} -> {target_topic} (mid={result.mid})")
+                else:
+                    print(f"【控制】✓ 通过 MQTT 发送命令：{command} -> {target_topic}（PUBACK {outcome['ack_ms']:.0f}ms）")
+                return response
             else:
                 print(f"【控制】❌ MQTT 发布失败，错误码: {result.rc}")
                 return {"success": False, "via": "MQTT", "error": f"publish rc={result.rc}", "device_id": device_id}
@@ -1496,7 +1837,7 @@ async def wait_for_startup_transport(preferred: str, preferred_timeout: int = 60
     preferred = (preferred or "BLE").upper()
     prefer_ble = preferred == "BLE"
     elapsed = 0
-    print(f"【MQ2初始化】等待{preferred}链路就绪以初始化MQ2...")
+    print(f"【传感器初始化】等待{preferred}链路就绪以初始化传感器...")
 
     while True:
         if prefer_ble and ble_connected:
@@ -1507,759 +1848,39 @@ async def wait_for_startup_transport(preferred: str, preferred_timeout: int = 60
         if preferred_timeout and elapsed >= preferred_timeout:
             fallback = "MQTT" if prefer_ble else "BLE"
             if fallback == "BLE" and ble_connected:
-                print(f"【MQ2初始化】⚠️ {preferred}未在{preferred_timeout}秒内就绪，改用BLE初始化。")
+                print(f"【传感器初始化】⚠️ {preferred}未在{preferred_timeout}秒内就绪，改用BLE初始化。")
                 return "BLE"
             if fallback == "MQTT" and mqtt_connected:
-                print(f"【MQ2初始化】⚠️ {preferred}未在{preferred_timeout}秒内就绪，改用MQTT初始化。")
+                print(f"【传感器初始化】⚠️ {preferred}未在{preferred_timeout}秒内就绪，改用MQTT初始化。")
                 return "MQTT"
 
         if remind_interval and elapsed and elapsed % remind_interval == 0:
-            print(f"【MQ2初始化】仍在等待{preferred}链路（已等待 {elapsed} 秒）...")
+            print(f"【传感器初始化】仍在等待{preferred}链路（已等待 {elapsed} 秒）...")
 
         await asyncio.sleep(1)
         elapsed += 1
 
 
-async def initialize_mq2_on_startup():
-    """
-    等待通信链路就绪后初始化MQ2，将状态交给调度器统一开启。
-    """
-    db = get_db_manager()
-    # 确保 D01 优先，其它设备按配置依次处理
-    ordered_devices = get_managed_mq2_devices()
-
-    for device in ordered_devices:
-        prefer = "BLE" if (device == "D01" and ble_or_mqtt_first == 0) else "MQTT"
-        transport = await wait_for_startup_transport(prefer)
-        if transport:
-            print(f"【MQ2初始化】通信链路 {transport} 已就绪（设备 {device}），交由调度器开启 MQ2。")
-            phase_message = f"等待调度器开启（链路：{transport}）"
-            via_label = transport
-        else:
-            print(f"【MQ2初始化】未等到可用通信链路（设备 {device}），调度器将持续重试。")
-            phase_message = "等待调度器开启（链路未就绪）"
-            via_label = None
-
-        try:
-            await db.set_sensor_state(
-                "MQ2",
-                sensor_state="off",
-                via=via_label,
-                mode=DEFAULT_MQ2_MODE,
-                phase="pending",
-                phase_message=phase_message,
-                phase_until=None,
-                device_id=device
-            )
-        except Exception as e:
-            print(f"【MQ2初始化】记录设备 {device} 状态失败：{e}")
-
-    ensure_mq2_cycle_started()
-
-
-def ensure_bmp180_cycle_started():
-    """确保BMP180供电调度器仅针对需要的设备各启动一次。"""
-    global bmp180_cycle_tasks, bmp180_cycle_wakeups
-    for device in get_managed_mq2_devices():  # 复用MQ2的设备列表
-        task = bmp180_cycle_tasks.get(device)
-        if task and not task.done():
-            continue
-        if device not in bmp180_cycle_wakeups:
-            bmp180_cycle_wakeups[device] = asyncio.Event()
-        bmp180_cycle_tasks[device] = asyncio.create_task(bmp180_cycle_manager(device))
-
-
-def ensure_bh1750_cycle_started():
-    """确保BH1750供电调度器仅针对需要的设备各启动一次。"""
-    global bh1750_cycle_tasks, bh1750_cycle_wakeups
-    for device in get_managed_mq2_devices():  # 复用MQ2的设备列表
-        task = bh1750_cycle_tasks.get(device)
-        if task and not task.done():
-            continue
-        if device not in bh1750_cycle_wakeups:
-            bh1750_cycle_wakeups[device] = asyncio.Event()
-        bh1750_cycle_tasks[device] = asyncio.create_task(bh1750_cycle_manager(device))
-
-
-async def initialize_bmp180_on_startup():
-    """等待通信链路就绪后初始化BMP180，将状态交给调度器统一开启。"""
-    db = get_db_manager()
-    ordered_devices = get_managed_mq2_devices()
-
-    for device in ordered_devices:
-        prefer = "BLE" if (device == "D01" and ble_or_mqtt_first == 0) else "MQTT"
-        transport = await wait_for_startup_transport(prefer)
-        if transport:
-            print(f"【BMP180初始化】通信链路 {transport} 已就绪（设备 {device}），交由调度器开启 BMP180。")
-            phase_message = f"等待调度器开启（链路：{transport}）"
-            via_label = transport
-        else:
-            print(f"【BMP180初始化】未等到可用通信链路（设备 {device}），调度器将持续重试。")
-            phase_message = "等待调度器开启（链路未就绪）"
-            via_label = None
-
-        try:
-            await db.set_sensor_state(
-                "BMP180",
-                sensor_state="off",
-                via=via_label,
-                mode=DEFAULT_BMP180_MODE,
-                phase="pending",
-                phase_message=phase_message,
-                phase_until=None,
-                device_id=device
-            )
-        except Exception as e:
-            print(f"【BMP180初始化】记录设备 {device} 状态失败：{e}")
-
-    ensure_bmp180_cycle_started()
-
-
-async def initialize_bh1750_on_startup():
-    """等待通信链路就绪后初始化BH1750，将状态交给调度器统一开启。"""
-    db = get_db_manager()
-    ordered_devices = get_managed_mq2_devices()
-
-    for device in ordered_devices:
-        prefer = "BLE" if (device == "D01" and ble_or_mqtt_first == 0) else "MQTT"
-        transport = await wait_for_startup_transport(prefer)
-        if transport:
-            print(f"【BH1750初始化】通信链路 {transport} 已就绪（设备 {device}），交由调度器开启 BH1750。")
-            phase_message = f"等待调度器开启（链路：{transport}）"
-            via_label = transport
-        else:
-            print(f"【BH1750初始化】未等到可用通信链路（设备 {device}），调度器将持续重试。")
-            phase_message = "等待调度器开启（链路未就绪）"
-            via_label = None
-
-        try:
-            await db.set_sensor_state(
-                "BH1750",
-                sensor_state="off",
-                via=via_label,
-                mode=DEFAULT_BH1750_MODE,
-                phase="pending",
-                phase_message=phase_message,
-                phase_until=None,
-                device_id=device
-            )
-        except Exception as e:
-            print(f"【BH1750初始化】记录设备 {device} 状态失败：{e}")
-
-    ensure_bh1750_cycle_started()
-
-
-def get_mq2_mode_config(mode_key: str):
-    return MQ2_MODE_CONFIG.get(mode_key, MQ2_MODE_CONFIG[DEFAULT_MQ2_MODE])
-
-
-def get_bmp180_mode_config(mode_key: str):
-    return MQ2_MODE_CONFIG.get(mode_key, MQ2_MODE_CONFIG[DEFAULT_BMP180_MODE])
-
-
-def get_bh1750_mode_config(mode_key: str):
-    return MQ2_MODE_CONFIG.get(mode_key, MQ2_MODE_CONFIG[DEFAULT_BH1750_MODE])
-
-
-async def wait_for_cycle_signal(timeout: float, device_id: str = "D01"):
-    """
-    在循环中等待调度唤醒或超时。
-    """
-    if timeout <= 0:
-        return
-    device_id = (device_id or "D01").upper()
-    event = mq2_cycle_wakeups.setdefault(device_id, asyncio.Event())
-    try:
-        await asyncio.wait_for(event.wait(), timeout=timeout)
-    except asyncio.TimeoutError:
-        pass
-    else:
-        event.clear()
-
-
-async def apply_mq2_phase(db, mode_key: str, target_phase: str, config: dict, duration: Optional[int],
-                          device_id: str = "D01"):
-    """
-    根据目标阶段发送开启/关闭命令，并写入数据库状态。
-    """
-    command = "ONMQ2" if target_phase == "on" else "OFFMQ2"
-    result = await send_command_ble_or_mqtt(command, device_id=device_id)
-    if not result.get("success"):
-        message = f"{'开启' if target_phase == 'on' else '关闭'}失败：{result.get('error', '未知错误')}"
-        await db.set_sensor_state(
-            "MQ2",
-            phase="error",
-            phase_message=message,
-            phase_until=None,
-            device_id=device_id
-        )
-        print(f"【MQ2调度】❌ {message}")
-        return False
-
-    phase_until = time.time() + duration if duration else None
-    status_text = "供电中" if target_phase == "on" else "休眠中"
-    await db.set_sensor_state(
-        "MQ2",
-        sensor_state=target_phase,
-        via=result.get("via"),
-        mode=mode_key,
-        phase=target_phase,
-        phase_message=f"{config['name']} · {status_text}",
-        phase_until=phase_until,
-        next_run_time=phase_until,
-        device_id=device_id
-    )
-    label = "开启" if target_phase == "on" else "关闭"
-    print(
-        f"【MQ2调度】✓ {config['name']} {label}成功，下一次在 {('%.0f秒后' % duration) if duration else '持续运行'} 切换")
-    return True
-
-
-async def mq2_cycle_manager(device_id: str):
-    """
-    简易供电调度器：根据模式在开/关之间循环。
-    """
-    db = get_db_manager()
-    device_id = (device_id or "D01").upper()
-    print(f"【MQ2调度】简单供电调度器已启动（设备 {device_id}）")
-
-    while True:
-        try:
-            record = await db.get_sensor_state("MQ2", device_id=device_id)
-            if not record:
-                await db.set_sensor_state(
-                    "MQ2",
-                    "on",
-                    mode=DEFAULT_MQ2_MODE,
-                    phase="pending",
-                    phase_message="等待调度",
-                    phase_until=None,
-                    device_id=device_id
-                )
-                await asyncio.sleep(2)
-                continue
-
-            mode = record.get("mode") or DEFAULT_MQ2_MODE
-            if mode not in MQ2_MODE_CONFIG:
-                mode = DEFAULT_MQ2_MODE
-                await db.set_sensor_state("MQ2", mode=mode, device_id=device_id)
-
-            config = get_mq2_mode_config(mode)
-            phase = (record.get("phase") or "pending").lower()
-            phase_until = record.get("phase_until")
-            state_device_id = record.get("device_id") or device_id
-
-            if phase == "manual":
-                # 手动关闭期间保持关闭状态
-                await db.set_sensor_state(
-                    "MQ2",
-                    sensor_state="off",
-                    phase="manual",
-                    phase_message=record.get("phase_message") or "手动关闭",
-                    phase_until=None,
-                    next_run_time=None,
-                    device_id=state_device_id
-                )
-                await wait_for_cycle_signal(5, device_id=device_id)
-                continue
-
-            if config.get("always_on"):
-                if phase != "on" or record.get("sensor_state") != "on":
-                    await apply_mq2_phase(db, mode, "on", config, duration=None, device_id=state_device_id)
-                    continue
-                await wait_for_cycle_signal(10, device_id=device_id)
-                continue
-
-            if phase not in ("on", "off") or not phase_until:
-                if await apply_mq2_phase(db, mode, "on", config, config["on_duration"], device_id=state_device_id):
-                    continue
-                await wait_for_cycle_signal(5, device_id=device_id)
-                continue
-
-            now = time.time()
-            if now >= phase_until - 0.2:
-                next_phase = "off" if phase == "on" else "on"
-                duration = config["on_duration"] if next_phase == "on" else config["off_duration"]
-                if await apply_mq2_phase(db, mode, next_phase, config, duration, device_id=state_device_id):
-                    continue
-                await wait_for_cycle_signal(5, device_id=device_id)
-                continue
-
-            sleep_for = max(1, min(5, phase_until - now))
-            await wait_for_cycle_signal(sleep_for, device_id=device_id)
-        except asyncio.CancelledError:
-            break
-        except Exception as e:
-            print(f"【MQ2调度】❌ 调度器错误（设备 {device_id}）：{e}")
-            import traceback
-            traceback.print_exc()
-            await wait_for_cycle_signal(5, device_id=device_id)
-
-    print(f"【MQ2调度】简单供电调度器已停止（设备 {device_id}）")
-
-
-# ============ BMP180 调度器 ============
-async def apply_bmp180_phase(db, mode_key: str, target_phase: str, config: dict, duration: Optional[int],
-                             device_id: str = "D01"):
-    """根据目标阶段发送开启/关闭命令，并写入数据库状态。"""
-    command = "ONBMP180" if target_phase == "on" else "OFFBMP180"
-    result = await send_command_ble_or_mqtt(command, device_id=device_id)
-    if not result.get("success"):
-        message = f"{'开启' if target_phase == 'on' else '关闭'}失败：{result.get('error', '未知错误')}"
-        await db.set_sensor_state(
-            "BMP180",
-            phase="error",
-            phase_message=message,
-            phase_until=None,
-            device_id=device_id
-        )
-        print(f"【BMP180调度】❌ {message}")
-        return False
-
-    phase_until = time.time() + duration if duration else None
-    status_text = "供电中" if target_phase == "on" else "休眠中"
-    await db.set_sensor_state(
-        "BMP180",
-        sensor_state=target_phase,
-        via=result.get("via"),
-        mode=mode_key,
-        phase=target_phase,
-        phase_message=f"{config['name']} · {status_text}",
-        phase_until=phase_until,
-        next_run_time=phase_until,
-        device_id=device_id
-    )
-    label = "开启" if target_phase == "on" else "关闭"
-    print(
-        f"【BMP180调度】✓ {config['name']} {label}成功，下一次在 {('%.0f秒后' % duration) if duration else '持续运行'} 切换")
-    return True
-
-
-async def wait_for_bmp180_cycle_signal(timeout: float, device_id: str = "D01"):
-    """在循环中等待调度唤醒或超时。"""
-    if timeout <= 0:
-        return
-    device_id = (device_id or "D01").upper()
-    event = bmp180_cycle_wakeups.setdefault(device_id, asyncio.Event())
-    try:
-        await asyncio.wait_for(event.wait(), timeout=timeout)
-    except asyncio.TimeoutError:
-        pass
-    else:
-        event.clear()
-
-
-def wake_bmp180_cycle(device_id: str = "D01"):
-    """唤醒BMP180调度器。"""
-    device_id = (device_id or "D01").upper()
-    event = bmp180_cycle_wakeups.get(device_id)
-    if event:
-        event.set()
-
-
-async def bmp180_cycle_manager(device_id: str):
-    """简易供电调度器：根据模式在开/关之间循环。"""
-    db = get_db_manager()
-    device_id = (device_id or "D01").upper()
-    print(f"【BMP180调度】简单供电调度器已启动（设备 {device_id}）")
-
-    while True:
-        try:
-            record = await db.get_sensor_state("BMP180", device_id=device_id)
-            if not record:
-                await db.set_sensor_state(
-                    "BMP180",
-                    "on",
-                    mode=DEFAULT_BMP180_MODE,
-                    phase="pending",
-                    phase_message="等待调度",
-                    phase_until=None,
-                    device_id=device_id
-                )
-                await asyncio.sleep(2)
-                continue
-
-            mode = record.get("mode") or DEFAULT_BMP180_MODE
-            if mode not in MQ2_MODE_CONFIG:
-                mode = DEFAULT_BMP180_MODE
-                await db.set_sensor_state("BMP180", mode=mode, device_id=device_id)
-
-            config = get_bmp180_mode_config(mode)
-            phase = (record.get("phase") or "pending").lower()
-            phase_until = record.get("phase_until")
-            state_device_id = record.get("device_id") or device_id
-
-            if phase == "manual":
-                await db.set_sensor_state(
-                    "BMP180",
-                    sensor_state="off",
-                    phase="manual",
-                    phase_message=record.get("phase_message") or "手动关闭",
-                    phase_until=None,
-                    next_run_time=None,
-                    device_id=state_device_id
-                )
-                await wait_for_bmp180_cycle_signal(5, device_id=device_id)
-                continue
-
-            if config.get("always_on"):
-                if phase != "on" or record.get("sensor_state") != "on":
-                    await apply_bmp180_phase(db, mode, "on", config, duration=None, device_id=state_device_id)
-                    continue
-                await wait_for_bmp180_cycle_signal(10, device_id=device_id)
-                continue
-
-            if phase not in ("on", "off") or not phase_until:
-                if await apply_bmp180_phase(db, mode, "on", config, config["on_duration"], device_id=state_device_id):
-                    continue
-                await wait_for_bmp180_cycle_signal(5, device_id=device_id)
-                continue
-
-            now = time.time()
-            if now >= phase_until - 0.2:
-                next_phase = "off" if phase == "on" else "on"
-                duration = config["on_duration"] if next_phase == "on" else config["off_duration"]
-                if await apply_bmp180_phase(db, mode, next_phase, config, duration, device_id=state_device_id):
-                    continue
-                await wait_for_bmp180_cycle_signal(5, device_id=device_id)
-                continue
-
-            sleep_for = max(1, min(5, phase_until - now))
-            await wait_for_bmp180_cycle_signal(sleep_for, device_id=device_id)
-        except asyncio.CancelledError:
-            break
-        except Exception as e:
-            print(f"【BMP180调度】❌ 调度器错误（设备 {device_id}）：{e}")
-            import traceback
-            traceback.print_exc()
-            await wait_for_bmp180_cycle_signal(5, device_id=device_id)
-
-    print(f"【BMP180调度】简单供电调度器已停止（设备 {device_id}）")
-
-
-# ============ BH1750 调度器 ============
-async def apply_bh1750_phase(db, mode_key: str, target_phase: str, config: dict, duration: Optional[int],
-                             device_id: str = "D01"):
-    """根据目标阶段发送开启/关闭命令，并写入数据库状态。"""
-    command = "ONBH1750" if target_phase == "on" else "OFFBH1750"
-    result = await send_command_ble_or_mqtt(command, device_id=device_id)
-    if not result.get("success"):
-        message = f"{'开启' if target_phase == 'on' else '关闭'}失败：{result.get('error', '未知错误')}"
-        await db.set_sensor_state(
-            "BH1750",
-            phase="error",
-            phase_message=message,
-            phase_until=None,
-            device_id=device_id
-        )
-        print(f"【BH1750调度】❌ {message}")
-        return False
-
-    phase_until = time.time() + duration if duration else None
-    status_text = "供电中" if target_phase == "on" else "休眠中"
-    await db.set_sensor_state(
-        "BH1750",
-        sensor_state=target_phase,
-        via=result.get("via"),
-        mode=mode_key,
-        phase=target_phase,
-        phase_message=f"{config['name']} · {status_text}",
-        phase_until=phase_until,
-        next_run_time=phase_until,
-        device_id=device_id
-    )
-    label = "开启" if target_phase == "on" else "关闭"
-    print(
-        f"【BH1750调度】✓ {config['name']} {label}成功，下一次在 {('%.0f秒后' % duration) if duration else '持续运行'} 切换")
-    return True
-
-
-async def wait_for_bh1750_cycle_signal(timeout: float, device_id: str = "D01"):
-    """在循环中等待调度唤醒或超时。"""
-    if timeout <= 0:
-        return
-    device_id = (device_id or "D01").upper()
-    event = bh1750_cycle_wakeups.setdefault(device_id, asyncio.Event())
-    try:
-        await asyncio.wait_for(event.wait(), timeout=timeout)
-    except asyncio.TimeoutError:
-        pass
-    else:
-        event.clear()
-
-
-def wake_bh1750_cycle(device_id: str = "D01"):
-    """唤醒BH1750调度器。"""
-    device_id = (device_id or "D01").upper()
-    event = bh1750_cycle_wakeups.get(device_id)
-    if event:
-        event.set()
-
-
-async def bh1750_cycle_manager(device_id: str):
-    """简易供电调度器：根据模式在开/关之间循环。"""
-    db = get_db_manager()
-    device_id = (device_id or "D01").upper()
-    print(f"【BH1750调度】简单供电调度器已启动（设备 {device_id}）")
-
-    while True:
-        try:
-            record = await db.get_sensor_state("BH1750", device_id=device_id)
-            if not record:
-                await db.set_sensor_state(
-                    "BH1750",
-                    "on",
-                    mode=DEFAULT_BH1750_MODE,
-                    phase="pending",
-                    phase_message="等待调度",
-                    phase_until=None,
-                    device_id=device_id
-                )
-                await asyncio.sleep(2)
-                continue
-
-            mode = record.get("mode") or DEFAULT_BH1750_MODE
-            if mode not in MQ2_MODE_CONFIG:
-                mode = DEFAULT_BH1750_MODE
-                await db.set_sensor_state("BH1750", mode=mode, device_id=device_id)
-
-            config = get_bh1750_mode_config(mode)
-            phase = (record.get("phase") or "pending").lower()
-            phase_until = record.get("phase_until")
-            state_device_id = record.get("device_id") or device_id
-
-            if phase == "manual":
-                await db.set_sensor_state(
-                    "BH1750",
-                    sensor_state="off",
-                    phase="manual",
-                    phase_message=record.get("phase_message") or "手动关闭",
-                    phase_until=None,
-                    next_run_time=None,
-                    device_id=state_device_id
-                )
-                await wait_for_bh1750_cycle_signal(5, device_id=device_id)
-                continue
-
-            if config.get("always_on"):
-                if phase != "on" or record.get("sensor_state") != "on":
-                    await apply_bh1750_phase(db, mode, "on", config, duration=None, device_id=state_device_id)
-                    continue
-                await wait_for_bh1750_cycle_signal(10, device_id=device_id)
-                continue
-
-            if phase not in ("on", "off") or not phase_until:
-                if await apply_bh1750_phase(db, mode, "on", config, config["on_duration"], device_id=state_device_id):
-                    continue
-                await wait_for_bh1750_cycle_signal(5, device_id=device_id)
-                continue
-
-            now = time.time()
-            if now >= phase_until - 0.2:
-                next_phase = "off" if phase == "on" else "on"
-                duration = config["on_duration"] if next_phase == "on" else config["off_duration"]
-                if await apply_bh1750_phase(db, mode, next_phase, config, duration, device_id=state_device_id):
-                    continue
-                await wait_for_bh1750_cycle_signal(5, device_id=device_id)
-                continue
-
-            sleep_for = max(1, min(5, phase_until - now))
-            await wait_for_bh1750_cycle_signal(sleep_for, device_id=device_id)
-        except asyncio.CancelledError:
-            break
-        except Exception as e:
-            print(f"【BH1750调度】❌ 调度器错误（设备 {device_id}）：{e}")
-            import traceback
-            traceback.print_exc()
-            await wait_for_bh1750_cycle_signal(5, device_id=device_id)
-
-    print(f"【BH1750调度】简单供电调度器已停止（设备 {device_id}）")
-
-
-@app.post("/api/mq2/switch", tags=["设备控制"])
-async def switch_mq2(request: Request):
-    """
-    切换MQ2传感器开关。
-    请求体JSON: {"action":"on"} 或 {"action":"off"}
-    - on  -> 发送 "ONMQ2"
-    - off -> 发送 "OFFMQ2"
-    优先通过BLE发送；若BLE未连接或失败则通过MQTT发送到命令主题。
-    """
-    try:
-        body = await request.json()
-        action = (body.get("action") or "").strip().lower()
-        if action not in ("on", "off"):
-            return {"success": False, "error": "参数错误：action 仅支持 on/off"}
-
-        device_id = (body.get("device_id") or "D01").upper()
-
-        command = "ONMQ2" if action == "on" else "OFFMQ2"
-        result = await send_command_ble_or_mqtt(command, device_id=device_id)
-        db = get_db_manager()
-        state_record = None
-
-        if result.get("success"):
-            try:
-                if action == "off":
-                    await db.set_sensor_state(
-                        "MQ2",
-                        "off",
-                        result.get("via"),
-                        phase="manual",
-                        phase_message="手动关闭",
-                        phase_until=None,
-                        next_run_time=None,
-                        device_id=device_id
-                    )
-                else:
-                    await db.set_sensor_state(
-                        "MQ2",
-                        "on",
-                        result.get("via"),
-                        phase="pending",
-                        phase_message="手动开启，等待调度",
-                        phase_until=None,
-                        device_id=device_id
-                    )
-            except Exception as e:
-                print(f"【控制】保存MQ2状态失败：{e}")
-            finally:
-                state_record = await db.get_sensor_state("MQ2", device_id=device_id)
-            wake_mq2_cycle(device_id)
-            return {
-                "success": True,
-                "action": action,
-                "command": command,
-                "via": result.get("via"),
-                "topic": result.get("topic"),
-                "state": (state_record or {}).get("sensor_state", action),
-                "updated_at": (state_record or {}).get("updated_at"),
-                "last_via": (state_record or {}).get("last_via"),
-                "device_id": device_id
-            }
-        else:
-            state_record = await db.get_sensor_state("MQ2", device_id=device_id)
-            return {
-                "success": False,
-                "action": action,
-                "command": command,
-                "error": result.get("error", "未知错误"),
-                "via": result.get("via"),
-                "state": (state_record or {}).get("sensor_state"),
-                "updated_at": (state_record or {}).get("updated_at"),
-                "last_via": (state_record or {}).get("last_via"),
-                "device_id": device_id
-            }
-    except Exception as e:
-        print(f"【API】切换MQ2失败：{e}")
-        return {"success": False, "error": str(e)}
-
-
-@app.get("/api/mq2/state", tags=["设备控制"])
-async def get_mq2_state(device_id: str = "D01"):
-    """
-    获取MQ2传感器当前的开关状态与模式
-    """
-    try:
-        device_id = (device_id or "D01").upper()
-        db = get_db_manager()
-        record = await db.get_sensor_state("MQ2", device_id=device_id)
-        if record:
-            mode = record.get("mode") or DEFAULT_MQ2_MODE
-            config = get_mq2_mode_config(mode)
-            phase_until = record.get("phase_until")
-            next_switch_in_sec = None
-            if phase_until:
-                next_switch_in_sec = max(0, int(phase_until - time.time()))
-            last_value = record.get("last_value")
-            return {
-                "success": True,
-                "state": record.get("sensor_state", "on"),
-                "mode": mode,
-                "mode_name": config["name"],
-                "mode_icon": config["icon"],
-                "mode_on_sec": config.get("on_duration"),
-                "mode_off_sec": config.get("off_duration"),
-                "phase": record.get("phase"),
-                "phase_message": record.get("phase_message"),
-                "phase_until": phase_until,
-                "next_switch_in_sec": next_switch_in_sec,
-                "last_value": float(last_value) if last_value is not None else None,
-                "updated_at": record.get("updated_at"),
-                "last_via": record.get("last_via"),
-                "device_id": record.get("device_id") or device_id
-            }
-        default_config = get_mq2_mode_config(DEFAULT_MQ2_MODE)
-        return {
-            "success": True,
-            "state": "on",
-            "mode": DEFAULT_MQ2_MODE,
-            "mode_name": default_config["name"],
-            "mode_icon": default_config["icon"],
-            "mode_on_sec": default_config.get("on_duration"),
-            "mode_off_sec": default_config.get("off_duration"),
-            "phase": "on",
-            "phase_message": "默认模式运行中",
-            "phase_until": None,
-            "next_switch_in_sec": None,
-            "last_value": None,
-            "updated_at": None,
-            "last_via": None,
-            "device_id": device_id
-        }
-    except Exception as e:
-        print(f"【API】获取MQ2状态失败：{e}")
-        import traceback
-        traceback.print_exc()
-        return {"success": False, "error": str(e)}
-
-
-@app.post("/api/mq2/mode", tags=["设备控制"])
-async def set_mq2_mode(request: Request):
-    """
-    设置MQ2运行模式：eco/balance/safe/always
-    """
-    try:
-        body = await request.json()
-        mode = (body.get("mode") or "").strip().lower()
-        if mode not in MQ2_MODE_CONFIG:
-            return {
-                "success": False,
-                "error": f"无效的模式：{mode}，可选：{', '.join(MQ2_MODE_CONFIG.keys())}"
-            }
-        device_id = (body.get("device_id") or "D01").upper()
-        db = get_db_manager()
-        await db.set_sensor_state(
-            "MQ2",
-            sensor_state=None,
-            mode=mode,
-            phase="pending",
-            phase_message="模式切换中",
-            phase_until=None,
-            device_id=device_id
-        )
-        wake_mq2_cycle(device_id)
-        config = get_mq2_mode_config(mode)
-        return {
-            "success": True,
-            "mode": mode,
-            "mode_name": config["name"],
-            "mode_icon": config["icon"],
-            "mode_on_sec": config.get("on_duration"),
-            "mode_off_sec": config.get("off_duration"),
-            "device_id": device_id
-        }
-    except Exception as e:
-        print(f"【API】设置MQ2模式失败：{e}")
-        import traceback
-        traceback.print_exc()
-        return {"success": False, "error": str(e)}
+# ============ 传感器供电调度（注册表驱动） ============
+sensor_cycle_engine = SensorCycleEngine(
+    definitions=SENSOR_CYCLE_REGISTRY,
+    get_db=get_db_manager,
+    send_command=send_command_ble_or_mqtt,
+    get_devices=get_managed_mq2_devices,
+    wait_for_transport=wait_for_startup_transport,
+    get_preferred_transport=lambda device: "BLE" if (ble_manager.has_device(device) and ble_or_mqtt_first == 0) else "MQTT"
+)
 
 
-# ============ BMP180 API ============
-@app.post("/api/bmp180/switch", tags=["设备控制"])
-async def switch_bmp180(request: Request):
-    """切换BMP180传感器开关。"""
+async def switch_cycle_sensor(definition: SensorDefinition, request: Request):
+    """
+    切换调度传感器开关。
+    请求体JSON: {"action":"on"} 或 {"action":"off"}
+    - on  -> 发送开启命令（如 "ONMQ2"）
+    - off -> 发送关闭命令（如 "OFFMQ2"）
+    优先通过BLE发送；若BLE未连接或失败则通过MQTT发送到命令主题。
+    """
+    sensor_name = definition.name
     try:
         body = await request.json()
         action = (body.get("action") or "").strip().lower()
@@ -2267,7 +1888,8 @@ async def switch_bmp180(request: Request):
             return {"success": False, "error": "参数错误：action 仅支持 on/off"}
 
         device_id = (body.get("device_id") or "D01").upper()
-        command = "ONBMP180" if action == "on" else "OFFBMP180"
+
+        command = definition.command_for(action)
         result = await send_command_ble_or_mqtt(command, device_id=device_id)
         db = get_db_manager()
         state_record = None
@@ -2276,7 +1898,7 @@ async def switch_bmp180(request: Request):
             try:
                 if action == "off":
                     await db.set_sensor_state(
-                        "BMP180",
+                        sensor_name,
                         "off",
                         result.get("via"),
                         phase="manual",
@@ -2287,7 +1909,7 @@ async def switch_bmp180(request: Request):
                     )
                 else:
                     await db.set_sensor_state(
-                        "BMP180",
+                        sensor_name,
                         "on",
                         result.get("via"),
                         phase="pending",
@@ -2296,10 +1918,10 @@ async def switch_bmp180(request: Request):
                         device_id=device_id
                     )
             except Exception as e:
-                print(f"【控制】保存BMP180状态失败：{e}")
+                print(f"【控制】保存{definition.label}状态失败：{e}")
             finally:
-                state_record = await db.get_sensor_state("BMP180", device_id=device_id)
-            wake_bmp180_cycle(device_id)
+                state_record = await db.get_sensor_state(sensor_name, device_id=device_id)
+            sensor_cycle_engine.wake(device_id)
             return {
                 "success": True,
                 "action": action,
@@ -2312,7 +1934,7 @@ async def switch_bmp180(request: Request):
                 "device_id": device_id
             }
         else:
-            state_record = await db.get_sensor_state("BMP180", device_id=device_id)
+            state_record = await db.get_sensor_state(sensor_name, device_id=device_id)
             return {
                 "success": False,
                 "action": action,
@@ -2325,20 +1947,21 @@ async def switch_bmp180(request: Request):
                 "device_id": device_id
             }
     except Exception as e:
-        print(f"【API】切换BMP180失败：{e}")
+        print(f"【API】切换{definition.label}失败：{e}")
         return {"success": False, "error": str(e)}
 
 
-@app.get("/api/bmp180/state", tags=["设备控制"])
-async def get_bmp180_state(device_id: str = "D01"):
-    """获取BMP180传感器当前的开关状态与模式"""
+async def get_cycle_sensor_state(definition: SensorDefinition, device_id: str = "D01"):
+    """
+    获取调度传感器当前的开关状态与模式
+    """
     try:
         device_id = (device_id or "D01").upper()
         db = get_db_manager()
-        record = await db.get_sensor_state("BMP180", device_id=device_id)
+        record = await db.get_sensor_state(definition.name, device_id=device_id)
         if record:
-            mode = record.get("mode") or DEFAULT_BMP180_MODE
-            config = get_bmp180_mode_config(mode)
+            mode = record.get("mode") or definition.default_mode
+            config = definition.get_mode_config(mode)
             phase_until = record.get("phase_until")
             next_switch_in_sec = None
             if phase_until:
@@ -2361,11 +1984,11 @@ async def get_bmp180_state(device_id: str = "D01"):
                 "last_via": record.get("last_via"),
                 "device_id": record.get("device_id") or device_id
             }
-        default_config = get_bmp180_mode_config(DEFAULT_BMP180_MODE)
+        default_config = definition.get_mode_config(definition.default_mode)
         return {
             "success": True,
             "state": "on",
-            "mode": DEFAULT_BMP180_MODE,
+            "mode": definition.default_mode,
             "mode_name": default_config["name"],
             "mode_icon": default_config["icon"],
             "mode_on_sec": default_config.get("on_duration"),
@@ -2380,27 +2003,28 @@ async def get_bmp180_state(device_id: str = "D01"):
             "device_id": device_id
         }
     except Exception as e:
-        print(f"【API】获取BMP180状态失败：{e}")
+        print(f"【API】获取{definition.label}状态失败：{e}")
         import traceback
         traceback.print_exc()
         return {"success": False, "error": str(e)}
 
 
-@app.post("/api/bmp180/mode", tags=["设备控制"])
-async def set_bmp180_mode(request: Request):
-    """设置BMP180运行模式：eco/balance/safe/always/dev"""
+async def set_cycle_sensor_mode(definition: SensorDefinition, request: Request):
+    """
+    设置调度传感器运行模式：eco/balance/safe/always/dev
+    """
     try:
         body = await request.json()
         mode = (body.get("mode") or "").strip().lower()
-        if mode not in MQ2_MODE_CONFIG:
+        if mode not in definition.mode_config:
             return {
                 "success": False,
-                "error": f"无效的模式：{mode}，可选：{', '.join(MQ2_MODE_CONFIG.keys())}"
+                "error": f"无效的模式：{mode}，可选：{', '.join(definition.mode_config.keys())}"
             }
         device_id = (body.get("device_id") or "D01").upper()
         db = get_db_manager()
         await db.set_sensor_state(
-            "BMP180",
+            definition.name,
             sensor_state=None,
             mode=mode,
             phase="pending",
@@ -2408,8 +2032,8 @@ async def set_bmp180_mode(request: Request):
             phase_until=None,
             device_id=device_id
         )
-        wake_bmp180_cycle(device_id)
-        config = get_bmp180_mode_config(mode)
+        sensor_cycle_engine.wake(device_id)
+        config = definition.get_mode_config(mode)
         return {
             "success": True,
             "mode": mode,
@@ -2420,182 +2044,210 @@ async def set_bmp180_mode(request: Request):
             "device_id": device_id
         }
     except Exception as e:
-        print(f"【API】设置BMP180模式失败：{e}")
+        print(f"【API】设置{definition.label}模式失败：{e}")
         import traceback
         traceback.print_exc()
         return {"success": False, "error": str(e)}
 
 
-# ============ BH1750 API ============
-@app.post("/api/bh1750/switch", tags=["设备控制"])
-async def switch_bh1750(request: Request):
-    """切换BH1750传感器开关。"""
-    try:
-        body = await request.json()
-        action = (body.get("action") or "").strip().lower()
-        if action not in ("on", "off"):
-            return {"success": False, "error": "参数错误：action 仅支持 on/off"}
+def register_cycle_sensor_routes(definition: SensorDefinition):
+    """为注册表中的传感器注册 /api/{slug}/switch|state|mode 三个接口"""
+    slug = definition.slug
 
-        device_id = (body.get("device_id") or "D01").upper()
-        command = "ONBH1750" if action == "on" else "OFFBH1750"
-        result = await send_command_ble_or_mqtt(command, device_id=device_id)
-        db = get_db_manager()
-        state_record = None
+    async def switch(request: Request):
+        return await switch_cycle_sensor(definition, request)
 
-        if result.get("success"):
-            try:
-                if action == "off":
-                    await db.set_sensor_state(
-                        "BH1750",
-                        "off",
-                        result.get("via"),
-                        phase="manual",
-                        phase_message="手动关闭",
-                        phase_until=None,
-                        next_run_time=None,
-                        device_id=device_id
-                    )
-                else:
-                    await db.set_sensor_state(
-                        "BH1750",
-                        "on",
-                        result.get("via"),
-                        phase="pending",
-                        phase_message="手动开启，等待调度",
-                        phase_until=None,
-                        device_id=device_id
-                    )
-            except Exception as e:
-                print(f"【控制】保存BH1750状态失败：{e}")
-            finally:
-                state_record = await db.get_sensor_state("BH1750", device_id=device_id)
-            wake_bh1750_cycle(device_id)
-            return {
-                "success": True,
-                "action": action,
-                "command": command,
-                "via": result.get("via"),
-                "topic": result.get("topic"),
-                "state": (state_record or {}).get("sensor_state", action),
-                "updated_at": (state_record or {}).get("updated_at"),
-                "last_via": (state_record or {}).get("last_via"),
-                "device_id": device_id
-            }
-        else:
-            state_record = await db.get_sensor_state("BH1750", device_id=device_id)
-            return {
-                "success": False,
-                "action": action,
-                "command": command,
-                "error": result.get("error", "未知错误"),
-                "via": result.get("via"),
-                "state": (state_record or {}).get("sensor_state"),
-                "updated_at": (state_record or {}).get("updated_at"),
-                "last_via": (state_record or {}).get("last_via"),
-                "device_id": device_id
-            }
-    except Exception as e:
-        print(f"【API】切换BH1750失败：{e}")
-        return {"success": False, "error": str(e)}
+    async def state(device_id: str = "D01"):
+        return await get_cycle_sensor_state(definition, device_id)
 
+    async def mode(request: Request):
+        return await set_cycle_sensor_mode(definition, request)
+
+    app.add_api_route(f"/api/{slug}/switch", switch, methods=["POST"], tags=["设备控制"],
+                      name=f"switch_{slug}", summary=f"切换{definition.label}传感器开关")
+    app.add_api_route(f"/api/{slug}/state", state, methods=["GET"], tags=["设备控制"],
+                      name=f"get_{slug}_state", summary=f"获取{definition.label}传感器当前的开关状态与模式")
+    app.add_api_route(f"/api/{slug}/mode", mode, methods=["POST"], tags=["设备控制"],
+                      name=f"set_{slug}_mode", summary=f"设置{definition.label}运行模式")
 
-@app.get("/api/bh1750/state", tags=["设备控制"])
-async def get_bh1750_state(device_id: str = "D01"):
-    """获取BH1750传感器当前的开关状态与模式"""
-    try:
-        device_id = (device_id or "D01").upper()
-        db = get_db_manager()
-        record = await db.get_sensor_state("BH1750", device_id=device_id)
-        if record:
-            mode = record.get("mode") or DEFAULT_BH1750_MODE
-            config = get_bh1750_mode_config(mode)
-            phase_until = record.get("phase_until")
-            next_switch_in_sec = None
-            if phase_until:
-                next_switch_in_sec = max(0, int(phase_until - time.time()))
-            last_value = record.get("last_value")
-            return {
-                "success": True,
-                "state": record.get("sensor_state", "on"),
-                "mode": mode,
-                "mode_name": config["name"],
-                "mode_icon": config["icon"],
-                "mode_on_sec": config.get("on_duration"),
-                "mode_off_sec": config.get("off_duration"),
-                "phase": record.get("phase"),
-                "phase_message": record.get("phase_message"),
-                "phase_until": phase_until,
-                "next_switch_in_sec": next_switch_in_sec,
-                "last_value": float(last_value) if last_value is not None else None,
-                "updated_at": record.get("updated_at"),
-                "last_via": record.get("last_via"),
-                "device_id": record.get("device_id") or device_id
-            }
-        default_config = get_bh1750_mode_config(DEFAULT_BH1750_MODE)
-        return {
-            "success": True,
-            "state": "on",
-            "mode": DEFAULT_BH1750_MODE,
-            "mode_name": default_config["name"],
-            "mode_icon": default_config["icon"],
-            "mode_on_sec": default_config.get("on_duration"),
-            "mode_off_sec": default_config.get("off_duration"),
-            "phase": "on",
-            "phase_message": "默认模式运行中",
-            "phase_until": None,
-            "next_switch_in_sec": None,
-            "last_value": None,
-            "updated_at": None,
-            "last_via": None,
-            "device_id": device_id
-        }
-    except Exception as e:
-        print(f"【API】获取BH1750状态失败：{e}")
-        import traceback
-        traceback.print_exc()
-        return {"success": False, "error": str(e)}
 
+for _definition in SENSOR_CYCLE_REGISTRY.values():
+    register_cycle_sensor_routes(_definition)
 
-@app.post("/api/bh1750/mode", tags=["设备控制"])
-async def set_bh1750_mode(request: Request):
-    """设置BH1750运行模式：eco/balance/safe/always/dev"""
+
+@app.post("/api/sensors/bulk", tags=["设备控制"])
+async def bulk_sensor_control(request: Request):
+    """
+    批量控制多台设备的调度传感器（开关或模式），一次请求完成整批切换。
+    请求体JSON:
+        {"items": [{"device_id": "D01", "sensor": "MQ2", "action": "off"},
+                   {"device_id": "D02", "sensor": "BMP180", "mode": "eco"}]}
+    或简写（同一操作作用于多台设备）:
+        {"devices": ["D01", "D02"], "sensor": "MQ2", "mode": "eco"}
+    开关命令并发下发，状态通过一次多行 upsert 写入数据库，返回每台设备的执行结果。
+    可选 "retries"（默认1，最大3）：仅对未确认（PUBACK 超时/发送失败）的命令重新下发。
+    """
     try:
         body = await request.json()
-        mode = (body.get("mode") or "").strip().lower()
-        if mode not in MQ2_MODE_CONFIG:
-            return {
-                "success": False,
-                "error": f"无效的模式：{mode}，可选：{', '.join(MQ2_MODE_CONFIG.keys())}"
-            }
-        device_id = (body.get("device_id") or "D01").upper()
-        db = get_db_manager()
-        await db.set_sensor_state(
-            "BH1750",
-            sensor_state=None,
-            mode=mode,
-            phase="pending",
-            phase_message="模式切换中",
-            phase_until=None,
-            device_id=device_id
-        )
-        wake_bh1750_cycle(device_id)
-        config = get_bh1750_mode_config(mode)
+        items = body.get("items")
+        if items is None:
+            shared = {k: body.get(k) for k in ("sensor", "action", "mode")}
+            items = [dict(shared, device_id=device) for device in (body.get("devices") or [])]
+        if not isinstance(items, list) or not items:
+            return {"success": False, "error": "参数错误：items 或 devices 不能为空"}
+        try:
+            retries = max(0, min(int(body.get("retries", 1)), COMMAND_MAX_RETRIES))
+        except (TypeError, ValueError):
+            return {"success": False, "error": "参数错误：retries 必须为整数"}
+
+        results = []
+        command_jobs = []  # (结果序号, 传感器定义, 设备ID, 动作, 命令)
+        state_rows = []
+        for item in items:
+            item = item if isinstance(item, dict) else {}
+            # 客户端可能传入数字等非字符串字段，统一转为字符串后校验，单项出错不影响整批
+            device_id = str(item.get("device_id") or "D01").strip().upper()
+            definition = sensor_cycle_engine.get(str(item.get("sensor") or ""))
+            action = str(item.get("action") or "").strip().lower()
+            mode = str(item.get("mode") or "").strip().lower()
+            result = {"device_id": device_id, "sensor": definition.name if definition else item.get("sensor")}
+            results.append(result)
+
+            if not DEVICE_ID_PATTERN.match(device_id):
+                result.update(success=False, error=f"参数错误：无效的设备ID：{item.get('device_id')}")
+            elif definition is None:
+                result.update(success=False, error=f"未知传感器：{item.get('sensor')}，可选：{', '.join(SENSOR_CYCLE_REGISTRY.keys())}")
+            elif bool(action) == bool(mode):
+                result.update(success=False, error="参数错误：action 与 mode 必须且只能提供一个")
+            elif action:
+                if action not in ("on", "off"):
+                    result.update(success=False, error="参数错误：action 仅支持 on/off")
+                else:
+                    command = definition.command_for(action)
+                    result.update(action=action, command=command)
+                    command_jobs.append((len(results) - 1, definition, device_id, action, command))
+            elif mode not in definition.mode_config:
+                result.update(success=False, error=f"无效的模式：{mode}，可选：{', '.join(definition.mode_config.keys())}")
+            else:
+                config = definition.get_mode_config(mode)
+                result.update(success=True, mode=mode, mode_name=config["name"], mode_icon=config["icon"])
+                state_rows.append({
+                    "sensor_name": definition.name,
+                    "device_id": device_id,
+                    "sensor_state": None,
+                    "mode": mode,
+                    "phase": "pending",
+                    "phase_message": "模式切换中",
+                    "phase_until": None,
+                })
+
+        # 并发下发所有开关命令，之后只重发未确认的部分
+        outcomes: Dict[int, dict] = {}
+        remaining = list(range(len(command_jobs)))
+        for attempt in range(1, retries + 2):
+            if not remaining:
+                break
+            if attempt > 1:
+                print(f"【控制】批量控制第 {attempt - 1} 次重试：{len(remaining)} 条命令未确认")
+            sent = await asyncio.gather(
+                *(send_command_ble_or_mqtt(command_jobs[job][4], device_id=command_jobs[job][2], wait_ack=True)
+                  for job in remaining),
+                return_exceptions=True
+            )
+            failed_jobs = []
+            for job, outcome in zip(remaining, sent):
+                if isinstance(outcome, Exception):
+                    outcome = {"success": False, "via": None, "error": str(outcome)}
+                outcome["attempts"] = attempt
+                outcomes[job] = outcome
+                if not outcome.get("success"):
+                    failed_jobs.append(job)
+            remaining = failed_jobs
+
+        for job, (index, definition, device_id, action, _) in enumerate(command_jobs):
+            outcome = outcomes[job]
+            result = results[index]
+            result.update(success=bool(outcome.get("success")), via=outcome.get("via"), topic=outcome.get("topic"),
+                          ack_ms=outcome.get("ack_ms"), attempts=outcome["attempts"])
+            if not result["success"]:
+                result["error"] = outcome.get("error", "未知错误")
+                continue
+            if action == "off":
+                state_rows.append({
+                    "sensor_name": definition.name,
+                    "device_id": device_id,
+                    "sensor_state": "off",
+                    "via": outcome.get("via"),
+                    "phase": "manual",
+                    "phase_message": "手动关闭",
+                    "phase_until": None,
+                    "next_run_time": None,
+                })
+            else:
+                state_rows.append({
+                    "sensor_name": definition.name,
+                    "device_id": device_id,
+                    "sensor_state": "on",
+                    "via": outcome.get("via"),
+                    "phase": "pending",
+                    "phase_message": "手动开启，等待调度",
+                    "phase_until": None,
+                })
+
+        # 一次多行 upsert 持久化全部状态
+        state_saved = True
+        if state_rows:
+            db = get_db_manager()
+            state_saved = await db.set_sensor_states_bulk(state_rows)
+            for device_id in {row["device_id"] for row in state_rows}:
+                sensor_cycle_engine.wake(device_id)
+        for result in results:
+            if result.get("success"):
+                result["state_saved"] = state_saved
+
+        succeeded = sum(1 for result in results if result.get("success"))
+        print(f"【控制】批量控制完成：{succeeded}/{len(results)} 项成功，命令 {len(command_jobs)} 条，状态写入 {len(state_rows)} 行")
         return {
-            "success": True,
-            "mode": mode,
-            "mode_name": config["name"],
-            "mode_icon": config["icon"],
-            "mode_on_sec": config.get("on_duration"),
-            "mode_off_sec": config.get("off_duration"),
-            "device_id": device_id
+            "success": succeeded == len(results),
+            "count": len(results),
+            "succeeded": succeeded,
+            "failed": len(results) - succeeded,
+            "results": results
         }
     except Exception as e:
-        print(f"【API】设置BH1750模式失败：{e}")
+        print(f"【API】批量控制失败：{e}")
         import traceback
         traceback.print_exc()
         return {"success": False, "error": str(e)}
 
 
+@app.get("/api/commands/stats", tags=["设备控制"])
+async def get_command_stats():
+    """
+    获取命令确认延迟统计：按设备 -> 链路（BLE/MQTT）-> 阶段（ack：PUBACK / BLE 写响应）输出延迟直方图、
+    超时次数及当前在途命令数。
+    """
+    return {"success": True, **command_tracker.stats()}
+
+
+@app.get("/api/ingest/stats", tags=["连接状态"])
+async def get_ingest_stats():
+    """
+    获取按设备的读数序列号统计：收到/放行/重复丢弃/丢包/迟到补回/乱序重排/重新同步次数、
+    当前暂存数和丢包率（仅统计携带序列号的读数）。启用多进程采集时合并各工作进程的统计，
+    并在 workers 中给出各进程的处理计数。
+    """
+    devices = sequence_tracker.stats()
+    devices.update(ingest_pool.device_stats())
+    return {
+        "success": True,
+        "window": SEQUENCE_WINDOW,
+        "reorder_delay": SEQUENCE_REORDER_DELAY,
+        "devices": devices,
+        "workers": ingest_pool.status(),
+    }
+
+
 # ============ BLE API ============
 @app.post("/api/ble/switch", tags=["设备控制"])
 async def switch_ble(request: Request):
@@ -3052,6 +2704,30 @@ async def ai_chat_proxy(request: Request):
         body = await request.json()
         model_name = body.get('model', '')
 
+        # 前端只提交 context（设备和时间范围）时，由服务端生成数据摘要注入系统提示（上游不认识该字段，需移除）
+        context = body.pop('context', None)
+        digest_text = None
+        if context:
+            digest_text = await inject_sensor_context(body, context)
+
+        # 响应缓存：键包含数据摘要指纹，数据变化后自动失效
+        requested = body.pop('cache', None)
+        use_cache = ai_response_cache.eligible(body, None if requested is None else requested is not False)
+        key = cache_key(body, fingerprint(digest_text)) if use_cache else None
+        if key:
+            cached = ai_response_cache.get(key)
+            if cached:
+                kind, value = cached
+                print(f"【AI】✓ 命中响应缓存（{'流式' if kind == 'stream' else '非流式'}），跳过模型生成")
+                if kind == "stream":
+                    return StreamingResponse(
+                        replay_stream(value),
+                        media_type="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-AI-Cache": "HIT"}
+                    )
+                return Response(content=json.dumps(value), media_type="application/json",
+                                headers={"X-AI-Cache": "HIT"})
+
         print(f"【AI】收到聊天请求，消息数：{len(body.get('messages', []))}")
         print(f"【AI】请求参数：")
         print(f"  - model: {model_name}")
@@ -3065,11 +2741,11 @@ async def ai_chat_proxy(request: Request):
         if is_online_model:
             # 使用 DeepSeek 在线 API
             print(f"【AI】使用在线模型：{model_name}")
-            return await call_deepseek_online_api(body)
+            return await call_deepseek_online_api(body, cache_key=key)
         else:
             # 使用本地 LM Studio
             print(f"【AI】使用本地模型：{model_name}")
-            return await call_local_lm_studio(body)
+            return await call_local_lm_studio(body, cache_key=key)
 
     except Exception as e:
         print(f"【AI】请求处理失败：{e}")
@@ -3085,10 +2761,54 @@ async def ai_chat_proxy(request: Request):
         )
 
 
+async def inject_sensor_context(body: dict, context: dict) -> str:
+    """把数据摘要追加到第一条 system 消息（没有则插入一条），返回摘要文本"""
+    end = float(context.get('end') or time.time())
+    start = float(context.get('start') or end - AI_CONTEXT_DEFAULT_HOURS * 3600)
+    digest = await ai_context_builder.build(context.get('device_id'), start, end,
+                                            buckets=int(context.get('buckets') or AI_CONTEXT_BUCKETS))
+    text = f"【当前数据】\n{digest['text']}"
+    messages = body.setdefault('messages', [])
+    for message in messages:
+        if message.get('role') == 'system':
+            message['content'] = f"{message.get('content', '')}\n\n{text}"
+            break
+    else:
+        messages.insert(0, {"role": "system", "content": text})
+    print(f"【AI】已注入数据摘要：{len(digest['devices'])} 个设备，{len(digest['text'])} 字符")
+    return digest['text']
+
+
+# API：AI 数据摘要
+@app.get("/api/ai/context", tags=["AI API"])
+async def get_ai_context(device_id: Optional[str] = None, start: Optional[float] = None, end: Optional[float] = None,
+                         buckets: int = AI_CONTEXT_BUCKETS):
+    """
+    生成设备在时间窗内的统计摘要（每个指标的均值/最值/趋势斜率/曲线，警告发作统计）
+
+    参数:
+        device_id: 设备ID（可选，不填则汇总全部设备）
+        start: 起始时间戳（秒），默认 end 前 AI_CONTEXT_DEFAULT_HOURS 小时
+        end: 结束时间戳（秒），默认当前时间
+        buckets: 目标分桶数
+    """
+    try:
+        end = end or time.time()
+        start = start or end - AI_CONTEXT_DEFAULT_HOURS * 3600
+        digest = await ai_context_builder.build(device_id, start, end, buckets=max(1, min(buckets, 500)))
+        return {"success": True, **digest}
+    except Exception as e:
+        print(f"【AI】生成数据摘要失败：{e}")
+        import traceback
+        traceback.print_exc()
+        return {"success": False, "error": str(e)}
+
+
 # 调用 DeepSeek 在线 API
-async def call_deepseek_online_api(body):
+async def call_deepseek_online_api(body, cache_key: Optional[str] = None):
     """
     调用 DeepSeek 官方在线 API
+    cache_key 不为空时，完整成功的回答写入 ai_response_cache
     """
     try:
         # DeepSeek API 不支持 max_tokens: -1，需要修正
@@ -3115,21 +2835,24 @@ async def call_deepseek_online_api(body):
         if is_stream:
             # 流式响应
             async def stream_response():
-                timeout = httpx.Timeout(
-                    connect=10.0,
-                    read=300.0,
-                    write=60.0,
-                    pool=10.0
-                )
-                client = httpx.AsyncClient(timeout=timeout)
-                chunk_count = 0
+                client = ai_clients.get("deepseek")
+                admission = ai_admission["deepseek"]
+                ticket = None
+                metrics = None
+                cached_chunks = []
                 try:
+                    # 先排队获取准入名额（排队期间推送位置），浏览器断开时在 finally 中出队/归还名额
+                    ticket = admission.enqueue()
+                    async for event in admission.queue_events(ticket, timeout=AI_QUEUE_TIMEOUT):
+                        yield event
                     print(f"【DeepSeek在线】开始流式请求到: {DEEPSEEK_API_URL}")
+                    metrics = StreamMetrics("deepseek")
                     async with client.stream(
                             "POST",
                             DEEPSEEK_API_URL,
                             json=body,
-                            headers=headers
+                            headers=headers,
+                            timeout=AI_STREAM_TIMEOUT
                     ) as response:
                         print(f"【DeepSeek在线】收到响应，状态码: {response.status_code}")
 
@@ -3139,16 +2862,14 @@ async def call_deepseek_online_api(body):
                             yield f"data: {json.dumps({'error': f'DeepSeek API 返回错误 {response.status_code}'})}\n\n".encode(
                                 'utf-8')
                         else:
-                            # 🎯 使用 aiter_text() 而不是 aiter_bytes()，让 httpx 处理 UTF-8 边界
-                            async for text_chunk in response.aiter_text():
-                                chunk_count += 1
-                                if chunk_count <= 5:
-                                    # 🐛 打印前5个块的内容（用于调试）
-                                    print(
-                                        f"【DeepSeek在线】块 #{chunk_count} (长度={len(text_chunk)}字符): {text_chunk[:300]}")
-                                # 转换回字节（保持与前端的兼容性）
-                                yield text_chunk.encode('utf-8')
-                            print(f"【DeepSeek在线】流式传输完成，共转发 {chunk_count} 个数据块")
+                            # 🎯 原样转发上游字节（不解码/重编码），旁路统计 token 数与首 token 时间
+                            async for data in relay_sse(response, metrics):
+                                if cache_key:
+                                    cached_chunks.append(data)
+                                yield data
+                            print(f"【DeepSeek在线】流式传输完成：{metrics.summary()}")
+                            if cache_key and metrics.done:
+                                ai_response_cache.put_stream(cache_key, cached_chunks)
                 except httpx.ReadTimeout:
                     error_msg = "⏰ DeepSeek API 响应超时"
                     print(f"【DeepSeek在线】{error_msg}")
@@ -3157,6 +2878,11 @@ async def call_deepseek_online_api(body):
                     error_msg = "⏰ 连接 DeepSeek API 超时"
                     print(f"【DeepSeek在线】{error_msg}")
                     yield f"data: {json.dumps({'error': error_msg})}\n\n".encode('utf-8')
+                except (AdmissionRejected, AdmissionTimeout) as e:
+                    if isinstance(e, AdmissionTimeout):
+                        admission.release(ticket, timed_out=True)
+                    print(f"【DeepSeek在线】排队失败：{e}")
+                    yield f"data: {json.dumps({'error': f'⏳ 当前 AI 请求较多，{e}，请稍后重试'})}\n\n".encode('utf-8')
                 except Exception as e:
                     print(f"【DeepSeek在线】流式传输错误：{e}")
                     import traceback
@@ -3164,8 +2890,10 @@ async def call_deepseek_online_api(body):
                     error_msg = f"data: {json.dumps({'error': str(e)})}\n\n"
                     yield error_msg.encode('utf-8')
                 finally:
-                    await client.aclose()
-                    print(f"【DeepSeek在线】HTTP 客户端已关闭")
+                    if ticket is not None:
+                        admission.release(ticket)
+                    if metrics is not None and metrics.finished_at is not None:
+                        ai_stream_stats.record(metrics)
 
             return StreamingResponse(
                 stream_response(),
@@ -3176,15 +2904,36 @@ async def call_deepseek_online_api(body):
                 }
             )
         else:
-            # 非流式响应
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                response = await client.post(
+            # 非流式响应（同样排队，超时返回 503）
+            admission = ai_admission["deepseek"]
+            ticket = admission.enqueue()
+            try:
+                if not await admission.wait(ticket, timeout=AI_QUEUE_TIMEOUT):
+                    admission.release(ticket, timed_out=True)
+                    raise AdmissionTimeout(f"deepseek 排队超过 {AI_QUEUE_TIMEOUT:.0f} 秒")
+                response = await ai_clients.get("deepseek").post(
                     DEEPSEEK_API_URL,
                     json=body,
-                    headers=headers
+                    headers=headers,
+                    timeout=60.0
                 )
-                return response.json()
-
+            finally:
+                admission.release(ticket)
+            result = response.json()
+            if cache_key and response.status_code == 200:
+                ai_response_cache.put_json(cache_key, result)
+            return result
+
+    except (AdmissionRejected, AdmissionTimeout) as e:
+        print(f"【DeepSeek在线】排队失败：{e}")
+        return Response(
+            content=json.dumps({
+                "error": "AI 请求排队失败",
+                "message": str(e)
+            }),
+            status_code=503,
+            media_type="application/json"
+        )
     except httpx.ConnectError:
         print(f"【DeepSeek在线】无法连接到 DeepSeek API")
         return Response(
@@ -3220,11 +2969,12 @@ async def call_deepseek_online_api(body):
 
 
 # 调用本地 LM Studio
-async def call_local_lm_studio(body):
+async def call_local_lm_studio(body, cache_key: Optional[str] = None):
     """
     调用本地 LM Studio
+    cache_key 不为空时，完整成功的回答写入 ai_response_cache
     """
-    AI_SERVICE_URL = "http://localhost:1234/v1/chat/completions"
+    AI_SERVICE_URL = LM_STUDIO_CHAT_URL
 
     try:
 
@@ -3234,24 +2984,25 @@ async def call_local_lm_studio(body):
         if is_stream:
             # 流式响应 - client 需要在整个流式传输期间保持打开
             async def stream_response():
-                # 设置更长的超时时间：连接10秒，读取300秒（5分钟），写入60秒
-                timeout = httpx.Timeout(
-                    connect=10.0,  # 连接超时
-                    read=300.0,  # 读取超时（包括模型推理时间）
-                    write=60.0,  # 写入超时
-                    pool=10.0  # 连接池超时
-                )
-                # 禁用代理，直连 localhost（避免代理干扰）
-                client = httpx.AsyncClient(timeout=timeout, proxies={})
-                chunk_count = 0
+                client = ai_clients.get("lm_studio")
+                admission = ai_admission["lm_studio"]
+                ticket = None
+                metrics = None
+                cached_chunks = []
                 try:
+                    # 先排队获取准入名额（排队期间推送位置），浏览器断开时在 finally 中出队/归还名额
+                    ticket = admission.enqueue()
+                    async for event in admission.queue_events(ticket, timeout=AI_QUEUE_TIMEOUT):
+                        yield event
                     print(f"【AI】开始流式请求到: {AI_SERVICE_URL}")
                     print(f"【AI】提示：首次请求可能需要加载模型，请耐心等待...")
+                    metrics = StreamMetrics("lm_studio")
                     async with client.stream(
                             "POST",
                             AI_SERVICE_URL,
                             json=body,
-                            headers={"Content-Type": "application/json"}
+                            headers={"Content-Type": "application/json"},
+                            timeout=AI_STREAM_TIMEOUT
                     ) as response:
                         print(f"【AI】收到响应，状态码: {response.status_code}")
 
@@ -3262,14 +3013,14 @@ async def call_local_lm_studio(body):
                             yield f"data: {json.dumps({'error': f'LM Studio 返回错误 {response.status_code}'})}\n\n".encode(
                                 'utf-8')
                         else:
-                            # 🎯 使用 aiter_text() 而不是 aiter_bytes()，让 httpx 处理 UTF-8 边界
-                            async for text_chunk in response.aiter_text():
-                                chunk_count += 1
-                                if chunk_count <= 3:  # 只打印前3个块
-                                    print(f"【AI】转发数据块 #{chunk_count}，大小: {len(text_chunk)} 字符")
-                                # 转换回字节（保持与前端的兼容性）
-                                yield text_chunk.encode('utf-8')
-                            print(f"【AI】流式传输完成，共转发 {chunk_count} 个数据块")
+                            # 🎯 原样转发上游字节（不解码/重编码），旁路统计 token 数与首 token 时间
+                            async for data in relay_sse(response, metrics):
+                                if cache_key:
+                                    cached_chunks.append(data)
+                                yield data
+                            print(f"【AI】流式传输完成：{metrics.summary()}")
+                            if cache_key and metrics.done:
+                                ai_response_cache.put_stream(cache_key, cached_chunks)
                 except httpx.ReadTimeout:
                     error_msg = "⏰ LM Studio 响应超时。这通常发生在首次加载模型时，请等待1-2分钟后重试。"
                     print(f"【AI】{error_msg}")
@@ -3278,6 +3029,11 @@ async def call_local_lm_studio(body):
                     error_msg = "⏰ 连接 LM Studio 超时。请检查服务是否正在运行。"
                     print(f"【AI】{error_msg}")
                     yield f"data: {json.dumps({'error': error_msg})}\n\n".encode('utf-8')
+                except (AdmissionRejected, AdmissionTimeout) as e:
+                    if isinstance(e, AdmissionTimeout):
+                        admission.release(ticket, timed_out=True)
+                    print(f"【AI】排队失败：{e}")
+                    yield f"data: {json.dumps({'error': f'⏳ 当前 AI 请求较多，{e}，请稍后重试'})}\n\n".encode('utf-8')
                 except Exception as e:
                     print(f"【AI】流式传输错误：{e}")
                     import traceback
@@ -3285,8 +3041,10 @@ async def call_local_lm_studio(body):
                     error_msg = f"data: {json.dumps({'error': str(e)})}\n\n"
                     yield error_msg.encode('utf-8')
                 finally:
-                    await client.aclose()
-                    print(f"【AI】HTTP 客户端已关闭")
+                    if ticket is not None:
+                        admission.release(ticket)
+                    if metrics is not None and metrics.finished_at is not None:
+                        ai_stream_stats.record(metrics)
 
             return StreamingResponse(
                 stream_response(),
@@ -3297,15 +3055,36 @@ async def call_local_lm_studio(body):
                 }
             )
         else:
-            # 非流式响应
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                response = await client.post(
+            # 非流式响应（同样排队，超时返回 503）
+            admission = ai_admission["lm_studio"]
+            ticket = admission.enqueue()
+            try:
+                if not await admission.wait(ticket, timeout=AI_QUEUE_TIMEOUT):
+                    admission.release(ticket, timed_out=True)
+                    raise AdmissionTimeout(f"lm_studio 排队超过 {AI_QUEUE_TIMEOUT:.0f} 秒")
+                response = await ai_clients.get("lm_studio").post(
                     AI_SERVICE_URL,
                     json=body,
-                    headers={"Content-Type": "application/json"}
+                    headers={"Content-Type": "application/json"},
+                    timeout=60.0
                 )
-                return response.json()
-
+            finally:
+                admission.release(ticket)
+            result = response.json()
+            if cache_key and response.status_code == 200:
+                ai_response_cache.put_json(cache_key, result)
+            return result
+
+    except (AdmissionRejected, AdmissionTimeout) as e:
+        print(f"【AI】排队失败：{e}")
+        return Response(
+            content=json.dumps({
+                "error": "AI 请求排队失败",
+                "message": str(e)
+            }),
+            status_code=503,
+            media_type="application/json"
+        )
     except httpx.ConnectError:
         print(f"【AI】无法连接到 AI 服务：{AI_SERVICE_URL}")
         return Response(
@@ -3342,67 +3121,43 @@ async def call_local_lm_studio(body):
 
 # API：AI 服务健康检查
 @app.get("/api/ai/health", tags=["AI API"])
-async def ai_health_check():
+async def ai_health_check(refresh: bool = False):
     """
     检查 AI 服务（LM Studio）是否在线
-    轻量级健康检查，不会触发模型推理
-    """
-    AI_SERVICE_URL = "http://localhost:1234/v1/models"
+    轻量级健康检查，不会触发模型推理；结果来自 ai_prober 缓存，多个页面轮询只产生一次上游探测
 
+    参数:
+        refresh: 为 True 时忽略缓存立即探测（用户手动点击检测）
+    """
     try:
-        # 使用 /v1/models 端点进行健康检查（更轻量）
-        async with httpx.AsyncClient(timeout=3.0) as client:
-            response = await client.get(AI_SERVICE_URL)
-
-            if response.status_code == 200:
-                models_data = response.json()
-                model_count = len(models_data.get('data', []))
-                print(f"【AI健康检查】✅ LM Studio 在线，加载了 {model_count} 个模型")
-                return {
-                    "online": True,
-                    "message": "LM Studio 在线",
-                    "models_count": model_count
-                }
-            else:
-                print(f"【AI健康检查】⚠️ LM Studio 响应异常: {response.status_code}")
-                return Response(
-                    content=json.dumps({
-                        "online": False,
-                        "message": f"LM Studio 响应异常: {response.status_code}"
-                    }),
-                    status_code=503,
-                    media_type="application/json"
-                )
-    except httpx.ConnectError:
-        print(f"【AI健康检查】❌ 无法连接到 LM Studio")
-        return Response(
-            content=json.dumps({
-                "online": False,
-                "message": "无法连接到 LM Studio，请确保服务正在运行"
-            }),
-            status_code=503,
-            media_type="application/json"
-        )
-    except httpx.TimeoutException:
-        print(f"【AI健康检查】❌ 连接 LM Studio 超时")
-        return Response(
-            content=json.dumps({
-                "online": False,
-                "message": "LM Studio 响应超时"
-            }),
-            status_code=504,
-            media_type="application/json"
-        )
+        probe = await ai_prober.get(refresh=refresh)
     except Exception as e:
         print(f"【AI健康检查】❌ 检查失败: {e}")
-        return Response(
-            content=json.dumps({
-                "online": False,
-                "message": f"健康检查失败: {str(e)}"
-            }),
-            status_code=500,
-            media_type="application/json"
-        )
+        probe = {"online": False, "error": "other", "message": str(e), "status_code": None}
+
+    if probe["online"]:
+        return {
+            "online": True,
+            "message": "LM Studio 在线",
+            "models_count": len((probe["models"] or {}).get('data', [])),
+            "checked_at": probe["checked_at"]
+        }
+    if probe["error"] == "status":
+        status_code, message = 503, f"LM Studio 响应异常: {probe['status_code']}"
+    elif probe["error"] == "connect":
+        status_code, message = 503, "无法连接到 LM Studio，请确保服务正在运行"
+    elif probe["error"] == "timeout":
+        status_code, message = 504, "LM Studio 响应超时"
+    else:
+        status_code, message = 500, f"健康检查失败: {probe['message']}"
+    return Response(
+        content=json.dumps({
+            "online": False,
+            "message": message
+        }),
+        status_code=status_code,
+        media_type="application/json"
+    )
 
 
 # API：获取连接状态
@@ -3432,41 +3187,52 @@ async def get_connection_status():
         "priority_mode": ble_or_mqtt_first,  # 0=蓝牙优先, 1=MQTT优先
         "ble": {
             "connected": ble_connected,
-            "name": "蓝牙设备 (BT27)",
+            "name": f"蓝牙设备 ({', '.join(BLE_DEVICES.keys())})",
             "priority": ble_priority,
-            "description": ble_desc
+            "description": ble_desc,
+            "devices": ble_manager.status()
         },
         "mqtt": {
             "connected": mqtt_connected,
             "name": "MQTT 服务器",
             "priority": mqtt_priority,
             "description": mqtt_desc
-        }
+        },
+        "event_bus": event_bus.status(),
+        "ai_upstreams": ai_clients.status(),
+        "ai_prober": ai_prober.status(),
+        "ai_cache": ai_response_cache.status(),
+        "ai_admission": {name: controller.status() for name, controller in ai_admission.items()},
+        "ai_stream": ai_stream_stats.status(),
+        "static_assets": {"web": static_assets.status(), "resource": resource_assets.status()},
+        "ws_wire": dict(wire_stats.status(), batched_clients=len(ws_batchers)),
+        "ws_delta": dict(delta_stats.status(), clients=len(ws_delta_encoders)),
+        "live_snapshot": live_snapshot.status(),
+        "device_liveness": device_liveness.status(),
+        "device_registry": device_registry.status()
     }
 
 
-@app.get("/api/devices", tags=["连接状态"])
-async def get_devices():
+def build_device_list():
     """
-    获取所有已配置设备及其在线状态
-    基于设备最后消息时间判断：10秒内收到消息则在线，否则离线
+    所有已配置设备及其在线状态（/api/devices 与连接快照共用）
+    基于设备最后消息时间判断：10秒内收到消息则在线，否则离线；
+    从属 worker 不处理设备消息，最后消息时间取自连接快照观察到的广播
     """
-    global ble_connected, mqtt_connected, device_last_message_time
-
     devices = []
     current_time = time.time()
 
     for dev_id in get_managed_mq2_devices():
-        has_ble = (dev_id == "D01")
+        has_ble = ble_manager.has_device(dev_id)
         has_mqtt = True  # 所有 Dxx 都走 MQTT
 
         # 判断设备是否在线：基于最后消息时间
-        last_message_time = device_last_message_time.get(dev_id)
+        last_message_time = max(device_last_message_time.get(dev_id) or 0, live_snapshot.last_seen(dev_id) or 0)
         if last_message_time and (current_time - last_message_time) <= DEVICE_ONLINE_TIMEOUT:
             online = True
             # 判断通过哪些方式在线
             via_list = []
-            if has_ble and ble_connected:
+            if ble_manager.is_connected(dev_id):
                 via_list.append("BLE")
             if mqtt_connected:
                 via_list.append("MQTT")
@@ -3475,7 +3241,7 @@ async def get_devices():
             via_list = []
 
         # 从配置中获取设备名称，如果未配置则使用默认格式
-        device_name = DEVICE_NAMES.get(dev_id, f"环境监测设备 {dev_id}")
+        device_name = device_registry.name(dev_id)
 
         devices.append({
             "id": dev_id,
@@ -3484,9 +3250,19 @@ async def get_devices():
             "via": via_list,
             "has_ble": has_ble,
             "has_mqtt": has_mqtt,
+            "last_seen": last_message_time or None,
             "description": "本地实验室多传感器监测节点"
         })
+    return devices
 
+
+@app.get("/api/devices", tags=["连接状态"])
+async def get_devices():
+    """
+    获取所有已配置设备及其在线状态
+    基于设备最后消息时间判断：10秒内收到消息则在线，否则离线
+    """
+    devices = build_device_list()
     return {
         "success": True,
         "devices": devices,
@@ -3496,21 +3272,15 @@ async def get_devices():
 
 # API：获取 AI 模型列表
 @app.get("/api/ai/models", tags=["AI API"])
-async def get_ai_models():
+async def get_ai_models(refresh: bool = False):
     """
-    获取 LM Studio 中可用的模型列表
+    获取 LM Studio 中可用的模型列表（与健康检查共用 ai_prober 缓存）
     """
-    AI_MODELS_URL = "http://localhost:1234/v1/models"
-
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.get(AI_MODELS_URL)
-            if response.status_code == 200:
-                models_data = response.json()
-                print(f"【AI】获取到 {len(models_data.get('data', []))} 个模型")
-                return models_data
-            else:
-                return {"error": "无法获取模型列表", "data": []}
+        probe = await ai_prober.get(refresh=refresh)
+        if probe["online"]:
+            return probe["models"]
+        return {"error": "无法获取模型列表", "data": []}
     except Exception as e:
         print(f"【AI】获取模型列表失败：{e}")
         return {"error": str(e), "data": []}
@@ -3658,7 +3428,7 @@ async def query_location(request: Request = None):
             }
 
         # 根据设备ID获取对应的命令主题
-        target_topic = MQTT_CMD_TOPIC_MAP.get(device_id, MQTT_CMD_TOPIC)
+        target_topic = get_cmd_topic(device_id)
 
         # 发送定位查询命令"LBS?"到定位命令主题
         # 注意：设备应该监听这个主题并返回定位数据到同一个主题
@@ -3709,16 +3479,54 @@ async def query_location(request: Request = None):
 @app.websocket("/ws")
 async def ws_endpoint(ws: WebSocket):
     await ws.accept()
+    try:
+        batch_ms = int(ws.query_params.get("batch") or 0)
+    except ValueError:
+        batch_ms = 0
+    if batch_ms > 0:
+        batch_ms = min(max(batch_ms, WS_BATCH_MIN_MS), WS_BATCH_MAX_MS)
+    delta = ws.query_params.get("proto") == "delta"
+    if delta:
+        ws_delta_encoders[ws] = DeltaEncoder(WS_DELTA_KEYFRAME_INTERVAL, WS_DELTA_KEYFRAME_SECONDS)
+    # 快照在加入连接集合前生成：之前的广播已包含在快照中，之后的广播由分发任务推送，不重复也不遗漏
+    # 首帧发送期间到达的广播暂存在 ws_initial_backlog 中，不会先于快照和增量精度表到达客户端
+    snapshot = live_snapshot.message()
+    backlog = ws_initial_backlog[ws] = []
     connections.add(ws)
-    print(f"【WS】客户端已连接，当前连接数：{len(connections)}")
+    modes = [f"合并窗口 {batch_ms}ms"] if batch_ms > 0 else []
+    if delta:
+        modes.append("增量编码")
+    mode_text = f"（{'，'.join(modes)}）" if modes else ""
+    print(f"【WS】客户端已连接{mode_text}，当前连接数：{len(connections)}")
     try:
+        await ws.send_text(snapshot)
+        wire_stats.record_send(len(snapshot.encode("utf-8")))
         await ws.send_text(json.dumps({"type": "hello", "msg": "connected"}))
+        if delta:
+            await ws.send_text(schema_message())
+        # 补发暂存的广播；队列清空与切换为直接推送之间没有 await，分发任务不会插队
+        if batch_ms > 0:
+            batcher = ws_batchers[ws] = WebSocketBatcher(ws.send_text, batch_ms / 1000.0)
+            batcher.start(on_error=lambda: connections.discard(ws))
+            for text in backlog:
+                batcher.add(text)
+            backlog.clear()
+        while backlog:
+            text = backlog.pop(0)
+            await ws.send_text(text)
+            wire_stats.record_send(len(text.encode("utf-8")))
+        ws_initial_backlog.pop(ws, None)
         while True:
             await asyncio.sleep(60)  # 仅保活，不要求客户端发消息
     except WebSocketDisconnect:
         pass
     finally:
         connections.discard(ws)
+        ws_initial_backlog.pop(ws, None)
+        batcher = ws_batchers.pop(ws, None)
+        if batcher is not None:
+            batcher.stop()
+        ws_delta_encoders.pop(ws, None)
         print(f"【WS】客户端已断开，当前连接数：{len(connections)}")
 
 
@@ -3726,4 +3534,6 @@ async def ws_endpoint(ws: WebSocket):
 if __name__ == "__main__":
     print("【服务】Uvicorn 启动中：http://localhost:8001")
     # 对所有IP监听
-    uvicorn.run("server:app", host="0.0.0.0", port=8001, reload=False)
+    # WebSocket 使用调优的 permessage-deflate（未安装 websockets 时退回 uvicorn 默认实现）
+    uvicorn.run("server:app", host="0.0.0.0", port=8001, reload=False,
+                ws=make_ws_protocol(**WS_DEFLATE) or "auto")
@@ -0,0 +1,347 @@
+# static_assets.py
+"""
+Web 静态资源管线
+三个页面各有 4~6 千行 HTML，并共用 6 千行的 common.js 和 common-styles.css，原先每次打开页面都完整下载约 700KB：
+- 指纹文件名：web/ 下的 .js/.css 按内容哈希生成 /static/common.<哈希>.js 形式的地址，页面 HTML 中的
+  /static/xxx.js?v=... 引用在输出时自动改写为指纹地址；指纹地址内容永不变化，可以长期强缓存（immutable）；
+- HTML 外壳：内容（含改写后的指纹地址）计算 ETag，浏览器用 If-None-Match 重新验证，未变化时返回 304；
+- 压缩：资源加载时预先生成 gzip（安装了 brotli 包时同时生成 br）变体，按 Accept-Encoding 选择发送；
+- 内存常驻：启动时 preload() 把整个目录连同压缩变体读入内存，请求时不再 stat/读盘，
+  响应体直接发送内存中的 memoryview，响应头按 (编码, 缓存策略) 预先编码好；
+- 开发模式：后台任务轮询文件 mtime，文件修改/新增/删除后重新加载并生成新指纹，页面随之引用新地址。
+"""
+import asyncio
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.staticfiles import StaticFiles
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    brotli = None
+    BROTLI_AVAILABLE = False
+
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"  # 指纹地址：一年强缓存
+REVALIDATE_CACHE = "no-cache"  # HTML 外壳 / 非指纹地址：每次用 ETag 重新验证
+FINGERPRINT_SUFFIXES = (".js", ".css")
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "application/manifest+json",
+                      "image/svg+xml", "image/x-icon", "image/vnd.microsoft.icon")
+MAX_PRELOAD_BYTES = 8 * 1024 * 1024  # 单个文件超过该大小不进内存，仍由 StaticFiles 读盘发送
+_HASH_LENGTH = 10
+_HASHED_NAME = re.compile(r"^(?P<stem>.+)\.(?P<hash>[0-9a-f]{%d})(?P<suffix>\.[A-Za-z0-9]+)$" % _HASH_LENGTH)
+
+
+def choose_encoding(accept_encoding: str, available) -> Optional[str]:
+    """按 Accept-Encoding 选择可用的压缩格式（br 优先于 gzip，q=0 表示拒绝）"""
+    accepted = set()
+    for part in (accept_encoding or "").lower().split(","):
+        token, _, params = part.strip().partition(";")
+        if not token:
+            continue
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(token)
+    for encoding in ("br", "gzip"):
+        if encoding in available and (encoding in accepted or "*" in accepted):
+            return encoding
+    return None
+
+
+def compress_variants(body: bytes, media_type: str, min_size: int = 1024) -> Dict[str, bytes]:
+    """生成压缩变体（只保留确实更小的）"""
+    if len(body) < min_size or not media_type.startswith(COMPRESSIBLE_TYPES):
+        return {}
+    variants = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+    if BROTLI_AVAILABLE:
+        variants["br"] = brotli.compress(body, quality=11)
+    return {encoding: data for encoding, data in variants.items() if len(data) < len(body) * 0.9}
+
+
+class AssetResponse(Response):
+    """直接发送内存中的响应体和预先编码的响应头（不经过 render，不复制响应体）"""
+
+    def __init__(self, status_code: int, raw_headers: List[Tuple[bytes, bytes]], body: memoryview):
+        self.status_code = status_code
+        self.raw_headers = raw_headers
+        self.body = body
+        self.background = None
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        await send({"type": "http.response.body", "body": self.body})
+
+
+class StaticAsset:
+    """一个已加载的静态资源（原始内容 + 压缩变体，均以 memoryview 常驻内存）"""
+
+    __slots__ = ("name", "mtime", "body", "media_type", "digest", "etag", "variants", "_views", "_headers")
+
+    def __init__(self, name: str, body: bytes, media_type: str, mtime: float = 0.0, min_size: int = 1024):
+        self.name = name
+        self.mtime = mtime
+        self.body = body
+        self.media_type = media_type
+        self.digest = hashlib.sha256(body).hexdigest()
+        self.etag = f'"{self.digest[:16]}"'
+        self.variants = compress_variants(body, media_type, min_size)
+        self._views = {None: memoryview(body), **{encoding: memoryview(data) for encoding, data in self.variants.items()}}
+        self._headers: Dict[tuple, List[Tuple[bytes, bytes]]] = {}  # (状态码, 编码, 缓存策略) -> 编码好的响应头
+
+    @property
+    def hashed_name(self) -> str:
+        path = Path(self.name)
+        return str(path.with_name(f"{path.stem}.{self.digest[:_HASH_LENGTH]}{path.suffix}"))
+
+    def _raw_headers(self, status_code: int, encoding: Optional[str], cache_control: str):
+        key = (status_code, encoding, cache_control)
+        headers = self._headers.get(key)
+        if headers is None:
+            headers = [(b"etag", self.etag.encode("latin-1")), (b"cache-control", cache_control.encode("latin-1"))]
+            if self.variants:
+                headers.append((b"vary", b"Accept-Encoding"))
+            if status_code != 304:
+                media_type = self.media_type
+                if media_type.startswith("text/"):
+                    media_type += "; charset=utf-8"
+                headers.append((b"content-type", media_type.encode("latin-1")))
+                headers.append((b"content-length", str(len(self._views[encoding])).encode("latin-1")))
+                if encoding:
+                    headers.append((b"content-encoding", encoding.encode("latin-1")))
+            headers = self._headers[key] = headers
+        return headers
+
+    def response(self, request_headers: Headers, cache_control: str, head: bool = False) -> Response:
+        """按条件请求 / Accept-Encoding 生成响应"""
+        if_none_match = request_headers.get("if-none-match", "")
+        if if_none_match and (if_none_match.strip() == "*" or self.etag in
+                              [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]):
+            return AssetResponse(304, self._raw_headers(304, None, cache_control), memoryview(b""))
+        encoding = choose_encoding(request_headers.get("accept-encoding", ""), self.variants)
+        body = self._views[encoding]
+        return AssetResponse(200, self._raw_headers(200, encoding, cache_control), memoryview(b"") if head else body)
+
+
+class AssetPipeline:
+    """一个静态资源目录的内存常驻资源（web/ 额外提供指纹地址与 HTML 外壳）"""
+
+    def __init__(self, directory: Path, url_prefix: str = "/static", fingerprint_suffixes=FINGERPRINT_SUFFIXES,
+                 compress_min_size: int = 1024):
+        """
+        参数:
+            directory: 静态资源目录
+            url_prefix: 静态资源挂载路径
+            fingerprint_suffixes: 提供指纹地址的文件类型（空元组表示不做指纹，如 resource/ 图片）
+            compress_min_size: 小于该字节数的文件不压缩
+        """
+        self.directory = Path(directory)
+        self.url_prefix = url_prefix.rstrip("/")
+        self.fingerprint_suffixes = tuple(fingerprint_suffixes)
+        self.compress_min_size = compress_min_size
+        self._assets: Dict[str, StaticAsset] = {}
+        self._html: Dict[str, Tuple[str, int, StaticAsset]] = {}  # 文件名 -> (源文件指纹, 资源版本, 渲染结果)
+        self._version = 0  # 任一资源重新加载时递增，使 HTML 外壳重新改写
+        self._reference = re.compile(
+            r"%s/(?P<name>[\w./-]+?(?:%s))(?:\?v=[^\"'\s>]*)?(?=[\"'\s>])" % (
+                re.escape(self.url_prefix), "|".join(re.escape(suffix) for suffix in FINGERPRINT_SUFFIXES)))
+        self._watch_task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.not_modified = 0
+        self.reloads = 0
+
+    def _path(self, name: str) -> Optional[Path]:
+        path = (self.directory / name).resolve()
+        if self.directory.resolve() not in path.parents or not path.is_file():
+            return None
+        return path
+
+    def _files(self) -> Dict[str, Path]:
+        """目录下的全部文件（相对路径 -> 路径，跳过隐藏文件）"""
+        files = {}
+        for root, dirs, names in os.walk(self.directory):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for filename in names:
+                if not filename.startswith("."):
+                    path = Path(root) / filename
+                    files[path.relative_to(self.directory).as_posix()] = path
+        return files
+
+    def _load(self, name: str, path: Path) -> Optional[StaticAsset]:
+        stat = path.stat()
+        if stat.st_size > MAX_PRELOAD_BYTES:
+            return None
+        media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        asset = StaticAsset(name, path.read_bytes(), media_type, stat.st_mtime, self.compress_min_size)
+        self._assets[name] = asset
+        self._version += 1
+        return asset
+
+    def preload(self):
+        """把整个目录读入内存（启动时调用）"""
+        raw = compressed = 0
+        for name, path in self._files().items():
+            asset = self._load(name, path)
+            if asset is not None:
+                raw += len(asset.body)
+                compressed += min([len(asset.body)] + [len(data) for data in asset.variants.values()])
+        print(f"【静态资源】已预加载 {self.directory.name}/ 共 {len(self._assets)} 个文件，"
+              f"原始 {raw / 1024:.0f}KB，压缩后 {compressed / 1024:.0f}KB")
+
+    def asset(self, name: str) -> Optional[StaticAsset]:
+        """获取资源：已在内存中直接返回，否则（未预加载的新文件）从磁盘加载"""
+        cached = self._assets.get(name)
+        if cached is not None:
+            return cached
+        path = self._path(name)
+        return self._load(name, path) if path is not None else None
+
+    def scan_changes(self) -> List[str]:
+        """对比磁盘 mtime，重新加载修改/新增的文件、移除已删除的文件，返回变化的文件名"""
+        files = self._files()
+        changed = []
+        for name, path in files.items():
+            cached = self._assets.get(name)
+            try:
+                if cached is None or cached.mtime != path.stat().st_mtime:
+                    self._load(name, path)
+                    changed.append(name)
+            except OSError:
+                continue  # 文件正在被替换，下一轮再看
+        for name in [name for name in self._assets if name not in files]:
+            del self._assets[name]
+            self._version += 1
+            changed.append(name)
+        if changed:
+            self.reloads += len(changed)
+            for name in changed:
+                asset = self._assets.get(name)
+                if asset is None:
+                    print(f"【静态资源】{name} 已删除")
+                elif name.endswith(self.fingerprint_suffixes):
+                    print(f"【静态资源】{name} 已更新，新指纹 {asset.hashed_name}")
+                else:
+                    print(f"【静态资源】{name} 已更新")
+        return changed
+
+    async def _watch_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.scan_changes)
+            except Exception as e:
+                print(f"【静态资源】检查文件变化失败：{e}")
+
+    def start_watcher(self, interval: float = 1.0):
+        """开发模式：后台轮询文件变化"""
+        if self._watch_task is None or self._watch_task.done():
+            self._watch_task = asyncio.create_task(self._watch_loop(interval))
+            print(f"【静态资源】开发模式：每 {interval:g} 秒检查 {self.directory.name}/ 文件变化")
+
+    async def stop_watcher(self):
+        if self._watch_task:
+            self._watch_task.cancel()
+            try:
+                await self._watch_task
+            except asyncio.CancelledError:
+                pass
+            self._watch_task = None
+
+    def resolve(self, path: str) -> Tuple[Optional[StaticAsset], bool]:
+        """
+        解析挂载路径下的请求路径
+
+        返回:
+            (资源, 是否可以 immutable 缓存)；不在内存中时返回 (None, False)，交给 StaticFiles 处理
+        """
+        if self.fingerprint_suffixes:
+            match = _HASHED_NAME.match(path)
+            if match and match["suffix"] in self.fingerprint_suffixes:
+                name = str(Path(path).with_name(match["stem"] + match["suffix"]))
+                asset = self.asset(name)
+                if asset is not None:
+                    # 旧指纹（文件已更新）仍返回当前内容，但不允许长期缓存
+                    return asset, asset.digest.startswith(match["hash"])
+        return self.asset(path), False
+
+    def url_for(self, name: str) -> str:
+        """资源的指纹地址（文件不存在时返回原地址）"""
+        asset = self.asset(name)
+        return f"{self.url_prefix}/{asset.hashed_name if asset else name}"
+
+    def rewrite_html(self, html: str) -> str:
+        """把 HTML 中的 /static/xxx.js?v=... 引用改写为指纹地址"""
+        return self._reference.sub(lambda match: self.url_for(match["name"]), html)
+
+    def html_response(self, request_headers: Headers, path: Path,
+                      transform: Optional[Callable[[str], str]] = None) -> Response:
+        """
+        输出 HTML 外壳（改写指纹地址 + 可选的内容替换），带 ETag 与压缩
+
+        参数:
+            request_headers: 请求头（If-None-Match / Accept-Encoding）
+            path: HTML 文件路径（位于本目录内）
+            transform: 额外的内容替换（如注入地图 Key），必须对同一输入给出相同输出
+
+        异常:
+            FileNotFoundError: 文件不存在
+        """
+        name = path.relative_to(self.directory).as_posix()
+        source = self.asset(name)
+        if source is None:
+            raise FileNotFoundError(name)
+        cached = self._html.get(name)
+        if cached is None or cached[0] != source.digest or cached[1] != self._version:
+            text = self.rewrite_html(source.body.decode("utf-8"))
+            if transform:
+                text = transform(text)
+            rendered = StaticAsset(name, text.encode("utf-8"), "text/html", source.mtime, self.compress_min_size)
+            cached = self._html[name] = (source.digest, self._version, rendered)
+        return self.respond(request_headers, cached[2], REVALIDATE_CACHE)
+
+    def respond(self, request_headers: Headers, asset: StaticAsset, cache_control: str, head: bool = False):
+        response = asset.response(request_headers, cache_control, head)
+        self.hits += 1
+        if response.status_code == 304:
+            self.not_modified += 1
+        return response
+
+    def status(self) -> dict:
+        fingerprinted = {name: asset for name, asset in self._assets.items() if name.endswith(self.fingerprint_suffixes)} \
+            if self.fingerprint_suffixes else {}
+        return {
+            "files": len(self._assets),
+            "bytes": sum(len(asset.body) for asset in self._assets.values()),
+            "compressed_bytes": sum(len(data) for asset in self._assets.values() for data in asset.variants.values()),
+            "fingerprinted": {name: f"{self.url_prefix}/{asset.hashed_name}" for name, asset in fingerprinted.items()},
+            "html": len(self._html),
+            "brotli": BROTLI_AVAILABLE,
+            "watching": self._watch_task is not None and not self._watch_task.done(),
+            "reloads": self.reloads,
+            "responses": self.hits,
+            "not_modified": self.not_modified,
+        }
+
+
+class AssetStaticFiles(StaticFiles):
+    """静态资源挂载：内存中的资源由 AssetPipeline 输出（指纹地址强缓存 + 压缩），其余文件仍按 StaticFiles 处理"""
+
+    def __init__(self, *, pipeline: AssetPipeline, **kwargs):
+        super().__init__(**kwargs)
+        self.pipeline = pipeline
+
+    async def get_response(self, path: str, scope) -> Response:
+        if scope["method"] in ("GET", "HEAD"):
+            asset, immutable = self.pipeline.resolve(path)
+            if asset is not None:
+                return self.pipeline.respond(Headers(scope=scope), asset,
+                                             IMMUTABLE_CACHE if immutable else REVALIDATE_CACHE,
+                                             head=scope["method"] == "HEAD")
+        return await super().get_response(path, scope)
@@ -0,0 +1,6 @@
+# conftest.py
+"""测试公共设置：与 scripts/ 下的脚本一样，把 PythonProject 目录加入模块搜索路径"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,189 @@
+# test_ble_manager.py
+"""BleManager：用替身扫描器/客户端工厂验证连接、断开、按连接分帧与多设备路由（无需蓝牙硬件）"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from ble_manager import BleManager
+
+CHAR_UUID = "0000ffe1-0000-1000-8000-00805f9b34fb"
+DEVICES = {"BT27": "AA:BB:CC:DD:EE:01", "BT28": "AA:BB:CC:DD:EE:02"}
+DEVICE_IDS = {"BT27": "D01", "BT28": "D02"}
+
+
+class FakeScanner:
+    """启动时立即"发现"所有广播中的设备"""
+
+    def __init__(self, advertising, detection_callback):
+        self.advertising = advertising
+        self.detection_callback = detection_callback
+        self.running = False
+
+    async def start(self):
+        self.running = True
+        for device in self.advertising:
+            self.detection_callback(device, None)
+
+    async def stop(self):
+        self.running = False
+
+
+class FakeClient:
+    """BleakClient 替身：连接总是成功，记录通知回调与写入内容"""
+
+    def __init__(self, registry, target, timeout=None, disconnected_callback=None):
+        self.registry = registry
+        self.target = target
+        self.disconnected_callback = disconnected_callback
+        self.is_connected = False
+        self.notify = None
+        self.writes = []
+
+    async def __aenter__(self):
+        self.is_connected = True
+        self.registry[getattr(self.target, "name", self.target)] = self
+        return self
+
+    async def __aexit__(self, *exc):
+        self.is_connected = False
+
+    async def start_notify(self, uuid, callback):
+        assert uuid == CHAR_UUID
+        self.notify = callback
+
+    async def write_gatt_char(self, uuid, payload, response=True):
+        self.writes.append((uuid, payload, response))
+
+    def send(self, data: bytes):
+        self.notify(0, bytearray(data))
+
+    def drop(self):
+        """模拟设备断开"""
+        self.is_connected = False
+        self.disconnected_callback(self)
+
+
+async def wait_until(predicate, timeout: float = 2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("等待条件超时")
+        await asyncio.sleep(0.01)
+
+
+def make_manager(lines, states, clients, advertising=None):
+    if advertising is None:
+        advertising = [SimpleNamespace(name=name, address=address) for name, address in DEVICES.items()]
+    return BleManager(
+        DEVICES,
+        DEVICE_IDS,
+        CHAR_UUID,
+        on_line=lambda device_id, line: lines.append((device_id, line)),
+        on_state_change=lambda device_id, connected: states.append((device_id, connected)),
+        client_factory=lambda target, **kwargs: FakeClient(clients, target, **kwargs),
+        scanner_factory=lambda detection_callback: FakeScanner(advertising, detection_callback),
+        scan_wait=0.05,
+    )
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_connects_all_devices_found_by_scanner():
+    async def scenario():
+        lines, states, clients = [], [], {}
+        manager = make_manager(lines, states, clients)
+        runner = asyncio.create_task(manager.run())
+        await wait_until(lambda: manager.is_connected("D01") and manager.is_connected("D02"))
+        assert sorted(states) == [("D01", True), ("D02", True)]
+        assert manager.any_connected
+        # 扫描器发现的设备对象直接交给客户端工厂，而不是配置里的地址字符串
+        assert clients["BT27"].target.address == DEVICES["BT27"]
+        await manager.stop()
+        await asyncio.gather(runner, return_exceptions=True)
+        assert sorted(states[2:]) == [("D01", False), ("D02", False)]
+        assert not manager.any_connected
+
+    run(scenario())
+
+
+def test_falls_back_to_configured_address_when_not_advertising():
+    async def scenario():
+        lines, states, clients = [], [], {}
+        manager = make_manager(lines, states, clients, advertising=[])
+        runner = asyncio.create_task(manager.run())
+        await wait_until(lambda: manager.is_connected("D01"))
+        assert clients[DEVICES["BT27"]].target == DEVICES["BT27"]
+        await manager.stop()
+        await asyncio.gather(runner, return_exceptions=True)
+
+    run(scenario())
+
+
+def test_lines_are_reassembled_per_connection_and_routed_by_device():
+    async def scenario():
+        lines, states, clients = [], [], {}
+        manager = make_manager(lines, states, clients)
+        runner = asyncio.create_task(manager.run())
+        await wait_until(lambda: manager.is_connected("D01") and manager.is_connected("D02"))
+        d01, d02 = clients["BT27"], clients["BT28"]
+        # 两台设备的小 MTU 分片交错到达，半行不能串到另一台设备的缓冲里
+        d01.send(b"T=24.61H=45")
+        d02.send(b"T=20.00H=50.00L=1")
+        d01.send(b".78L=0.0R=1.01Y=3.4W=26.10P=1014.23\r\nDT3")
+        d02.send(b"0.0R=1.0Y=1.0W=20.0P=1000.0\r\n")
+        d01.send(b"2.25\r\n")
+        assert lines == [
+            ("D01", b"T=24.61H=45.78L=0.0R=1.01Y=3.4W=26.10P=1014.23"),
+            ("D02", b"T=20.00H=50.00L=10.0R=1.0Y=1.0W=20.0P=1000.0"),
+            ("D01", b"DT32.25"),
+        ]
+        assert manager.status()["D01"]["lines"] == 2
+        assert manager.status()["D02"]["lines"] == 1
+        await manager.stop()
+        await asyncio.gather(runner, return_exceptions=True)
+
+    run(scenario())
+
+
+def test_disconnect_discards_half_line_and_marks_device_offline():
+    async def scenario():
+        lines, states, clients = [], [], {}
+        manager = make_manager(lines, states, clients)
+        runner = asyncio.create_task(manager.run())
+        await wait_until(lambda: manager.is_connected("D01") and manager.is_connected("D02"))
+        d01 = clients["BT27"]
+        d01.send(b"T=24.61H=")
+        d01.drop()
+        await wait_until(lambda: not manager.is_connected("D01"))
+        assert ("D01", False) in states
+        assert manager.is_connected("D02")
+        assert manager.get_client("D01") is None
+        assert len(manager.connections["D01"].framer) == 0
+
+        # 快速重连后旧的半行不会与新数据拼在一起
+        await wait_until(lambda: manager.is_connected("D01"), timeout=3.0)
+        clients["BT27"].send(b"DT32.25\r\n")
+        assert lines == [("D01", b"DT32.25")]
+        await manager.stop()
+        await asyncio.gather(runner, return_exceptions=True)
+
+    run(scenario())
+
+
+def test_write_goes_to_the_device_connection():
+    async def scenario():
+        lines, states, clients = [], [], {}
+        manager = make_manager(lines, states, clients)
+        runner = asyncio.create_task(manager.run())
+        await wait_until(lambda: manager.is_connected("D02"))
+        await manager.write("d02", b"ONMQ2\r\n")
+        assert clients["BT28"].writes == [(CHAR_UUID, b"ONMQ2\r\n", True)]
+        await manager.stop()
+        await asyncio.gather(runner, return_exceptions=True)
+        with pytest.raises(RuntimeError):
+            await manager.write("D03", b"ONMQ2\r\n")
+
+    run(scenario())
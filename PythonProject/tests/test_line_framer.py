@@ -0,0 +1,59 @@
+# test_line_framer.py
+"""LineFramer：分片重组、空白修剪、缓冲回绕/扩容与超长行丢弃"""
+from line_framer import LineFramer
+
+
+def collect(framer: LineFramer, *chunks):
+    lines = []
+    for chunk in chunks:
+        framer.feed(chunk, lambda line: lines.append(bytes(line)))
+    return lines
+
+
+def test_reassembles_lines_split_across_notifications():
+    framer = LineFramer()
+    assert collect(framer, b"T=24.6", b"1H=45.78\r", b"\nDT32.25\r\nS", b"T\r\n") == \
+        [b"T=24.61H=45.78", b"DT32.25", b"ST"]
+    assert framer.lines == 3
+    assert len(framer) == 0
+
+
+def test_strips_whitespace_and_skips_empty_lines():
+    framer = LineFramer()
+    assert collect(framer, b"  ONMQ2 \t\r\n\r\n \r\nLBS?\r\n") == [b"ONMQ2", b"LBS?"]
+
+
+def test_separator_split_between_chunks():
+    framer = LineFramer()
+    assert collect(framer, b"abc\r") == []
+    assert collect(framer, b"\ndef\r\n") == [b"abc", b"def"]
+
+
+def test_custom_line_end():
+    framer = LineFramer(b"\n")
+    assert collect(framer, b"a\nb", b"c\n") == [b"a", b"bc"]
+
+
+def test_half_line_survives_buffer_wraparound_and_growth():
+    framer = LineFramer(capacity=16)
+    line = b"T=1H=2L=3R=4Y=5W=6P=7"  # 比初始容量长，需要扩容
+    lines = collect(framer, b"x" * 10 + b"\r\n", line[:5], line[5:12], line[12:] + b"\r\n")
+    assert lines == [b"x" * 10, line]
+    assert framer.capacity >= len(line)
+    # 反复写入不超过容量的数据时只在起点与末尾之间搬移半行，内容保持正确
+    for i in range(50):
+        assert collect(framer, b"%02d-" % i, b"ab\r\n") == [b"%02d-ab" % i]
+
+
+def test_overlong_line_is_dropped():
+    framer = LineFramer(max_line_length=8)
+    assert collect(framer, b"0123456789") == []
+    assert framer.dropped_bytes == 10
+    assert collect(framer, b"ok\r\n") == [b"ok"]
+
+
+def test_clear_discards_half_line():
+    framer = LineFramer()
+    collect(framer, b"T=24")
+    framer.clear()
+    assert collect(framer, b"ST\r\n") == [b"ST"]
@@ -0,0 +1,131 @@
+# test_payload_parser.py
+"""payload_parser：文本数据行、v1 单条二进制帧、v2 批量帧与其他消息的分类"""
+import math
+
+import pytest
+
+from payload_parser import (
+    BINARY_FRAME_SIZE, KIND_CONTROL, KIND_LOCATION, KIND_QUERY, KIND_RESOLVED, KIND_SENSOR, KIND_UNKNOWN,
+    KIND_WARNING, PayloadParser, encode_binary_batch, encode_binary_frame, parse_binary_batch, parse_binary_frame,
+    parse_sensor_line, resolve_sample_times,
+)
+
+VALUES = (24.61, 45.78, 0.0, 1.01, 3.4, 26.1, 1014.23)
+parser = PayloadParser(["ONMQ2", "OFFMQ2"])
+
+
+def test_sensor_line():
+    assert parse_sensor_line(b"T=24.61H=45.78L=0.0R=1.01Y=3.4W=26.10P=1014.23") == (VALUES, None, None)
+    parsed = parser.classify(b" T=24.61H=45.78L=0.0R=1.01Y=3.4W=26.10P=1014.23\r\n")
+    assert parsed.kind == KIND_SENSOR and parsed.values == VALUES
+
+
+def test_sensor_line_with_sequence_and_timestamp():
+    assert parse_sensor_line(b"T=24.61H=45.78L=0.0R=1.01Y=3.4W=26.10P=1014.23N=1024U=1731600000.5") == \
+        (VALUES, 1024, 1731600000.5)
+    assert parse_sensor_line(b"T=1H=2L=3R=4Y=5W=6P=7N=5")[1:] == (5, None)
+    # U=0 视为未携带
+    assert parse_sensor_line(b"T=1H=2L=3R=4Y=5W=6P=7U=0")[2] is None
+    parsed = parser.classify(b"T=1H=2L=3R=4Y=5W=6P=7N=9U=1731600000")
+    assert (parsed.seq, parsed.timestamp) == (9, 1731600000.0)
+
+
+@pytest.mark.parametrize("line", [
+    b"T=24.61H=45.78L=0.0R=1.01Y=3.4W=26.10",  # 缺字段
+    b"T=24.61H=45.78L=0.0R=1.01Y=3.4P=1014.23W=26.10",  # 顺序错误
+    b"T=24.61H=45.78L=0.0R=1.01Y=3.4W=26.10P=1014.23N=-1",  # 序列号为负
+    b"T=24.61H=45.78L=0.0R=1.01Y=3.4W=26.10P=1014.23N=4294967296",  # 超出 uint32
+    b"T=24.61H=45.78L=0.0R=1.01Y=3.4W=26.10P=1014.23U=1N=1",  # N= 必须在 U= 之前
+    b"T=1-2H=2L=3R=4Y=5W=6P=7",  # 数值非法
+    b"T=H=2L=3R=4Y=5W=6P=7",  # 空字段
+])
+def test_malformed_sensor_lines_are_rejected(line):
+    assert parse_sensor_line(line) is None
+    assert parser.classify(line).kind == KIND_UNKNOWN
+
+
+def test_v1_binary_frame_round_trip():
+    frame = encode_binary_frame((24.61, 45.78, None, 1.01, 3.4, 26.1, 1014.23), seq=7, timestamp=1731600000.25)
+    assert len(frame) == BINARY_FRAME_SIZE
+    seq, timestamp, values = parse_binary_frame(frame)
+    assert (seq, timestamp) == (7, 1731600000.25)
+    assert values[2] is None
+    assert values[0] == pytest.approx(24.61, abs=1e-4) and values[6] == pytest.approx(1014.23, abs=1e-2)
+
+    parsed = parser.classify(frame)
+    assert parsed.kind == KIND_SENSOR and parsed.binary and parsed.seq == 7
+    # 没有采样时间的帧返回 None（使用接收时间）
+    assert parse_binary_frame(encode_binary_frame(VALUES, seq=1))[1] is None
+
+
+def test_v1_binary_frame_with_bad_version_is_unknown():
+    frame = bytearray(encode_binary_frame(VALUES, seq=1))
+    frame[2] = 9
+    assert parse_binary_frame(bytes(frame)) is None
+    assert parser.classify(bytes(frame)).kind == KIND_UNKNOWN
+
+
+def test_v1_binary_frame_containing_newline_bytes_is_not_split():
+    frame = encode_binary_frame(VALUES, seq=0x0A0A0A0A)
+    assert b"\n" in frame
+    items = parser.classify_many(frame)
+    assert len(items) == 1 and items[0].kind == KIND_SENSOR and items[0].seq == 0x0A0A0A0A
+
+
+def test_v2_batch_frame_round_trip_and_per_sample_fields():
+    samples = [(0, VALUES), (1000, (25.0, 46.0, 1.0, 1.0, 3.0, 26.0, None)), (2500, VALUES)]
+    frame = encode_binary_batch(samples, base_seq=0xFFFFFFFF, base_timestamp=1731600000.0)
+    base_seq, base_timestamp, decoded = parse_binary_batch(frame)
+    assert (base_seq, base_timestamp) == (0xFFFFFFFF, 1731600000.0)
+    assert [offset for offset, _values in decoded] == [0, 1000, 2500]
+    assert decoded[1][1][6] is None
+
+    items = parser.classify_many(frame)
+    assert [item.kind for item in items] == [KIND_SENSOR] * 3
+    # 序列号按 uint32 回绕，采样时间按偏移推算
+    assert [item.seq for item in items] == [0xFFFFFFFF, 0, 1]
+    assert [item.timestamp for item in items] == [1731600000.0, 1731600001.0, 1731600002.5]
+
+
+def test_v2_batch_frame_with_wrong_length_is_unknown():
+    frame = encode_binary_batch([(0, VALUES), (10, VALUES)], base_seq=1)
+    assert parse_binary_batch(frame[:-1]) is None
+    assert [item.kind for item in parser.classify_many(frame[:-1])] == [KIND_UNKNOWN]
+
+
+def test_resolve_sample_times_uses_offsets_when_device_clock_is_off():
+    frame = encode_binary_batch([(0, VALUES), (1000, VALUES)], base_seq=1, base_timestamp=1000.0)
+    items = parser.classify_many(frame)
+    timestamps, rejected = resolve_sample_times(items, max_skew=60, received_at=5000.0)
+    assert timestamps == [4999.0, 5000.0]
+    assert rejected == 1000.0
+    timestamps, rejected = resolve_sample_times(items, max_skew=60, received_at=1030.0)
+    assert timestamps == [1000.0, 1001.0] and rejected is None
+    # 文本行没有偏移信息，使用接收时间
+    assert resolve_sample_times(parser.classify_many(b"T=1H=2L=3R=4Y=5W=6P=7"), 60, 5000.0) == ([None], None)
+
+
+def test_multi_line_text_message():
+    items = parser.classify_many(b"T=1H=2L=3R=4Y=5W=6P=7\nT=2H=2L=3R=4Y=5W=6P=7\n\nDT32.5\n")
+    assert [item.kind for item in items] == [KIND_SENSOR, KIND_SENSOR, KIND_WARNING]
+    assert [item.values[0] for item in items[:2]] == [1.0, 2.0]
+
+
+def test_nan_values_become_none():
+    frame = encode_binary_frame((math.nan,) * 7, seq=1)
+    assert parse_binary_frame(frame)[2] == (None,) * 7
+
+
+@pytest.mark.parametrize("raw, kind, attrs", [
+    (b"DT32.25", KIND_WARNING, {"warning_type": "T", "warning_value": 32.25}),
+    (b"Sp", KIND_RESOLVED, {"warning_type": "P"}),
+    (b'{"lon":116.4,"lat":39.9}', KIND_LOCATION, {"location": {"lon": 116.4, "lat": 39.9}}),
+    (b"onmq2", KIND_CONTROL, {"command": "ONMQ2"}),
+    (b"LBS?", KIND_QUERY, {"command": "LBS?"}),
+    (b"hello", KIND_UNKNOWN, {}),
+])
+def test_other_message_kinds(raw, kind, attrs):
+    parsed = parser.classify(raw)
+    assert parsed.kind == kind
+    for name, value in attrs.items():
+        assert getattr(parsed, name) == value
@@ -0,0 +1,107 @@
+# test_sequence_tracker.py
+"""SequenceTracker：去重、乱序重排、缺口超时、回绕与设备重启"""
+from sequence_tracker import SequenceTracker, seq_diff
+
+
+def feed(tracker, device_id, seqs, now=1000.0, device_ts=None):
+    """依次提交序列号，条目即 (seq, device_ts)；device_ts 为函数时按序列号计算采样时间"""
+    released = []
+    for seq in seqs:
+        ts = device_ts(seq) if callable(device_ts) else device_ts
+        released.extend(tracker.accept(device_id, seq, (seq, ts), now=now, device_ts=ts))
+    return [item[0] for item in released]
+
+
+def test_seq_diff_wraps_around_uint32():
+    assert seq_diff(0, 0xFFFFFFFF) == 1
+    assert seq_diff(0xFFFFFFFF, 0) == -1
+    assert seq_diff(5, 3) == 2
+
+
+def test_in_order_and_duplicates():
+    tracker = SequenceTracker()
+    assert feed(tracker, "D01", [1, 2, 3, 2, 3, 4]) == [1, 2, 3, 4]
+    stats = tracker.stats()["D01"]
+    assert stats["duplicates"] == 2 and stats["released"] == 4 and stats["lost"] == 0
+
+
+def test_duplicate_with_same_device_timestamp_is_dropped():
+    tracker = SequenceTracker()
+    assert feed(tracker, "D01", range(10), device_ts=lambda seq: 5000.0 + seq) == list(range(10))
+    # QoS1 重投：序列号和设备采样时间都与已放行的相同
+    assert feed(tracker, "D01", [3, 4], device_ts=lambda seq: 5000.0 + seq) == []
+    assert tracker.stats()["D01"]["duplicates"] == 2
+
+
+def test_out_of_order_readings_are_released_in_order():
+    tracker = SequenceTracker()
+    assert feed(tracker, "D01", [1, 3, 4]) == [1]
+    assert feed(tracker, "D01", [2]) == [2, 3, 4]
+    assert tracker.stats()["D01"]["reordered"] == 1
+
+
+def test_gap_is_skipped_after_reorder_delay_and_late_reading_recovered():
+    tracker = SequenceTracker(reorder_delay=2.0)
+    assert feed(tracker, "D01", [1, 3, 4], now=1000.0) == [1]
+    assert tracker.flush_expired(now=1001.0) == {}
+    assert [item[0] for item in tracker.flush_expired(now=1002.5)["D01"]] == [3, 4]
+    assert tracker.stats()["D01"]["lost"] == 1
+    # 已判定丢失的缺口迟到了：照常放行并计入 recovered
+    assert feed(tracker, "D01", [2]) == [2]
+    stats = tracker.stats()["D01"]
+    assert stats["recovered"] == 1 and stats["loss_rate"] == 0.0
+
+
+def test_max_pending_forces_gap_skip():
+    tracker = SequenceTracker(max_pending=2)
+    assert feed(tracker, "D01", [1, 3, 4]) == [1]
+    assert feed(tracker, "D01", [5]) == [3, 4, 5]
+
+
+def test_counter_wraparound_is_not_a_jump():
+    tracker = SequenceTracker()
+    assert feed(tracker, "D01", [0xFFFFFFFE, 0xFFFFFFFF, 0, 1]) == [0xFFFFFFFE, 0xFFFFFFFF, 0, 1]
+    assert tracker.stats()["D01"]["resyncs"] == 0
+
+
+def test_large_jump_resyncs():
+    tracker = SequenceTracker(window=16)
+    assert feed(tracker, "D01", [1, 2, 1000, 1001]) == [1, 2, 1000, 1001]
+    assert tracker.stats()["D01"]["resyncs"] == 1
+
+
+def test_devices_are_independent():
+    tracker = SequenceTracker()
+    assert feed(tracker, "D01", [1, 2]) == [1, 2]
+    assert feed(tracker, "D02", [1, 2]) == [1, 2]
+
+
+def test_restart_with_device_timestamps_keeps_new_readings():
+    """重启后计数器从 0 开始，窗口内的序列号仍在 seen 中，但采样时间不同，不能当作重复丢弃"""
+    tracker = SequenceTracker()
+    assert feed(tracker, "D01", range(100), device_ts=lambda seq: 5000.0 + seq * 10) == list(range(100))
+    assert feed(tracker, "D01", range(20), device_ts=lambda seq: 9000.0 + seq * 10) == list(range(20))
+    stats = tracker.stats()["D01"]
+    assert stats["duplicates"] == 0 and stats["resyncs"] == 1 and stats["next_seq"] == 20
+
+
+def test_restart_with_clock_reset_keeps_new_readings():
+    """设备时钟随重启回退（如使用开机时间）同样判定为重启"""
+    tracker = SequenceTracker()
+    feed(tracker, "D01", range(50), device_ts=lambda seq: 500.0 + seq)
+    assert feed(tracker, "D01", range(5), device_ts=lambda seq: 1.0 + seq) == list(range(5))
+
+
+def test_restart_without_device_timestamps_keeps_new_readings():
+    tracker = SequenceTracker()
+    feed(tracker, "D01", range(100))
+    assert feed(tracker, "D01", range(30)) == list(range(30))
+    assert tracker.stats()["D01"]["duplicates"] == 0
+
+
+def test_restart_after_start_of_window_was_evicted():
+    """小序列号已移出去重窗口时按迟到读数放行，遇到窗口内时间不同的序列号再重新同步"""
+    tracker = SequenceTracker(window=32)
+    feed(tracker, "D01", range(40), device_ts=lambda seq: 5000.0 + seq)
+    assert feed(tracker, "D01", range(40), device_ts=lambda seq: 9000.0 + seq) == list(range(40))
+    assert tracker.stats()["D01"]["duplicates"] == 0
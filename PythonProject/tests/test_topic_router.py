@@ -0,0 +1,65 @@
+# test_topic_router.py
+"""TopicRouter 通配匹配与结果缓存，以及 DeviceRegistry 基于它的主题解析"""
+import pytest
+
+from device_registry import TOPIC_CMD, TOPIC_DATA, DeviceRegistry
+from topic_router import TopicRouter
+
+
+@pytest.fixture
+def router():
+    router = TopicRouter()
+    router.add("a/+/x", lambda params: ("plus", params))
+    router.add("a/#", lambda params: ("hash", params))
+    router.add("a/b/x", lambda params: ("exact", params))
+    return router
+
+
+def test_precedence_exact_then_plus_then_hash(router):
+    assert router.route("a/b/x") == ("exact", ())
+    assert router.route("a/c/x") == ("plus", ("c",))
+    assert router.route("a/c/y/z") == ("hash", ("c/y/z",))
+    # MQTT 规定 a/# 同时匹配父级主题 a
+    assert router.route("a") == ("hash", ("",))
+    assert router.route("b/c") is None
+
+
+def test_results_and_misses_are_cached(router):
+    for _ in range(3):
+        router.route("a/c/x")
+        router.route("b/c")
+    assert router.status()["hits"] == 4 and router.status()["misses"] == 2
+
+
+def test_rejected_build_falls_through_to_next_pattern():
+    router = TopicRouter()
+    router.add("a/+", lambda params: None if params[0] == "skip" else params[0])
+    router.add("a/#", lambda params: "fallback")
+    assert router.route("a/ok") == "ok"
+    assert router.route("a/skip") == "fallback"
+
+
+def test_cache_is_bounded():
+    router = TopicRouter(cache_size=4)
+    router.add("a/+", lambda params: params[0])
+    for i in range(10):
+        assert router.route(f"a/{i}") == str(i)
+    assert router.status()["cached_topics"] <= 4
+
+
+def test_hash_must_be_last_level():
+    with pytest.raises(ValueError):
+        TopicRouter().add("a/#/b", lambda params: params)
+
+
+def test_registry_parses_device_topics():
+    registry = DeviceRegistry(["D01", "D02"])
+    assert registry.parse_topic("stm32/d03/data_now") == ("D03", TOPIC_DATA)
+    assert registry.parse_topic("stm32/D01/data_cmd") == ("D01", TOPIC_CMD)
+    assert registry.parse_topic("stm32/bad id!/data_now") == (None, None)
+    assert registry.parse_topic("stm32/D01/other") == (None, None)
+    assert registry.parse_topic("other/D01/data_now") == (None, None)
+    # 未登记设备按需自动登记，之后出现在设备列表中
+    assert registry.device_for_topic("stm32/D09/data_now") == "D09"
+    assert registry.ids() == ("D01", "D02", "D09")
+    assert registry.device_for_topic("stm32/D10/data_now", auto_register=False) is None
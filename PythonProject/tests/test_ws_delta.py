@@ -0,0 +1,85 @@
+# test_ws_delta.py
+"""DeltaEncoder：关键帧/增量帧切换，并按 common.js decodeWsDelta 的算法还原读数"""
+import json
+
+from ws_delta import DELTA_DECIMALS, DeltaEncoder
+
+
+def reading(ts, temp=22.5, hum=50.0, lux=300.0, device_id="D01", **extra):
+    message = {"type": "reading", "ts": ts, "temp": temp, "hum": hum, "lux": lux, "smoke": 3.0,
+               "pressure": 1010.0, "temp2": 22.0, "rs_ro": 1.0, "device_id": device_id}
+    message.update(extra)
+    return message
+
+
+class Decoder:
+    """common.js decodeWsDelta 的 Python 版本"""
+
+    def __init__(self):
+        self.base = {}
+
+    def decode(self, frame: dict) -> dict:
+        if frame["type"] == "reading":
+            self.base[frame["device_id"]] = frame
+            return frame
+        base = self.base[frame["device_id"]]
+        full = dict(base, ts=base["ts"] + frame.get("dt", 0) / 1000)
+        for field, step in frame.get("q", {}).items():
+            places = DELTA_DECIMALS[field]
+            full[field] = round(base[field] + step / 10 ** places, places)
+        self.base[frame["device_id"]] = full
+        return full
+
+
+def encode(encoder, message):
+    return json.loads(encoder.encode(message, json.dumps(message)))
+
+
+def test_first_reading_is_keyframe_then_deltas():
+    encoder = DeltaEncoder()
+    assert encode(encoder, reading(1000.0))["type"] == "reading"
+    frame = encode(encoder, reading(1001.0, temp=22.53))
+    assert frame == {"type": "reading_delta", "device_id": "D01", "dt": 1000, "q": {"temp": 3}}
+    # 没有变化的字段不出现在 q 中
+    assert "q" not in encode(encoder, reading(1002.0, temp=22.53))
+
+
+def test_decoded_values_match_without_drift():
+    encoder, decoder = DeltaEncoder(keyframe_interval=1000), Decoder()
+    temp = 22.0
+    for i in range(200):
+        temp = round(temp + (0.01 if i % 3 else -0.02), 2)
+        message = reading(1000.0 + i * 0.5, temp=temp, lux=300.0 + i * 0.1)
+        decoded = decoder.decode(encode(encoder, message))
+        assert decoded["temp"] == message["temp"]
+        assert decoded["lux"] == round(message["lux"], 1)
+        assert abs(decoded["ts"] - message["ts"]) < 0.001
+
+
+def test_keyframe_interval_and_field_changes_force_keyframes():
+    encoder = DeltaEncoder(keyframe_interval=2)
+    kinds = [encode(encoder, reading(1000.0 + i))["type"] for i in range(5)]
+    assert kinds == ["reading", "reading_delta", "reading_delta", "reading", "reading_delta"]
+    # 字段变为 null 或出现附加字段时无法用增量表示
+    assert encode(encoder, reading(1010.0, lux=None))["type"] == "reading"
+    assert encode(encoder, reading(1011.0, lux=None, flag=1))["type"] == "reading"
+
+
+def test_devices_have_separate_baselines():
+    encoder = DeltaEncoder()
+    assert encode(encoder, reading(1000.0, device_id="D01"))["type"] == "reading"
+    assert encode(encoder, reading(1000.0, device_id="D02"))["type"] == "reading"
+    assert encode(encoder, reading(1001.0, device_id="D02"))["type"] == "reading_delta"
+
+
+def test_other_events_and_batches_pass_through():
+    encoder = DeltaEncoder()
+    warning = {"type": "warning", "device_id": "D01", "warning_type": "T"}
+    raw = json.dumps(warning)
+    assert encoder.encode(warning, raw) is raw
+    batch = {"type": "readings", "device_id": "D01", "items": [reading(1000.0), reading(1001.0, temp=23.0)]}
+    raw = json.dumps(batch)
+    assert encoder.encode(batch, raw) is raw
+    # 批量帧的最后一条成为新的基准
+    assert encode(encoder, reading(1002.0, temp=23.01)) == \
+        {"type": "reading_delta", "device_id": "D01", "dt": 1000, "q": {"temp": 1}}
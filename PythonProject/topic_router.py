@@ -0,0 +1,110 @@
+# topic_router.py
+"""
+MQTT 主题路由模块
+按 MQTT 通配规则（+ 匹配一层，# 匹配其余所有层）把主题映射到处理目标：
+- 订阅模式预先编译为按层级的前缀树，未见过的主题沿树匹配一次（代价与层数有关，与设备数量无关）；
+- 匹配结果（经 build 回调转换后的最终结果，如 (设备ID, 主题类型)）按主题缓存在字典中，
+  同一主题的后续消息只需一次字典查找，不再拆分字符串、规范化和校验；
+- 不匹配的主题同样缓存（结果为 None）；缓存条数有上限，超过后整体清空重新积累。
+"""
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+_MISS = object()
+
+
+class _Node:
+    __slots__ = ("children", "plus", "hash", "targets")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        self.plus: Optional["_Node"] = None  # "+" 子节点
+        self.hash: Optional[Tuple[Callable, ...]] = None  # "#" 终止的处理目标
+        self.targets: Optional[Tuple[Callable, ...]] = None  # 在此层结束的处理目标
+
+
+class TopicRouter:
+    """编译后的主题路由表（带结果缓存）"""
+
+    def __init__(self, cache_size: int = 20000):
+        """
+        参数:
+            cache_size: 最多缓存的主题数
+        """
+        self.cache_size = cache_size
+        self._root = _Node()
+        self._cache: Dict[str, Any] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def add(self, pattern: str, build: Callable[[Tuple[str, ...]], Any]):
+        """
+        添加订阅模式
+
+        参数:
+            pattern: MQTT 主题模式，如 stm32/+/data_now
+            build: 匹配后调用 build(通配层捕获的值) 得到路由结果；返回 None 表示拒绝（继续尝试其他模式）
+        """
+        node = self._root
+        levels = pattern.split("/")
+        for i, level in enumerate(levels):
+            if level == "#":
+                if i != len(levels) - 1:
+                    raise ValueError(f"'#' 只能出现在主题模式末尾：{pattern}")
+                node.hash = (node.hash or ()) + (build,)
+                break
+            if level == "+":
+                node.plus = node.plus or _Node()
+                node = node.plus
+            else:
+                node = node.children.setdefault(level, _Node())
+        else:
+            node.targets = (node.targets or ()) + (build,)
+        self._cache.clear()
+
+    def route(self, topic: str) -> Any:
+        """返回主题的路由结果（未匹配返回 None）"""
+        result = self._cache.get(topic, _MISS)
+        if result is not _MISS:
+            self.hits += 1
+            return result
+        self.misses += 1
+        result = self._match(self._root, topic.split("/"), 0, [])
+        if len(self._cache) >= self.cache_size:
+            self._cache.clear()
+        self._cache[topic] = result
+        return result
+
+    def _match(self, node: _Node, levels: Sequence[str], index: int, captured: List[str]) -> Any:
+        # 优先级：精确层 > "+" > "#"
+        if index == len(levels):
+            for build in node.targets or ():
+                result = build(tuple(captured))
+                if result is not None:
+                    return result
+        else:
+            level = levels[index]
+            child = node.children.get(level)
+            if child is not None:
+                result = self._match(child, levels, index + 1, captured)
+                if result is not None:
+                    return result
+            if node.plus is not None:
+                captured.append(level)
+                result = self._match(node.plus, levels, index + 1, captured)
+                captured.pop()
+                if result is not None:
+                    return result
+        for build in node.hash or ():
+            result = build(tuple(captured) + ("/".join(levels[index:]),))
+            if result is not None:
+                return result
+        return None
+
+    def status(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "cached_topics": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else None,
+        }
@@ -36,6 +36,58 @@ if (!window.ensureDeviceParam) {
     window.ensureDeviceParam = ensureDeviceParam;
 }
 
+/**
+ * 逐条处理 WebSocket 消息
+ * 以 /ws?batch=N 连接时，服务端把 N 毫秒内的事件合并成 {"type":"batch","events":[...]} 一帧发送，
+ * 这里拆开后按原顺序逐条交给 handler（单条事件帧直接交给 handler）
+ */
+function forEachWsMessage(data, handler) {
+    const frame = JSON.parse(data);
+    const events = frame && frame.type === 'batch' && Array.isArray(frame.events) ? frame.events : [frame];
+    for (const event of events) {
+        try {
+            const msg = decodeWsDelta(event);
+            if (msg) handler(msg);
+        } catch (error) {
+            console.error('处理 WebSocket 消息失败：', error);
+        }
+    }
+}
+window.forEachWsMessage = forEachWsMessage;
+
+/**
+ * 增量模式（/ws?proto=delta）还原：完整的 reading 作为该设备的基准，
+ * reading_delta 按 基准 + 量化增量 还原为完整 reading 后再交给页面（页面无需感知增量模式）
+ */
+const wsDeltaState = {decimals: {}, base: new Map()};
+
+function decodeWsDelta(msg) {
+    if (!msg || !msg.type) return msg;
+    if (msg.type === 'delta_schema') {
+        wsDeltaState.decimals = msg.decimals || {};
+        return null;
+    }
+    if (msg.type === 'reading' && msg.device_id) {
+        wsDeltaState.base.set(msg.device_id, msg);
+        return msg;
+    }
+    if (msg.type === 'readings' && msg.device_id && Array.isArray(msg.items) && msg.items.length) {
+        wsDeltaState.base.set(msg.device_id, msg.items[msg.items.length - 1]);
+        return msg;
+    }
+    if (msg.type !== 'reading_delta') return msg;
+
+    const base = wsDeltaState.base.get(msg.device_id);
+    if (!base) return null;  // 尚未收到关键帧（正常情况下不会发生）
+    const full = Object.assign({}, base, {ts: base.ts + (msg.dt || 0) / 1000});
+    for (const [field, step] of Object.entries(msg.q || {})) {
+        const places = wsDeltaState.decimals[field] ?? 2;
+        full[field] = Number((base[field] + step / Math.pow(10, places)).toFixed(places));
+    }
+    wsDeltaState.base.set(msg.device_id, full);
+    return full;
+}
+
 /**
  * 简化 querySelector
  */
@@ -0,0 +1,143 @@
+# ws_delta.py
+"""
+WebSocket 读数增量编码模块（/ws?proto=delta）
+每条 reading 推送都重复七个指标、device_id 和浮点时间戳，而相邻两条读数大多只变化 0.01 或完全不变。
+增量模式下服务端为每个连接、每台设备记住"客户端当前看到的读数"，只发送变化量：
+- 关键帧：原样发送完整的 reading（与普通模式完全相同），客户端以它为基准；
+- 增量帧：{"type":"reading_delta","device_id":"D01","dt":1000,"q":{"temp":3,"lux":-12}}
+  dt 为与上一帧的时间差（毫秒），q 为变化字段的量化增量（单位为该字段的最小精度，如温度 0.01），未出现的字段不变；
+- 服务端按"基准 + 量化增量"更新自己保存的状态（与客户端的还原算法一致），误差不会累积；
+- 每台设备每 keyframe_interval 帧或 keyframe_seconds 秒强制发送一次关键帧；字段出现/消失（null）时也发送关键帧；
+- readings 批量帧与其他事件原样转发，批量帧的最后一条作为该设备的新基准。
+各字段的精度在连接建立时以 {"type":"delta_schema","decimals":{...}} 下发给客户端。
+"""
+import json
+import time
+from typing import Dict, Optional
+
+# 增量编码的字段及其小数位（与 payload_parser.build_reading 的推送精度一致）
+DELTA_DECIMALS = {
+    "temp": 2,
+    "hum": 2,
+    "lux": 1,
+    "smoke": 1,
+    "pressure": 1,
+    "temp2": 2,
+    "rs_ro": 2,
+}
+
+
+class DeltaStats:
+    """增量编码统计（本进程所有连接）"""
+
+    def __init__(self):
+        self.keyframes = 0
+        self.deltas = 0
+        self.full_bytes = 0  # 若全部发送完整读数所需的字节数
+        self.sent_bytes = 0  # 实际发送的字节数
+
+    def status(self) -> dict:
+        return {
+            "keyframes": self.keyframes,
+            "deltas": self.deltas,
+            "full_bytes": self.full_bytes,
+            "sent_bytes": self.sent_bytes,
+            "ratio": round(self.sent_bytes / self.full_bytes, 3) if self.full_bytes else None,
+        }
+
+
+delta_stats = DeltaStats()
+
+
+def schema_message(decimals: Optional[Dict[str, int]] = None) -> str:
+    """连接建立时下发的字段精度表"""
+    return json.dumps({"type": "delta_schema", "decimals": decimals or DELTA_DECIMALS})
+
+
+class DeltaEncoder:
+    """单个连接的读数增量编码器"""
+
+    def __init__(self, keyframe_interval: int = 30, keyframe_seconds: float = 60.0,
+                 decimals: Optional[Dict[str, int]] = None):
+        """
+        参数:
+            keyframe_interval: 每台设备最多连续发送多少个增量帧后强制关键帧
+            keyframe_seconds: 每台设备距上次关键帧超过该秒数时强制关键帧
+            decimals: 字段 -> 小数位（量化精度）
+        """
+        self.keyframe_interval = keyframe_interval
+        self.keyframe_seconds = keyframe_seconds
+        self.decimals = decimals or DELTA_DECIMALS
+        self._state: Dict[str, dict] = {}  # 设备ID -> 客户端当前看到的读数
+        self._since_key: Dict[str, int] = {}  # 设备ID -> 距上次关键帧的增量帧数
+        self._key_at: Dict[str, float] = {}  # 设备ID -> 上次关键帧时间（monotonic）
+
+    def encode(self, message: dict, raw: str) -> str:
+        """
+        编码一条广播
+
+        参数:
+            message: 已解析的事件
+            raw: 原始 JSON 文本（原样转发时直接使用，不重新序列化）
+
+        返回:
+            要发送给该连接的文本
+        """
+        kind = message.get("type")
+        device_id = message.get("device_id")
+        if kind == "readings" and device_id and message.get("items"):
+            self._keyframe(device_id, message["items"][-1])
+            return raw
+        if kind != "reading" or not device_id:
+            return raw
+
+        base = self._state.get(device_id)
+        delta_stats.full_bytes += len(raw)
+        if base is None or self._needs_keyframe(device_id, base, message):
+            self._keyframe(device_id, message)
+            delta_stats.keyframes += 1
+            delta_stats.sent_bytes += len(raw)
+            return raw
+
+        changes = {}
+        for field, places in self.decimals.items():
+            value, previous = message.get(field), base.get(field)
+            if value is None:
+                continue
+            step = round((value - previous) * 10 ** places)
+            if step:
+                changes[field] = step
+                base[field] = round(previous + step / 10 ** places, places)
+        dt = round((message.get("ts", base["ts"]) - base["ts"]) * 1000)
+        base["ts"] = base["ts"] + dt / 1000
+        frame = {"type": "reading_delta", "device_id": device_id, "dt": dt}
+        if changes:
+            frame["q"] = changes
+        self._since_key[device_id] += 1
+        encoded = json.dumps(frame, separators=(",", ":"))
+        delta_stats.deltas += 1
+        delta_stats.sent_bytes += len(encoded)
+        return encoded
+
+    def _needs_keyframe(self, device_id: str, base: dict, message: dict) -> bool:
+        if self._since_key[device_id] >= self.keyframe_interval:
+            return True
+        if time.monotonic() - self._key_at[device_id] >= self.keyframe_seconds:
+            return True
+        if not isinstance(message.get("ts"), (int, float)):
+            return True
+        if message.keys() != base.keys():
+            return True
+        for field, value in message.items():
+            if field in self.decimals:
+                # 字段出现或消失（null）时无法用增量表示
+                if (value is None) != (base.get(field) is None):
+                    return True
+            elif field != "ts" and base.get(field) != value:
+                return True  # 非量化字段（如附加标记）变化
+        return False
+
+    def _keyframe(self, device_id: str, reading: dict):
+        self._state[device_id] = dict(reading, device_id=device_id)
+        self._since_key[device_id] = 0
+        self._key_at[device_id] = time.monotonic()
@@ -0,0 +1,191 @@
+# ws_wire.py
+"""
+WebSocket 线路压缩与批量发送模块
+/ws 推送的读数、警告都是结构相同的 JSON 文本帧，字段名在每一帧里重复出现，非常适合 permessage-deflate：
+- 调优的 permessage-deflate：启用上下文接管（跨帧共享字典，重复的字段名几乎不占字节），
+  同时把滑动窗口缩小到 2^13、memLevel 降到 5（每个连接的压缩器内存从约 256KB 降到约 48KB，压缩率只略有下降）；
+- 自适应：小于 min_size 字节的帧不压缩直接发送（RFC 7692 允许逐条消息决定），省去无意义的压缩开销；
+- 批量：客户端以 /ws?batch=N 连接时，N 毫秒内的事件合并为一帧 {"type":"batch","events":[...]}，
+  一次压缩多条相似事件，压缩率更高、帧数更少；
+- 统计：记录应用层发送的字节数与压缩前后的字节数，/api/status 中可以直接对比压缩效果。
+uvicorn 只暴露 permessage-deflate 的开关，调优参数通过 make_ws_protocol() 生成的协议类传给 uvicorn.run(ws=...)。
+"""
+import asyncio
+from typing import Awaitable, Callable, List, Optional
+
+try:
+    from uvicorn.protocols.websockets.websockets_impl import WebSocketProtocol
+    from websockets import frames
+    from websockets.extensions.permessage_deflate import PerMessageDeflate, ServerPerMessageDeflateFactory
+    WEBSOCKETS_AVAILABLE = True
+except ImportError:
+    WEBSOCKETS_AVAILABLE = False
+
+
+class WireStats:
+    """WebSocket 发送字节统计（本进程）"""
+
+    def __init__(self):
+        self.messages = 0  # 应用层发送的帧数
+        self.payload_bytes = 0  # 应用层发送的字节数（压缩前）
+        self.deflate_in = 0  # 进入 permessage-deflate 的字节数
+        self.deflate_out = 0  # 压缩后的字节数
+        self.compressed_frames = 0
+        self.skipped_frames = 0  # 因太小而未压缩的帧
+        self.batches = 0
+        self.batched_events = 0
+
+    def record_send(self, size: int):
+        self.messages += 1
+        self.payload_bytes += size
+
+    def status(self) -> dict:
+        wire_bytes = self.payload_bytes - self.deflate_in + self.deflate_out
+        return {
+            "messages": self.messages,
+            "payload_bytes": self.payload_bytes,
+            "wire_bytes": wire_bytes,  # 压缩后实际写出的负载字节数（不含帧头）
+            "ratio": round(wire_bytes / self.payload_bytes, 3) if self.payload_bytes else None,
+            "compressed_frames": self.compressed_frames,
+            "skipped_frames": self.skipped_frames,
+            "deflate_ratio": round(self.deflate_out / self.deflate_in, 3) if self.deflate_in else None,
+            "batches": self.batches,
+            "batched_events": self.batched_events,
+        }
+
+
+wire_stats = WireStats()
+
+
+if WEBSOCKETS_AVAILABLE:
+    class AdaptivePerMessageDeflate(PerMessageDeflate):
+        """小帧不压缩的 permessage-deflate，并统计压缩前后字节数"""
+
+        min_size = 64
+
+        def encode(self, frame: "frames.Frame") -> "frames.Frame":
+            if frame.opcode in frames.CTRL_OPCODES:
+                return frame
+            if frame.opcode is not frames.OP_CONT and frame.fin and len(frame.data) < self.min_size:
+                # 未置 rsv1 的帧即为未压缩消息；上下文接管的压缩器状态不受影响
+                wire_stats.skipped_frames += 1
+                return frame
+            size = len(frame.data)
+            encoded = super().encode(frame)
+            wire_stats.compressed_frames += 1
+            wire_stats.deflate_in += size
+            wire_stats.deflate_out += len(encoded.data)
+            return encoded
+
+    class AdaptiveDeflateFactory(ServerPerMessageDeflateFactory):
+        """协商结果改用 AdaptivePerMessageDeflate"""
+
+        def __init__(self, min_size: int = 64, **kwargs):
+            super().__init__(**kwargs)
+            self.min_size = min_size
+
+        def process_request_params(self, params, accepted_extensions):
+            response_params, extension = super().process_request_params(params, accepted_extensions)
+            adaptive = AdaptivePerMessageDeflate(
+                extension.remote_no_context_takeover,
+                extension.local_no_context_takeover,
+                extension.remote_max_window_bits,
+                extension.local_max_window_bits,
+                self.compress_settings,
+            )
+            adaptive.min_size = self.min_size
+            return response_params, adaptive
+
+
+def make_ws_protocol(server_max_window_bits: int = 13, client_max_window_bits: int = 13, level: int = 6,
+                     mem_level: int = 5, min_size: int = 64):
+    """
+    生成带调优 permessage-deflate 的 uvicorn WebSocket 协议类（传给 uvicorn.run(ws=...)）
+
+    参数:
+        server_max_window_bits: 服务端压缩窗口（8~15，越小每连接内存越少）
+        client_max_window_bits: 要求客户端使用的压缩窗口
+        level: zlib 压缩级别（1~9）
+        mem_level: zlib 内存级别（1~9）
+        min_size: 小于该字节数的帧不压缩
+
+    返回:
+        协议类；未安装 websockets 时返回 None（调用方退回 uvicorn 默认实现）
+    """
+    if not WEBSOCKETS_AVAILABLE:
+        return None
+    compress_settings = {"level": level, "memLevel": mem_level}
+
+    class TunedWebSocketProtocol(WebSocketProtocol):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            if self.config.ws_per_message_deflate:
+                self.available_extensions = [AdaptiveDeflateFactory(
+                    min_size=min_size,
+                    server_max_window_bits=server_max_window_bits,
+                    client_max_window_bits=client_max_window_bits,
+                    compress_settings=compress_settings,
+                )]
+
+    return TunedWebSocketProtocol
+
+
+class WebSocketBatcher:
+    """单个连接的批量发送器：interval 秒内的事件合并为一帧"""
+
+    def __init__(self, send_text: Callable[[str], Awaitable[None]], interval: float, max_events: int = 200):
+        """
+        参数:
+            send_text: 发送文本帧的函数（ws.send_text）
+            interval: 合并窗口（秒），第一条事件到达后最多等待这么久再发送
+            max_events: 单帧最多事件数，达到后立即发送
+        """
+        self.send_text = send_text
+        self.interval = interval
+        self.max_events = max_events
+        self._pending: List[str] = []
+        self._wakeup = asyncio.Event()
+        self._full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.closed = False
+
+    def add(self, message: str):
+        """加入一条已序列化的事件"""
+        self._pending.append(message)
+        self._wakeup.set()
+        if len(self._pending) >= self.max_events:
+            self._full.set()
+
+    def start(self, on_error: Callable[[], None]):
+        self._task = asyncio.create_task(self._run(on_error))
+
+    def stop(self):
+        self.closed = True
+        if self._task:
+            self._task.cancel()
+
+    async def _run(self, on_error: Callable[[], None]):
+        try:
+            while True:
+                await self._wakeup.wait()
+                try:
+                    await asyncio.wait_for(self._full.wait(), timeout=self.interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                self._full.clear()
+                events, self._pending = self._pending, []
+                if not events:
+                    continue
+                # 单条事件原样发送，多条拼成 batch 帧（事件本身已是 JSON 文本，直接拼接，无需重新序列化）
+                frame = events[0] if len(events) == 1 else '{"type":"batch","events":[' + ",".join(events) + "]}"
+                await self.send_text(frame)
+                wire_stats.record_send(len(frame.encode("utf-8")))
+                if len(events) > 1:
+                    wire_stats.batches += 1
+                    wire_stats.batched_events += len(events)
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            self.closed = True
+            on_error()